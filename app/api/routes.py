@@ -1,16 +1,36 @@
-from fastapi import APIRouter, UploadFile, File, HTTPException, Body, Query
-from fastapi.responses import FileResponse
-from typing import List, Dict, Any, Optional
+from fastapi import APIRouter, UploadFile, File, HTTPException, Body, Query, Request
+from fastapi.responses import FileResponse, JSONResponse, StreamingResponse
+from starlette.concurrency import run_in_threadpool
+from starlette.datastructures import UploadFile as FormFile
+from typing import AsyncIterator, List, Dict, Any, Optional, Tuple
+import asyncio
 import os
-import tempfile
 import shutil
 import json
-from pathlib import Path
+import hashlib
+import re
+import uuid
+import zipfile
+from pathlib import Path, PurePosixPath
 from datetime import datetime
 
-from app.services.document_processor import process_documents
-from app.services.llm_service import extract_field_from_document
+from app.services.document_processor import DocumentChangedError, process_documents
+from app.services.parse_pool import parse_pool
+from app.services.llm_service import EventCallback, LLMUnavailableError, extract_field_from_document, reextract_fields
+from app.services.rule_extractor import EXPECTED_FIELDS
 from app.services.audit_service import audit_service
+from app.services.job_queue import job_queue, QueueFullError
+from app.services.extraction_cache import extraction_cache
+from app.services.batch_service import (
+    batch_manager,
+    BatchNotFoundError,
+    ExtractionBatch,
+    SHIPMENT_ID_PATTERN
+)
+from app.services.llm_client import batch_lane, llm_client
+from app.services.llm_metrics import llm_metrics
+from app.services.circuit_breaker import llm_breaker
+from app.core.config import settings
 
 router = APIRouter()
 
@@ -18,6 +38,20 @@ router = APIRouter()
 UPLOAD_DIR = Path("uploads")
 UPLOAD_DIR.mkdir(exist_ok=True)
 
+# Uploads are streamed here first; parsing reads from these private copies
+INCOMING_DIR = UPLOAD_DIR / ".incoming"
+INCOMING_DIR.mkdir(exist_ok=True)
+
+# Leading bytes expected for each allowed file type
+FILE_SIGNATURES = {
+    ".pdf": [b"%PDF-"],
+    ".xlsx": [b"PK\x03\x04"],
+    ".xls": [b"\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1", b"PK\x03\x04"],
+    ".zip": [b"PK\x03\x04"]  # Batch archives only
+}
+DOCUMENT_EXTENSIONS = [".pdf", ".xlsx", ".xls"]
+SHA256_PATTERN = re.compile(r"^[0-9a-f]{64}$")
+
 # Create storage directory for saved extractions
 STORAGE_DIR = Path("storage")
 STORAGE_DIR.mkdir(exist_ok=True)
@@ -29,10 +63,179 @@ async def health_check():
     return {"status": "ok", "message": "API is running"}
 
 
+async def _stream_upload(file: UploadFile, file_ext: str, max_bytes: Optional[int] = None) -> Tuple[str, str, int]:
+    """
+    Stream an upload to a private file in chunks, hashing as it goes.
+
+    The first chunk is checked against the file type's magic bytes and the
+    upload is rejected as soon as it exceeds MAX_UPLOAD_BYTES (or max_bytes),
+    so invalid or oversized files are never fully written.
+
+    Returns:
+        (private path, SHA-256 hex digest, size in bytes)
+    """
+    max_bytes = max_bytes or settings.MAX_UPLOAD_BYTES
+    private_path = INCOMING_DIR / f"{uuid.uuid4().hex}{file_ext}"
+    digest = hashlib.sha256()
+    size = 0
+
+    try:
+        with open(private_path, "wb") as f:
+            while True:
+                chunk = await file.read(settings.UPLOAD_CHUNK_SIZE)
+                if not chunk:
+                    break
+
+                if size == 0 and not any(chunk.startswith(sig) for sig in FILE_SIGNATURES[file_ext]):
+                    raise HTTPException(
+                        status_code=400,
+                        detail=f"Invalid file content: {file.filename} is not a valid {file_ext[1:].upper()} file."
+                    )
+
+                size += len(chunk)
+                if size > max_bytes:
+                    raise HTTPException(
+                        status_code=413,
+                        detail=f"File too large: {file.filename} exceeds {max_bytes // (1024 * 1024)} MB."
+                    )
+
+                digest.update(chunk)
+                f.write(chunk)
+    except BaseException:
+        _cleanup_temp_files([str(private_path)])
+        raise
+
+    if size == 0:
+        _cleanup_temp_files([str(private_path)])
+        raise HTTPException(status_code=400, detail=f"Empty file: {file.filename}")
+
+    return str(private_path), digest.hexdigest(), size
+
+
+def _publish_upload(private_path: str, filename: str) -> None:
+    """
+    Expose an upload at UPLOAD_DIR/filename for the frontend without copying
+    the bytes again: hardlink the private file and atomically swap it in.
+    """
+    public_path = UPLOAD_DIR / filename
+    staging_path = UPLOAD_DIR / f".{uuid.uuid4().hex}.tmp"
+    try:
+        os.link(private_path, staging_path)
+    except OSError:
+        # Filesystem without hardlinks
+        shutil.copyfile(private_path, staging_path)
+    os.replace(staging_path, public_path)
+
+
+def _cleanup_temp_files(paths: List[str]) -> None:
+    """Delete temporary upload copies, ignoring files that are already gone"""
+    for path in paths:
+        try:
+            if os.path.exists(path):
+                os.unlink(path)
+        except Exception as e:
+            print(f"Error deleting temp file {path}: {e}")
+
+
+async def _save_uploads(
+    files: List[UploadFile],
+    temp_file_paths: List[str],
+    file_hashes: List[str],
+    saved_files: List[Dict[str, Any]]
+) -> None:
+    """
+    Validate and save uploaded documents, appending to the given lists as
+    each file is saved (so the caller can clean up after a failure).
+    """
+    for file in files:
+        # Validate file type
+        file_ext = os.path.splitext(file.filename)[1].lower()
+        if file_ext not in DOCUMENT_EXTENSIONS:
+            raise HTTPException(
+                status_code=400,
+                detail=f"Invalid file type: {file.filename}. Only PDF and XLSX files are allowed."
+            )
+
+        # Stream to a private file for processing (single write)
+        filename = os.path.basename(file.filename)
+        private_path, file_hash, size = await _stream_upload(file, file_ext)
+        temp_file_paths.append(private_path)
+        file_hashes.append(file_hash)
+
+        # Also expose it in the uploads directory for frontend access
+        _publish_upload(private_path, filename)
+
+        saved_files.append({
+            "originalName": filename,
+            "path": f"/uploads/{filename}",
+            "size": size,
+            "hash": file_hash
+        })
+
+
+async def _run_extraction(
+    temp_file_paths: List[str],
+    cache_key: Optional[str] = None,
+    file_hashes: Optional[List[str]] = None,
+    on_event: Optional[EventCallback] = None
+) -> Dict[str, Any]:
+    """
+    Parse the documents and extract shipment data with the LLM.
+
+    Parsing is blocking, so it runs in the thread pool to keep the event
+    loop free for other requests. The LLM call is awaited directly.
+    When a cache key is given, a cached result skips both steps.
+    If on_event is given, parsing stages and extracted fields are reported
+    to it (on the event loop) as they happen.
+
+    Returns:
+        dict: {"data": extracted fields, "cache": hit/miss details,
+               "extraction": fields found by rules / asked from the LLM,
+               "partial": True if the LLM was skipped (circuit open)}
+    """
+    if cache_key:
+        cached_data, tier = extraction_cache.get(cache_key)
+        if cached_data is not None:
+            print(f"[CACHE] Extraction cache hit ({tier}) for {cache_key[:12]}")
+            return {
+                "data": cached_data,
+                "cache": {"hit": True, "tier": tier, "key": cache_key}
+            }
+
+    parse_options: Dict[str, Any] = {}
+    extract_options: Dict[str, Any] = {}
+    if on_event is not None:
+        loop = asyncio.get_running_loop()
+        # Parsing runs in a worker thread; hand its stage events to the loop
+        parse_options["on_stage"] = lambda stage, data: loop.call_soon_threadsafe(on_event, stage, data)
+        extract_options["on_event"] = on_event
+
+    print(f"Processing {len(temp_file_paths)} documents...")
+    documents = await run_in_threadpool(process_documents, temp_file_paths, file_hashes, **parse_options)
+
+    print("Extracting data with Claude AI...")
+    report: Dict[str, Any] = {}
+    extracted_data = await extract_field_from_document(documents, report=report, **extract_options)
+
+    # Degraded (local-only) results must not be served from the cache later
+    partial = "degraded" in report
+    if cache_key and not partial:
+        extraction_cache.put(cache_key, extracted_data)
+
+    return {
+        "data": extracted_data,
+        "cache": {"hit": False, "tier": None, "key": cache_key},
+        "extraction": report,
+        "partial": partial
+    }
+
+
 @router.post("/extract", response_model=dict)
 async def extract_shipment_data(
     files: List[UploadFile] = File(...),
-    use_mock: bool = True  # Default to mock mode to bypass Claude API
+    use_mock: bool = True,  # Default to mock mode to bypass Claude API
+    async_mode: bool = False,
+    use_cache: bool = True
 ):
     """
     Extract shipment data from uploaded documents (PDF and XLSX).
@@ -40,42 +243,19 @@ async def extract_shipment_data(
     Args:
         files: Uploaded PDF/XLSX documents
         use_mock: If True, return sample data without calling Claude API (default: True)
+        async_mode: If True, enqueue a background job and return its id immediately
+            (HTTP 202). Poll GET /api/jobs/{job_id} for the result.
+        use_cache: If False, skip the extraction result cache and call Claude again
     """
     if not files:
         raise HTTPException(status_code=400, detail="No files uploaded")
 
     temp_file_paths = []
     saved_files = []
+    file_hashes = []
 
     try:
-        # Save uploaded files
-        for file in files:
-            # Validate file type
-            file_ext = os.path.splitext(file.filename)[1].lower()
-            if file_ext not in [".pdf", ".xlsx", ".xls"]:
-                raise HTTPException(
-                    status_code=400,
-                    detail=f"Invalid file type: {file.filename}. Only PDF and XLSX files are allowed."
-                )
-
-            # Save to temp file for processing
-            temp_file = tempfile.NamedTemporaryFile(suffix=file_ext, delete=False)
-            temp_file_paths.append(temp_file.name)
-
-            content = await file.read()
-            temp_file.write(content)
-            temp_file.close()
-
-            # Also save to uploads directory for frontend access
-            saved_path = UPLOAD_DIR / file.filename
-            with open(saved_path, "wb") as f:
-                f.write(content)
-
-            saved_files.append({
-                "originalName": file.filename,
-                "path": f"/uploads/{file.filename}",
-                "size": len(content)
-            })
+        await _save_uploads(files, temp_file_paths, file_hashes, saved_files)
 
         # MOCK MODE: Return sample data matching seed.sql structure
         if use_mock:
@@ -125,20 +305,45 @@ async def extract_shipment_data(
                 "mock_mode": True
             }
 
-        # REAL MODE: Process documents and call Claude API
-        # Process documents - extract text
-        print(f"Processing {len(temp_file_paths)} documents...")
-        document_text = process_documents(temp_file_paths)
+        cache_key = None
+        if use_cache and settings.EXTRACTION_CACHE_ENABLED:
+            cache_key = extraction_cache.make_key(file_hashes)
+
+        # JOB MODE: Hand the temp files over to a background job
+        if async_mode:
+            job_paths = list(temp_file_paths)
+            try:
+                job = job_queue.submit(
+                    lambda: _run_extraction(job_paths, cache_key, file_hashes),
+                    cleanup=lambda: _cleanup_temp_files(job_paths),
+                    metadata={"files": saved_files}
+                )
+            except QueueFullError as e:
+                raise HTTPException(status_code=503, detail=str(e))
 
-        # Extract structured data using LLM
-        print("Extracting data with Claude AI...")
-        extracted_data = extract_field_from_document(document_text)
+            # The job owns the temp files now
+            temp_file_paths.clear()
+
+            return JSONResponse(status_code=202, content={
+                "success": True,
+                "job_id": job.job_id,
+                "status": job.status,
+                "status_url": f"/api/jobs/{job.job_id}",
+                "files": saved_files,
+                "mock_mode": False
+            })
+
+        # REAL MODE: Process documents and call Claude API
+        outcome = await _run_extraction(temp_file_paths, cache_key, file_hashes)
 
         return {
             "success": True,
-            "data": extracted_data,
+            "data": outcome["data"],
             "files": saved_files,
-            "mock_mode": False
+            "mock_mode": False,
+            "cache": outcome["cache"],
+            "extraction": outcome.get("extraction"),
+            "partial": outcome.get("partial", False)
         }
 
     except HTTPException:
@@ -149,12 +354,476 @@ async def extract_shipment_data(
 
     finally:
         # Clean up temp files
-        for path in temp_file_paths:
+        _cleanup_temp_files(temp_file_paths)
+
+
+def _sse(event: str, data: Dict[str, Any]) -> str:
+    """Format one Server-Sent Event"""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+async def _extraction_events(
+    temp_file_paths: List[str],
+    file_hashes: List[str],
+    saved_files: List[Dict[str, Any]],
+    cache_key: Optional[str]
+) -> AsyncIterator[str]:
+    """
+    SSE stream of one extraction. The temp files are deleted when the
+    stream ends; if the client disconnects, the extraction is cancelled.
+    """
+    queue: asyncio.Queue = asyncio.Queue()
+    task = None
+    try:
+        for saved in saved_files:
+            yield _sse("upload_saved", saved)
+
+        task = asyncio.create_task(
+            _run_extraction(temp_file_paths, cache_key, file_hashes, lambda event, data: queue.put_nowait((event, data)))
+        )
+        task.add_done_callback(lambda _: queue.put_nowait(None))
+
+        while True:
+            item = await queue.get()
+            if item is None:
+                break
+            yield _sse(*item)
+
+        try:
+            outcome = task.result()
+        except Exception as e:
+            print(f"Error processing documents: {str(e)}")
+            yield _sse("error", {"detail": f"Failed to process documents: {str(e)}"})
+            return
+
+        yield _sse("result", {
+            "success": True,
+            "data": outcome["data"],
+            "files": saved_files,
+            "mock_mode": False,
+            "cache": outcome["cache"],
+            "extraction": outcome.get("extraction"),
+            "partial": outcome.get("partial", False)
+        })
+
+    finally:
+        if task is not None and not task.done():
+            task.cancel()
+        _cleanup_temp_files(temp_file_paths)
+
+
+@router.post("/extract/stream")
+async def extract_shipment_data_stream(
+    files: List[UploadFile] = File(...),
+    use_cache: bool = True
+):
+    """
+    Extract shipment data and stream progress as Server-Sent Events.
+
+    Events, in order:
+        upload_saved: one per file ({"originalName", "path", "size", "hash"})
+        documents_parsed: text layers parsed ({"parsed", "scanned_pdfs", "scanned_pages"})
+        parse_fallback: a file's parser failed or blew its time/memory budget
+            ({"file", "reason", "fallback"}; "render_only" for PDFs, "unreadable" for PDFs
+            that cannot be opened, "skipped" for XLSX)
+        pages_rendered: image-only pages rendered for vision ({"pages", "failed", "skipped"})
+        field: a field value as soon as it is known ({"name", "value", "source"}),
+            from the rules first, then from the streamed LLM response
+        llm_started: the LLM call began ({"fields", "model", "vision"})
+        result: the final response, same shape as POST /api/extract
+        error: extraction failed ({"detail"})
+
+    Field events are provisional; `result` holds the validated data (e.g.
+    lineItemsCount and averagePrice computed from the invoice). A cache hit
+    goes straight to `result`.
+    """
+    if not files:
+        raise HTTPException(status_code=400, detail="No files uploaded")
+
+    temp_file_paths = []
+    saved_files = []
+    file_hashes = []
+
+    try:
+        await _save_uploads(files, temp_file_paths, file_hashes, saved_files)
+    except HTTPException:
+        _cleanup_temp_files(temp_file_paths)
+        raise
+    except Exception as e:
+        _cleanup_temp_files(temp_file_paths)
+        print(f"Error saving uploads: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Failed to process documents: {str(e)}")
+
+    cache_key = None
+    if use_cache and settings.EXTRACTION_CACHE_ENABLED:
+        cache_key = extraction_cache.make_key(file_hashes)
+
+    # The stream owns the temp files now
+    return StreamingResponse(
+        _extraction_events(temp_file_paths, file_hashes, saved_files, cache_key),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+@router.post("/extract/fields")
+async def reextract_shipment_fields(request: Dict[str, Any] = Body(...)):
+    """
+    Re-extract some fields of an earlier extraction instead of rerunning it.
+
+    Body:
+        files: The "files" list of the earlier /extract response ({"originalName", "hash"})
+        fields: Names of the fields to extract again, e.g. ["consigneeAddress"]
+        data: The current extraction result; the new values are merged into it
+
+    Files are identified by their content hash, so a later upload with the
+    same name is never used instead (409). Parsed text comes from the
+    document cache, and only the pages/sheets relevant to the requested
+    fields are sent to Claude. While the LLM circuit is open this is a 503.
+    """
+    fields = request.get("fields") or []
+    file_infos = request.get("files") or []
+    current = request.get("data") or {}
+
+    if not fields:
+        raise HTTPException(status_code=400, detail="No fields to re-extract")
+    unknown = [name for name in fields if name not in EXPECTED_FIELDS]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(unknown)}")
+    if not file_infos:
+        raise HTTPException(status_code=400, detail="No files given")
+
+    file_paths = []
+    file_hashes = []
+    for file_info in file_infos:
+        original_name = os.path.basename(file_info.get("originalName", ""))
+        file_hash = str(file_info.get("hash", "")).lower()
+        if not original_name or not SHA256_PATTERN.match(file_hash):
+            raise HTTPException(status_code=400, detail="Each file needs the originalName and hash of the earlier response")
+        file_paths.append(str(UPLOAD_DIR / original_name))
+        file_hashes.append(file_hash)
+
+    try:
+        # Cached parses are found by hash; anything else must still be the same upload
+        documents = await run_in_threadpool(process_documents, file_paths, file_hashes, verify_hashes=True)
+    except FileNotFoundError as e:
+        raise HTTPException(status_code=404, detail=f"Uploaded file not found: {os.path.basename(e.filename or '')}")
+    except DocumentChangedError as e:
+        raise HTTPException(status_code=409, detail=f"{e}; upload the files again")
+    except Exception as e:
+        print(f"Error re-extracting fields: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Failed to re-extract fields: {str(e)}")
+
+    if not documents.documents:
+        raise HTTPException(status_code=400, detail="None of the files is a PDF or Excel document")
+
+    try:
+        report: Dict[str, Any] = {}
+        data = await reextract_fields(documents, fields, current, report=report)
+
+        return {
+            "success": True,
+            "data": data,
+            "fields": fields,
+            "extraction": report
+        }
+
+    except LLMUnavailableError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    except Exception as e:
+        print(f"Error re-extracting fields: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Failed to re-extract fields: {str(e)}")
+
+
+@router.get("/jobs/{job_id}")
+async def get_extraction_job(job_id: str):
+    """
+    Get the status of a background extraction job.
+
+    Status is one of: queued, running, completed, failed.
+    When completed, `result` holds the extracted shipment data.
+    """
+    job = job_queue.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail=f"Job {job_id} not found")
+
+    return {
+        "success": True,
+        "job": job.to_dict()
+    }
+
+
+def _stage_batch_file(
+    batch: ExtractionBatch,
+    shipment_id: str,
+    filename: str,
+    source_path: str,
+    file_hash: str,
+    size: int
+) -> None:
+    """Move a validated file into the batch directory under its shipment"""
+    if not SHIPMENT_ID_PATTERN.match(shipment_id):
+        raise HTTPException(status_code=400, detail=f"Invalid shipment id: {shipment_id}")
+
+    dest_dir = batch.files_dir(shipment_id)
+    dest_dir.mkdir(parents=True, exist_ok=True)
+    dest = dest_dir / filename
+    if dest.exists():
+        raise HTTPException(status_code=400, detail=f"Duplicate file {filename} in shipment {shipment_id}")
+
+    shutil.move(source_path, dest)
+    batch.shipments.setdefault(shipment_id, []).append({
+        "name": filename,
+        "path": str(dest),
+        "hash": file_hash,
+        "size": size
+    })
+
+
+def _unpack_batch_archive(batch: ExtractionBatch, archive_path: str, default_shipment: str) -> None:
+    """
+    Stage the documents of a zip archive. Each top-level folder is one
+    shipment; files at the root belong to `default_shipment`.
+    Members are validated like uploads (type, magic bytes, size).
+    """
+    try:
+        archive = zipfile.ZipFile(archive_path)
+    except zipfile.BadZipFile:
+        raise HTTPException(status_code=400, detail="Invalid zip archive")
+
+    with archive:
+        for info in archive.infolist():
+            parts = PurePosixPath(info.filename).parts
+            # Skip folders and OS metadata (__MACOSX/, .DS_Store)
+            if info.is_dir() or any(part.startswith((".", "__")) for part in parts):
+                continue
+
+            filename = parts[-1]
+            file_ext = os.path.splitext(filename)[1].lower()
+            if file_ext not in DOCUMENT_EXTENSIONS:
+                raise HTTPException(
+                    status_code=400,
+                    detail=f"Invalid file type in archive: {info.filename}. Only PDF and XLSX files are allowed."
+                )
+            if info.file_size > settings.MAX_UPLOAD_BYTES:
+                raise HTTPException(status_code=413, detail=f"File too large in archive: {info.filename}")
+
+            private_path = INCOMING_DIR / f"{uuid.uuid4().hex}{file_ext}"
+            digest = hashlib.sha256()
+            size = 0
+            try:
+                with archive.open(info) as src, open(private_path, "wb") as dst:
+                    for chunk in iter(lambda: src.read(settings.UPLOAD_CHUNK_SIZE), b""):
+                        if size == 0 and not any(chunk.startswith(sig) for sig in FILE_SIGNATURES[file_ext]):
+                            raise HTTPException(
+                                status_code=400,
+                                detail=f"Invalid file content in archive: {info.filename}"
+                            )
+                        size += len(chunk)
+                        # file_size in the zip header can lie; enforce on the real bytes
+                        if size > settings.MAX_UPLOAD_BYTES:
+                            raise HTTPException(status_code=413, detail=f"File too large in archive: {info.filename}")
+                        digest.update(chunk)
+                        dst.write(chunk)
+                if size == 0:
+                    raise HTTPException(status_code=400, detail=f"Empty file in archive: {info.filename}")
+
+                shipment_id = parts[0] if len(parts) > 1 else default_shipment
+                _stage_batch_file(batch, shipment_id, filename, str(private_path), digest.hexdigest(), size)
+            finally:
+                _cleanup_temp_files([str(private_path)])
+
+
+def _batch_runner(use_cache: bool):
+    """Shipment runner for batches: the regular extraction path in the batch LLM lane"""
+    async def run(file_paths: List[str], file_hashes: List[str]) -> Dict[str, Any]:
+        cache_key = None
+        if use_cache and settings.EXTRACTION_CACHE_ENABLED:
+            cache_key = extraction_cache.make_key(file_hashes)
+        with batch_lane():
+            return await _run_extraction(file_paths, cache_key, file_hashes)
+    return run
+
+
+def _batch_stream(batch: ExtractionBatch, after: int = 0) -> StreamingResponse:
+    return StreamingResponse(
+        batch.stream(after),
+        media_type="application/x-ndjson",
+        headers={"X-Batch-Id": batch.batch_id}
+    )
+
+
+@router.post("/extract/batch")
+async def extract_batch(request: Request, use_cache: bool = True):
+    """
+    Extract many shipments in one request.
+
+    Send a multipart form where each file field name is the shipment id
+    (e.g. `SHP001=@bol.pdf`, `SHP001=@invoice.xlsx`, `SHP002=@...`), and/or
+    one or more `archive` fields with zip files whose top-level folders are
+    the shipments.
+
+    Results stream back as NDJSON, one line per shipment as it completes,
+    between a `batch` header line and a `summary` line. The batch keeps
+    running if the client disconnects; reconnect with
+    GET /api/extract/batch/{batch_id}?after=N.
+    """
+    form = await request.form()
+    batch = batch_manager.new_batch_dir()
+
+    try:
+        for field_name, value in form.multi_items():
+            if not isinstance(value, FormFile) or not value.filename:
+                continue
+
+            filename = os.path.basename(value.filename)
+            file_ext = os.path.splitext(filename)[1].lower()
+
+            if field_name == "archive":
+                if file_ext != ".zip":
+                    raise HTTPException(status_code=400, detail=f"Archive must be a .zip file: {filename}")
+                archive_path, _, _ = await _stream_upload(value, file_ext, settings.BATCH_MAX_ARCHIVE_BYTES)
+                try:
+                    await run_in_threadpool(
+                        _unpack_batch_archive, batch, archive_path, os.path.splitext(filename)[0]
+                    )
+                finally:
+                    _cleanup_temp_files([archive_path])
+                continue
+
+            if file_ext not in DOCUMENT_EXTENSIONS:
+                raise HTTPException(
+                    status_code=400,
+                    detail=f"Invalid file type: {filename}. Only PDF and XLSX files are allowed."
+                )
+            private_path, file_hash, size = await _stream_upload(value, file_ext)
             try:
-                if os.path.exists(path):
-                    os.unlink(path)
-            except Exception as e:
-                print(f"Error deleting temp file {path}: {e}")
+                _stage_batch_file(batch, field_name, filename, private_path, file_hash, size)
+            finally:
+                _cleanup_temp_files([private_path])
+
+        if not batch.shipments:
+            raise HTTPException(status_code=400, detail="No shipment files uploaded")
+        if len(batch.shipments) > settings.BATCH_MAX_SHIPMENTS:
+            raise HTTPException(
+                status_code=400,
+                detail=f"Too many shipments: {len(batch.shipments)} (max {settings.BATCH_MAX_SHIPMENTS})"
+            )
+
+    except HTTPException:
+        batch_manager.discard(batch)
+        raise
+    except Exception as e:
+        batch_manager.discard(batch)
+        print(f"Error receiving batch: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Failed to receive batch: {str(e)}")
+    finally:
+        await form.close()
+
+    batch_manager.start(batch, _batch_runner(use_cache))
+    return _batch_stream(batch)
+
+
+@router.get("/extract/batch/{batch_id}")
+async def get_extraction_batch(batch_id: str, after: int = 0):
+    """
+    Stream the results of a batch as NDJSON, starting at result index
+    `after` (use the number of results already received to resume).
+    Follows the batch until it finishes if it is still running.
+    """
+    try:
+        batch = batch_manager.get(batch_id)
+    except BatchNotFoundError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+
+    return _batch_stream(batch, after)
+
+
+@router.post("/extract/batch/{batch_id}/resume")
+async def resume_extraction_batch(batch_id: str, after: int = 0, use_cache: bool = True):
+    """
+    Re-run the shipments of an interrupted batch (e.g. after a restart)
+    that have no complete result yet (failed, or partial because the LLM
+    was skipped), and stream the results.
+    """
+    try:
+        batch = batch_manager.resume(batch_id, _batch_runner(use_cache))
+    except BatchNotFoundError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+
+    return _batch_stream(batch, after)
+
+
+@router.get("/admin/cache/stats")
+async def get_extraction_cache_stats():
+    """
+    Extraction result cache statistics (hits, misses, tier sizes)
+    """
+    return {
+        "success": True,
+        "stats": extraction_cache.stats()
+    }
+
+
+@router.get("/admin/parse/stats")
+async def get_parse_stats():
+    """
+    Parse pool statistics: workers, budgets, and the calls that timed out,
+    ran out of memory or crashed their worker
+    """
+    return {
+        "success": True,
+        "stats": parse_pool.stats()
+    }
+
+
+@router.get("/admin/llm/stats")
+async def get_llm_stats():
+    """
+    LLM extraction statistics: token usage, structured output health
+    (parse failure rate, malformed fields, repair calls), retries/hedges
+    and the circuit breaker state
+    """
+    return {
+        "success": True,
+        "stats": {
+            **llm_metrics.stats(),
+            "usage": llm_client.usage_totals,
+            "circuit_breaker": llm_breaker.stats()
+        }
+    }
+
+
+@router.delete("/admin/cache/{cache_key}")
+async def invalidate_extraction_cache_entry(cache_key: str):
+    """
+    Invalidate one cached extraction result by its key
+    (the `cache.key` returned by /api/extract).
+    """
+    try:
+        removed = extraction_cache.invalidate(cache_key)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    if not removed:
+        raise HTTPException(status_code=404, detail=f"Cache entry {cache_key} not found")
+
+    return {
+        "success": True,
+        "message": f"Cache entry {cache_key} invalidated"
+    }
+
+
+@router.delete("/admin/cache")
+async def clear_extraction_cache():
+    """
+    Remove all cached extraction results
+    """
+    removed = extraction_cache.clear()
+    return {
+        "success": True,
+        "message": f"Removed {removed} cached extraction results"
+    }
 
 
 @router.get("/uploads/{filename}")
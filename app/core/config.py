@@ -19,6 +19,115 @@ class Settings(BaseSettings):
     # Document types
     ALLOWED_DOCUMENT_TYPES: List[str] = [".pdf", ".xlsx", ".xls"]
 
+    # Uploads
+    MAX_UPLOAD_BYTES: int = 50 * 1024 * 1024  # Per file
+    UPLOAD_CHUNK_SIZE: int = 1024 * 1024
+
+    # LLM client
+    LLM_MODEL: str = "claude-3-opus-20240229"
+    LLM_BASE_URL: str = ""  # Empty = Anthropic API; e.g. http://127.0.0.1:8089 for tools/fake_llm_server.py
+    LLM_MAX_TOKENS: int = 2000
+    LLM_MAX_IN_FLIGHT: int = 8  # Concurrent LLM calls per worker process
+    LLM_MAX_CONNECTIONS: int = 32  # Enough for LLM_MAX_IN_FLIGHT + BATCH_LLM_MAX_IN_FLIGHT
+    LLM_MAX_KEEPALIVE_CONNECTIONS: int = 10
+    LLM_KEEPALIVE_EXPIRY_SECONDS: float = 30.0
+    LLM_REQUESTS_PER_MINUTE: int = 50  # 0 disables the limit
+    LLM_TOKENS_PER_MINUTE: int = 40000  # Input + output tokens, 0 disables the limit
+    LLM_PROMPT_CACHING: bool = True  # Mark the static instructions cacheable (prompt caching beta)
+
+    # Model tiers: text documents go to LLM_FAST_MODEL first; fields failing validation or
+    # cross-field checks, and scanned (vision) documents, go to LLM_MODEL
+    LLM_TIERING_ENABLED: bool = True
+    LLM_FAST_MODEL: str = "claude-3-haiku-20240307"
+
+    # LLM call deadlines and retries (jittered exponential backoff on 429/5xx/timeouts)
+    LLM_TIMEOUT_SECONDS: float = 60.0  # One attempt
+    LLM_DEADLINE_SECONDS: float = 180.0  # One call, including retries and backoff
+    LLM_MAX_RETRIES: int = 3
+    LLM_RETRY_BASE_DELAY_SECONDS: float = 0.5
+    LLM_RETRY_MAX_DELAY_SECONDS: float = 8.0
+
+    # Hedging: send a second request if the first has no first token within the p95 latency
+    LLM_HEDGING_ENABLED: bool = False
+    LLM_HEDGE_PERCENTILE: float = 0.95
+    LLM_HEDGE_MIN_SAMPLES: int = 20  # Latencies observed before the percentile is used
+    LLM_HEDGE_INITIAL_DELAY_SECONDS: float = 10.0  # Hedge delay until then
+
+    # Circuit breaker around LLM extraction: while open, return local (rule-based) results flagged partial
+    LLM_BREAKER_ENABLED: bool = True
+    LLM_BREAKER_WINDOW: int = 20  # Most recent extractions considered
+    LLM_BREAKER_MIN_CALLS: int = 5
+    LLM_BREAKER_FAILURE_RATE: float = 0.5  # Share of failed or slow extractions that opens the circuit
+    LLM_BREAKER_SLOW_CALL_SECONDS: float = 60.0
+    LLM_BREAKER_OPEN_SECONDS: float = 30.0  # Before a half-open probe is let through
+
+    # Extraction result cache (keyed by uploaded file hashes + prompt/model version)
+    EXTRACTION_CACHE_ENABLED: bool = True
+    EXTRACTION_CACHE_MEMORY_ENTRIES: int = 256
+    EXTRACTION_CACHE_DIR: str = "cache/extractions"
+    EXTRACTION_CACHE_MAX_DISK_BYTES: int = 100 * 1024 * 1024
+
+    # Parsed document cache (text per page/sheet and rendered images, keyed by file hash)
+    DOCUMENT_CACHE_ENABLED: bool = True
+    DOCUMENT_CACHE_DIR: str = "cache/documents"
+    DOCUMENT_CACHE_MAX_DISK_BYTES: int = 500 * 1024 * 1024
+
+    # Parallel document parsing (process pool; 0 parses inline, and so does 1 without PARSE_ISOLATION)
+    PARSE_WORKERS: int = min(4, os.cpu_count() or 1)
+    PARSE_POOL_START_METHOD: str = "spawn"
+    PARSE_PDF_PAGES_PER_TASK: int = 10  # Large PDFs are split into page ranges of this size
+
+    # Parse watchdog: each parse call runs in a worker process with a deadline and a memory cap;
+    # a call over budget has its worker killed and the file falls back to a cheaper extractor
+    PARSE_ISOLATION: bool = True
+    PARSE_TIMEOUT_SECONDS: float = 30.0  # Per call (an XLSX file, a PDF page range or page render); 0 disables
+    PARSE_MEMORY_LIMIT_MB: int = 2048  # Address space cap per worker (RLIMIT_AS); 0 disables
+
+    # PDF text layer extraction: "auto" (PDFium, PyPDF2 for badly decoded pages), "pdfium" or "pypdf2"
+    PDF_TEXT_BACKEND: str = "auto"
+
+    # Per-page classification: pages with less text than this are checked for image content, and
+    # rendered for vision extraction if images cover enough of the page (or there is no text at all)
+    PDF_PAGE_MIN_TEXT_CHARS: int = 50  # Non-whitespace characters
+    PDF_PAGE_MIN_IMAGE_COVERAGE: float = 0.5  # Share of the page area
+
+    # Scanned PDF rendering for vision extraction
+    PDF_RENDER_MAX_PAGES: int = 0  # Image-only pages rendered per PDF; 0 renders all of them
+    PDF_RENDER_PAGE_RANGE: str = ""  # 1-based pages, e.g. "1-3,5"; overrides PDF_RENDER_MAX_PAGES
+    PDF_RENDER_TARGET_LONG_EDGE: int = 1568  # Pixels; larger images are downscaled by the API anyway
+    PDF_RENDER_MIN_SCALE: float = 0.5
+    PDF_RENDER_MAX_SCALE: float = 3.0
+    PDF_RENDER_FORMAT: str = "JPEG"  # JPEG, WEBP or PNG
+    PDF_RENDER_QUALITY: int = 80  # JPEG/WEBP starting quality
+    PDF_RENDER_GRAYSCALE: bool = True
+    PDF_RENDER_MAX_IMAGE_BYTES: int = 3 * 1024 * 1024  # Budget for all page images of a request
+
+    # XLSX parsing: replace line item tables with locally computed figures
+    XLSX_SUMMARIZE_TABLES: bool = True
+
+    # Rule-based pre-extraction: fields at or above the confidence skip the LLM
+    RULE_EXTRACTION_ENABLED: bool = True
+    RULE_MIN_CONFIDENCE: float = 0.8
+
+    # Prompt compaction: estimated token budget for the document text (0 = no limit)
+    PROMPT_COMPACTION_ENABLED: bool = True
+    PROMPT_TOKEN_BUDGET: int = 12000
+
+    # Structured output: follow-up calls for fields returned in the wrong shape
+    LLM_REPAIR_ATTEMPTS: int = 1
+
+    # Background extraction jobs (POST /api/extract?async_mode=true)
+    EXTRACTION_WORKERS: int = 4  # Max jobs parsing/calling the LLM at once
+    EXTRACTION_QUEUE_MAX_SIZE: int = 100  # Max jobs waiting for a worker
+    EXTRACTION_JOB_TTL_SECONDS: int = 3600  # How long finished jobs stay pollable
+
+    # Batch extraction (POST /api/extract/batch)
+    BATCH_DIR: str = "batches"  # Manifests, results and pending files of each batch
+    BATCH_MAX_SHIPMENTS: int = 500
+    BATCH_MAX_ARCHIVE_BYTES: int = 1024 * 1024 * 1024  # Zip uploads (each member is still capped by MAX_UPLOAD_BYTES)
+    BATCH_CONCURRENCY: int = 16  # Shipments parsed/extracted at once per batch
+    BATCH_LLM_MAX_IN_FLIGHT: int = 16  # LLM calls in flight for batches (separate from interactive calls)
+
     class Config:
         env_file = ".env"
         env_file_encoding = "utf-8"
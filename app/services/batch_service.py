@@ -0,0 +1,252 @@
+"""
+Batch Extraction
+Runs many shipments (each a group of PDF/XLSX files) through the regular
+extraction path with high concurrency and streams each shipment's result
+as NDJSON as soon as it completes.
+
+Every batch is persisted under BATCH_DIR/<batch_id>/ (manifest, results
+so far, files of unfinished shipments), so a client can reconnect to the
+result stream and an interrupted batch can be resumed. Partial results
+(LLM skipped, rule-based fields only) keep their files and are run again
+on resume.
+"""
+import asyncio
+import json
+import re
+import shutil
+import uuid
+from datetime import datetime
+from pathlib import Path
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional
+
+from app.core.config import settings
+
+BATCH_ID_PATTERN = re.compile(r"^[0-9a-f]{32}$")
+SHIPMENT_ID_PATTERN = re.compile(r"^[A-Za-z0-9][A-Za-z0-9_.\-]{0,63}$")
+
+# (file paths, file hashes) -> {"data", "cache", "extraction"}
+ShipmentRunner = Callable[[List[str], List[str]], Awaitable[Dict[str, Any]]]
+
+
+class BatchNotFoundError(Exception):
+    """Raised for unknown or malformed batch ids"""
+    pass
+
+
+class ExtractionBatch:
+    """State of one batch: its shipments and the results recorded so far"""
+
+    def __init__(self, batch_id: str, directory: Path, shipments: Dict[str, List[Dict[str, Any]]]):
+        """
+        Args:
+            batch_id: Batch id (32 hex chars)
+            directory: Batch directory
+            shipments: shipment id -> [{"name", "path", "hash", "size"}]
+        """
+        self.batch_id = batch_id
+        self.directory = directory
+        self.shipments = shipments
+        self.results: List[Dict[str, Any]] = []
+        self.status = "running"
+        self.created_at = datetime.now()
+        self._changed: Optional[asyncio.Event] = None
+
+    @property
+    def manifest_path(self) -> Path:
+        return self.directory / "manifest.json"
+
+    @property
+    def results_path(self) -> Path:
+        return self.directory / "results.ndjson"
+
+    def files_dir(self, shipment_id: str) -> Path:
+        return self.directory / "files" / shipment_id
+
+    def succeeded(self) -> set:
+        """Shipments with a complete (successful, not partial) result"""
+        return {r["shipment_id"] for r in self.results if r["success"] and not r.get("partial")}
+
+    def pending(self) -> List[str]:
+        """Shipments without a complete result, in submission order"""
+        done = self.succeeded()
+        return [shipment_id for shipment_id in self.shipments if shipment_id not in done]
+
+    def summary(self) -> Dict[str, Any]:
+        succeeded = self.succeeded()
+        latest = {r["shipment_id"]: r for r in self.results}
+        return {
+            "type": "summary",
+            "batch_id": self.batch_id,
+            "status": self.status,
+            "shipments": len(self.shipments),
+            "succeeded": len(succeeded),
+            "partial": sum(1 for r in latest.values() if r["success"] and r.get("partial")),
+            "failed": sum(1 for r in latest.values() if not r["success"])
+        }
+
+    def write_manifest(self) -> None:
+        manifest = {
+            "batch_id": self.batch_id,
+            "created_at": self.created_at.isoformat(),
+            "shipments": self.shipments
+        }
+        self.manifest_path.write_text(json.dumps(manifest), encoding="utf-8")
+
+    def _event(self) -> asyncio.Event:
+        if self._changed is None:
+            self._changed = asyncio.Event()
+        return self._changed
+
+    def _notify(self) -> None:
+        if self._changed is not None:
+            self._changed.set()
+
+    def record(self, result: Dict[str, Any]) -> None:
+        """Append a shipment result (in memory and on disk) and wake up streams"""
+        self.results.append(result)
+        with open(self.results_path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(result) + "\n")
+        self._notify()
+
+    def finish(self, status: str) -> None:
+        self.status = status
+        self._notify()
+
+    async def stream(self, after: int = 0) -> AsyncIterator[str]:
+        """
+        NDJSON lines: a header, every result from index `after` on (waiting
+        for new ones while the batch runs), then a summary.
+        """
+        yield json.dumps({
+            "type": "batch",
+            "batch_id": self.batch_id,
+            "status": self.status,
+            "shipments": len(self.shipments),
+            "status_url": f"/api/extract/batch/{self.batch_id}"
+        }) + "\n"
+
+        index = max(after, 0)
+        while True:
+            event = self._event()
+            event.clear()
+            while index < len(self.results):
+                yield json.dumps({"type": "result", "index": index, **self.results[index]}) + "\n"
+                index += 1
+            if self.status != "running":
+                break
+            await event.wait()
+
+        yield json.dumps(self.summary()) + "\n"
+
+
+class BatchManager:
+    """Creates, runs, reloads and resumes extraction batches"""
+
+    def __init__(
+        self,
+        directory: str = settings.BATCH_DIR,
+        concurrency: int = settings.BATCH_CONCURRENCY
+    ):
+        self.directory = Path(directory)
+        self.concurrency = concurrency
+        self._batches: Dict[str, ExtractionBatch] = {}
+        self._tasks = set()
+
+    def new_batch_dir(self) -> ExtractionBatch:
+        """Create an empty batch whose directory files can be staged into"""
+        batch_id = uuid.uuid4().hex
+        directory = self.directory / batch_id
+        (directory / "files").mkdir(parents=True, exist_ok=True)
+        return ExtractionBatch(batch_id, directory, {})
+
+    def discard(self, batch: ExtractionBatch) -> None:
+        """Remove a batch that was never started (e.g. invalid upload)"""
+        shutil.rmtree(batch.directory, ignore_errors=True)
+
+    def get(self, batch_id: str) -> ExtractionBatch:
+        """
+        Look up a batch in memory, or reload it from disk (status
+        "interrupted" if it has unfinished shipments but is not running).
+
+        Raises:
+            BatchNotFoundError: If the batch does not exist
+        """
+        if not BATCH_ID_PATTERN.match(batch_id):
+            raise BatchNotFoundError(f"Invalid batch id: {batch_id}")
+        if batch_id in self._batches:
+            return self._batches[batch_id]
+
+        directory = self.directory / batch_id
+        manifest_path = directory / "manifest.json"
+        if not manifest_path.exists():
+            raise BatchNotFoundError(f"Batch not found: {batch_id}")
+
+        manifest = json.loads(manifest_path.read_text(encoding="utf-8"))
+        batch = ExtractionBatch(batch_id, directory, manifest["shipments"])
+        batch.created_at = datetime.fromisoformat(manifest["created_at"])
+        if batch.results_path.exists():
+            with open(batch.results_path, encoding="utf-8") as f:
+                batch.results = [json.loads(line) for line in f if line.strip()]
+        batch.status = "interrupted" if batch.pending() else "completed"
+        self._batches[batch_id] = batch
+        return batch
+
+    def start(self, batch: ExtractionBatch, runner: ShipmentRunner) -> None:
+        """
+        Run the batch's pending shipments in the background. The run does
+        not depend on any client connection, so it survives disconnects.
+        Must be called from a running event loop.
+        """
+        batch.status = "running"
+        batch.write_manifest()
+        self._batches[batch.batch_id] = batch
+
+        task = asyncio.get_running_loop().create_task(self._run(batch, runner))
+        # Keep a reference so the task is not garbage collected mid-flight
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, batch: ExtractionBatch, runner: ShipmentRunner) -> None:
+        semaphore = asyncio.Semaphore(self.concurrency)
+        pending = batch.pending()
+        print(f"[BATCH {batch.batch_id}] Extracting {len(pending)} shipments")
+
+        async def run_shipment(shipment_id: str) -> None:
+            files = batch.shipments[shipment_id]
+            async with semaphore:
+                try:
+                    outcome = await runner([f["path"] for f in files], [f["hash"] for f in files])
+                    partial = outcome.get("partial", False)
+                    batch.record({
+                        "shipment_id": shipment_id,
+                        "success": True,
+                        "partial": partial,
+                        "data": outcome["data"],
+                        "cache": outcome.get("cache"),
+                        "extraction": outcome.get("extraction")
+                    })
+                    # Complete shipments no longer need their files; partial ones are retried on resume
+                    if not partial:
+                        shutil.rmtree(batch.files_dir(shipment_id), ignore_errors=True)
+                except Exception as e:
+                    print(f"[BATCH {batch.batch_id}] Shipment {shipment_id} failed: {str(e)}")
+                    batch.record({"shipment_id": shipment_id, "success": False, "error": str(e)})
+
+        try:
+            await asyncio.gather(*[run_shipment(shipment_id) for shipment_id in pending])
+        finally:
+            batch.finish("completed" if not batch.pending() else "completed_with_errors")
+            print(f"[BATCH {batch.batch_id}] Finished: {batch.summary()}")
+
+    def resume(self, batch_id: str, runner: ShipmentRunner) -> ExtractionBatch:
+        """Re-run the shipments of a batch that have no complete result yet (failed or partial)"""
+        batch = self.get(batch_id)
+        if batch.status == "running":
+            return batch
+        if batch.pending():
+            self.start(batch, runner)
+        return batch
+
+
+# Create singleton instance
+batch_manager = BatchManager()
@@ -0,0 +1,152 @@
+"""
+Circuit Breaker
+Tracks the outcome and latency of recent LLM extractions. When too many
+of them fail or are slow, the circuit opens and callers skip the LLM
+(and fall back to local extraction) instead of waiting for the provider
+to time out. After a cool-down one probe call is let through (half-open);
+its success closes the circuit, its failure opens it again.
+"""
+import threading
+import time
+from collections import deque
+from typing import Any, Dict, Optional
+
+from app.core.config import settings
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitBreaker:
+    """Failure/slow-call rate breaker over a window of recent calls"""
+
+    def __init__(
+        self,
+        window: int = settings.LLM_BREAKER_WINDOW,
+        min_calls: int = settings.LLM_BREAKER_MIN_CALLS,
+        failure_rate: float = settings.LLM_BREAKER_FAILURE_RATE,
+        slow_call_seconds: float = settings.LLM_BREAKER_SLOW_CALL_SECONDS,
+        open_seconds: float = settings.LLM_BREAKER_OPEN_SECONDS,
+        enabled: bool = settings.LLM_BREAKER_ENABLED
+    ):
+        """
+        Args:
+            window: Number of recent calls the rates are computed over
+            min_calls: Calls needed in the window before the circuit can open
+            failure_rate: Share of failed or slow calls that opens the circuit
+            slow_call_seconds: Calls slower than this count as failures
+            open_seconds: Time the circuit stays open before a probe is allowed
+            enabled: If False, every call is allowed and nothing is tracked
+        """
+        self.min_calls = min_calls
+        self.failure_rate = failure_rate
+        self.slow_call_seconds = slow_call_seconds
+        self.open_seconds = open_seconds
+        self.enabled = enabled
+        self._outcomes: deque = deque(maxlen=window)  # True = healthy call
+        self._state = CLOSED
+        self._opened_at: Optional[float] = None
+        self._probing = False
+        self._lock = threading.Lock()
+        self.times_opened = 0
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            self._maybe_half_open()
+            return self._state
+
+    def _maybe_half_open(self) -> None:
+        if self._state == OPEN and time.monotonic() - self._opened_at >= self.open_seconds:
+            self._state = HALF_OPEN
+            self._probing = False
+
+    def _open(self) -> None:
+        self._state = OPEN
+        self._opened_at = time.monotonic()
+        self._probing = False
+        self.times_opened += 1
+
+    def allow(self) -> bool:
+        """
+        Whether a call may go to the LLM now. In the half-open state only
+        one probe is allowed at a time; everything else fails fast.
+        """
+        if not self.enabled:
+            return True
+        with self._lock:
+            self._maybe_half_open()
+            if self._state == CLOSED:
+                return True
+            if self._state == HALF_OPEN and not self._probing:
+                self._probing = True
+                return True
+            return False
+
+    def record_success(self, seconds: float) -> None:
+        """Record a completed call and how long it took"""
+        if not self.enabled:
+            return
+        healthy = seconds <= self.slow_call_seconds
+        with self._lock:
+            if self._state == HALF_OPEN:
+                if healthy:
+                    print("[BREAKER] Probe succeeded, closing circuit")
+                    self._state = CLOSED
+                    self._outcomes.clear()
+                else:
+                    print(f"[BREAKER] Probe was slow ({seconds:.1f}s), reopening circuit")
+                    self._open()
+                return
+            self._outcomes.append(healthy)
+            self._check()
+
+    def record_failure(self) -> None:
+        """Record a failed call"""
+        if not self.enabled:
+            return
+        with self._lock:
+            if self._state == HALF_OPEN:
+                print("[BREAKER] Probe failed, reopening circuit")
+                self._open()
+                return
+            self._outcomes.append(False)
+            self._check()
+
+    def release(self) -> None:
+        """
+        Give back the probe slot of a call that ended without an outcome
+        (e.g. cancelled when the client disconnected), so the next call can
+        probe instead of the circuit staying half-open for good
+        """
+        if not self.enabled:
+            return
+        with self._lock:
+            if self._state == HALF_OPEN:
+                self._probing = False
+
+    def _check(self) -> None:
+        if self._state != CLOSED or len(self._outcomes) < self.min_calls:
+            return
+        unhealthy = self._outcomes.count(False) / len(self._outcomes)
+        if unhealthy >= self.failure_rate:
+            print(f"[BREAKER] {unhealthy:.0%} of recent LLM calls failed or were slow, opening circuit "
+                  f"for {self.open_seconds:.0f}s")
+            self._open()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            self._maybe_half_open()
+            outcomes = list(self._outcomes)
+            return {
+                "enabled": self.enabled,
+                "state": self._state,
+                "window_calls": len(outcomes),
+                "window_unhealthy": outcomes.count(False),
+                "times_opened": self.times_opened
+            }
+
+
+# Create singleton instance
+llm_breaker = CircuitBreaker()
@@ -1,27 +1,318 @@
 import os
-from app.utils.pdf_utils import extract_text_from_pdf
-from app.utils.xlsx_utils import extract_text_from_xlsx
+import hashlib
+import json
+from typing import Any, Callable, Dict, List, Optional
+from app.core.config import settings
+from app.utils.pdf_utils import (
+    PDF_EXTRACTOR_VERSION,
+    classify_page,
+    classify_pdf_pages,
+    count_pdf_pages,
+    extract_pdf_page_range,
+    page_classification_options,
+    render_options,
+    text_density,
+    select_render_pages,
+    per_page_budget,
+    render_pdf_page
+)
+from app.utils.xlsx_utils import XLSX_EXTRACTOR_VERSION, extract_xlsx_sheets
+from app.utils.document_cache import document_cache, hash_file
+from app.utils.document_segments import (
+    DocumentBundle,
+    ImageSegment,
+    ParsedDocument,
+    Segment,
+    SheetSegment,
+    TextSegment
+)
+from app.services.parse_pool import CallResult, parse_pool
 
-def process_documents(file_paths):
+# (stage name, details) callback; called from the parsing thread
+StageCallback = Callable[[str, Dict[str, Any]], None]
+
+
+class DocumentChangedError(Exception):
+    """Raised when a file no longer has the content hash it was referred to by"""
+    pass
+
+
+def _extractor_version(kind: str) -> str:
+    """Cache version for a document kind (output also depends on render/summary settings)"""
+    if kind == "pdf":
+        options = json.dumps(
+            {**render_options(), **page_classification_options(), "text_backend": settings.PDF_TEXT_BACKEND},
+            sort_keys=True
+        ).encode("utf-8")
+        return f"{PDF_EXTRACTOR_VERSION}-{hashlib.sha256(options).hexdigest()[:12]}"
+    return f"{XLSX_EXTRACTOR_VERSION}-{'summary' if settings.XLSX_SUMMARIZE_TABLES else 'full'}"
+
+
+def _render_page(file_path: str, page_index: int, options: Dict[str, Any], max_bytes: int) -> Optional[ImageSegment]:
+    """Render one scanned PDF page for vision extraction (None if rendering fails)"""
+    try:
+        return render_pdf_page(file_path, page_index, options, max_bytes)
+    except Exception as e:
+        print(f"Error converting PDF page {page_index + 1} to image: {e}")
+        return None
+
+
+def _page_ranges(page_count: int, pages_per_task: int) -> List[tuple]:
+    """Split [0, page_count) into consecutive (start, end) ranges"""
+    if page_count <= pages_per_task:
+        return [(0, None)]
+    return [(start, min(start + pages_per_task, page_count)) for start in range(0, page_count, pages_per_task)]
+
+
+def _parse_documents(documents: List[Dict[str, Any]], on_stage: Optional[StageCallback] = None) -> None:
+    """
+    Parse documents that were not in the cache, filling in their "segments".
+
+    XLSX files and page ranges of PDFs are parsed concurrently in the parse
+    pool; results are merged back in page order. Each PDF page is then
+    classified on its own: pages with a text layer become text segments and
+    only image-only pages (scanned PDFs, scanned pages of mixed PDFs) are
+    rendered. on_stage is told when the text is parsed ("documents_parsed")
+    and when image-only pages are rendered ("pages_rendered").
+    """
+    text_backend = settings.PDF_TEXT_BACKEND
+    for document in documents:
+        document["parse_seconds"] = 0.0
+        document["fallback"] = None
+
+    # Opening a PDF is the first thing a hostile file can hang or blow up, so
+    # the page count runs under the watchdog too
+    pdfs = [document for document in documents if document["kind"] == "pdf"]
+    counts = parse_pool.map_guarded([(count_pdf_pages, (document["path"],)) for document in pdfs])
+    for document, result in zip(pdfs, counts):
+        document["parse_seconds"] += result.seconds
+        document["pages"] = []
+        if result.ok:
+            document["page_count"] = result.value
+        else:
+            # Neither PDFium nor PyPDF2 can open it in budget: nothing to parse or render
+            document["page_count"] = 0
+            _record_fallback(document, result, "unreadable", on_stage)
+
+    calls = []
+    owners = []  # Which document each call's result belongs to
+    for document in documents:
+        if document["kind"] == "pdf":
+            if document["fallback"]:
+                continue
+            for start, end in _page_ranges(document["page_count"], settings.PARSE_PDF_PAGES_PER_TASK):
+                calls.append((extract_pdf_page_range, (document["path"], start, end, text_backend)))
+                owners.append(document)
+        else:
+            calls.append((extract_xlsx_sheets, (document["path"],)))
+            owners.append(document)
+
+    for document, result in zip(owners, parse_pool.map_guarded(calls)):
+        document["parse_seconds"] += result.seconds
+        if not result.ok:
+            # Over budget or broken: PDFs are rendered instead, spreadsheets are left out
+            if document["fallback"] is None:
+                fallback = "render_only" if document["kind"] == "pdf" else "skipped"
+                _record_fallback(document, result, fallback, on_stage)
+        elif document["kind"] == "pdf":
+            document["pages"].extend(result.value)
+        else:
+            document["segments"] = result.value
+
+    for document in documents:
+        if document["kind"] == "pdf" and document["fallback"]:
+            document["pages"] = [""] * document["page_count"]
+        elif document["kind"] != "pdf" and document["fallback"]:
+            document["segments"] = [SheetSegment(
+                sheet_name="Unparsed",
+                text=f"[Spreadsheet could not be parsed: {document['failure']}]"
+            )]
+
+    # Classify the pages of PDFs with sparse text (scanned pages, mixed PDFs); pages
+    # with plenty of text are text pages without looking at their layout
+    classification = page_classification_options()
+    calls = []
+    owners = []
+    for document in documents:
+        if document["kind"] != "pdf":
+            continue
+        pages = document["pages"]
+        if document["fallback"]:
+            document["page_kinds"] = ["image"] * len(pages)
+        elif any(text_density(text) < classification["min_text_chars"] for text in pages):
+            calls.append((classify_pdf_pages, (document["path"], pages, classification)))
+            owners.append(document)
+        else:
+            document["page_kinds"] = ["text"] * len(pages)
+
+    for document, result in zip(owners, parse_pool.map_guarded(calls)):
+        document["parse_seconds"] += result.seconds
+        if result.ok:
+            document["page_kinds"] = result.value
+        else:
+            # Without the layout, judge the pages by their text alone
+            document["page_kinds"] = [classify_page(text, None, classification) for text in document["pages"]]
+
+    scanned = []
+    for document in documents:
+        if document["kind"] != "pdf":
+            continue
+        document["segments"] = [TextSegment(text=text, page=index) for index, text in enumerate(document["pages"]) if text.strip()]
+        document["image_pages"] = [index for index, kind in enumerate(document["page_kinds"]) if kind == "image"]
+        if not document["image_pages"]:
+            continue
+        filename = os.path.basename(document["path"])
+        if len(document["image_pages"]) == document["page_count"]:
+            print(f"No text found in {filename}, treating as scanned document")
+        else:
+            print(f"{len(document['image_pages'])} of {document['page_count']} pages of {filename} have no text layer, rendering them")
+        scanned.append(document)
+
+    if on_stage:
+        on_stage("documents_parsed", {
+            "parsed": len(documents),
+            "scanned_pdfs": len(scanned),
+            "scanned_pages": sum(len(document["image_pages"]) for document in scanned)
+        })
+
+    # Render the selected image-only pages of every PDF concurrently
+    options = render_options()
+    render_pages = []
+    for document in scanned:
+        selected = select_render_pages(document["page_count"], options, document["image_pages"])
+        document["unrendered_pages"] = [index for index in document["image_pages"] if index not in selected]
+        if document["unrendered_pages"]:
+            print(f"[PARSE] Render limit leaves out {len(document['unrendered_pages'])} of "
+                  f"{len(document['image_pages'])} image-only pages of {os.path.basename(document['path'])}: "
+                  f"{', '.join(str(index + 1) for index in document['unrendered_pages'])}")
+        render_pages.extend((document, page_index) for page_index in selected)
+
+    # The image byte budget is shared by all pages rendered for this request
+    budget = per_page_budget(len(render_pages), options)
+    calls = [(_render_page, (document["path"], page_index, options, budget)) for document, page_index in render_pages]
+    owners = [document for document, _ in render_pages]
+
+    rendered = 0
+    for document, result in zip(owners, parse_pool.map_guarded(calls)):
+        document["parse_seconds"] += result.seconds
+        if result.ok and result.value:
+            document["segments"].append(result.value)
+            rendered += 1
+        elif not result.ok:
+            print(f"Rendering a page of {os.path.basename(document['path'])} failed ({result.failure}): {result.detail}")
+            document["render_failures"] = document.get("render_failures", 0) + 1
+
+    if on_stage and render_pages:
+        on_stage("pages_rendered", {
+            "pages": rendered,
+            "failed": len(render_pages) - rendered,
+            "skipped": sum(len(document["unrendered_pages"]) for document in scanned)
+        })
+
+    for document in documents:
+        if document["kind"] != "pdf":
+            continue
+        # Text and images in page order
+        document["segments"].sort(key=lambda segment: segment.page)
+        if document["fallback"] == "unreadable":
+            document["segments"].append(TextSegment(text="[PDF could not be opened - file is damaged or not a PDF]"))
+        elif not document["segments"]:
+            document["segments"].append(TextSegment(text="[Scanned PDF - text extraction not possible]"))
+
+
+def _record_fallback(
+    document: Dict[str, Any],
+    result: CallResult,
+    fallback: str,
+    on_stage: Optional[StageCallback]
+) -> None:
+    """Note that a document's parser failed or blew its budget, and what is done instead"""
+    filename = os.path.basename(document["path"])
+    document["fallback"] = fallback
+    document["failure"] = result.failure
+    print(f"[PARSE] Parsing {filename} failed ({result.failure}: {result.detail}), fallback: {fallback}")
+    if on_stage:
+        on_stage("parse_fallback", {"file": filename, "reason": result.failure, "fallback": fallback})
+
+
+def process_documents(
+    file_paths,
+    file_hashes: Optional[List[str]] = None,
+    on_stage: Optional[StageCallback] = None,
+    verify_hashes: bool = False
+) -> DocumentBundle:
     """
     Process different types of documents and extract relevant information.
 
+    Parsed content is cached per file (by content hash), so retries and
+    re-extractions of the same files skip PDF/XLSX parsing. Files that are
+    not cached are parsed in parallel in the parse pool, under its time and
+    memory budgets: a PDF whose text parser fails is rendered instead, a
+    spreadsheet is left out, and a PDF that cannot be opened at all is
+    marked unreadable. Such results are not cached.
+
     Args:
         file_paths: List of paths to the documents
+        file_hashes: Optional SHA-256 of each file (computed here if omitted)
+        on_stage: Optional progress callback ("documents_parsed", "parse_fallback",
+            "pages_rendered")
+        verify_hashes: Check that files not served from the cache still have
+            the given hashes (for files referred to by an earlier response)
 
     Returns:
-        str: Combined text from all documents
+        DocumentBundle: Typed segments (page text, sheet text, page images)
+        of every document, in upload order
+
+    Raises:
+        DocumentChangedError: If verify_hashes is set and a file that has to
+            be parsed no longer matches its hash
     """
-    all_text = ""
+    documents = []
+    for index, file_path in enumerate(file_paths):
+        file_ext = os.path.splitext(file_path)[1].lower()
+        if file_ext == ".pdf":
+            kind = "pdf"
+        elif file_ext in (".xlsx", ".xls"):
+            kind = "xlsx"
+        else:
+            continue
+
+        file_hash = file_hashes[index] if file_hashes else hash_file(file_path)
+        segments = document_cache.get(file_hash, kind, _extractor_version(kind))
+        if segments is not None:
+            print(f"[CACHE] Document cache hit for {os.path.basename(file_path)}")
+
+        documents.append({"path": file_path, "kind": kind, "hash": file_hash, "segments": segments})
 
-    for file_path in file_paths:
-        filename = os.path.basename(file_path)
+    missing = [document for document in documents if document["segments"] is None]
+    if verify_hashes and file_hashes:
+        for document in missing:
+            if hash_file(document["path"]) != document["hash"]:
+                raise DocumentChangedError(f"{os.path.basename(document['path'])} has changed since it was extracted")
+    if missing:
+        _parse_documents(missing, on_stage)
+        for document in missing:
+            # A budget failure may not happen next time, and a result cut short by the
+            # render limit must keep reporting it; parse such files again
+            if document["fallback"] or document.get("render_failures") or document.get("unrendered_pages"):
+                continue
+            document_cache.put(document["hash"], document["kind"], _extractor_version(document["kind"]), document["segments"])
+    elif on_stage:
+        on_stage("documents_parsed", {"parsed": 0, "scanned_pdfs": 0, "scanned_pages": 0})
 
-        if file_path.endswith(".pdf"):
-            text = extract_text_from_pdf(file_path)
-            all_text += f"\n\n=== Document: {filename} (PDF) ===\n{text}"
-        elif file_path.endswith(".xlsx") or file_path.endswith(".xls"):
-            text = extract_text_from_xlsx(file_path)
-            all_text += f"\n\n=== Document: {filename} (XLSX) ===\n{text}"
+    parsed = []
+    for document in documents:
+        filename = os.path.basename(document["path"])
+        segments: List[Segment] = document["segments"]
+        for segment in segments:
+            segment.source = filename
+        parsed.append(ParsedDocument(
+            filename=filename,
+            doc_type="PDF" if document["kind"] == "pdf" else "XLSX",
+            segments=segments,
+            parse_seconds=round(document["parse_seconds"], 4) if "parse_seconds" in document else None,
+            parse_fallback=document.get("fallback"),
+            unrendered_pages=document.get("unrendered_pages", [])
+        ))
 
-    return all_text 
\ No newline at end of file
+    return DocumentBundle(parsed)
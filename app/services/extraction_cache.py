@@ -0,0 +1,129 @@
+"""
+Extraction Result Cache
+Content-addressed cache of LLM extraction results so that re-uploading
+the same documents does not pay for another Claude call.
+
+Two tiers: an in-memory LRU in front of a size-bounded on-disk store.
+"""
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, Optional, Tuple
+
+from app.core.config import settings
+from app.services.llm_service import EXTRACTION_PROMPT_VERSION, model_tiers
+from app.utils.disk_cache import DiskCache
+
+
+class ExtractionCache:
+    """Two-tier (memory + disk) cache of extracted shipment data"""
+
+    def __init__(
+        self,
+        max_memory_entries: int = settings.EXTRACTION_CACHE_MEMORY_ENTRIES,
+        cache_dir: str = settings.EXTRACTION_CACHE_DIR,
+        max_disk_bytes: int = settings.EXTRACTION_CACHE_MAX_DISK_BYTES
+    ):
+        self.max_memory_entries = max_memory_entries
+        self._memory: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._disk = DiskCache(cache_dir, max_disk_bytes, suffix=".json")
+        self._stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "writes": 0}
+
+    @staticmethod
+    def make_key(file_hashes: Iterable[str], model: Optional[str] = None) -> str:
+        """
+        Build the cache key from the uploaded files' SHA-256 hashes.
+
+        The key ignores file names and upload order, and changes whenever
+        the extraction prompt or model changes.
+        """
+        material = {
+            "files": sorted(file_hashes),
+            "prompt_version": EXTRACTION_PROMPT_VERSION,
+            "model": model or "+".join(model_tiers())
+        }
+        return hashlib.sha256(json.dumps(material, sort_keys=True).encode("utf-8")).hexdigest()
+
+    def _remember(self, key: str, data: Dict[str, Any]) -> None:
+        with self._lock:
+            self._memory[key] = data
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.max_memory_entries:
+                self._memory.popitem(last=False)
+
+    def get(self, key: str) -> Tuple[Optional[Dict[str, Any]], Optional[str]]:
+        """
+        Look up extracted data.
+
+        Returns:
+            (data, tier) where tier is "memory" or "disk", or (None, None) on a miss
+        """
+        with self._lock:
+            data = self._memory.get(key)
+            if data is not None:
+                self._memory.move_to_end(key)
+                self._stats["memory_hits"] += 1
+                return dict(data), "memory"
+
+        raw = self._disk.get(key)
+        if raw is not None:
+            try:
+                data = json.loads(raw)
+            except ValueError:
+                self._disk.delete(key)
+            else:
+                self._remember(key, data)
+                with self._lock:
+                    self._stats["disk_hits"] += 1
+                return dict(data), "disk"
+
+        with self._lock:
+            self._stats["misses"] += 1
+        return None, None
+
+    def put(self, key: str, data: Dict[str, Any]) -> None:
+        """Store extracted data in both tiers"""
+        self._remember(key, dict(data))
+        try:
+            self._disk.put(key, json.dumps(data).encode("utf-8"))
+        except Exception as e:
+            # The memory tier still has it; a full or read-only disk should not fail the request
+            print(f"Error writing extraction cache entry {key}: {e}")
+        with self._lock:
+            self._stats["writes"] += 1
+
+    def invalidate(self, key: str) -> bool:
+        """Remove one entry from both tiers. Returns True if it existed."""
+        with self._lock:
+            in_memory = self._memory.pop(key, None) is not None
+        on_disk = self._disk.delete(key)
+        return in_memory or on_disk
+
+    def clear(self) -> int:
+        """Remove all entries. Returns the number of disk entries removed."""
+        with self._lock:
+            self._memory.clear()
+        return self._disk.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        """Hit/miss counters and tier sizes"""
+        with self._lock:
+            counters = dict(self._stats)
+            memory_entries = len(self._memory)
+
+        lookups = counters["memory_hits"] + counters["disk_hits"] + counters["misses"]
+        hits = counters["memory_hits"] + counters["disk_hits"]
+        return {
+            **counters,
+            "hit_rate": round(hits / lookups, 4) if lookups else 0.0,
+            "memory": {"entries": memory_entries, "max_entries": self.max_memory_entries},
+            "disk": self._disk.stats(),
+            "prompt_version": EXTRACTION_PROMPT_VERSION,
+            "model": "+".join(model_tiers())
+        }
+
+
+# Create singleton instance
+extraction_cache = ExtractionCache()
@@ -0,0 +1,182 @@
+"""
+Extraction Job Queue
+Runs document parsing and LLM extraction in the background so that
+/api/extract can return a job id immediately instead of holding the
+HTTP connection for the full LLM round trip.
+"""
+import asyncio
+import time
+import uuid
+from datetime import datetime
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from app.core.config import settings
+
+
+class QueueFullError(Exception):
+    """Raised when the job queue cannot accept more work"""
+    pass
+
+
+class ExtractionJob:
+    """State of a single background extraction job"""
+
+    def __init__(self, job_id: str, metadata: Optional[Dict[str, Any]] = None):
+        self.job_id = job_id
+        self.status = "queued"
+        self.metadata = metadata or {}
+        self.result: Optional[Dict[str, Any]] = None
+        self.error: Optional[str] = None
+        self.created_at = datetime.now()
+        self.started_at: Optional[datetime] = None
+        self.finished_at: Optional[datetime] = None
+        self._finished_monotonic: Optional[float] = None
+
+    @property
+    def is_finished(self) -> bool:
+        return self.status in ("completed", "failed")
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Serialize job state for the API"""
+        return {
+            "job_id": self.job_id,
+            "status": self.status,
+            "created_at": self.created_at.isoformat(),
+            "started_at": self.started_at.isoformat() if self.started_at else None,
+            "finished_at": self.finished_at.isoformat() if self.finished_at else None,
+            "result": self.result,
+            "error": self.error,
+            **self.metadata
+        }
+
+
+class ExtractionJobQueue:
+    """
+    Bounded in-process worker pool for extraction jobs.
+
+    At most `max_workers` jobs run at once; further jobs wait in the queue
+    (up to `max_queued`). Finished jobs are kept for `job_ttl_seconds` so
+    clients can poll GET /api/jobs/{id} for the result.
+    """
+
+    def __init__(
+        self,
+        max_workers: int = settings.EXTRACTION_WORKERS,
+        max_queued: int = settings.EXTRACTION_QUEUE_MAX_SIZE,
+        job_ttl_seconds: int = settings.EXTRACTION_JOB_TTL_SECONDS
+    ):
+        self.max_workers = max_workers
+        self.max_queued = max_queued
+        self.job_ttl_seconds = job_ttl_seconds
+        self._jobs: Dict[str, ExtractionJob] = {}
+        self._tasks = set()
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def _get_semaphore(self) -> asyncio.Semaphore:
+        """Semaphores are bound to an event loop, so create one per running loop"""
+        loop = asyncio.get_running_loop()
+        if self._semaphore is None or self._loop is not loop:
+            self._semaphore = asyncio.Semaphore(self.max_workers)
+            self._loop = loop
+        return self._semaphore
+
+    def pending_count(self) -> int:
+        """Number of jobs that are queued or running"""
+        return sum(1 for job in self._jobs.values() if not job.is_finished)
+
+    def submit(
+        self,
+        runner: Callable[[], Awaitable[Dict[str, Any]]],
+        cleanup: Optional[Callable[[], None]] = None,
+        metadata: Optional[Dict[str, Any]] = None
+    ) -> ExtractionJob:
+        """
+        Enqueue a job. Must be called from a running event loop.
+
+        Args:
+            runner: Coroutine factory producing the job result
+            cleanup: Optional callback run after the job finishes (success or failure)
+            metadata: Extra fields returned with the job status (e.g. uploaded files)
+
+        Raises:
+            QueueFullError: If too many jobs are already pending
+        """
+        self._prune_expired()
+
+        if self.pending_count() >= self.max_workers + self.max_queued:
+            raise QueueFullError("Extraction queue is full. Please retry later.")
+
+        job = ExtractionJob(uuid.uuid4().hex, metadata)
+        self._jobs[job.job_id] = job
+
+        task = asyncio.get_running_loop().create_task(self._run(job, runner, cleanup))
+        # Keep a reference so the task is not garbage collected mid-flight
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+        return job
+
+    async def _run(
+        self,
+        job: ExtractionJob,
+        runner: Callable[[], Awaitable[Dict[str, Any]]],
+        cleanup: Optional[Callable[[], None]]
+    ) -> None:
+        try:
+            async with self._get_semaphore():
+                job.status = "running"
+                job.started_at = datetime.now()
+                print(f"[JOB {job.job_id}] Started")
+                try:
+                    job.result = await runner()
+                    job.status = "completed"
+                except Exception as e:
+                    print(f"[JOB {job.job_id}] Failed: {str(e)}")
+                    job.error = str(e)
+                    job.status = "failed"
+        except asyncio.CancelledError:
+            # Shutdown or task cancellation: the job must not stay "queued"/"running" forever
+            print(f"[JOB {job.job_id}] Cancelled")
+            job.error = "Job was cancelled"
+            job.status = "failed"
+            raise
+        finally:
+            job.finished_at = datetime.now()
+            job._finished_monotonic = time.monotonic()
+            if cleanup:
+                try:
+                    cleanup()
+                except Exception as e:
+                    print(f"[JOB {job.job_id}] Cleanup error: {e}")
+
+    def get(self, job_id: str) -> Optional[ExtractionJob]:
+        """Look up a job by id (None if unknown or expired)"""
+        self._prune_expired()
+        return self._jobs.get(job_id)
+
+    async def wait(self, job_id: str, timeout: Optional[float] = None) -> Optional[ExtractionJob]:
+        """Wait until a job finishes (used by tests and internal callers)"""
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        while True:
+            job = self._jobs.get(job_id)
+            if job is None or job.is_finished:
+                return job
+            if deadline is not None and time.monotonic() >= deadline:
+                return job
+            await asyncio.sleep(0.01)
+
+    def _prune_expired(self) -> None:
+        """Drop finished jobs older than the TTL"""
+        now = time.monotonic()
+        expired = [
+            job_id for job_id, job in self._jobs.items()
+            if job._finished_monotonic is not None
+            and now - job._finished_monotonic > self.job_ttl_seconds
+        ]
+        for job_id in expired:
+            del self._jobs[job_id]
+
+
+# Create singleton instance
+job_queue = ExtractionJobQueue()
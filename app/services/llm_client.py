@@ -0,0 +1,470 @@
+"""
+Shared async Anthropic client
+Keeps one keep-alive connection pool per event loop and limits how many
+LLM calls are in flight, how many requests start per minute and how many
+tokens are sent per minute. Requests whose system blocks carry
+cache_control go through the prompt caching API. Responses can be
+streamed to a callback as the text arrives.
+
+Every attempt has a timeout and every call an overall deadline; retryable
+failures (429, 5xx, timeouts, connection errors) are retried with jittered
+exponential backoff. Optionally, a call whose first token has not arrived
+within the observed p95 latency is hedged with a second request; the
+first to answer wins and the other is cancelled.
+"""
+import asyncio
+import json
+import random
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, List, Optional, Union
+
+import anthropic
+import httpx
+from anthropic import AsyncAnthropic
+
+from app.core.config import settings
+from app.services.llm_metrics import llm_metrics
+from app.services.rate_limiter import TokenBucket
+
+# Set while running batch work, so its calls use the batch in-flight limit
+_batch_lane: ContextVar[bool] = ContextVar("llm_batch_lane", default=False)
+
+# Rough cost of one image block in input tokens (Claude scales images to ~1.15MP)
+IMAGE_TOKEN_ESTIMATE = 1600
+
+
+def estimate_tokens(content: Union[str, List[Dict[str, Any]]]) -> int:
+    """
+    Estimate input tokens for a message content (string or content blocks).
+    Uses ~4 characters per token for text.
+    """
+    if isinstance(content, str):
+        return len(content) // 4 + 1
+
+    total = 0
+    for block in content:
+        if block.get("type") == "image":
+            total += IMAGE_TOKEN_ESTIMATE
+        elif block.get("type") == "text":
+            total += len(block.get("text", "")) // 4 + 1
+    return total
+
+
+@contextmanager
+def batch_lane():
+    """
+    Run LLM calls made inside this block in the batch lane: they share the
+    connection pool and rate limits with interactive calls, but have their
+    own in-flight limit so backfills neither starve nor are starved by /extract.
+    """
+    token = _batch_lane.set(True)
+    try:
+        yield
+    finally:
+        _batch_lane.reset(token)
+
+
+def usage_summary(message: Any) -> Dict[str, int]:
+    """Token usage of a response, including prompt cache reads/writes"""
+    usage = getattr(message, "usage", None)
+    return {
+        key: getattr(usage, key, None) or 0
+        for key in ("input_tokens", "output_tokens", "cache_read_input_tokens", "cache_creation_input_tokens")
+    }
+
+
+def is_retryable(error: BaseException) -> bool:
+    """Whether a failed LLM call is worth retrying"""
+    if isinstance(error, (asyncio.TimeoutError, anthropic.APIConnectionError)):
+        return True
+    if isinstance(error, anthropic.APIStatusError):
+        return error.status_code in (408, 409, 429) or error.status_code >= 500
+    return False
+
+
+def _retry_after(error: BaseException) -> Optional[float]:
+    """Seconds from a Retry-After header, if the error carries one"""
+    response = getattr(error, "response", None)
+    value = response.headers.get("retry-after") if response is not None else None
+    try:
+        return float(value) if value is not None else None
+    except ValueError:
+        return None
+
+
+class LatencyTracker:
+    """Recent time-to-first-token samples, for the hedge delay"""
+
+    def __init__(self, window: int = 200):
+        self._samples: deque = deque(maxlen=window)
+
+    def record(self, seconds: float) -> None:
+        self._samples.append(seconds)
+
+    def __len__(self) -> int:
+        return len(self._samples)
+
+    def percentile(self, fraction: float) -> Optional[float]:
+        if not self._samples:
+            return None
+        ordered = sorted(self._samples)
+        return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+class _Attempt:
+    """
+    One HTTP request of a (possibly hedged) call. Streamed deltas are
+    buffered until the attempt is chosen as the winner, so the callback
+    only ever sees one response.
+    """
+
+    def __init__(self, api: Any, kwargs: Dict[str, Any], on_text: Optional[Callable[[str], None]], progress: Dict[str, bool]):
+        self.loop = asyncio.get_running_loop()
+        self.started_at = self.loop.time()
+        self.first_token_at: Optional[float] = None
+        self.first_token = asyncio.Event()
+        self._on_text = on_text
+        self._forward = False
+        self._buffer: List[str] = []
+        self._progress = progress
+        self.task = asyncio.ensure_future(self._run(api, kwargs))
+        # Losing attempts are cancelled or fail unobserved; retrieve their errors
+        self.task.add_done_callback(lambda task: task.cancelled() or task.exception())
+
+    @property
+    def latency(self) -> Optional[float]:
+        return self.first_token_at - self.started_at if self.first_token_at is not None else None
+
+    def _mark_first_token(self) -> None:
+        if self.first_token_at is None:
+            self.first_token_at = self.loop.time()
+            self.first_token.set()
+
+    def _emit(self, text: str) -> None:
+        self._mark_first_token()
+        if self._forward:
+            self._progress["forwarded"] = True
+            self._on_text(text)
+        else:
+            self._buffer.append(text)
+
+    def win(self) -> None:
+        """Start passing this attempt's deltas (buffered ones first) to the callback"""
+        self._forward = True
+        for text in self._buffer:
+            self._progress["forwarded"] = True
+            self._on_text(text)
+        self._buffer = []
+
+    async def _run(self, api: Any, kwargs: Dict[str, Any]) -> Any:
+        if self._on_text is None:
+            message = await api.create(**kwargs)
+            self._mark_first_token()
+            return message
+
+        async with api.stream(**kwargs) as stream:
+            async for event in stream:
+                if event.type == "text":
+                    self._emit(event.text)
+                elif event.type == "input_json":
+                    self._emit(event.partial_json)
+            message = await stream.get_final_message()
+        self._mark_first_token()
+        return message
+
+
+def _uses_cache_control(kwargs: Dict[str, Any]) -> bool:
+    system = kwargs.get("system")
+    return isinstance(system, list) and any("cache_control" in block for block in system)
+
+
+def _strip_cache_control(kwargs: Dict[str, Any]) -> Dict[str, Any]:
+    """Request kwargs for the regular messages API (no cache_control markers)"""
+    system = [{k: v for k, v in block.items() if k != "cache_control"} for block in kwargs["system"]]
+    return {**kwargs, "system": system}
+
+
+class LLMClient:
+    """Pooled, rate-limited wrapper around AsyncAnthropic"""
+
+    def __init__(
+        self,
+        max_in_flight: int = settings.LLM_MAX_IN_FLIGHT,
+        requests_per_minute: int = settings.LLM_REQUESTS_PER_MINUTE,
+        tokens_per_minute: int = settings.LLM_TOKENS_PER_MINUTE,
+        transport: Optional[httpx.AsyncBaseTransport] = None,
+        batch_max_in_flight: int = settings.BATCH_LLM_MAX_IN_FLIGHT
+    ):
+        """
+        Args:
+            max_in_flight: Max concurrent LLM calls
+            requests_per_minute: Request rate limit (0 = unlimited)
+            tokens_per_minute: Token rate limit (0 = unlimited)
+            transport: Optional httpx transport (used by tests to stand in for the API)
+            batch_max_in_flight: Max concurrent LLM calls made in the batch lane
+        """
+        self.max_in_flight = max_in_flight
+        self.batch_max_in_flight = batch_max_in_flight
+        self.transport = transport
+        self.request_bucket = TokenBucket(requests_per_minute)
+        self.token_bucket = TokenBucket(tokens_per_minute)
+        self._client: Optional[AsyncAnthropic] = None
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._batch_semaphore: Optional[asyncio.Semaphore] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self.prompt_caching = settings.LLM_PROMPT_CACHING
+        self.timeout = settings.LLM_TIMEOUT_SECONDS
+        self.deadline = settings.LLM_DEADLINE_SECONDS
+        self.max_retries = settings.LLM_MAX_RETRIES
+        self.retry_base_delay = settings.LLM_RETRY_BASE_DELAY_SECONDS
+        self.retry_max_delay = settings.LLM_RETRY_MAX_DELAY_SECONDS
+        self.hedging = settings.LLM_HEDGING_ENABLED
+        # Streamed and non-streamed calls have very different first-token times
+        self.latencies = {True: LatencyTracker(), False: LatencyTracker()}
+        self.usage_totals = {
+            "calls": 0,
+            "input_tokens": 0,
+            "output_tokens": 0,
+            "cache_read_input_tokens": 0,
+            "cache_creation_input_tokens": 0
+        }
+
+    def _bind_to_loop(self) -> None:
+        """
+        httpx connections and asyncio semaphores belong to one event loop,
+        so (re)create them when called from a different loop.
+        """
+        loop = asyncio.get_running_loop()
+        if self._loop is loop and self._client is not None:
+            return
+
+        self._release_client()
+        print(f"[LLM] Creating Anthropic async client for {settings.LLM_BASE_URL or 'the Anthropic API'} "
+              f"(max connections: {settings.LLM_MAX_CONNECTIONS}, in flight: {self.max_in_flight})")
+        http_client = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=settings.LLM_MAX_CONNECTIONS,
+                max_keepalive_connections=settings.LLM_MAX_KEEPALIVE_CONNECTIONS,
+                keepalive_expiry=settings.LLM_KEEPALIVE_EXPIRY_SECONDS
+            ),
+            timeout=httpx.Timeout(self.timeout, connect=5.0),
+            transport=self.transport
+        )
+        # Retries are handled in create_message (with deadlines and hedging)
+        self._client = AsyncAnthropic(
+            api_key=settings.ANTHROPIC_API_KEY,
+            base_url=settings.LLM_BASE_URL or None,
+            http_client=http_client,
+            max_retries=0
+        )
+        self._semaphore = asyncio.Semaphore(self.max_in_flight)
+        self._batch_semaphore = asyncio.Semaphore(self.batch_max_in_flight)
+        self._loop = loop
+
+    def _release_client(self) -> None:
+        """
+        Let go of the client bound to the previous event loop. If that loop
+        is still running (e.g. another thread's), the client is closed there;
+        connections of a stopped loop cannot be closed from this one, so
+        that client is only dropped (use aclose() on its loop to close it).
+        """
+        client, loop = self._client, self._loop
+        self._client = None
+        self._loop = None
+        if client is None:
+            return
+        if loop is not None and loop.is_running() and not loop.is_closed():
+            asyncio.run_coroutine_threadsafe(client.close(), loop)
+        else:
+            print("[LLM] Dropping the Anthropic client of a stopped event loop")
+
+    async def aclose(self) -> None:
+        """Close the client and its connections (call from its event loop, e.g. on shutdown)"""
+        if self._client is not None and self._loop is asyncio.get_running_loop():
+            client = self._client
+            self._client = None
+            self._loop = None
+            await client.close()
+        else:
+            self._release_client()
+
+    @property
+    def client(self) -> AsyncAnthropic:
+        """The AsyncAnthropic client for the current event loop"""
+        self._bind_to_loop()
+        return self._client
+
+    def hedge_delay(self, streamed: bool) -> float:
+        """Seconds to wait for a first token before sending a hedge request"""
+        tracker = self.latencies[streamed]
+        if len(tracker) < settings.LLM_HEDGE_MIN_SAMPLES:
+            return settings.LLM_HEDGE_INITIAL_DELAY_SECONDS
+        return tracker.percentile(settings.LLM_HEDGE_PERCENTILE)
+
+    def retry_delay(self, retry: int, error: BaseException) -> float:
+        """Full-jitter exponential backoff, at least the server's Retry-After"""
+        delay = random.uniform(0, min(self.retry_max_delay, self.retry_base_delay * (2 ** retry)))
+        retry_after = _retry_after(error)
+        if retry_after is not None:
+            delay = max(delay, min(retry_after, self.retry_max_delay))
+        return delay
+
+    async def _race(
+        self,
+        api: Any,
+        kwargs: Dict[str, Any],
+        on_text: Optional[Callable[[str], None]],
+        progress: Dict[str, bool],
+        estimated_tokens: int
+    ) -> Any:
+        """Run one attempt, hedged with a second one if its first token is late"""
+        streamed = on_text is not None
+        attempts = [_Attempt(api, kwargs, on_text, progress)]
+        try:
+            primary = attempts[0]
+            if self.hedging:
+                first_token = asyncio.ensure_future(primary.first_token.wait())
+                try:
+                    done, _ = await asyncio.wait(
+                        {first_token, primary.task},
+                        timeout=self.hedge_delay(streamed),
+                        return_when=asyncio.FIRST_COMPLETED
+                    )
+                finally:
+                    first_token.cancel()
+                # Only hedge if it would not have to wait for rate limit budget
+                if not done and (not self.request_bucket.enabled or self.request_bucket.available() >= 1):
+                    self.request_bucket.debit(1)
+                    self.token_bucket.debit(estimated_tokens)
+                    llm_metrics.increment("llm_hedges")
+                    print(f"[LLM] No first token after {primary.loop.time() - primary.started_at:.2f}s, hedging")
+                    attempts.append(_Attempt(api, kwargs, on_text, progress))
+
+            winner = await self._first_to_answer(attempts)
+            if winner is not primary:
+                llm_metrics.increment("llm_hedge_wins")
+            for attempt in attempts:
+                if attempt is not winner:
+                    attempt.task.cancel()
+
+            winner.win()
+            message = await winner.task
+            self.latencies[streamed].record(winner.latency)
+            return message
+        finally:
+            for attempt in attempts:
+                if not attempt.task.done():
+                    attempt.task.cancel()
+
+    @staticmethod
+    async def _first_to_answer(attempts: List[_Attempt]) -> _Attempt:
+        """The first attempt to produce a token; attempts that fail before that drop out"""
+        pending = list(attempts)
+        errors = []
+        while True:
+            for attempt in list(pending):
+                if attempt.first_token.is_set():
+                    return attempt
+                if attempt.task.done():
+                    pending.remove(attempt)
+                    errors.append(attempt.task.exception())
+            if not pending:
+                raise errors[0]
+
+            waiters = [asyncio.ensure_future(attempt.first_token.wait()) for attempt in pending]
+            try:
+                await asyncio.wait(waiters + [attempt.task for attempt in pending], return_when=asyncio.FIRST_COMPLETED)
+            finally:
+                for waiter in waiters:
+                    waiter.cancel()
+
+    async def create_message(self, on_text: Optional[Callable[[str], None]] = None, **kwargs) -> Any:
+        """
+        Call messages.create once a concurrency slot and rate budget are available.
+        Accepts the same keyword arguments as AsyncAnthropic.messages.create.
+
+        If system blocks are marked with cache_control, the call goes through
+        the prompt caching API (or the markers are dropped when caching is off).
+
+        Each attempt is limited to LLM_TIMEOUT_SECONDS and the whole call
+        (retries and backoff included) to LLM_DEADLINE_SECONDS. Retryable
+        errors are retried up to LLM_MAX_RETRIES times; a streamed call is
+        not retried once text has been passed to on_text.
+
+        Args:
+            on_text: Optional callback; when given, the response is streamed
+                and each text or tool input JSON delta is passed to it as it
+                arrives. The complete message is still returned.
+        """
+        self._bind_to_loop()
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.deadline
+
+        estimated_tokens = sum(estimate_tokens(m["content"]) for m in kwargs.get("messages", []))
+        estimated_tokens += estimate_tokens(kwargs.get("system") or "") + kwargs.get("max_tokens", 0)
+        if kwargs.get("tools"):
+            estimated_tokens += estimate_tokens(json.dumps(kwargs["tools"]))
+
+        if _uses_cache_control(kwargs):
+            if self.prompt_caching:
+                api = self._client.beta.prompt_caching.messages
+            else:
+                api = self._client.messages
+                kwargs = _strip_cache_control(kwargs)
+        else:
+            api = self._client.messages
+
+        semaphore = self._batch_semaphore if _batch_lane.get() else self._semaphore
+        progress = {"forwarded": False}
+        retry = 0
+        while True:
+            try:
+                async with semaphore:
+                    waited = await self.request_bucket.acquire(1)
+                    waited += await self.token_bucket.acquire(estimated_tokens)
+                    if waited > 0:
+                        print(f"[LLM] Rate limited for {waited:.2f}s")
+
+                    timeout = min(self.timeout, deadline - loop.time())
+                    if timeout <= 0:
+                        raise asyncio.TimeoutError()
+                    try:
+                        message = await asyncio.wait_for(
+                            self._race(api, kwargs, on_text, progress, estimated_tokens), timeout
+                        )
+                    except asyncio.TimeoutError:
+                        llm_metrics.increment("llm_timeouts")
+                        raise
+                break
+            except Exception as e:
+                delay = self.retry_delay(retry, e) if is_retryable(e) else None
+                if (delay is None or retry >= self.max_retries or progress["forwarded"]
+                        or loop.time() + delay >= deadline):
+                    if isinstance(e, asyncio.TimeoutError):
+                        raise Exception(f"LLM call timed out after {retry + 1} attempt(s)") from e
+                    raise
+                retry += 1
+                llm_metrics.increment("llm_retries")
+                print(f"[LLM] {type(e).__name__} ({str(e) or 'timeout'}), retry {retry} in {delay:.2f}s")
+                await asyncio.sleep(delay)
+
+        # Reconcile the token bucket with what the call actually used
+        if getattr(message, "usage", None) is not None:
+            usage = usage_summary(message)
+            actual_tokens = sum(usage.values())
+            self.token_bucket.debit(actual_tokens - estimated_tokens)
+
+            self.usage_totals["calls"] += 1
+            for key, value in usage.items():
+                self.usage_totals[key] += value
+            if usage["cache_read_input_tokens"] or usage["cache_creation_input_tokens"]:
+                print(f"[LLM] Prompt cache: {usage['cache_read_input_tokens']} read, "
+                      f"{usage['cache_creation_input_tokens']} written")
+
+        return message
+
+
+# Create singleton instance
+llm_client = LLMClient()
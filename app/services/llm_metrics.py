@@ -0,0 +1,53 @@
+"""
+LLM Extraction Metrics
+In-process counters for the LLM extraction path (responses, parse
+failures, repair calls, model tier escalations), exposed at GET /api/admin/llm/stats.
+"""
+import threading
+from typing import Any, Dict
+
+
+def _rate(numerator: int, denominator: int) -> float:
+    return round(numerator / denominator, 4) if denominator else 0.0
+
+
+class LLMMetrics:
+    """Thread-safe named counters with derived rates"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters: Dict[str, int] = {}
+
+    def increment(self, name: str, count: int = 1) -> None:
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + count
+
+    def get(self, name: str) -> int:
+        with self._lock:
+            return self._counters.get(name, 0)
+
+    def reset(self) -> None:
+        with self._lock:
+            self._counters.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        """Counters plus the rates derived from them"""
+        with self._lock:
+            counters = dict(self._counters)
+
+        responses = counters.get("responses", 0)
+        return {
+            **counters,
+            # Responses with no usable structured output at all
+            "parse_failure_rate": _rate(counters.get("parse_failures", 0), responses),
+            # Responses with at least one field in the wrong shape
+            "malformed_response_rate": _rate(counters.get("malformed_responses", 0), responses),
+            # Extra calls spent on repairs, per response
+            "repair_call_rate": _rate(counters.get("repair_calls", 0), responses),
+            # Fast model extractions that needed the large model for some fields
+            "escalation_rate": _rate(counters.get("escalations", 0), counters.get("fast_model_extractions", 0))
+        }
+
+
+# Create singleton instance
+llm_metrics = LLMMetrics()
@@ -1,212 +1,805 @@
-from anthropic import Anthropic
 from app.core.config import settings
+from app.services.circuit_breaker import llm_breaker
+from app.services.llm_client import llm_client, usage_summary
+from app.services.llm_metrics import llm_metrics
+from app.services.prompt_compactor import compact_documents, select_sections
+from app.services.rule_extractor import EXPECTED_FIELDS, RuleExtraction, extract_with_rules, pdf_gross_weight_kg
+from app.services.validators import ShipmentValidator
+from app.utils.document_segments import DocumentBundle
+from app.utils.json_stream import IncrementalJSONParser
+from typing import Any, Callable, Dict, List, Optional, Tuple
 import json
+import re
+import time
+
+# Bump whenever the extraction prompts, rules or response handling change,
+# so cached extraction results from older prompts are not reused
+EXTRACTION_PROMPT_VERSION = "10"
+
+
+class LLMUnavailableError(Exception):
+    """Raised when the LLM circuit is open and no local fallback applies"""
+    pass
+
+# Per-field instructions for text documents. The full instruction block is
+# the same on every call (so it can be prompt-cached); the user message
+# names the fields that still need the LLM
+TEXT_FIELD_INSTRUCTIONS = {
+    'billOfLadingNumber': "billOfLadingNumber - The B/L number or BOL number from PDF or Excel",
+    'containerNumber': "containerNumber - The container number (e.g., ABCD1234567) from PDF or Excel",
+    'consigneeName': 'consigneeName - The name of the consignee/receiver (company name from "SHIP TO" in Excel or PDF)',
+    'consigneeAddress': """consigneeAddress - The FULL delivery address of the consignee:
+   - FIRST: Look in the PDF Bill of Lading for the "CONSIGNEE" or "NOTIFY PARTY" section
+   - The address should include: street, city, state, ZIP code, country
+   - If not in PDF, check Excel "SHIP TO" field (but it may only have company name)
+   - Return the complete address, not just the company name""",
+    'dateOfExport': "dateOfExport - The export date in MM/DD/YYYY format",
+    'lineItemsCount': "lineItemsCount - COUNT the number of rows with S.No. values in the Excel Invoice sheet",
+    'averageGrossWeight': 'averageGrossWeight - Find TOTAL weight from PDF, divide by lineItemsCount (format: "X.XX KG")',
+    'averagePrice': 'averagePrice - Sum Excel "Total Value (USD)" column E, divide by lineItemsCount (format: "$X.XX")'
+}
+
+TEXT_FIELD_RULES = {
+    'dateOfExport': "For dateOfExport, convert any date format to MM/DD/YYYY",
+    'lineItemsCount': "For lineItemsCount: COUNT numbered rows with S.No. in Excel Invoice sheet",
+    'averageGrossWeight': "For averageGrossWeight: Use PDF TOTAL weight (not Excel sum), divide by lineItemsCount",
+    'averagePrice': 'For averagePrice: Sum Excel "Total Value (USD)" column E, divide by lineItemsCount',
+    'consigneeAddress': "For consigneeAddress: Look in PDF FIRST (CONSIGNEE section), it should be a full street address"
+}
+
+# Per-field instructions for scanned PDFs sent as page images
+VISION_FIELD_INSTRUCTIONS = {
+    'billOfLadingNumber': 'billOfLadingNumber - Extract from PDF or Excel (e.g., "ZMLU34110002")',
+    'containerNumber': 'containerNumber - Extract from PDF or Excel (e.g., "MSCU1234567")',
+    'consigneeName': 'consigneeName - Extract "SHIP TO" company name from Excel Invoice sheet or PDF',
+    'consigneeAddress': """consigneeAddress - Extract the full consignee delivery address:
+   - FIRST: Look in the PDF Bill of Lading for the "CONSIGNEE" or "NOTIFY PARTY" section
+   - The address typically includes: street, city, state, ZIP code, country
+   - If not in PDF, check Excel "SHIP TO" field (but it may only have company name)
+   - Return the complete address, not just the company name""",
+    'dateOfExport': "dateOfExport - Extract date from ANY document, convert to MM/DD/YYYY format",
+    'lineItemsCount': """lineItemsCount - COUNT the number of rows with S.No. values in the Excel Invoice sheet
+   - Look for rows with numbered S.No. (1, 2, 3, etc.)
+   - Count ALL numbered rows, even if some numbers are missing
+   - Return the total COUNT as a number""",
+    'averageGrossWeight': """averageGrossWeight - CRITICAL CALCULATION (DO NOT GET THIS WRONG):
+   - Step 1: Find the TOTAL GROSS WEIGHT from the PDF Bill of Lading image
+   - Look for text like "GROSS WEIGHT: 16250 KGS" or "TOTAL: 16250.00 KG"
+   - This is the TOTAL for the entire shipment, NOT per item
+   - Step 2: Take the lineItemsCount (e.g., 18)
+   - Step 3: Divide: (PDF total gross weight) / (lineItemsCount)
+   - EXAMPLE: PDF shows "16250 KGS" and lineItemsCount is 18
+     Calculation: 16250 / 18 = 902.78 KG
+   - DO NOT use Excel weights. DO NOT sum anything. ONLY divide PDF total by count.
+   - Format result as "X.XX KG\"""",
+    'averagePrice': """averagePrice - Calculate from Excel Invoice sheet:
+   - Find the "Total Value (USD)" column (column E)
+   - Sum ALL total values in this column (not unit prices)
+   - Calculate: (sum of total values) / (lineItemsCount)
+   - Format as "$X.XX\""""
+}
 
-print(f"[DEBUG] Loading Anthropic client with API key: {settings.ANTHROPIC_API_KEY[:30]}...{settings.ANTHROPIC_API_KEY[-20:]}")
-client = Anthropic(api_key=settings.ANTHROPIC_API_KEY)
+VISION_FIELD_RULES = {
+    'averageGrossWeight': """For averageGrossWeight: Find PDF TOTAL gross weight (e.g., 16250 KG), divide by lineItemsCount
+  WRONG: Using Excel weights, summing anything, calculating per-item weights
+  RIGHT: 16250 / 18 = 902.78 KG""",
+    'lineItemsCount': "For lineItemsCount: Count numbered rows in Excel Invoice sheet (not Packing List)",
+    'averagePrice': 'For averagePrice: Use Excel "Total Value (USD)" column (column E), NOT unit prices',
+    'consigneeAddress': """For consigneeAddress: Look in the PDF Bill of Lading image FIRST for the "CONSIGNEE" section with full street address
+- Excel SHIP TO field typically only has company name, not the full address"""
+}
 
+# (event name, data) callback used to stream extraction progress
+EventCallback = Callable[[str, Dict[str, Any]], None]
 
-def extract_field_from_document(document_text):
-    """
-    Use Claude AI to extract shipment data from document text or images.
+COMPUTED_FIGURES_RULE = 'If a sheet has "COMPUTED INVOICE FIGURES", use its lineItemsCount and averagePrice exactly (do not recount)'
 
-    Args:
-        document_text: Combined text from all documents (may contain IMAGE_PDF markers)
 
-    Returns:
-        dict: Extracted shipment data with all required fields
-    """
+def build_field_list(fields: List[str], instructions: Dict[str, str], separator: str = "\n") -> str:
+    """Numbered instructions for the requested fields"""
+    return separator.join(f"{number}. {instructions[name]}" for number, name in enumerate(fields, 1))
+
+
+def build_rules(fields: List[str], rules: Dict[str, str]) -> List[str]:
+    """Rule lines for the requested fields, in the order of the rules dict"""
+    lines = [rule for name, rule in rules.items() if name in fields]
+    if "lineItemsCount" in fields or "averagePrice" in fields:
+        lines.append(COMPUTED_FIGURES_RULE)
+    return lines
+
 
-    # Check if we have image-based PDFs
-    if "IMAGE_PDF:" in document_text:
-        return extract_from_image_pdf(document_text)
+def _rule_lines(rules: Dict[str, str]) -> str:
+    return "\n".join(f"- {rule}" for rule in build_rules(EXPECTED_FIELDS, rules))
 
-    prompt = f"""You are an AI assistant specialized in extracting shipment data from documents.
+
+# Static instruction blocks, sent as cacheable system prompts
+TEXT_INSTRUCTIONS = f"""You are an AI assistant specialized in extracting shipment data from documents.
 I will provide you with the text content of shipment documents (Bill of Lading, Commercial Invoice, Packing List, etc.).
 
-Please extract the following fields and return them in a JSON format:
+Please extract the following fields and record them with the record_shipment_data tool:
 
-1. billOfLadingNumber - The B/L number or BOL number from PDF or Excel
-2. containerNumber - The container number (e.g., ABCD1234567) from PDF or Excel
-3. consigneeName - The name of the consignee/receiver (company name from "SHIP TO" in Excel or PDF)
-4. consigneeAddress - The FULL delivery address of the consignee:
-   - FIRST: Look in the PDF Bill of Lading for the "CONSIGNEE" or "NOTIFY PARTY" section
-   - The address should include: street, city, state, ZIP code, country
-   - If not in PDF, check Excel "SHIP TO" field (but it may only have company name)
-   - Return the complete address, not just the company name
-5. dateOfExport - The export date in MM/DD/YYYY format
-6. lineItemsCount - COUNT the number of rows with S.No. values in the Excel Invoice sheet
-7. averageGrossWeight - Find TOTAL weight from PDF, divide by lineItemsCount (format: "X.XX KG")
-8. averagePrice - Sum Excel "Total Value (USD)" column E, divide by lineItemsCount (format: "$X.XX")
+{build_field_list(EXPECTED_FIELDS, TEXT_FIELD_INSTRUCTIONS)}
 
 Important instructions:
 - If a field is not found, use null as the value
-- For dateOfExport, convert any date format to MM/DD/YYYY
-- For lineItemsCount: COUNT numbered rows with S.No. in Excel Invoice sheet
-- For averageGrossWeight: Use PDF TOTAL weight (not Excel sum), divide by lineItemsCount
-- For averagePrice: Sum Excel "Total Value (USD)" column E, divide by lineItemsCount
-- For consigneeAddress: Look in PDF FIRST (CONSIGNEE section), it should be a full street address
-- Return ONLY valid JSON, no additional text or explanation
-- Be precise and extract data exactly as it appears in the documents
-
-Here are the documents:
-{document_text}
+{_rule_lines(TEXT_FIELD_RULES)}
+- Record the fields with the record_shipment_data tool, no additional text or explanation
+- Be precise and extract data exactly as it appears in the documents"""
+
+VISION_INSTRUCTIONS = f"""You have been provided with shipment documents including:
+- Scanned PDF image(s): Bill of Lading with TOTAL gross weight for the entire shipment
+- Excel/XLSX file(s): Commercial Invoice and Packing List with line items and individual prices
+
+CRITICAL: Follow these EXACT instructions for each field:
 
-Return the extracted data as JSON:"""
+{build_field_list(EXPECTED_FIELDS, VISION_FIELD_INSTRUCTIONS, separator=chr(10) * 2)}
 
+CRITICAL RULES (FOLLOW EXACTLY):
+{_rule_lines(VISION_FIELD_RULES)}
+- Record the fields with the record_shipment_data tool, no explanation or markdown
+- If a field cannot be found, use null"""
+
+
+# Structured output: the model records the fields by calling this tool, so
+# the response arrives as an object the API has already parsed. The schema
+# is static (every field, none required) so it stays in the cached prefix
+EXTRACTION_TOOL_NAME = "record_shipment_data"
+
+# Expected shape of string fields: (pattern, description for repair requests)
+FIELD_FORMATS = {
+    'containerNumber': (re.compile(r"^[A-Z]{4}\d{7}$"), "4 letters + 7 digits, e.g. MSCU1234567"),
+    'dateOfExport': (re.compile(r"^\d{2}/\d{2}/\d{4}$"), "MM/DD/YYYY"),
+    'averageGrossWeight': (re.compile(r"^\d+(\.\d+)? KG$"), '"X.XX KG"'),
+    'averagePrice': (re.compile(r"^\$\d[\d,]*(\.\d+)?$"), '"$X.XX"')
+}
+
+
+def _field_schema(name: str) -> Dict[str, Any]:
+    if name == "lineItemsCount":
+        return {"type": ["integer", "null"], "minimum": 0, "description": "Number of invoice line items"}
+    schema: Dict[str, Any] = {"type": ["string", "null"]}
+    if name in FIELD_FORMATS:
+        pattern, description = FIELD_FORMATS[name]
+        schema["pattern"] = pattern.pattern
+        schema["description"] = f"Format: {description}"
+    return schema
+
+
+EXTRACTION_TOOL = {
+    "name": EXTRACTION_TOOL_NAME,
+    "description": "Record the shipment fields extracted from the documents. "
+                   "Use null for a field that is not in the documents; leave out fields listed as already extracted.",
+    "input_schema": {
+        "type": "object",
+        "properties": {name: _field_schema(name) for name in EXPECTED_FIELDS}
+    }
+}
+
+
+def build_system(instructions: str) -> List[Dict[str, Any]]:
+    """System prompt block marked for prompt caching"""
+    return [{"type": "text", "text": instructions, "cache_control": {"type": "ephemeral"}}]
+
+
+def build_field_request(fields: List[str], known: Dict[str, Any]) -> str:
+    """Per-request note on which fields to return and which are already known"""
+    if list(fields) == list(EXPECTED_FIELDS):
+        return ""
+    request = f"Only extract these fields: {', '.join(fields)}\n"
+    if known:
+        lines = "\n".join(f"- {name}: {value}" for name, value in known.items())
+        request += f"Already extracted (use these values in calculations, do not return them):\n{lines}\n"
+    return request + "\n"
+
+
+def record_usage(message: Any, report: Optional[Dict[str, Any]]) -> None:
+    """Add the call's token usage (including prompt cache reads/writes) to the report"""
+    if report is not None:
+        usage = report.setdefault("usage", {})
+        for key, value in usage_summary(message).items():
+            usage[key] = usage.get(key, 0) + value
+
+
+def parse_json_response(response_text: str) -> Dict[str, Any]:
+    """Parse the JSON object in a model response (tolerates markdown fences)"""
+    json_match = response_text.strip()
+    # Remove markdown code blocks if present
+    if json_match.startswith("```"):
+        json_match = json_match.split("```")[1]
+        if json_match.startswith("json"):
+            json_match = json_match[4:]
+        json_match = json_match.strip()
+
+    # Find JSON object
+    start_idx = json_match.find("{")
+    end_idx = json_match.rfind("}") + 1
+    if start_idx != -1 and end_idx > start_idx:
+        json_match = json_match[start_idx:end_idx]
+
+    return json.loads(json_match)
+
+
+def read_structured_output(message: Any) -> Tuple[Optional[Dict[str, Any]], Optional[str]]:
+    """
+    The extracted fields of a response and the id of its tool call.
+
+    Uses the record_shipment_data tool input; falls back to JSON in the
+    text for responses without a tool call. Returns (None, None) if the
+    response holds no usable object.
+    """
+    for block in message.content:
+        if getattr(block, "type", None) == "tool_use" and block.name == EXTRACTION_TOOL_NAME:
+            if isinstance(block.input, dict):
+                return block.input, block.id
+            return None, block.id
+
+    text = "".join(block.text for block in message.content if getattr(block, "type", None) == "text")
     try:
-        message = client.messages.create(
-            model="claude-3-opus-20240229",
-            max_tokens=2000,
-            messages=[{
-                "role": "user",
-                "content": prompt
-            }]
-        )
-
-        response_text = message.content[0].text
-        print(f"Claude response: {response_text}")
-
-        # Parse JSON response
-        json_match = response_text.strip()
-        # Remove markdown code blocks if present
-        if json_match.startswith("```"):
-            json_match = json_match.split("```")[1]
-            if json_match.startswith("json"):
-                json_match = json_match[4:]
-            json_match = json_match.strip()
-
-        # Find JSON object
-        start_idx = json_match.find("{")
-        end_idx = json_match.rfind("}") + 1
-        if start_idx != -1 and end_idx > start_idx:
-            json_match = json_match[start_idx:end_idx]
-
-        extracted_data = json.loads(json_match)
-
-        # Validate and structure the response
-        expected_fields = [
-            'billOfLadingNumber',
-            'containerNumber',
-            'consigneeName',
-            'consigneeAddress',
-            'dateOfExport',
-            'lineItemsCount',
-            'averageGrossWeight',
-            'averagePrice'
-        ]
+        data = parse_json_response(text)
+    except ValueError:
+        return None, None
+    return (data, None) if isinstance(data, dict) else (None, None)
+
+
+def normalize_fields(data: Dict[str, Any]) -> Dict[str, Any]:
+    """Local fixes that do not need the model (whitespace, numeric strings)"""
+    result = {}
+    for name, value in data.items():
+        if isinstance(value, str):
+            value = value.strip()
+            if name == "lineItemsCount" and value.isdigit():
+                value = int(value)
+        elif name == "lineItemsCount" and isinstance(value, float) and value.is_integer():
+            value = int(value)
+        result[name] = value
+    return result
+
+
+def validate_field(name: str, value: Any) -> Optional[str]:
+    """What is wrong with a returned field value (None if it has the expected shape)"""
+    if value is None:
+        return None
+    if name == "lineItemsCount":
+        if isinstance(value, bool) or not isinstance(value, int) or value < 0:
+            return "expected a whole number"
+        return None
+    if not isinstance(value, str) or not value:
+        return "expected a string"
+    if name in FIELD_FORMATS:
+        pattern, description = FIELD_FORMATS[name]
+        if not pattern.match(value):
+            return f"expected {description}"
+    return None
+
+
+def model_tiers() -> List[str]:
+    """Models an extraction may use, cheapest first"""
+    if settings.LLM_TIERING_ENABLED and settings.LLM_FAST_MODEL != settings.LLM_MODEL:
+        return [settings.LLM_FAST_MODEL, settings.LLM_MODEL]
+    return [settings.LLM_MODEL]
+
+
+def _business_problem(name: str, value: Any) -> Optional[str]:
+    """ShipmentValidator checks for a field value that already has the right shape"""
+    if name == "containerNumber":
+        return ShipmentValidator.validate_container_check_digit(value)
+    if name == "billOfLadingNumber":
+        return ShipmentValidator.validate_bol_number(value, "B/L number")
+    if name == "consigneeName":
+        return ShipmentValidator.validate_name(value, "Consignee name")
+    if name == "averageGrossWeight":
+        return ShipmentValidator.validate_weight(value)
+    return None
+
+
+def find_inconsistent_fields(result: Dict[str, Any], fields: List[str], documents: DocumentBundle) -> Dict[str, str]:
+    """
+    Fields (of those asked from the LLM) that are missing, malformed, fail
+    ShipmentValidator, or disagree with the totals in the documents.
+    Used to decide what a fast model answer must escalate.
+    """
+    problems = {}
+    for name in fields:
+        value = result.get(name)
+        problem = "not found" if value is None else validate_field(name, value) or _business_problem(name, value)
+        if problem:
+            problems[name] = problem
+
+    # Cross-field check: average gross weight x line items = PDF total gross weight
+    count = result.get("lineItemsCount")
+    weight = result.get("averageGrossWeight")
+    if (
+        ("averageGrossWeight" in fields or "lineItemsCount" in fields)
+        and "averageGrossWeight" not in problems
+        and isinstance(count, int) and count > 0 and weight
+    ):
+        total_kg = pdf_gross_weight_kg(documents)
+        if total_kg:
+            implied = float(weight.split()[0]) * count
+            # Averages are rounded to cents, so allow 1% (or a cent per item)
+            if abs(implied - total_kg) > max(0.01 * total_kg, 0.01 * count):
+                name = "averageGrossWeight" if "averageGrossWeight" in fields else "lineItemsCount"
+                problems[name] = (f"average x {count} line items is {implied:.2f} KG, "
+                                  f"but the documents state a total of {total_kg:.2f} KG")
+    return problems
+
+
+def find_malformed_fields(data: Dict[str, Any], fields: List[str]) -> Dict[str, str]:
+    """Requested fields whose values do not have the expected shape -> problem"""
+    problems = {}
+    for name in fields:
+        problem = validate_field(name, data.get(name))
+        if problem:
+            problems[name] = problem
+    return problems
+
+
+def _assistant_content(message: Any) -> List[Dict[str, Any]]:
+    """A response's content blocks as request params, to continue the conversation"""
+    content = []
+    for block in message.content:
+        block_type = getattr(block, "type", None)
+        if block_type == "tool_use":
+            content.append({"type": "tool_use", "id": block.id, "name": block.name, "input": block.input})
+        elif block_type == "text" and block.text:
+            content.append({"type": "text", "text": block.text})
+    return content or [{"type": "text", "text": "{}"}]
+
+
+def build_repair_request(problems: Dict[str, str], data: Dict[str, Any], tool_use_id: Optional[str]) -> List[Dict[str, Any]]:
+    """Follow-up user turn asking again for only the malformed fields"""
+    lines = []
+    for name, problem in problems.items():
+        got = f" (got {json.dumps(data[name])})" if data.get(name) is not None else ""
+        lines.append(f"- {name}: {problem}{got}")
+    text = ("These fields are missing or malformed:\n" + "\n".join(lines) +
+            f"\nCall {EXTRACTION_TOOL_NAME} again with only these fields, corrected. "
+            "Use null if a field is not in the documents.")
+    if tool_use_id:
+        return [{"type": "tool_result", "tool_use_id": tool_use_id, "is_error": True, "content": text}]
+    return [{"type": "text", "text": text}]
+
+
+def field_streamer(fields: List[str], on_event: Optional[EventCallback]) -> Optional[Callable[[str], None]]:
+    """
+    Text callback for a streamed LLM response that emits a "field" event
+    for each requested field as soon as its JSON value is complete.
+    """
+    if on_event is None:
+        return None
+    parser = IncrementalJSONParser()
 
-        result = {}
-        for field in expected_fields:
-            result[field] = extracted_data.get(field, None)
+    def on_text(text: str) -> None:
+        for name, value in parser.feed(text):
+            if name in fields:
+                on_event("field", {"name": name, "value": value, "source": "llm"})
+    return on_text
 
+
+def apply_computed_figures(result: Dict[str, Any], documents: DocumentBundle) -> Dict[str, Any]:
+    """
+    Replace LLM arithmetic with the figures computed from the XLSX line items.
+    The average price is left alone when the line items and the stated
+    invoice total disagree.
+    """
+    analytics = documents.invoice_analytics()
+    if not analytics or not analytics["line_items_count"]:
         return result
 
-    except Exception as e:
-        print(f"Error calling Claude API: {str(e)}")
-        raise Exception(f"Failed to extract data with AI: {str(e)}")
+    result["lineItemsCount"] = analytics["line_items_count"]
+    if analytics["average_price"] is not None and not analytics.get("total_mismatch"):
+        result["averagePrice"] = f"${analytics['average_price']:.2f}"
+    return result
+
+
+def prepare_document_text(documents: DocumentBundle, report: Optional[Dict[str, Any]] = None) -> str:
+    """Document text for the prompt, compacted to the token budget when enabled"""
+    if not settings.PROMPT_COMPACTION_ENABLED:
+        return documents.render_text()
+
+    compaction = compact_documents(documents, settings.PROMPT_TOKEN_BUDGET)
+    print(f"[PROMPT] Document text: ~{compaction.tokens_before} -> ~{compaction.tokens_after} tokens")
+    if report is not None:
+        report["prompt"] = compaction.to_dict()
+    return compaction.text
 
 
-def extract_from_image_pdf(document_text):
+def degraded_result(
+    documents: DocumentBundle,
+    rules: Optional[RuleExtraction],
+    report: Optional[Dict[str, Any]] = None,
+    on_event: Optional[EventCallback] = None
+) -> Dict[str, Any]:
     """
-    Extract data from scanned PDFs and other documents using Claude's vision API.
-    Handles multiple IMAGE_PDF markers and combines with XLSX data.
+    Best-effort result from local extraction only, used while the LLM
+    circuit is open. Every rule match is used whatever its confidence;
+    the report says which fields are missing or uncertain.
+    """
+    rules = rules or extract_with_rules(documents)
+    result = {name: rules.matches[name].value if name in rules.matches else None for name in EXPECTED_FIELDS}
+    result = apply_computed_figures(result, documents)
+
+    degraded = {
+        "reason": "llm_circuit_open",
+        "missing_fields": [name for name in EXPECTED_FIELDS if result[name] is None],
+        "low_confidence_fields": [
+            name for name, match in rules.matches.items() if match.confidence < rules.min_confidence
+        ]
+    }
+    llm_metrics.increment("degraded_responses")
+    print(f"[BREAKER] LLM circuit open, returning local extraction "
+          f"(missing: {', '.join(degraded['missing_fields']) or 'none'})")
+
+    if report is not None:
+        report["degraded"] = degraded
+    if on_event is not None:
+        for name in degraded["low_confidence_fields"]:
+            on_event("field", {"name": name, "value": result[name], "source": "rules"})
+        on_event("degraded", degraded)
+    return result
+
+
+async def extract_field_from_document(
+    documents: DocumentBundle,
+    report: Optional[Dict[str, Any]] = None,
+    on_event: Optional[EventCallback] = None
+):
+    """
+    Extract shipment data from document text or images.
+
+    A local rule-based stage runs first; fields it finds with enough
+    confidence are not sent to Claude, and if all of them are found the
+    LLM is not called at all. Text documents are tried on the fast model
+    first (see _extract_tiered); scanned documents go to the large model.
+    While the LLM circuit breaker is open, the local result is returned
+    as is, flagged in report["degraded"].
 
     Args:
-        document_text: Text containing IMAGE_PDF: markers and/or XLSX content
+        documents: Parsed documents (page text, sheet text and page images)
+        report: Optional dict that receives the per-file parse times and
+            fallbacks, which fields came from rules/LLM, the prompt token
+            counts and the call's usage (incl. cache reads/writes)
+        on_event: Optional callback for progress events: "field" for each
+            field found by the rules or completed in the streamed LLM
+            response, "llm_started" before the LLM call, "llm_escalated"
+            when fast model fields are re-asked from the large model, and
+            "degraded" when the LLM is skipped because its circuit is open
 
     Returns:
-        dict: Extracted shipment data
+        dict: Extracted shipment data with all required fields
     """
+    known: Dict[str, Any] = {}
+    fields = list(EXPECTED_FIELDS)
+    rules = None
+
+    if report is not None:
+        report["parse"] = documents.parse_report()
+
+    if settings.RULE_EXTRACTION_ENABLED:
+        rules = extract_with_rules(documents)
+        known = rules.accepted
+        fields = rules.missing
+        if report is not None:
+            report["rules"] = {"fields": list(known), "confidence": rules.confidence()}
+        if on_event is not None:
+            for name, value in known.items():
+                on_event("field", {"name": name, "value": value, "source": "rules"})
+
+    if report is not None:
+        report["llm_fields"] = fields
+
+    if not fields:
+        print("[RULES] All fields extracted locally, skipping Claude")
+        return apply_computed_figures({name: known.get(name) for name in EXPECTED_FIELDS}, documents)
+
+    if known:
+        print(f"[RULES] Extracted {len(known)} fields locally, asking Claude for: {', '.join(fields)}")
+
+    # Fail fast while the provider is unhealthy
+    if not llm_breaker.allow():
+        return degraded_result(documents, rules, report, on_event)
+
+    started = time.monotonic()
     try:
-        # Build content array for multi-modal input
-        content = []
-
-        # Extract all IMAGE_PDF markers (there may be multiple PDFs)
-        parts = document_text.split("IMAGE_PDF:")
-
-        # Add all PDF images
-        for i in range(1, len(parts)):
-            # Extract base64 data for this PDF (everything before next newline or end)
-            pdf_base64 = parts[i].split("\n")[0].strip()
-            if pdf_base64 and not pdf_base64.startswith("==="):
-                content.append({
-                    "type": "image",
-                    "source": {
-                        "type": "base64",
-                        "media_type": "image/png",
-                        "data": pdf_base64
-                    }
-                })
-
-        # Extract XLSX text content (everything that's not IMAGE_PDF data)
-        xlsx_text = parts[0]  # Everything before first IMAGE_PDF
-        for part in parts[1:]:
-            # Get text after the base64 data
-            lines = part.split("\n", 1)
-            if len(lines) > 1:
-                xlsx_text += "\n" + lines[1]
-
-        # Build the prompt text
-        prompt_text = """You have been provided with shipment documents including:
-- Scanned PDF image(s): Bill of Lading with TOTAL gross weight for the entire shipment
-- Excel/XLSX file(s): Commercial Invoice and Packing List with line items and individual prices
+        # Check if we have image-based PDFs
+        if documents.has_images:
+            if on_event is not None:
+                on_event("llm_started", {"fields": fields, "model": settings.LLM_MODEL, "vision": True})
+            extracted_data = await extract_from_image_pdf(documents, fields, known, report, on_event)
+        else:
+            extracted_data = await _extract_tiered(documents, fields, known, report, on_event)
+    except Exception:
+        llm_breaker.record_failure()
+        raise
+    except BaseException:
+        # Cancelled (client gone) or shutting down: no verdict on the provider
+        llm_breaker.release()
+        raise
+    llm_breaker.record_success(time.monotonic() - started)
+
+    # Validate and structure the response
+    result = {}
+    for field in EXPECTED_FIELDS:
+        result[field] = known[field] if field in known else extracted_data.get(field, None)
+
+    return apply_computed_figures(result, documents)
+
+
+async def reextract_fields(
+    documents: DocumentBundle,
+    fields: List[str],
+    current: Dict[str, Any],
+    report: Optional[Dict[str, Any]] = None
+) -> Dict[str, Any]:
+    """
+    Re-extract a subset of fields and merge them into an existing result.
 
-CRITICAL: Follow these EXACT instructions for each field:
+    Only the pages/sheets relevant to those fields are sent (see
+    select_sections), with the other current values as known context.
+    Line item count and average price are recomputed locally when the
+    invoice figures are available. Uses LLM_MODEL, since a re-extraction
+    usually follows a value the first pass got wrong.
 
-1. billOfLadingNumber - Extract from PDF or Excel (e.g., "ZMLU34110002")
+    Args:
+        documents: Parsed documents of the shipment (normally from the document cache)
+        fields: Names of the fields to extract again
+        current: The existing extraction result
+        report: Optional dict that receives the selected sections, prompt size and usage
 
-2. containerNumber - Extract from PDF or Excel (e.g., "MSCU1234567")
+    Returns:
+        dict: current with the re-extracted fields replaced
+    """
+    unknown = [name for name in fields if name not in EXPECTED_FIELDS]
+    if unknown:
+        raise ValueError(f"Unknown fields: {', '.join(unknown)}")
+
+    fields = [name for name in EXPECTED_FIELDS if name in fields]
+    computed = apply_computed_figures({}, documents)
+    result = dict(current)
+    result.update({name: computed[name] for name in fields if name in computed})
+    remaining = [name for name in fields if name not in computed]
+
+    if report is not None:
+        report["fields"] = fields
+        report["computed_fields"] = [name for name in fields if name in computed]
+    if not remaining:
+        return result
 
-3. consigneeName - Extract "SHIP TO" company name from Excel Invoice sheet or PDF
+    known = {name: value for name, value in current.items() if name in EXPECTED_FIELDS and name not in fields and value is not None}
+    selected = select_sections(documents, remaining)
+    if report is not None:
+        report["sections"] = {"selected": len(selected.segments), "total": len(documents.segments)}
+    print(f"[RE-EXTRACT] Asking for {', '.join(remaining)} from "
+          f"{len(selected.segments)} of {len(documents.segments)} pages/sheets")
 
-4. consigneeAddress - Extract the full consignee delivery address:
-   - FIRST: Look in the PDF Bill of Lading for the "CONSIGNEE" or "NOTIFY PARTY" section
-   - The address typically includes: street, city, state, ZIP code, country
-   - If not in PDF, check Excel "SHIP TO" field (but it may only have company name)
-   - Return the complete address, not just the company name
+    if not llm_breaker.allow():
+        raise LLMUnavailableError("LLM circuit is open, re-extraction is unavailable")
 
-5. dateOfExport - Extract date from ANY document, convert to MM/DD/YYYY format
+    started = time.monotonic()
+    try:
+        if selected.has_images:
+            extracted = await extract_from_image_pdf(selected, remaining, known, report)
+        else:
+            extracted = await _extract_from_text(selected, remaining, known, report)
+    except Exception:
+        llm_breaker.record_failure()
+        raise
+    except BaseException:
+        # Cancelled (client gone) or shutting down: no verdict on the provider
+        llm_breaker.release()
+        raise
+    llm_breaker.record_success(time.monotonic() - started)
+
+    result.update({name: extracted.get(name) for name in remaining})
+    return result
+
+
+async def _extract_tiered(
+    documents: DocumentBundle,
+    fields: List[str],
+    known: Dict[str, Any],
+    report: Optional[Dict[str, Any]] = None,
+    on_event: Optional[EventCallback] = None
+) -> Dict[str, Any]:
+    """
+    Ask the fast model for the fields of text documents, then the large
+    model for only the fields whose fast answer is missing, invalid or
+    inconsistent with the document totals (or for every field if the fast
+    model call fails). With tiering disabled the large model is asked directly.
+    """
+    tiers = model_tiers()
+    if len(tiers) == 1:
+        if on_event is not None:
+            on_event("llm_started", {"fields": fields, "model": tiers[0], "vision": False})
+        return await _extract_from_text(documents, fields, known, report, on_event)
 
-6. lineItemsCount - COUNT the number of rows with S.No. values in the Excel Invoice sheet
-   - Look for rows with numbered S.No. (1, 2, 3, etc.)
-   - Count ALL numbered rows, even if some numbers are missing
-   - Return the total COUNT as a number
+    fast_model, large_model = tiers
+    if on_event is not None:
+        on_event("llm_started", {"fields": fields, "model": fast_model, "vision": False})
 
-7. averageGrossWeight - CRITICAL CALCULATION (DO NOT GET THIS WRONG):
-   - Step 1: Find the TOTAL GROSS WEIGHT from the PDF Bill of Lading image
-   - Look for text like "GROSS WEIGHT: 16250 KGS" or "TOTAL: 16250.00 KG"
-   - This is the TOTAL for the entire shipment, NOT per item
-   - Step 2: Take the lineItemsCount you found in step 6 (e.g., 18)
-   - Step 3: Divide: (PDF total gross weight) / (lineItemsCount)
-   - EXAMPLE: PDF shows "16250 KGS" and lineItemsCount is 18
-     Calculation: 16250 / 18 = 902.78 KG
-   - DO NOT use Excel weights. DO NOT sum anything. ONLY divide PDF total by count.
-   - Format result as "X.XX KG"
+    llm_metrics.increment("fast_model_extractions")
+    try:
+        # Not streamed: fast answers are only reported once they pass the checks
+        extracted = await _extract_from_text(documents, fields, known, report, None, fast_model)
+        merged = apply_computed_figures({**extracted, **known}, documents)
+        problems = find_inconsistent_fields(merged, fields, documents)
+    except Exception as e:
+        print(f"[TIERS] Fast model failed ({e}), escalating every field")
+        llm_metrics.increment("fast_model_failures")
+        extracted = {}
+        problems = {name: "fast model failed" for name in fields}
+
+    accepted = {name: extracted.get(name) for name in fields if name not in problems}
+    if on_event is not None:
+        for name, value in accepted.items():
+            on_event("field", {"name": name, "value": value, "source": "llm"})
+
+    if report is not None:
+        report["tiers"] = {"fast_model": fast_model, "large_model": large_model, "escalated_fields": problems}
+    if not problems:
+        return extracted
+
+    escalate = list(problems)
+    llm_metrics.increment("escalations")
+    llm_metrics.increment("escalated_fields", len(escalate))
+    print(f"[TIERS] Escalating to {large_model}: " + ", ".join(f"{name} ({problem})" for name, problem in problems.items()))
+    if on_event is not None:
+        on_event("llm_escalated", {"fields": escalate, "model": large_model, "reasons": problems})
+
+    escalated = await _extract_from_text(documents, escalate, {**known, **accepted}, report, on_event, large_model)
+    return {**accepted, **{name: escalated.get(name) for name in escalate}}
+
+
+async def _create_structured(
+    instructions: str,
+    messages: List[Dict[str, Any]],
+    fields: List[str],
+    report: Optional[Dict[str, Any]],
+    on_event: Optional[EventCallback],
+    model: Optional[str] = None
+) -> Any:
+    """One extraction call that must answer with the record_shipment_data tool"""
+    message = await llm_client.create_message(
+        model=model or settings.LLM_MODEL,
+        max_tokens=settings.LLM_MAX_TOKENS,
+        system=build_system(instructions),
+        tools=[EXTRACTION_TOOL],
+        tool_choice={"type": "tool", "name": EXTRACTION_TOOL_NAME},
+        on_text=field_streamer(fields, on_event),
+        messages=messages
+    )
+    record_usage(message, report)
+    return message
+
+
+async def _request_structured(
+    instructions: str,
+    content: Any,
+    fields: List[str],
+    report: Optional[Dict[str, Any]] = None,
+    on_event: Optional[EventCallback] = None,
+    model: Optional[str] = None
+) -> Dict[str, Any]:
+    """
+    Ask for the fields as a tool call, then re-ask (at most
+    LLM_REPAIR_ATTEMPTS times) for only the fields that came back
+    missing or in the wrong shape. Fields still malformed after the
+    repairs are returned as they are.
+    """
+    messages = [{"role": "user", "content": content}]
+    message = await _create_structured(instructions, messages, fields, report, on_event, model)
+    data, tool_use_id = read_structured_output(message)
+
+    llm_metrics.increment("responses")
+    if data is None:
+        llm_metrics.increment("parse_failures")
+        print("[LLM] Response had no structured output")
+        data = {}
+        problems = {name: "missing from the response" for name in fields}
+    else:
+        data = normalize_fields(data)
+        problems = find_malformed_fields(data, fields)
+        if problems:
+            llm_metrics.increment("malformed_responses")
+    malformed = list(problems)
+
+    repair_calls = 0
+    while problems and repair_calls < settings.LLM_REPAIR_ATTEMPTS:
+        repair_calls += 1
+        llm_metrics.increment("repair_calls")
+        print(f"[LLM] Re-asking for malformed fields: {', '.join(problems)}")
+        messages = messages + [
+            {"role": "assistant", "content": _assistant_content(message)},
+            {"role": "user", "content": build_repair_request(problems, data, tool_use_id)}
+        ]
+        message = await _create_structured(instructions, messages, list(problems), report, None, model)
+        repaired, tool_use_id = read_structured_output(message)
+        repaired = normalize_fields(repaired or {})
+        for name in list(problems):
+            if name in repaired and validate_field(name, repaired[name]) is None:
+                data[name] = repaired[name]
+                del problems[name]
+                llm_metrics.increment("repaired_fields")
+                if on_event is not None:
+                    on_event("field", {"name": name, "value": data[name], "source": "llm"})
+
+    if problems:
+        llm_metrics.increment("unrepaired_fields", len(problems))
+        print(f"[LLM] Fields still malformed after {repair_calls} repair call(s): {', '.join(problems)}")
+
+    if report is not None:
+        report["structured_output"] = {
+            "malformed_fields": malformed,
+            "repair_calls": repair_calls,
+            "unrepaired_fields": list(problems)
+        }
+    return data
+
+
+async def _extract_from_text(
+    documents: DocumentBundle,
+    fields: List[str],
+    known: Dict[str, Any],
+    report: Optional[Dict[str, Any]] = None,
+    on_event: Optional[EventCallback] = None,
+    model: Optional[str] = None
+) -> Dict[str, Any]:
+    """Ask Claude (model, default LLM_MODEL) for the given fields of text-only documents"""
+    document_text = prepare_document_text(documents, report)
+
+    prompt = f"""{build_field_request(fields, known)}Here are the documents:
+{document_text}
 
-8. averagePrice - Calculate from Excel Invoice sheet:
-   - Find the "Total Value (USD)" column (column E)
-   - Sum ALL total values in this column (not unit prices)
-   - Calculate: (sum of total values) / (lineItemsCount from step 6)
-   - Format as "$X.XX"
+Record the extracted data with the {EXTRACTION_TOOL_NAME} tool."""
 
-CRITICAL RULES (FOLLOW EXACTLY):
-- For averageGrossWeight: Find PDF TOTAL gross weight (e.g., 16250 KG), divide by lineItemsCount
-  WRONG: Using Excel weights, summing anything, calculating per-item weights
-  RIGHT: 16250 / 18 = 902.78 KG
-- For lineItemsCount: Count numbered rows in Excel Invoice sheet (not Packing List)
-- For averagePrice: Use Excel "Total Value (USD)" column (column E), NOT unit prices
-- For consigneeAddress: Look in the PDF Bill of Lading image FIRST for the "CONSIGNEE" section with full street address
-- Excel SHIP TO field typically only has company name, not the full address
-- Return ONLY valid JSON, no explanation or markdown
-- If a field cannot be found, use null
+    try:
+        extracted = await _request_structured(TEXT_INSTRUCTIONS, prompt, fields, report, on_event, model)
+        print(f"Claude response: {json.dumps(extracted)}")
+        return extracted
 
-"""
+    except Exception as e:
+        print(f"Error calling Claude API: {str(e)}")
+        raise Exception(f"Failed to extract data with AI: {str(e)}")
+
+
+async def extract_from_image_pdf(
+    documents: DocumentBundle,
+    fields: Optional[List[str]] = None,
+    known: Optional[Dict[str, Any]] = None,
+    report: Optional[Dict[str, Any]] = None,
+    on_event: Optional[EventCallback] = None
+) -> Dict[str, Any]:
+    """
+    Extract data from scanned PDFs and other documents using Claude's vision API.
+    Sends every rendered page image and combines them with the XLSX data.
+
+    Args:
+        documents: Parsed documents containing at least one page image
+        fields: Fields to ask for (default: all expected fields)
+        known: Fields already extracted locally
+        report: Optional dict that receives prompt size and token usage
+        on_event: Optional callback that receives "field" events while the
+            response streams in
+
+    Returns:
+        dict: Extracted shipment data
+    """
+    fields = fields or list(EXPECTED_FIELDS)
+    try:
+        # Build content array for multi-modal input: all PDF page images first
+        # (base64 encoding happens here, once per image)
+        content = [image.to_content_block() for image in documents.images]
+
+        # Text content of the other documents (XLSX sheets, text PDFs)
+        xlsx_text = prepare_document_text(documents, report)
+
+        # Per-shipment part of the prompt (the instructions are in the system prompt)
+        prompt_text = build_field_request(fields, known or {})
 
         if xlsx_text.strip():
             prompt_text += f"\n\nExcel/XLSX Packing List Data:\n{xlsx_text}\n"
 
-        prompt_text += "\nReturn the extracted data as JSON:"
+        prompt_text += f"\nRecord the extracted data with the {EXTRACTION_TOOL_NAME} tool."
 
         content.append({
             "type": "text",
@@ -214,50 +807,9 @@ CRITICAL RULES (FOLLOW EXACTLY):
         })
 
         # Use Claude vision to read all documents
-        message = client.messages.create(
-            model="claude-3-opus-20240229",
-            max_tokens=2000,
-            messages=[{
-                "role": "user",
-                "content": content
-            }]
-        )
-
-        response_text = message.content[0].text
-        print(f"Claude vision response: {response_text}")
-
-        # Parse JSON response
-        json_match = response_text.strip()
-        if json_match.startswith("```"):
-            json_match = json_match.split("```")[1]
-            if json_match.startswith("json"):
-                json_match = json_match[4:]
-            json_match = json_match.strip()
-
-        start_idx = json_match.find("{")
-        end_idx = json_match.rfind("}") + 1
-        if start_idx != -1 and end_idx > start_idx:
-            json_match = json_match[start_idx:end_idx]
-
-        extracted_data = json.loads(json_match)
-
-        # Validate and structure the response
-        expected_fields = [
-            'billOfLadingNumber',
-            'containerNumber',
-            'consigneeName',
-            'consigneeAddress',
-            'dateOfExport',
-            'lineItemsCount',
-            'averageGrossWeight',
-            'averagePrice'
-        ]
-
-        result = {}
-        for field in expected_fields:
-            result[field] = extracted_data.get(field, None)
-
-        return result
+        extracted = await _request_structured(VISION_INSTRUCTIONS, content, fields, report, on_event)
+        print(f"Claude vision response: {json.dumps(extracted)}")
+        return extracted
 
     except Exception as e:
         print(f"Error extracting from image PDF: {str(e)}")
@@ -0,0 +1,322 @@
+"""
+Document Parse Pool
+Warm process pool for CPU-bound document parsing (PDF text extraction,
+openpyxl loading, pypdfium2 rendering) so the files of a request are
+parsed on several cores instead of one after another under the GIL.
+
+With isolation on, every parse call runs in a worker process under a
+watchdog: a call that runs past its deadline gets its worker killed,
+and workers run with a capped address space, so a malformed or hostile
+file costs one failed call instead of a stalled or bloated API worker.
+"""
+import itertools
+import multiprocessing
+import queue
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, CancelledError, Future, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+
+from app.core.config import settings
+
+try:
+    import resource
+except ImportError:  # Not available on Windows; the memory cap is skipped there
+    resource = None
+
+WATCHDOG_POLL_SECONDS = 0.05
+
+# Set in each worker process by _init_worker
+_started_queue = None
+
+
+def _warm_worker() -> None:
+    """Pre-import the parsing libraries so the first task does not pay for it"""
+    import PyPDF2  # noqa: F401
+    import openpyxl  # noqa: F401
+    import pypdfium2  # noqa: F401
+    import app.utils.pdf_utils  # noqa: F401
+    import app.utils.xlsx_utils  # noqa: F401
+
+
+def _init_worker(started_queue, memory_limit_mb: int) -> None:
+    """Worker initializer: cap the address space, then warm up"""
+    global _started_queue
+    _started_queue = started_queue
+    if memory_limit_mb > 0 and resource is not None:
+        limit = memory_limit_mb * 1024 * 1024
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+    _warm_worker()
+
+
+def _guarded_call(call_id: int, fn: Callable[..., Any], args: tuple) -> Tuple[Any, float]:
+    """Run one call in a worker, telling the watchdog when it really starts"""
+    if _started_queue is not None:
+        _started_queue.put(call_id)
+    started = time.perf_counter()
+    result = fn(*args)
+    return result, time.perf_counter() - started
+
+
+@dataclass
+class CallResult:
+    """Outcome of one guarded parse call"""
+    value: Any = None
+    seconds: float = 0.0
+    failure: Optional[str] = None  # "timeout", "memory", "crashed" or "error"
+    detail: str = ""
+
+    @property
+    def ok(self) -> bool:
+        return self.failure is None
+
+
+class ParsePool:
+    """Lazily started process pool that runs parse calls in order"""
+
+    def __init__(
+        self,
+        max_workers: int = settings.PARSE_WORKERS,
+        start_method: str = settings.PARSE_POOL_START_METHOD,
+        isolate: bool = settings.PARSE_ISOLATION,
+        timeout: float = settings.PARSE_TIMEOUT_SECONDS,
+        memory_limit_mb: int = settings.PARSE_MEMORY_LIMIT_MB
+    ):
+        self.max_workers = max_workers
+        self.start_method = start_method
+        self.isolate = isolate
+        self.timeout = timeout
+        self.memory_limit_mb = memory_limit_mb
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._started_queue = None
+        self._started_at: Dict[int, float] = {}
+        self._generation = 0  # Bumped whenever the watchdog kills the workers
+        self._call_ids = itertools.count()
+        self._lock = threading.Lock()
+
+        # Statistics
+        self.calls = 0
+        self.timeouts = 0
+        self.memory_errors = 0
+        self.crashes = 0
+        self.errors = 0
+        self.kills = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_workers > 1 or (self.isolate and self.max_workers >= 1)
+
+    @property
+    def guarded(self) -> bool:
+        """Whether parse calls run isolated under the watchdog"""
+        return self.enabled and self.isolate
+
+    def _get_executor(self) -> Tuple[ProcessPoolExecutor, int]:
+        with self._lock:
+            if self._executor is None:
+                print(f"[PARSE] Starting parse pool with {self.max_workers} workers")
+                context = multiprocessing.get_context(self.start_method)
+                # A fresh queue per pool: a worker killed mid-put can leave the old one unusable
+                self._started_queue = context.Queue()
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.max_workers,
+                    mp_context=context,
+                    initializer=_init_worker,
+                    initargs=(self._started_queue, self.memory_limit_mb if self.isolate else 0)
+                )
+            return self._executor, self._generation
+
+    def warm_up(self) -> None:
+        """Start the worker processes ahead of the first request"""
+        if self.enabled:
+            executor, _ = self._get_executor()
+            for future in [executor.submit(_warm_worker) for _ in range(self.max_workers)]:
+                future.result()
+
+    def map_guarded(self, calls: List[Tuple[Callable[..., Any], tuple]]) -> List[CallResult]:
+        """
+        Run (function, args) calls under the time and memory budgets and
+        return a CallResult per call, in the same order. Failures are
+        returned, not raised, so the caller can fall back per file.
+
+        Without isolation the deadline and memory cap are off, and a single
+        call (or every call, if the pool is disabled) runs inline; exceptions
+        are still caught.
+        """
+        self.calls += len(calls)
+        if not self.enabled or (not self.guarded and len(calls) <= 1):
+            return [self._run_inline(fn, args) for fn, args in calls]
+
+        results: List[Optional[CallResult]] = [None] * len(calls)
+        suspects: Set[int] = set()  # In flight when a worker crashed; retried one at a time
+        pending = list(range(len(calls)))
+        while pending:
+            batch = [index for index in pending if index not in suspects] or pending[:1]
+            rest = [index for index in pending if index not in batch]
+            pending = self._run_round(calls, batch, results, suspects) + rest
+        return results
+
+    def _run_inline(self, fn: Callable[..., Any], args: tuple) -> CallResult:
+        started = time.perf_counter()
+        try:
+            return CallResult(value=fn(*args), seconds=time.perf_counter() - started)
+        except MemoryError as e:
+            self.memory_errors += 1
+            return CallResult(seconds=time.perf_counter() - started, failure="memory", detail=str(e) or "out of memory")
+        except Exception as e:
+            self.errors += 1
+            return CallResult(seconds=time.perf_counter() - started, failure="error", detail=str(e))
+
+    def _run_round(
+        self,
+        calls: List[Tuple[Callable[..., Any], tuple]],
+        indices: List[int],
+        results: List[Optional[CallResult]],
+        suspects: Set[int]
+    ) -> List[int]:
+        """
+        Submit the calls once and watch them. Returns the indices to run
+        again: calls whose worker was killed for another call's timeout, and
+        calls in flight when a worker crashed (unless the call ran alone, in
+        which case it is the one that crashed it).
+        """
+        executor, generation = self._get_executor()
+        futures: Dict[Future, Tuple[int, int]] = {}
+        try:
+            for index in indices:
+                call_id = next(self._call_ids)
+                fn, args = calls[index]
+                futures[executor.submit(_guarded_call, call_id, fn, args)] = (index, call_id)
+        except BrokenProcessPool:
+            # The pool broke under another request; start over in a new one
+            self._discard(executor)
+            return list(indices)
+        except RuntimeError:
+            # "cannot schedule new futures after shutdown": another request's
+            # watchdog killed or discarded this pool; start over in a new one
+            with self._lock:
+                if self._executor is executor:
+                    raise  # Not replaced, e.g. the interpreter is shutting down
+            return list(indices)
+
+        retry = []
+        not_done = set(futures)
+        while not_done:
+            done, not_done = wait(not_done, timeout=WATCHDOG_POLL_SECONDS, return_when=FIRST_COMPLETED)
+            for future in done:
+                index, call_id = futures[future]
+                self._forget(call_id)
+                try:
+                    value, seconds = future.result()
+                    results[index] = CallResult(value=value, seconds=seconds)
+                except CancelledError:
+                    retry.append(index)  # Queued in a pool another request's watchdog shut down
+                except BrokenProcessPool as e:
+                    if self._generation != generation:
+                        retry.append(index)  # Killed by the watchdog for another call
+                        continue
+                    self._discard(executor)
+                    if len(indices) == 1:
+                        self.crashes += 1
+                        results[index] = CallResult(failure="crashed", detail=str(e))
+                    else:
+                        suspects.add(index)
+                        retry.append(index)
+                except MemoryError as e:
+                    self.memory_errors += 1
+                    results[index] = CallResult(failure="memory", detail=str(e) or "out of memory")
+                except Exception as e:
+                    self.errors += 1
+                    results[index] = CallResult(failure="error", detail=str(e))
+
+            if not not_done or not self.guarded or self.timeout <= 0:
+                continue
+
+            now = time.monotonic()
+            started_at = self._started_times()
+            expired = [
+                future for future in not_done
+                if futures[future][1] in started_at and now - started_at[futures[future][1]] > self.timeout
+            ]
+            if expired:
+                for future in expired:
+                    index, call_id = futures[future]
+                    self.timeouts += 1
+                    results[index] = CallResult(
+                        seconds=now - started_at[call_id],
+                        failure="timeout",
+                        detail=f"exceeded {self.timeout:g}s"
+                    )
+                self._kill(executor)
+                for future in not_done - set(expired):
+                    retry.append(futures[future][0])
+                for _, call_id in futures.values():
+                    self._forget(call_id)
+                break
+
+        return retry
+
+    def _started_times(self) -> Dict[int, float]:
+        """Start times of the calls running in the workers (drained from their queue)"""
+        with self._lock:
+            started_queue = self._started_queue
+            if started_queue is not None:
+                while True:
+                    try:
+                        call_id = started_queue.get_nowait()
+                    except (queue.Empty, OSError, ValueError):
+                        break
+                    self._started_at[call_id] = time.monotonic()
+            return dict(self._started_at)
+
+    def _forget(self, call_id: int) -> None:
+        with self._lock:
+            self._started_at.pop(call_id, None)
+
+    def _kill(self, executor: ProcessPoolExecutor) -> None:
+        """Kill the workers of a pool that is running an over-deadline call"""
+        with self._lock:
+            if self._executor is not executor:
+                return
+            self.kills += 1
+            self._generation += 1
+            print(f"[PARSE] Parse call over its {self.timeout:g}s deadline, restarting the parse pool")
+            for process in list((getattr(executor, "_processes", None) or {}).values()):
+                process.kill()
+            executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    def _discard(self, executor: ProcessPoolExecutor) -> None:
+        """Drop a broken pool (a worker died); the next call starts a new one"""
+        with self._lock:
+            if self._executor is executor:
+                print("[PARSE] Parse pool broken, restarting it")
+                executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "workers": self.max_workers,
+            "isolated": self.guarded,
+            "timeout_seconds": self.timeout,
+            "memory_limit_mb": self.memory_limit_mb,
+            "calls": self.calls,
+            "timeouts": self.timeouts,
+            "memory_errors": self.memory_errors,
+            "crashes": self.crashes,
+            "errors": self.errors,
+            "kills": self.kills
+        }
+
+    def shutdown(self) -> None:
+        """Stop the worker processes"""
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
+
+
+# Create singleton instance
+parse_pool = ParsePool()
@@ -0,0 +1,200 @@
+"""
+Prompt Compaction
+Shrinks the rendered document text before it goes into the prompt:
+collapses whitespace and empty " | | " cells, drops empty and duplicate
+sheets, and, when the text is still over the token budget, keeps the
+highest-value sections (consignee block, totals, invoice figures) and
+trims the rest.
+"""
+import hashlib
+import re
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+
+from app.core.config import settings
+from app.services.llm_client import estimate_tokens
+from app.utils.document_segments import DocumentBundle, ParsedDocument, SheetSegment, TextSegment
+
+# Lines worth keeping when a section has to be trimmed, by weight
+KEY_LINE_PATTERNS = [
+    (re.compile(r"COMPUTED INVOICE FIGURES|^- (lineItemsCount|averagePrice|Sum of|Stated TOTAL)", re.IGNORECASE), 5),
+    (re.compile(r"CONSIGNEE|SHIP\s+TO|NOTIFY", re.IGNORECASE), 4),
+    (re.compile(r"B\s*/\s*L|BILL\s+OF\s+LADING|CONTAINER|\b[A-Z]{4}\d{7}\b", re.IGNORECASE), 4),
+    (re.compile(r"GROSS\s+(WEIGHT|WT)|TOTAL", re.IGNORECASE), 4),
+    (re.compile(r"DATE|ON\s+BOARD|EXPORT", re.IGNORECASE), 3),
+    (re.compile(r"S\.?\s*NO|INVOICE|AMOUNT|VALUE", re.IGNORECASE), 2)
+]
+# Lines that make a page or sheet relevant to a field (targeted re-extraction)
+INVOICE_FIGURES = r"COMPUTED INVOICE FIGURES|lineItemsCount|S\.?\s*NO"
+CONSIGNEE_LINES = r"CONSIGNEE|SHIP\s+TO|NOTIFY|DELIVER\s+TO"
+FIELD_LINE_PATTERNS = {
+    "billOfLadingNumber": re.compile(r"B\s*/\s*L|BILL\s+OF\s+LADING|\bBOL\b", re.IGNORECASE),
+    "containerNumber": re.compile(r"CONTAINER|\b[A-Z]{4}\d{7}\b", re.IGNORECASE),
+    "consigneeName": re.compile(CONSIGNEE_LINES, re.IGNORECASE),
+    "consigneeAddress": re.compile(CONSIGNEE_LINES, re.IGNORECASE),
+    "dateOfExport": re.compile(r"DATE|ON\s+BOARD|EXPORT", re.IGNORECASE),
+    "lineItemsCount": re.compile(INVOICE_FIGURES, re.IGNORECASE),
+    "averageGrossWeight": re.compile(rf"GROSS\s+(WEIGHT|WT)|{INVOICE_FIGURES}", re.IGNORECASE),
+    "averagePrice": re.compile(rf"TOTAL\s+VALUE|averagePrice|{INVOICE_FIGURES}", re.IGNORECASE)
+}
+# Sheet names that never carry fields we extract
+IRRELEVANT_SHEET_PATTERN = re.compile(r"terms|conditions|instructions|notes|lookup|config", re.IGNORECASE)
+
+EMPTY_CELLS_PATTERN = re.compile(r"(?:[ \t]*\|[ \t]*)+")
+SPACES_PATTERN = re.compile(r"[ \t\u00a0]+")
+
+
+def compact_text(text: str) -> str:
+    """Collapse runs of whitespace and empty cells; drop blank lines"""
+    lines = []
+    for line in text.splitlines():
+        line = SPACES_PATTERN.sub(" ", line)
+        line = EMPTY_CELLS_PATTERN.sub(" | ", line).strip(" |")
+        if line:
+            lines.append(line)
+    return "\n".join(lines)
+
+
+def _line_weight(line: str) -> int:
+    return max((weight for pattern, weight in KEY_LINE_PATTERNS if pattern.search(line)), default=0)
+
+
+@dataclass
+class Section:
+    """One PDF page or XLSX sheet of a document"""
+    document: int
+    header: str  # Sheet header, "" for PDF pages
+    text: str
+    priority: int = 0  # Weight of its most valuable line
+
+    @property
+    def tokens(self) -> int:
+        return estimate_tokens(self.header + self.text)
+
+
+@dataclass
+class CompactionResult:
+    """Compacted document text and what was done to get there"""
+    text: str
+    tokens_before: int
+    tokens_after: int
+    dropped: List[str] = field(default_factory=list)
+    trimmed: List[str] = field(default_factory=list)
+
+    def to_dict(self) -> Dict[str, object]:
+        return {
+            "tokens_before": self.tokens_before,
+            "tokens_after": self.tokens_after,
+            "dropped_sections": self.dropped,
+            "trimmed_sections": self.trimmed
+        }
+
+
+def _trim(section: Section, budget: int) -> Optional[str]:
+    """Keep the most valuable lines of a section (in order) within a token budget"""
+    lines = section.text.splitlines()
+    ranked = sorted(range(len(lines)), key=lambda i: (-_line_weight(lines[i]), i))
+    keep, used = set(), estimate_tokens(section.header) + 8
+    for index in ranked:
+        cost = estimate_tokens(lines[index])
+        if used + cost > budget:
+            continue
+        keep.add(index)
+        used += cost
+    if not keep:
+        return None
+    omitted = len(lines) - len(keep)
+    kept = "\n".join(lines[i] for i in sorted(keep))
+    return kept + (f"\n[... {omitted} lines omitted]" if omitted else "") + "\n"
+
+
+def compact_documents(documents: DocumentBundle, budget: int = settings.PROMPT_TOKEN_BUDGET) -> CompactionResult:
+    """
+    Render the documents' text for the prompt within a token budget.
+
+    Args:
+        documents: Parsed documents
+        budget: Maximum estimated tokens of the document text (0 = no limit)
+
+    Returns:
+        CompactionResult: Text in the render_text format, plus token counts
+    """
+    tokens_before = estimate_tokens(documents.render_text())
+    sections: List[Section] = []
+    dropped: List[str] = []
+    seen = set()
+
+    for index, document in enumerate(documents.documents):
+        for segment in document.segments:
+            if isinstance(segment, SheetSegment):
+                name = f"{document.filename}:{segment.sheet_name}"
+                text = compact_text(segment.text)
+                digest = hashlib.sha256(text.encode("utf-8")).hexdigest()
+                if not text or digest in seen or IRRELEVANT_SHEET_PATTERN.search(segment.sheet_name):
+                    dropped.append(name)
+                    continue
+                seen.add(digest)
+                sections.append(Section(index, f"\n\n=== Sheet: {segment.sheet_name} ===\n", text + "\n"))
+            elif isinstance(segment, TextSegment) and segment.text:
+                text = compact_text(segment.text)
+                if text:
+                    sections.append(Section(index, "", text + "\n"))
+
+    for section in sections:
+        section.priority = max((_line_weight(line) for line in section.text.splitlines()), default=0)
+
+    trimmed: List[str] = []
+    if budget and sum(s.tokens for s in sections) > budget:
+        # Fill the budget with whole sections by value (cheapest first on ties), trim the rest
+        remaining = budget
+        for section in sorted(sections, key=lambda s: (-s.priority, s.tokens)):
+            if section.tokens <= remaining:
+                remaining -= section.tokens
+                continue
+            text = _trim(section, remaining)
+            label = section.header.strip() or documents.documents[section.document].filename
+            if text is None:
+                dropped.append(label)
+                section.text = ""
+            else:
+                trimmed.append(label)
+                section.text = text
+                remaining -= section.tokens
+
+    parts = []
+    for index, document in enumerate(documents.documents):
+        body = "".join(s.header + s.text for s in sections if s.document == index and s.text)
+        if document.doc_type != "XLSX":
+            # Page notes sit outside the budget: the model must know which pages are images
+            body += document.page_notes(body)
+        parts.append(f"\n\n=== Document: {document.filename} ({document.doc_type}) ===\n{body}")
+
+    text = "".join(parts)
+    return CompactionResult(text, tokens_before, estimate_tokens(text), dropped, trimmed)
+
+
+def select_sections(documents: DocumentBundle, fields: List[str]) -> DocumentBundle:
+    """
+    The pages and sheets that mention any of the given fields (see
+    FIELD_LINE_PATTERNS), for a targeted re-extraction prompt. Page images
+    are always kept since their content is unknown here. If nothing
+    matches, every document is returned unchanged.
+    """
+    patterns = [FIELD_LINE_PATTERNS[name] for name in fields if name in FIELD_LINE_PATTERNS]
+    selected = []
+    matched = False
+    for document in documents.documents:
+        segments = []
+        for segment in document.segments:
+            if isinstance(segment, (TextSegment, SheetSegment)):
+                if segment.text and any(pattern.search(segment.text) for pattern in patterns):
+                    segments.append(segment)
+                    matched = True
+            else:
+                segments.append(segment)
+        if segments:
+            selected.append(ParsedDocument(
+                document.filename, document.doc_type, segments,
+                unrendered_pages=document.unrendered_pages
+            ))
+    return DocumentBundle(selected) if matched else documents
@@ -0,0 +1,71 @@
+"""
+Token bucket rate limiter for outbound API calls
+"""
+import asyncio
+import time
+from typing import Optional
+
+
+class TokenBucket:
+    """
+    Async token bucket.
+
+    Holds up to `capacity` tokens and refills at `rate_per_minute`.
+    A rate of 0 disables limiting.
+    """
+
+    def __init__(self, rate_per_minute: float, capacity: Optional[float] = None):
+        self.rate_per_second = rate_per_minute / 60.0
+        self.capacity = capacity if capacity is not None else rate_per_minute
+        self._tokens = self.capacity
+        self._updated_at = time.monotonic()
+
+    @property
+    def enabled(self) -> bool:
+        return self.rate_per_second > 0
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        elapsed = now - self._updated_at
+        self._updated_at = now
+        self._tokens = min(self.capacity, self._tokens + elapsed * self.rate_per_second)
+
+    def available(self) -> float:
+        """Tokens currently available (may be negative after a debit)"""
+        self._refill()
+        return self._tokens
+
+    async def acquire(self, amount: float = 1) -> float:
+        """
+        Wait until `amount` tokens are available and take them.
+
+        Requests larger than the bucket capacity are clamped to the capacity
+        so they can still proceed once the bucket is full.
+
+        Returns:
+            float: Seconds spent waiting
+        """
+        if not self.enabled:
+            return 0.0
+
+        amount = min(amount, self.capacity)
+        waited = 0.0
+        while True:
+            self._refill()
+            if self._tokens >= amount:
+                self._tokens -= amount
+                return waited
+
+            delay = (amount - self._tokens) / self.rate_per_second
+            await asyncio.sleep(delay)
+            waited += delay
+
+    def debit(self, amount: float) -> None:
+        """
+        Adjust the bucket after the fact (e.g. actual vs. estimated tokens).
+        Positive amounts take tokens, negative amounts give them back.
+        """
+        if not self.enabled:
+            return
+        self._refill()
+        self._tokens = min(self.capacity, self._tokens - amount)
@@ -0,0 +1,294 @@
+"""
+Rule-Based Pre-Extraction
+Finds shipment fields in the text layer of BOL PDFs and the XLSX sheets
+with compiled patterns and ShipmentValidator checks, and scores each field.
+Fields that clear the confidence threshold do not need the LLM; if all
+eight pass, the LLM call is skipped entirely.
+"""
+import re
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+from app.core.config import settings
+from app.services.validators import ShipmentValidator
+from app.utils.document_segments import DocumentBundle, ParsedDocument, SheetSegment, TextSegment
+
+EXPECTED_FIELDS = [
+    'billOfLadingNumber',
+    'containerNumber',
+    'consigneeName',
+    'consigneeAddress',
+    'dateOfExport',
+    'lineItemsCount',
+    'averageGrossWeight',
+    'averagePrice'
+]
+
+LBS_TO_KG = 0.45359237
+
+BOL_PATTERN = re.compile(
+    r"\b(?:B\s*/\s*L|BILL\s+OF\s+LADING|BOL)\b[ \t]*(?:NO\.?|NUMBER|#)?[ \t:#.|]*"
+    r"(?=[A-Z0-9\-]*\d)([A-Z0-9][A-Z0-9\-]{3,19})\b",
+    re.IGNORECASE
+)
+CONTAINER_PATTERN = re.compile(r"\b([A-Z]{3}[UJZ])\s?(\d{6})\s?-?\s?(\d)\b")
+EXPORT_DATE_PATTERN = re.compile(
+    r"(?:DATE\s+OF\s+EXPORT|EXPORT\s+DATE|SHIPPED\s+ON\s+BOARD(?:\s+DATE)?|ON\s+BOARD\s+DATE|"
+    r"DATE\s+OF\s+SHIPMENT|SHIPMENT\s+DATE|SAILING\s+DATE)\s*[:\-]?\s*([^\n|]{6,30})",
+    re.IGNORECASE
+)
+GROSS_WEIGHT_PATTERN = re.compile(
+    r"(TOTAL\s+)?GROSS\s+(?:WEIGHT|WT\.?)[^\d\n]{0,20}(\d[\d,]*(?:\.\d+)?)\s*(KGS?|KILOS?|LBS?)\b",
+    re.IGNORECASE
+)
+# "CONSIGNEE: <value>", "CONSIGNEE (NAME AND ADDRESS):" or a bare "CONSIGNEE" heading
+# above the value; anything else after the label is kept in group 2
+CONSIGNEE_LABEL_PATTERN = re.compile(
+    r"^[ \t]*CONSIGNEE\b(?:[^:\n]{0,40}:[ \t]*(.*)|[ \t]*(?:\([^)\n]*\))?[ \t]*$|[ \t]+(.*))",
+    re.IGNORECASE | re.MULTILINE
+)
+SHIP_TO_PATTERN = re.compile(r"SHIP\s+TO\s*:?\s*(?:\|\s*)*([^|\n]+)", re.IGNORECASE)
+# Labels that end the consignee block
+BLOCK_END_PATTERN = re.compile(
+    r"^\s*(NOTIFY|SHIPPER|EXPORTER|FORWARD|VESSEL|VOYAGE|PORT|PLACE|B\s*/\s*L|BILL|BOOKING|"
+    r"CONTAINER|DATE|MARKS|DESCRIPTION|GROSS|FREIGHT|ALSO\s+NOTIFY)",
+    re.IGNORECASE
+)
+ADDRESS_HINT_PATTERN = re.compile(r"\d")
+# B/L numbers are carrier prefixes plus digits; short or all-digit matches are
+# more likely years, page numbers or references
+MIN_BOL_LENGTH = 8
+
+DATE_FORMATS = ["%Y-%m-%d", "%d-%b-%Y", "%d %b %Y", "%b %d, %Y", "%B %d, %Y", "%d %B %Y", "%d-%B-%Y", "%d.%m.%Y"]
+
+
+@dataclass
+class FieldMatch:
+    """A locally extracted value with a 0-1 confidence score"""
+    value: Any
+    confidence: float
+    source: str  # "pdf", "xlsx" or "computed"
+
+
+@dataclass
+class RuleExtraction:
+    """Outcome of the rule-based stage"""
+    matches: Dict[str, FieldMatch] = field(default_factory=dict)
+    min_confidence: float = settings.RULE_MIN_CONFIDENCE
+
+    @property
+    def accepted(self) -> Dict[str, Any]:
+        """Fields confident enough to skip the LLM"""
+        return {
+            name: match.value for name, match in self.matches.items()
+            if match.confidence >= self.min_confidence
+        }
+
+    @property
+    def missing(self) -> List[str]:
+        """Fields the LLM still has to extract, in the expected order"""
+        accepted = self.accepted
+        return [name for name in EXPECTED_FIELDS if name not in accepted]
+
+    @property
+    def complete(self) -> bool:
+        return not self.missing
+
+    def confidence(self) -> Dict[str, float]:
+        return {name: round(match.confidence, 2) for name, match in self.matches.items()}
+
+
+def normalize_date(raw: str) -> Tuple[Optional[str], float]:
+    """
+    Convert a date to MM/DD/YYYY.
+
+    Returns (date, confidence). Numeric dates where day and month could be
+    swapped (e.g. 03/04/2024) get a low confidence so the LLM decides.
+    """
+    raw = raw.strip().rstrip(".,")
+    numeric = re.match(r"^(\d{1,2})[/\-.](\d{1,2})[/\-.](\d{4})\b", raw)
+    if numeric:
+        first, second, year = (int(part) for part in numeric.groups())
+        if first > 12 and second <= 12:
+            month, day, confidence = second, first, 0.9
+        elif second > 12 and first <= 12:
+            month, day, confidence = first, second, 0.95
+        else:
+            month, day, confidence = first, second, 0.6 if first != second else 0.95
+        try:
+            return datetime(year, month, day).strftime("%m/%d/%Y"), confidence
+        except ValueError:
+            return None, 0.0
+
+    candidate = re.split(r"\s{2,}", raw)[0]
+    for fmt in DATE_FORMATS:
+        for length in range(len(candidate), 7, -1):
+            try:
+                return datetime.strptime(candidate[:length].strip(), fmt).strftime("%m/%d/%Y"), 0.95
+            except ValueError:
+                continue
+    return None, 0.0
+
+
+def _find_bol(text: str) -> Optional[FieldMatch]:
+    values, weak = [], []
+    for match in BOL_PATTERN.finditer(text):
+        value = match.group(1).upper().strip("-")
+        if ShipmentValidator.validate_bol_number(value, "BOL") is not None:
+            continue
+        target = values if len(value) >= MIN_BOL_LENGTH and re.search(r"[A-Z]", value) else weak
+        if value not in target:
+            target.append(value)
+    if not values:
+        # e.g. "BOL NUMBER 2019": let the LLM decide
+        return FieldMatch(weak[0], 0.4, "pdf") if weak else None
+    # Several different B/L numbers (e.g. house and master) are ambiguous
+    return FieldMatch(values[0], 0.95 if len(values) == 1 else 0.5, "pdf")
+
+
+def _find_container(text: str) -> Optional[FieldMatch]:
+    valid, invalid = [], []
+    for match in CONTAINER_PATTERN.finditer(text):
+        value = "".join(match.groups())
+        target = valid if ShipmentValidator.validate_container_check_digit(value) is None else invalid
+        if value not in target:
+            target.append(value)
+    if valid:
+        return FieldMatch(valid[0], 0.99 if len(valid) == 1 else 0.5, "pdf")
+    if invalid:
+        # Right shape but wrong check digit: likely an OCR/typing error, let the LLM look
+        return FieldMatch(invalid[0], 0.4, "pdf")
+    return None
+
+
+def _find_export_date(text: str) -> Optional[FieldMatch]:
+    for match in EXPORT_DATE_PATTERN.finditer(text):
+        value, confidence = normalize_date(match.group(1))
+        if value:
+            return FieldMatch(value, confidence, "pdf")
+    return None
+
+
+def _find_gross_weight_kg(text: str) -> Optional[Tuple[float, float]]:
+    """(total gross weight in KG, confidence), preferring lines labeled TOTAL"""
+    best = None
+    for match in GROSS_WEIGHT_PATTERN.finditer(text):
+        amount = match.group(2).replace(",", "")
+        if ShipmentValidator.validate_weight(amount) is not None:
+            continue
+        weight = float(amount)
+        if match.group(3).upper().startswith("LB"):
+            weight *= LBS_TO_KG
+        confidence = 0.95 if match.group(1) else 0.85
+        if best is None or confidence > best[1]:
+            best = (weight, confidence)
+    return best
+
+
+def _find_consignee(text: str) -> Tuple[Optional[FieldMatch], Optional[FieldMatch]]:
+    """Consignee name and address from the CONSIGNEE block of a BOL"""
+    matches = list(CONSIGNEE_LABEL_PATTERN.finditer(text))
+    # Prefer a proper label; "CONSIGNEE <text>" without a colon may be a heading, not the name
+    match = next((m for m in matches if m.group(2) is None), matches[0] if matches else None)
+    if not match:
+        return None, None
+
+    unlabeled = match.group(2) is not None
+    first = (match.group(2) if unlabeled else match.group(1) or "").strip()
+    lines = [first] if first else []
+    for line in text[match.end():].splitlines()[1:]:
+        line = line.strip()
+        if not line:
+            if lines:
+                break
+            continue
+        if BLOCK_END_PATTERN.match(line) or len(lines) >= 6:
+            break
+        lines.append(line)
+
+    if not lines:
+        return None, None
+
+    name = lines[0].rstrip(",")
+    name_match = None
+    if ShipmentValidator.validate_name(name, "Consignee Name") is None:
+        name_match = FieldMatch(name, 0.5 if unlabeled else 0.9, "pdf")
+
+    address_lines = [line.rstrip(",") for line in lines[1:]]
+    address_match = None
+    if address_lines:
+        address = ", ".join(address_lines)
+        # A full address has a street number or ZIP code and more than one line
+        full = len(address_lines) >= 2 and ADDRESS_HINT_PATTERN.search(address)
+        confidence = 0.85 if full and not unlabeled else 0.5
+        address_match = FieldMatch(address, confidence, "pdf")
+    return name_match, address_match
+
+
+def _text_of(document: ParsedDocument) -> str:
+    return "\n".join(s.text for s in document.segments if isinstance(s, (TextSegment, SheetSegment)) and s.text)
+
+
+def pdf_gross_weight_kg(documents: DocumentBundle) -> Optional[float]:
+    """Total gross weight stated in the PDF text, in KG (None if not found)"""
+    pdf_text = "\n".join(_text_of(d) for d in documents.documents if d.doc_type == "PDF")
+    weight = _find_gross_weight_kg(pdf_text)
+    return weight[0] if weight else None
+
+
+def extract_with_rules(documents: DocumentBundle) -> RuleExtraction:
+    """
+    Run the local extraction stage over the text of all documents.
+
+    PDF text is searched first; XLSX sheets are a fallback for the label
+    fields. Count and average price come from the computed invoice figures.
+    """
+    result = RuleExtraction()
+    pdf_text = "\n".join(_text_of(d) for d in documents.documents if d.doc_type == "PDF")
+    xlsx_text = "\n".join(_text_of(d) for d in documents.documents if d.doc_type == "XLSX")
+
+    def put(name: str, match: Optional[FieldMatch]) -> None:
+        current = result.matches.get(name)
+        if match and (current is None or match.confidence > current.confidence):
+            result.matches[name] = match
+
+    for text, source in ((pdf_text, "pdf"), (xlsx_text, "xlsx")):
+        if not text:
+            continue
+        found = {
+            "billOfLadingNumber": _find_bol(text),
+            "containerNumber": _find_container(text),
+            "dateOfExport": _find_export_date(text)
+        }
+        name_match, address_match = _find_consignee(text)
+        found["consigneeName"] = name_match
+        found["consigneeAddress"] = address_match
+        for name, match in found.items():
+            if match:
+                match.source = source
+                if source == "xlsx":
+                    match.confidence -= 0.05
+            put(name, match)
+
+    if "consigneeName" not in result.matches and xlsx_text:
+        ship_to = SHIP_TO_PATTERN.search(xlsx_text)
+        if ship_to and ShipmentValidator.validate_name(ship_to.group(1).strip(), "Consignee Name") is None:
+            put("consigneeName", FieldMatch(ship_to.group(1).strip(), 0.85, "xlsx"))
+
+    analytics = documents.invoice_analytics()
+    count = analytics["line_items_count"] if analytics else 0
+    if count:
+        put("lineItemsCount", FieldMatch(count, 1.0, "computed"))
+        if analytics.get("total_mismatch"):
+            # Line items and stated total disagree: offer the invoice's own total, but let the LLM check
+            put("averagePrice", FieldMatch(f"${analytics['stated_average_price']:.2f}", 0.5, "computed"))
+        elif analytics.get("average_price") is not None:
+            put("averagePrice", FieldMatch(f"${analytics['average_price']:.2f}", 1.0, "computed"))
+
+        weight = _find_gross_weight_kg(pdf_text)
+        if weight:
+            total_kg, confidence = weight
+            put("averageGrossWeight", FieldMatch(f"{total_kg / count:.2f} KG", confidence, "computed"))
+
+    return result
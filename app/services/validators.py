@@ -24,6 +24,14 @@ class ShipmentValidator:
     BOL_NUMBER_PATTERN = r'^[A-Z0-9\-]{4,20}$'  # Alphanumeric with dashes, 4-20 chars
     ALPHANUMERIC_PATTERN = r'^[A-Za-z0-9\s\-.,/()]+$'  # Alphanumeric with common punctuation
 
+    # ISO 6346 letter values (multiples of 11 are skipped)
+    CONTAINER_LETTER_VALUES = {
+        letter: value for letter, value in zip(
+            "ABCDEFGHIJKLMNOPQRSTUVWXYZ",
+            [v for v in range(10, 39) if v % 11 != 0]
+        )
+    }
+
     @classmethod
     def validate_snapshot_data(cls, snapshot_data: Dict[str, Any]) -> List[str]:
         """
@@ -152,6 +160,29 @@ class ShipmentValidator:
 
         return None
 
+    @staticmethod
+    def container_check_digit(container_num: str) -> int:
+        """ISO 6346 check digit computed from the first 10 characters (owner code + serial)"""
+        total = 0
+        for position, char in enumerate(container_num[:10].upper()):
+            value = ShipmentValidator.CONTAINER_LETTER_VALUES[char] if char.isalpha() else int(char)
+            total += value * (2 ** position)
+        return total % 11 % 10
+
+    @staticmethod
+    def validate_container_check_digit(container_num: Any) -> Optional[str]:
+        """Validate the ISO 6346 check digit of a container number"""
+        error = ShipmentValidator.validate_container_number(container_num)
+        if error or not container_num:
+            return error
+
+        container_num = container_num.strip().upper()
+        expected = ShipmentValidator.container_check_digit(container_num)
+        if int(container_num[10]) != expected:
+            return f"Validation Error: Invalid container number check digit (expected {expected})"
+
+        return None
+
     @staticmethod
     def validate_bol_number(bol_num: Any, field_name: str) -> Optional[str]:
         """Validate Bill of Lading number"""
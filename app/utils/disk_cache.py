@@ -0,0 +1,146 @@
+"""
+Size-bounded on-disk key/value store with LRU eviction
+"""
+import os
+import threading
+import uuid
+from pathlib import Path
+from typing import Dict, Optional
+
+
+class DiskCache:
+    """
+    Stores one file per key under `directory`.
+
+    Reads refresh the file's mtime, and writes evict the least recently
+    used files once the total size exceeds `max_bytes`. Safe to share
+    between threads; concurrent processes may briefly overshoot the limit.
+    """
+
+    def __init__(self, directory: str, max_bytes: int, suffix: str = ".bin"):
+        self.directory = Path(directory)
+        self.max_bytes = max_bytes
+        self.suffix = suffix
+        self._lock = threading.Lock()
+        self._total_bytes: Optional[int] = None
+        self.evictions = 0
+
+    def _path(self, key: str) -> Path:
+        # Keys are hex digests; refuse anything that could escape the directory
+        if not key or not all(c.isalnum() or c in "-_" for c in key):
+            raise ValueError(f"Invalid cache key: {key}")
+        return self.directory / f"{key}{self.suffix}"
+
+    def _entries(self):
+        if not self.directory.exists():
+            return []
+        return [p for p in self.directory.iterdir() if p.is_file() and p.suffix == self.suffix]
+
+    @staticmethod
+    def _size(path: Path) -> int:
+        try:
+            return path.stat().st_size
+        except FileNotFoundError:
+            return 0
+
+    def _ensure_total(self) -> int:
+        if self._total_bytes is None:
+            self._total_bytes = sum(self._size(p) for p in self._entries())
+        return self._total_bytes
+
+    def get(self, key: str) -> Optional[bytes]:
+        """Return the stored bytes or None"""
+        path = self._path(key)
+        try:
+            data = path.read_bytes()
+        except FileNotFoundError:
+            return None
+        try:
+            os.utime(path)  # Mark as recently used
+        except FileNotFoundError:
+            pass
+        return data
+
+    def put(self, key: str, data: bytes) -> None:
+        """Store bytes under key, evicting old entries if over the size limit"""
+        if len(data) > self.max_bytes:
+            return
+
+        path = self._path(key)
+        with self._lock:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            total = self._ensure_total()
+
+            old_size = self._size(path)
+
+            # Write atomically so readers never see a partial file
+            tmp_path = self.directory / f".{uuid.uuid4().hex}.tmp"
+            tmp_path.write_bytes(data)
+            os.replace(tmp_path, path)
+
+            self._total_bytes = total - old_size + len(data)
+            if self._total_bytes > self.max_bytes:
+                self._evict(keep=path)
+
+    def _evict(self, keep: Path) -> None:
+        """Delete least recently used files until under max_bytes"""
+        entries = []
+        for p in self._entries():
+            try:
+                stat = p.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, p))
+        entries.sort(key=lambda e: e[0])
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, p in entries:
+            if total <= self.max_bytes:
+                break
+            if p == keep:
+                continue
+            try:
+                p.unlink()
+                total -= size
+                self.evictions += 1
+            except FileNotFoundError:
+                pass
+        self._total_bytes = total
+
+    def delete(self, key: str) -> bool:
+        """Remove an entry. Returns True if it existed."""
+        path = self._path(key)
+        with self._lock:
+            try:
+                size = path.stat().st_size
+                path.unlink()
+            except FileNotFoundError:
+                return False
+            if self._total_bytes is not None:
+                self._total_bytes -= size
+            return True
+
+    def clear(self) -> int:
+        """Remove all entries. Returns the number removed."""
+        with self._lock:
+            removed = 0
+            for p in self._entries():
+                try:
+                    p.unlink()
+                    removed += 1
+                except FileNotFoundError:
+                    pass
+            self._total_bytes = 0
+            return removed
+
+    def stats(self) -> Dict[str, int]:
+        """Entry count and size on disk"""
+        with self._lock:
+            entries = self._entries()
+            self._total_bytes = sum(self._size(p) for p in entries)
+            return {
+                "entries": len(entries),
+                "bytes": self._total_bytes,
+                "max_bytes": self.max_bytes,
+                "evictions": self.evictions
+            }
@@ -0,0 +1,128 @@
+"""
+Parsed Document Cache
+Stores the parsed content of each uploaded file (text per PDF page or
+XLSX sheet, plus rendered page images) keyed by the file's content hash
+and the extractor version, so retries and re-extractions skip parsing.
+
+Entries are packed as a JSON header followed by the raw image bytes, so
+images are never base64-encoded for storage.
+"""
+import hashlib
+import json
+import struct
+from typing import Any, Dict, List, Optional
+
+from app.core.config import settings
+from app.utils.disk_cache import DiskCache
+from app.utils.document_segments import TextSegment, SheetSegment, ImageSegment, Segment
+
+
+def hash_file(file_path: str, chunk_size: int = 1024 * 1024) -> str:
+    """SHA-256 of a file, read in chunks"""
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def pack_segments(segments: List[Segment]) -> bytes:
+    """Serialize segments: 4-byte header length, JSON header, image bytes"""
+    header = []
+    blobs = []
+    for segment in segments:
+        if isinstance(segment, ImageSegment):
+            header.append({"type": "image", "media_type": segment.media_type,
+                           "page": segment.page, "size": len(segment.data)})
+            blobs.append(segment.data)
+        elif isinstance(segment, SheetSegment):
+            header.append({"type": "sheet", "sheet_name": segment.sheet_name, "text": segment.text,
+                           "analytics": segment.analytics})
+        else:
+            header.append({"type": "text", "page": segment.page, "text": segment.text})
+
+    header_bytes = json.dumps(header).encode("utf-8")
+    return struct.pack(">I", len(header_bytes)) + header_bytes + b"".join(blobs)
+
+
+def unpack_segments(data: bytes) -> List[Segment]:
+    """Inverse of pack_segments"""
+    (header_length,) = struct.unpack(">I", data[:4])
+    header = json.loads(data[4:4 + header_length])
+    offset = 4 + header_length
+
+    segments: List[Segment] = []
+    for item in header:
+        if item["type"] == "image":
+            end = offset + item["size"]
+            if end > len(data):
+                raise ValueError("Truncated document cache entry")
+            segments.append(ImageSegment(data=data[offset:end], media_type=item["media_type"], page=item["page"]))
+            offset = end
+        elif item["type"] == "sheet":
+            segments.append(SheetSegment(sheet_name=item["sheet_name"], text=item["text"],
+                                         analytics=item.get("analytics")))
+        else:
+            segments.append(TextSegment(text=item["text"], page=item["page"]))
+    return segments
+
+
+class DocumentCache:
+    """On-disk LRU cache of parsed documents"""
+
+    def __init__(
+        self,
+        cache_dir: str = settings.DOCUMENT_CACHE_DIR,
+        max_disk_bytes: int = settings.DOCUMENT_CACHE_MAX_DISK_BYTES,
+        enabled: bool = settings.DOCUMENT_CACHE_ENABLED
+    ):
+        self.enabled = enabled
+        self._disk = DiskCache(cache_dir, max_disk_bytes, suffix=".seg")
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(file_hash: str, extractor: str, version: str) -> str:
+        """Cache key for one file parsed by one extractor version"""
+        return hashlib.sha256(f"{file_hash}:{extractor}:{version}".encode("utf-8")).hexdigest()
+
+    def get(self, file_hash: str, extractor: str, version: str) -> Optional[List[Segment]]:
+        """Return the parsed segments of a file, or None"""
+        if not self.enabled:
+            return None
+
+        raw = self._disk.get(self.make_key(file_hash, extractor, version))
+        if raw is None:
+            self.misses += 1
+            return None
+
+        try:
+            segments = unpack_segments(raw)
+        except (ValueError, KeyError, struct.error):
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        return segments
+
+    def put(self, file_hash: str, extractor: str, version: str, segments: List[Segment]) -> None:
+        """Store the parsed segments of a file"""
+        if not self.enabled:
+            return
+        try:
+            self._disk.put(self.make_key(file_hash, extractor, version), pack_segments(segments))
+        except Exception as e:
+            # Caching is best effort; parsing already succeeded
+            print(f"Error writing document cache entry: {e}")
+
+    def clear(self) -> int:
+        """Remove all cached documents"""
+        return self._disk.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        """Hit/miss counters and disk usage"""
+        return {"hits": self.hits, "misses": self.misses, "disk": self._disk.stats()}
+
+
+# Create singleton instance
+document_cache = DocumentCache()
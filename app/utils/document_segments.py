@@ -0,0 +1,154 @@
+"""
+Typed Document Segments
+Parsed documents flow from the utils through process_documents into the
+LLM service as typed segments (PDF page text, XLSX sheet text, rendered
+page images) instead of one concatenated string. Image bytes stay raw
+until the API payload is built.
+"""
+import base64
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Union
+
+
+@dataclass
+class TextSegment:
+    """Text layer of one PDF page"""
+    text: str
+    page: Optional[int] = None  # 0-based page index
+    source: str = ""
+
+
+@dataclass
+class SheetSegment:
+    """Text of one XLSX sheet ("|"-joined rows, or header block + computed figures)"""
+    sheet_name: str
+    text: str
+    source: str = ""
+    analytics: Optional[Dict[str, Any]] = None  # Computed line item figures, see xlsx_analysis
+
+
+@dataclass
+class ImageSegment:
+    """Rendered page image (raw encoded bytes, e.g. JPEG)"""
+    data: bytes
+    media_type: str
+    page: Optional[int] = None
+    source: str = ""
+    _base64: Optional[str] = field(default=None, init=False, repr=False, compare=False)
+
+    def base64(self) -> str:
+        """Base64 of the image, encoded once on first use"""
+        if self._base64 is None:
+            self._base64 = base64.standard_b64encode(self.data).decode("utf-8")
+        return self._base64
+
+    def to_content_block(self) -> Dict[str, Any]:
+        """Anthropic messages API image block"""
+        return {
+            "type": "image",
+            "source": {
+                "type": "base64",
+                "media_type": self.media_type,
+                "data": self.base64()
+            }
+        }
+
+
+Segment = Union[TextSegment, SheetSegment, ImageSegment]
+
+
+@dataclass
+class ParsedDocument:
+    """All segments of one uploaded file"""
+    filename: str
+    doc_type: str  # "PDF" or "XLSX"
+    segments: List[Segment]
+    parse_seconds: Optional[float] = None  # Worker time spent parsing (None if served from the document cache)
+    parse_fallback: Optional[str] = None  # "render_only", "skipped" or "unreadable" if the parser failed or blew its budget
+    unrendered_pages: List[int] = field(default_factory=list)  # Image-only pages left out by PDF_RENDER_MAX_PAGES/RANGE
+
+    @property
+    def images(self) -> List[ImageSegment]:
+        return [s for s in self.segments if isinstance(s, ImageSegment)]
+
+    def page_notes(self, body: str) -> str:
+        """
+        Notes on the scanned pages of a PDF, to follow its text body: which
+        pages are attached as images and which the render limit left out
+        """
+        notes = ""
+        if not body.strip() and self.images:
+            notes = f"[Scanned PDF: {len(self.images)} page image(s) attached]\n"
+        elif self.images:
+            pages = ", ".join(str(image.page + 1) for image in self.images if image.page is not None)
+            notes = f"[Scanned pages attached as images: {pages}]\n"
+        if self.unrendered_pages:
+            pages = ", ".join(str(page + 1) for page in self.unrendered_pages)
+            notes += f"[Scanned pages not attached (render limit): {pages}]\n"
+        return notes
+
+    def render_text(self) -> str:
+        """Text of this document with its header (images are noted, not inlined)"""
+        if self.doc_type == "XLSX":
+            body = "".join(
+                f"\n\n=== Sheet: {s.sheet_name} ===\n{s.text}"
+                for s in self.segments if isinstance(s, SheetSegment)
+            )
+        else:
+            body = "".join(
+                s.text + "\n"
+                for s in self.segments if isinstance(s, TextSegment) and s.text
+            )
+            body += self.page_notes(body)
+
+        return f"\n\n=== Document: {self.filename} ({self.doc_type}) ===\n{body}"
+
+
+class DocumentBundle:
+    """The parsed documents of one extraction request, in upload order"""
+
+    def __init__(self, documents: Optional[List[ParsedDocument]] = None):
+        self.documents = documents or []
+
+    @property
+    def segments(self) -> List[Segment]:
+        return [segment for document in self.documents for segment in document.segments]
+
+    @property
+    def images(self) -> List[ImageSegment]:
+        return [image for document in self.documents for image in document.images]
+
+    @property
+    def has_images(self) -> bool:
+        return any(document.images for document in self.documents)
+
+    def invoice_analytics(self) -> Optional[Dict[str, Any]]:
+        """
+        Computed line item figures of the invoice sheet, if any.
+        Prefers a sheet named like "Invoice" over e.g. the packing list.
+        """
+        sheets = [s for s in self.segments if isinstance(s, SheetSegment) and s.analytics]
+        for sheet in sheets:
+            if "invoice" in sheet.sheet_name.lower():
+                return sheet.analytics
+        return sheets[0].analytics if sheets else None
+
+    def parse_report(self) -> List[Dict[str, Any]]:
+        """Per-file parse time, fallback and unrendered pages, for the extraction report"""
+        return [
+            {
+                "file": document.filename,
+                "seconds": document.parse_seconds,
+                "cached": document.parse_seconds is None,
+                "fallback": document.parse_fallback,
+                "unrendered_pages": [page + 1 for page in document.unrendered_pages]
+            }
+            for document in self.documents
+        ]
+
+    def render_text(self) -> str:
+        """Combined text of all documents, in the format the prompts expect"""
+        return "".join(document.render_text() for document in self.documents)
+
+    def __len__(self) -> int:
+        return len(self.documents)
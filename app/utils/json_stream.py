@@ -0,0 +1,134 @@
+"""
+Incremental JSON Parsing
+Reads a JSON object as it streams in (e.g. token by token from the LLM)
+and reports each top-level field as soon as its value is complete.
+Text before the opening brace (markdown fences, preamble) is skipped.
+"""
+import json
+from typing import Any, Dict, List, Optional, Tuple
+
+WHITESPACE = " \t\r\n"
+
+
+class IncrementalJSONParser:
+    """
+    Streaming parser for one flat-ish JSON object.
+
+    feed() returns the (key, value) pairs completed by the new text.
+    Nested values (objects, arrays) are reported once they close. Values
+    that are not valid JSON are skipped; the caller still parses the
+    complete response at the end.
+    """
+
+    def __init__(self):
+        self.fields: Dict[str, Any] = {}
+        self._state = "start"  # start, key_wait, key, colon, value_wait, value, after_value, done
+        self._buffer = ""
+        self._key: Optional[str] = None
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+
+    @property
+    def done(self) -> bool:
+        return self._state == "done"
+
+    def feed(self, text: str) -> List[Tuple[str, Any]]:
+        completed: List[Tuple[str, Any]] = []
+        for char in text:
+            if self._state == "done":
+                break
+            self._step(char, completed)
+        return completed
+
+    def _string_char(self, char: str) -> bool:
+        """Add a char inside a string; True when it closes the string"""
+        self._buffer += char
+        if self._escape:
+            self._escape = False
+        elif char == "\\":
+            self._escape = True
+        elif char == '"':
+            self._in_string = False
+            return True
+        return False
+
+    def _complete(self, completed: List[Tuple[str, Any]]) -> None:
+        try:
+            value = json.loads(self._buffer)
+        except json.JSONDecodeError:
+            pass
+        else:
+            self.fields[self._key] = value
+            completed.append((self._key, value))
+        self._buffer = ""
+        self._state = "after_value"
+
+    def _step(self, char: str, completed: List[Tuple[str, Any]]) -> None:
+        state = self._state
+
+        if state == "start":
+            if char == "{":
+                self._state = "key_wait"
+
+        elif state in ("key_wait", "after_value"):
+            if char == '"' and state == "key_wait":
+                self._buffer, self._in_string, self._state = '"', True, "key"
+            elif char == "," and state == "after_value":
+                self._state = "key_wait"
+            elif char == "}":
+                self._state = "done"
+
+        elif state == "key":
+            if self._string_char(char):
+                try:
+                    self._key = json.loads(self._buffer)
+                except json.JSONDecodeError:
+                    self._key = self._buffer.strip('"')
+                self._buffer = ""
+                self._state = "colon"
+
+        elif state == "colon":
+            if char == ":":
+                self._state = "value_wait"
+
+        elif state == "value_wait":
+            if char in WHITESPACE:
+                return
+            self._state = "value"
+            self._buffer = ""
+            self._depth = 0
+            self._value_char(char, completed)
+
+        elif state == "value":
+            self._value_char(char, completed)
+
+    def _value_char(self, char: str, completed: List[Tuple[str, Any]]) -> None:
+        if self._in_string:
+            if self._string_char(char) and self._depth == 0:
+                self._complete(completed)
+            return
+
+        if char == '"':
+            self._buffer += char
+            self._in_string = True
+        elif char in "{[":
+            self._buffer += char
+            self._depth += 1
+        elif char in "}]":
+            if self._depth == 0:
+                # Closing brace of the object ends a scalar value
+                self._complete(completed)
+                self._state = "done"
+                return
+            self._buffer += char
+            self._depth -= 1
+            if self._depth == 0:
+                self._complete(completed)
+        elif self._depth == 0 and (char == "," or char in WHITESPACE):
+            # End of a number, true, false or null
+            self._complete(completed)
+            if char == ",":
+                self._state = "key_wait"
+        else:
+            self._buffer += char
@@ -1,64 +1,448 @@
 import PyPDF2
 import os
-import base64
-from typing import Optional, List
+import io
+import itertools
+from abc import ABC, abstractmethod
+from typing import Optional, List, Dict, Any, Iterable, Iterator
 import pypdfium2 as pdfium
+import pypdfium2.raw as pdfium_c
+from app.core.config import settings
+from app.utils.document_segments import TextSegment, ImageSegment, Segment
 
-def extract_text_from_pdf(file_path: str) -> str:
+# Bump whenever the text/image output of this module changes,
+# so cached parse results from older versions are not reused
+PDF_EXTRACTOR_VERSION = "5"
+
+# Pages whose text has fewer printable characters than this share are
+# treated as badly decoded (missing ToUnicode maps, broken encodings)
+MIN_PRINTABLE_SHARE = 0.9
+WHITESPACE_REMOVAL = str.maketrans("", "", " \t\n\r\f\v")
+
+
+class PdfTextBackend(ABC):
+    """Reads the text layer of PDF pages, one page at a time"""
+    name = ""
+
+    @abstractmethod
+    def iter_pages(self, file_path: str, start: int = 0, end: Optional[int] = None) -> Iterator[str]:
+        """Text of pages start..end (0-based, end exclusive), in page order"""
+
+
+class PyPDF2Backend(PdfTextBackend):
+    """Pure-Python text extraction (slow on dense pages, tolerant of malformed files)"""
+    name = "pypdf2"
+
+    def iter_pages(self, file_path: str, start: int = 0, end: Optional[int] = None) -> Iterator[str]:
+        with open(file_path, "rb") as file:
+            reader = PyPDF2.PdfReader(file)
+            for page in reader.pages[start:end]:
+                yield page.extract_text() or ""
+
+
+class PdfiumBackend(PdfTextBackend):
+    """Native text extraction through PDFium"""
+    name = "pdfium"
+
+    def iter_pages(self, file_path: str, start: int = 0, end: Optional[int] = None) -> Iterator[str]:
+        pdf = pdfium.PdfDocument(file_path)
+        try:
+            for index in range(*slice(start, end).indices(len(pdf))):
+                page = pdf[index]
+                textpage = page.get_textpage()
+                try:
+                    text = textpage.get_text_range()
+                finally:
+                    textpage.close()
+                    page.close()
+                # PDFium ends lines with CRLF; PyPDF2 (and the rule patterns) use LF
+                yield text.replace("\r\n", "\n").replace("\r", "\n")
+        finally:
+            pdf.close()
+
+
+def text_quality(text: str) -> float:
+    """Share of printable characters in a page text (1.0 for empty text)"""
+    characters = text.translate(WHITESPACE_REMOVAL)
+    if not characters:
+        return 1.0
+    if characters.isprintable() and "\ufffd" not in characters:
+        return 1.0
+    printable = sum(1 for c in characters if c.isprintable() and c != "\ufffd")
+    return printable / len(characters)
+
+
+class AutoBackend(PdfTextBackend):
+    """
+    PDFium first; a page whose PDFium text looks badly decoded is re-read
+    with PyPDF2 and the cleaner of the two kept. PyPDF2 also takes over
+    whole files PDFium cannot open.
+    """
+    name = "auto"
+
+    def __init__(self):
+        self.fast = PdfiumBackend()
+        self.fallback = PyPDF2Backend()
+
+    def _fallback_page(self, file_path: str, index: int) -> str:
+        try:
+            return next(self.fallback.iter_pages(file_path, index, index + 1), "")
+        except Exception as e:
+            print(f"PyPDF2 could not read page {index + 1} of {os.path.basename(file_path)}: {e}")
+            return ""
+
+    def iter_pages(self, file_path: str, start: int = 0, end: Optional[int] = None) -> Iterator[str]:
+        try:
+            pages = self.fast.iter_pages(file_path, start, end)
+            first = next(pages, None)
+        except FileNotFoundError:
+            raise
+        except Exception as e:
+            print(f"PDFium could not open {os.path.basename(file_path)}, using PyPDF2: {e}")
+            yield from self.fallback.iter_pages(file_path, start, end)
+            return
+        if first is None:
+            return
+
+        for index, text in enumerate(itertools.chain([first], pages), start=start):
+            if text_quality(text) < MIN_PRINTABLE_SHARE:
+                alternative = self._fallback_page(file_path, index)
+                if text_quality(alternative) > text_quality(text):
+                    text = alternative
+            yield text
+
+
+PDF_TEXT_BACKENDS = {backend.name: backend for backend in (AutoBackend, PdfiumBackend, PyPDF2Backend)}
+
+
+def get_text_backend(name: Optional[str] = None) -> PdfTextBackend:
+    """Text backend by name (PDF_TEXT_BACKEND if omitted)"""
+    name = (name or settings.PDF_TEXT_BACKEND).lower()
+    if name not in PDF_TEXT_BACKENDS:
+        raise ValueError(f"Unknown PDF text backend: {name} (expected one of {', '.join(PDF_TEXT_BACKENDS)})")
+    return PDF_TEXT_BACKENDS[name]()
+
+
+def count_pdf_pages(file_path: str) -> int:
+    """
+    Number of pages in a PDF. Files PDFium cannot open are counted with
+    PyPDF2; if neither can read the file, PyPDF2's error is raised.
+    """
+    try:
+        pdf = pdfium.PdfDocument(file_path)
+    except FileNotFoundError:
+        raise
+    except Exception as e:
+        print(f"PDFium could not open {os.path.basename(file_path)}, counting pages with PyPDF2: {e}")
+        with open(file_path, 'rb') as file:
+            return len(PyPDF2.PdfReader(file).pages)
+    try:
+        return len(pdf)
+    finally:
+        pdf.close()
+
+
+def iter_pdf_pages(
+    file_path: str,
+    start: int = 0,
+    end: Optional[int] = None,
+    backend: Optional[str] = None
+) -> Iterator[str]:
+    """
+    Lazily yield the text layer of pages [start, end) of a PDF; the file
+    is closed once the iterator is exhausted or discarded.
+
+    Args:
+        file_path: Path to the PDF file
+        start: First page index
+        end: Page index to stop at (None for the last page)
+        backend: Text backend name (PDF_TEXT_BACKEND if omitted)
+    """
+    return get_text_backend(backend).iter_pages(file_path, start, end)
+
+
+def extract_pdf_page_range(
+    file_path: str,
+    start: int = 0,
+    end: Optional[int] = None,
+    backend: Optional[str] = None
+) -> List[str]:
     """
-    Extract text from a PDF file. If the PDF is scanned (no text),
-    returns base64 encoded images for vision-based extraction.
+    Extract the text layer of pages [start, end) of a PDF.
 
     Args:
         file_path: Path to the PDF file
+        start: First page index
+        end: Page index to stop at (None for the last page)
+        backend: Text backend name (passed explicitly to parse pool workers)
 
     Returns:
-        str: Extracted text or special marker for image-based PDF
+        List[str]: Text of each page (empty string for pages without text)
     """
-    text = ""
+    return list(iter_pdf_pages(file_path, start, end, backend))
 
-    # First try standard text extraction
-    with open(file_path, "rb") as file:
-        reader = PyPDF2.PdfReader(file)
-        for page in reader.pages:
-            page_text = page.extract_text()
-            if page_text:
-                text += page_text + "\n"
 
-    # If no text found, it's likely a scanned PDF - convert to image
-    if not text.strip():
-        print(f"No text found in PDF, treating as scanned document")
-        return extract_pdf_as_image(file_path)
+def extract_pdf_pages(file_path: str) -> List[str]:
+    """
+    Extract the text layer of each page of a PDF.
 
-    return text
+    Args:
+        file_path: Path to the PDF file
 
+    Returns:
+        List[str]: Text of each page (empty string for pages without text)
+    """
+    return extract_pdf_page_range(file_path)
+
+
+def join_pdf_pages(pages: Iterable[str]) -> str:
+    """Join page texts the way extract_text_from_pdf returns them"""
+    return "".join(page_text + "\n" for page_text in pages if page_text)
+
+
+def page_classification_options() -> Dict[str, Any]:
+    """Current page classification settings (passed explicitly to parse pool workers)"""
+    return {
+        "min_text_chars": settings.PDF_PAGE_MIN_TEXT_CHARS,
+        "min_image_coverage": settings.PDF_PAGE_MIN_IMAGE_COVERAGE
+    }
+
+
+def text_density(text: str) -> int:
+    """Number of non-whitespace characters in a page text"""
+    return len(text.translate(WHITESPACE_REMOVAL))
 
-def extract_pdf_as_image(file_path: str) -> str:
+
+def pdf_page_layout(file_path: str, page_indices: List[int]) -> List[Dict[str, Any]]:
     """
-    Convert PDF pages to base64 encoded PNG images for vision-based extraction.
-    Returns a special marker that the LLM service will detect.
+    Image coverage (share of the page area under image objects, 0-1) and
+    number of page objects of the given pages, read without rendering.
     """
+    layouts = []
+    pdf = pdfium.PdfDocument(file_path)
     try:
-        # Use pypdfium2 to render PDF pages to images
-        pdf = pdfium.PdfDocument(file_path)
+        for index in page_indices:
+            page = pdf[index]
+            try:
+                left, bottom, right, top = page.get_bbox()
+                area = max((right - left) * (top - bottom), 1.0)
+                covered = 0.0
+                objects = 0
+                for obj in page.get_objects():
+                    objects += 1
+                    if obj.type != pdfium_c.FPDF_PAGEOBJ_IMAGE:
+                        continue
+                    x0, y0, x1, y1 = obj.get_bounds()
+                    covered += max(0.0, min(x1, right) - max(x0, left)) * max(0.0, min(y1, top) - max(y0, bottom))
+                layouts.append({"image_coverage": round(min(covered / area, 1.0), 3), "objects": objects})
+            finally:
+                page.close()
+    finally:
+        pdf.close()
+    return layouts
 
-        # Convert first page to image
-        page = pdf[0]
 
-        # Render page to bitmap at 2x scale for better quality
-        bitmap = page.render(scale=2.0)
-        pil_image = bitmap.to_pil()
+def classify_page(text: str, layout: Optional[Dict[str, Any]], options: Dict[str, Any]) -> str:
+    """
+    Kind of a PDF page: "text" (its text layer carries the content),
+    "image" (scanned or drawn content that has to be rendered) or "blank".
+
+    A page with a little text over a large image, such as a scan with a
+    stamped page number, is an image page; its text is still kept.
+    """
+    if text_density(text) >= options["min_text_chars"]:
+        return "text"
+    if layout is None:
+        return "text" if text.strip() else "image"
+    if layout["image_coverage"] >= options["min_image_coverage"]:
+        return "image"
+    if text.strip():
+        return "text"
+    return "image" if layout["objects"] else "blank"
 
-        # Convert PIL image to base64 PNG
-        import io
+
+def classify_pdf_pages(file_path: str, pages: List[str], options: Dict[str, Any]) -> List[str]:
+    """
+    Classify every page of a PDF from its extracted text; only pages with
+    little text have their layout read.
+
+    Returns:
+        List[str]: "text", "image" or "blank" per page
+    """
+    sparse = [index for index, text in enumerate(pages) if text_density(text) < options["min_text_chars"]]
+    layouts = dict(zip(sparse, pdf_page_layout(file_path, sparse))) if sparse else {}
+    return [classify_page(text, layouts.get(index), options) for index, text in enumerate(pages)]
+
+
+def extract_pdf_segments(file_path: str) -> List[Segment]:
+    """
+    Extract a PDF as typed segments in page order: a TextSegment for each
+    page with text, and an ImageSegment for each rendered image-only page
+    (scanned pages of mixed PDFs included).
+
+    Args:
+        file_path: Path to the PDF file
+
+    Returns:
+        List[Segment]: Page text segments and page image segments
+    """
+    pages = extract_pdf_pages(file_path)
+    kinds = classify_pdf_pages(file_path, pages, page_classification_options())
+    image_pages = [index for index, kind in enumerate(kinds) if kind == "image"]
+
+    segments: List[Segment] = [TextSegment(text=text, page=index) for index, text in enumerate(pages) if text.strip()]
+    if image_pages:
+        print(f"{len(image_pages)} of {len(pages)} pages have no text layer, rendering them")
+        segments.extend(extract_pdf_as_image(file_path, image_pages))
+    return sorted(segments, key=lambda segment: segment.page or 0)
+
+
+def extract_text_from_pdf(file_path: str) -> str:
+    """
+    Extract the text layer of a PDF file.
+
+    Args:
+        file_path: Path to the PDF file
+
+    Returns:
+        str: Extracted text (empty for scanned PDFs; use extract_pdf_segments
+        to get their page images)
+    """
+    return join_pdf_pages(iter_pdf_pages(file_path))
+
+
+IMAGE_MEDIA_TYPES = {"JPEG": "image/jpeg", "WEBP": "image/webp", "PNG": "image/png"}
+
+
+def render_options() -> Dict[str, Any]:
+    """Current rendering settings (passed explicitly to parse pool workers)"""
+    return {
+        "max_pages": settings.PDF_RENDER_MAX_PAGES,
+        "page_range": settings.PDF_RENDER_PAGE_RANGE,
+        "target_long_edge": settings.PDF_RENDER_TARGET_LONG_EDGE,
+        "min_scale": settings.PDF_RENDER_MIN_SCALE,
+        "max_scale": settings.PDF_RENDER_MAX_SCALE,
+        "format": settings.PDF_RENDER_FORMAT.upper(),
+        "quality": settings.PDF_RENDER_QUALITY,
+        "grayscale": settings.PDF_RENDER_GRAYSCALE,
+        "max_total_bytes": settings.PDF_RENDER_MAX_IMAGE_BYTES
+    }
+
+
+def select_render_pages(page_count: int, options: Dict[str, Any], candidates: Optional[List[int]] = None) -> List[int]:
+    """
+    0-based indices of the pages to render, out of candidates (all pages
+    if omitted, otherwise e.g. the image-only pages of a mixed PDF).
+
+    PDF_RENDER_PAGE_RANGE uses 1-based pages ("1-3,5"); otherwise the first
+    PDF_RENDER_MAX_PAGES candidates are rendered (all of them if 0).
+    """
+    if candidates is None:
+        candidates = list(range(page_count))
+    spec = (options.get("page_range") or "").strip()
+    if spec:
+        pages = set()
+        for part in spec.split(","):
+            part = part.strip()
+            if not part:
+                continue
+            if "-" in part:
+                first, last = part.split("-", 1)
+                pages.update(range(int(first) - 1, int(last)))
+            else:
+                pages.add(int(part) - 1)
+        return [p for p in candidates if p in pages and 0 <= p < page_count]
+
+    max_pages = options.get("max_pages") or page_count
+    return [p for p in candidates if 0 <= p < page_count][:max_pages]
+
+
+def _encode_image(pil_image, options: Dict[str, Any], max_bytes: int) -> bytes:
+    """
+    Encode a page image, lowering quality and then resolution until it fits
+    in max_bytes (or can't shrink further).
+    """
+    image_format = options["format"] if options["format"] in IMAGE_MEDIA_TYPES else "JPEG"
+    if options["grayscale"]:
+        pil_image = pil_image.convert("L")
+    elif pil_image.mode not in ("RGB", "L"):
+        pil_image = pil_image.convert("RGB")
+
+    quality = options["quality"]
+    while True:
         buffer = io.BytesIO()
-        pil_image.save(buffer, format='PNG')
-        image_data = base64.standard_b64encode(buffer.getvalue()).decode('utf-8')
+        if image_format == "PNG":
+            pil_image.save(buffer, format="PNG", optimize=True)
+        else:
+            pil_image.save(buffer, format=image_format, quality=quality)
+        data = buffer.getvalue()
+
+        if len(data) <= max_bytes:
+            return data
+        if image_format != "PNG" and quality > 40:
+            quality -= 15
+        elif min(pil_image.size) > 400:
+            pil_image = pil_image.resize((int(pil_image.width * 0.75), int(pil_image.height * 0.75)))
+        else:
+            return data
+
+
+def render_pdf_page(file_path: str, page_index: int, options: Dict[str, Any], max_bytes: int) -> ImageSegment:
+    """
+    Render one PDF page for vision extraction.
+
+    The scale is chosen from the page size so the long edge lands near
+    target_long_edge pixels, and the image is encoded to fit in max_bytes.
 
+    Returns:
+        ImageSegment: Encoded image bytes and media type for the page
+    """
+    pdf = pdfium.PdfDocument(file_path)
+    try:
+        page = pdf[page_index]
+        width, height = page.get_size()  # PDF points
+        scale = options["target_long_edge"] / max(width, height, 1)
+        scale = max(options["min_scale"], min(options["max_scale"], scale))
+
+        bitmap = page.render(scale=scale, grayscale=options["grayscale"])
+        pil_image = bitmap.to_pil()
+    finally:
         pdf.close()
 
-        return f"IMAGE_PDF:{image_data}"
+    image_format = options["format"] if options["format"] in IMAGE_MEDIA_TYPES else "JPEG"
+    return ImageSegment(
+        data=_encode_image(pil_image, options, max_bytes),
+        media_type=IMAGE_MEDIA_TYPES[image_format],
+        page=page_index
+    )
+
+
+def per_page_budget(page_count: int, options: Dict[str, Any]) -> int:
+    """Split the request image budget evenly across rendered pages"""
+    return max(1, options["max_total_bytes"] // max(page_count, 1))
+
+
+def extract_pdf_as_image(file_path: str, candidates: Optional[List[int]] = None) -> List[Segment]:
+    """
+    Render PDF pages to images for vision-based extraction.
+
+    Args:
+        file_path: Path to the PDF file
+        candidates: 0-based pages that may be rendered (all pages if omitted)
+
+    Returns:
+        List[Segment]: One ImageSegment per rendered page, or a single
+        TextSegment noting the failure if the PDF cannot be rendered
+    """
+    try:
+        options = render_options()
+        page_count = count_pdf_pages(file_path)
+        pages = select_render_pages(page_count, options, candidates)
+        skipped = len(candidates if candidates is not None else range(page_count)) - len(pages)
+        if skipped:
+            print(f"Render limit leaves out {skipped} page(s) of {os.path.basename(file_path)}")
+        budget = per_page_budget(len(pages), options)
+        return [render_pdf_page(file_path, page_index, options, budget) for page_index in pages]
 
     except Exception as e:
         print(f"Error converting PDF to image: {e}")
-        return "[Scanned PDF - text extraction not possible]"
+        return [TextSegment(text="[Scanned PDF - text extraction not possible]")]
@@ -0,0 +1,228 @@
+"""
+Invoice Table Analysis
+Finds the line item table in an invoice/packing list sheet (header row
+with S.No. and Total Value columns) and computes counts, sums and
+averages locally, so the LLM only needs the figures plus the header block
+instead of every row of the sheet.
+"""
+import math
+import re
+from typing import Any, Dict, List, Optional, Sequence
+
+# Normalized header names (lowercase letters only) for each column role
+SERIAL_HEADERS = {"sno", "srno", "slno", "serialno", "no", "itemno", "snumber"}
+TOTAL_VALUE_PATTERN = re.compile(r"total(value|amount|price)?(usd)?$|amount(usd)?$|value(usd)?$")
+GROSS_WEIGHT_PATTERN = re.compile(r"^(total)?(gross(weight|wt)|gw)")
+NET_WEIGHT_PATTERN = re.compile(r"^(total)?(net(weight|wt)|nw)")
+QUANTITY_PATTERN = re.compile(r"^(qty|quantity|pcs|pieces|cartons|ctns)")
+
+NUMBER_PATTERN = re.compile(r"-?\d+(?:\.\d+)?")
+# Line item sums and stated totals further apart than this disagree
+TOTAL_TOLERANCE = 0.01
+
+
+def _normalize_header(value: Any) -> str:
+    return re.sub(r"[^a-z]", "", str(value).lower()) if value is not None else ""
+
+
+def to_number(value: Any) -> Optional[float]:
+    """Parse a cell as a number ("$1,234.50", "16250 KGS", 12) or None"""
+    if value is None or isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        return float(value)
+    match = NUMBER_PATTERN.search(str(value).replace(",", ""))
+    return float(match.group()) if match else None
+
+
+def _is_serial(value: Any) -> bool:
+    """True for S.No. cells such as 1, 2.0 or "3" """
+    if isinstance(value, bool) or value is None:
+        return False
+    if isinstance(value, (int, float)):
+        return float(value).is_integer() and value > 0
+    return bool(re.fullmatch(r"\s*\d+\.?\s*", str(value)))
+
+
+def find_table_header(row: Sequence[Any]) -> Optional[Dict[str, int]]:
+    """
+    Column indices of a line item header row, or None if the row is not one.
+    Requires an S.No. column and a total value column.
+    """
+    columns: Dict[str, int] = {}
+    for index, cell in enumerate(row):
+        name = _normalize_header(cell)
+        if not name:
+            continue
+        if "serial" not in columns and name in SERIAL_HEADERS:
+            columns["serial"] = index
+        elif "unitprice" in name or "unitvalue" in name:
+            continue
+        elif TOTAL_VALUE_PATTERN.search(name):
+            # Prefer the most specific total column (e.g. "Total Value (USD)" over "Amount")
+            if "total_value" not in columns or name.startswith("total"):
+                columns["total_value"] = index
+        elif "gross_weight" not in columns and GROSS_WEIGHT_PATTERN.search(name):
+            columns["gross_weight"] = index
+        elif "net_weight" not in columns and NET_WEIGHT_PATTERN.search(name):
+            columns["net_weight"] = index
+        elif "quantity" not in columns and QUANTITY_PATTERN.search(name):
+            columns["quantity"] = index
+
+    if "serial" in columns and "total_value" in columns:
+        return columns
+    return None
+
+
+def row_to_line(row: Sequence[Any]) -> str:
+    """Render a row as " | "-joined text ("" for empty rows)"""
+    row_data = [str(cell) if cell is not None else "" for cell in row]
+    return " | ".join(row_data) + "\n" if any(row_data) else ""
+
+
+class InvoiceTableScanner:
+    """
+    Single pass over the rows of a sheet.
+
+    Rows before the line item header are kept as text (the header block:
+    invoice no., ship to, dates...). Line item rows are only counted and
+    summed, never stored. The table ends at a row labelled TOTAL; a row
+    without S.No. that only has a number in the total value column (an
+    unlabelled footer) is taken as the stated total unless more line
+    items follow it. Rows after the total are kept as text. If no line
+    item table is found, every row is kept as text.
+    """
+
+    def __init__(self):
+        self.columns: Optional[Dict[str, int]] = None
+        self.column_names: Dict[str, str] = {}
+        self.state = "searching"
+        self.before: List[str] = []
+        self.after: List[str] = []
+        self.values: Dict[str, List[float]] = {}
+        self.line_items_count = 0
+        self.stated_total: Optional[float] = None
+        self.footer_total: Optional[float] = None  # Unlabelled footer candidate
+        self.trailing: List[str] = []  # Non-item rows since the last line item
+
+    def _cell(self, row: Sequence[Any], role: str) -> Any:
+        index = self.columns.get(role)
+        return row[index] if index is not None and index < len(row) else None
+
+    def feed(self, row: Sequence[Any]) -> None:
+        if self.state == "searching":
+            columns = find_table_header(row)
+            if columns:
+                self.columns = columns
+                self.column_names = {role: str(row[index]) for role, index in columns.items()}
+                self.values = {role: [] for role in columns if role != "serial"}
+                self.state = "table"
+            else:
+                line = row_to_line(row)
+                if line:
+                    self.before.append(line)
+            return
+
+        if self.state == "table":
+            if _is_serial(self._cell(row, "serial")):
+                self.line_items_count += 1
+                for role, values in self.values.items():
+                    number = to_number(self._cell(row, role))
+                    if number is not None:
+                        values.append(number)
+                # More line items: the footer candidate was a subtotal or an unnumbered row
+                self.footer_total = None
+                self.trailing = []
+                return
+
+            # A "TOTAL" row without S.No. ends the table
+            if any("total" in str(cell).lower() for cell in row if cell is not None):
+                self.stated_total = to_number(self._cell(row, "total_value"))
+                self.state = "done"
+                return
+
+            total = self._cell(row, "total_value")
+            if self._cell(row, "serial") is None and not isinstance(total, str) and to_number(total) is not None:
+                self.footer_total = to_number(total)
+            else:
+                # Kept whether or not a footer follows: the table may simply end here
+                line = row_to_line(row)
+                if line:
+                    self.trailing.append(line)
+            return
+
+        line = row_to_line(row)
+        if line:
+            self.after.append(line)
+
+    def analysis(self) -> Optional[Dict[str, Any]]:
+        """Computed figures, or None if no line item table was found"""
+        if self.columns is None:
+            return None
+
+        def column_sum(role: str) -> Optional[float]:
+            values = self.values.get(role)
+            return math.fsum(values) if values else None
+
+        count = self.line_items_count
+        total_value = column_sum("total_value")
+        stated = self.stated_total if self.stated_total is not None else self.footer_total
+        return {
+            "columns": dict(self.column_names),
+            "line_items_count": count,
+            "total_value_sum": round(total_value, 2) if total_value is not None else None,
+            "stated_total_value": stated,
+            # Sum and stated total disagree: neither average is trusted without a look at the sheet
+            "total_mismatch": (
+                total_value is not None and stated is not None and abs(total_value - stated) > TOTAL_TOLERANCE
+            ),
+            "average_price": round(total_value / count, 2) if total_value is not None and count else None,
+            "stated_average_price": round(stated / count, 2) if stated is not None and count else None,
+            "gross_weight_sum": column_sum("gross_weight"),
+            "net_weight_sum": column_sum("net_weight"),
+            "quantity_sum": column_sum("quantity")
+        }
+
+    def text(self) -> str:
+        """Sheet text: header block + computed figures + footer, or every row"""
+        analysis = self.analysis()
+        if analysis is None:
+            return "".join(self.before)
+        after = self.after if self.state == "done" else self.trailing
+        return "".join(self.before) + format_analysis(analysis) + "".join(after)
+
+
+def analyze_rows(rows: List[Sequence[Any]]) -> Optional[Dict[str, Any]]:
+    """Analyze the rows of one sheet (None if it has no line item table)"""
+    scanner = InvoiceTableScanner()
+    for row in rows:
+        scanner.feed(row)
+    return scanner.analysis()
+
+
+def format_analysis(analysis: Dict[str, Any]) -> str:
+    """Render computed figures as prompt text"""
+    columns = analysis["columns"]
+    lines = [
+        f"[Line item table: {analysis['line_items_count']} rows, columns: "
+        f"{', '.join(columns.values())}]",
+        "COMPUTED INVOICE FIGURES (exact, calculated from every line item row):",
+        f"- lineItemsCount: {analysis['line_items_count']}"
+    ]
+    if analysis["total_value_sum"] is not None:
+        lines.append(f"- Sum of \"{columns['total_value']}\": {analysis['total_value_sum']:.2f}")
+    if analysis["stated_total_value"] is not None:
+        lines.append(f"- Stated TOTAL row value: {analysis['stated_total_value']:.2f}")
+    if analysis.get("total_mismatch"):
+        lines.append(
+            f"- WARNING: the line items do not add up to the stated total; averagePrice is "
+            f"${analysis['average_price']:.2f} from the line items or ${analysis['stated_average_price']:.2f} "
+            f"from the stated total - check the sheet"
+        )
+    elif analysis["average_price"] is not None:
+        lines.append(f"- averagePrice: ${analysis['average_price']:.2f}")
+    for role in ("gross_weight", "net_weight", "quantity"):
+        total = analysis.get(f"{role}_sum")
+        if total is not None:
+            lines.append(f"- Sum of \"{columns[role]}\": {total:g}")
+    return "\n".join(lines) + "\n"
@@ -1,30 +1,71 @@
 import openpyxl
+from typing import List
+from app.core.config import settings
+from app.utils.document_segments import SheetSegment
+from app.utils.xlsx_analysis import InvoiceTableScanner, row_to_line
 
-def extract_text_from_xlsx(file_path: str) -> str:
+# Bump whenever the text output of this module changes,
+# so cached parse results from older versions are not reused
+XLSX_EXTRACTOR_VERSION = "5"
+
+
+def extract_xlsx_sheets(file_path: str, summarize: bool = None) -> List[SheetSegment]:
     """
-    Extract text from an XLSX file.
+    Extract the text of each sheet of an XLSX file.
+
+    The workbook is streamed row by row. Sheets with a line item table
+    (S.No. + Total Value columns) keep their header block and footer rows,
+    while the table itself is replaced by computed figures (row count,
+    column sums, average price) that are also attached as analytics.
 
     Args:
         file_path: Path to the XLSX file
+        summarize: Replace line item tables with computed figures
+            (defaults to settings.XLSX_SUMMARIZE_TABLES)
 
     Returns:
-        str: Extracted text from all sheets in the XLSX file
+        List[SheetSegment]: One segment per sheet
     """
-    text = ""
+    if summarize is None:
+        summarize = settings.XLSX_SUMMARIZE_TABLES
+
+    sheets = []
     try:
-        workbook = openpyxl.load_workbook(file_path, data_only=True)
+        workbook = openpyxl.load_workbook(file_path, read_only=True, data_only=True)
 
         for sheet_name in workbook.sheetnames:
-            sheet = workbook[sheet_name]
-            text += f"\n\n=== Sheet: {sheet_name} ===\n"
+            scanner = InvoiceTableScanner()
+            lines = []
+
+            for row in workbook[sheet_name].iter_rows(values_only=True):
+                scanner.feed(row)
+                if not summarize:
+                    line = row_to_line(row)
+                    if line:  # Only add non-empty rows
+                        lines.append(line)
 
-            for row in sheet.iter_rows(values_only=True):
-                # Filter out empty cells and join with |
-                row_data = [str(cell) if cell is not None else "" for cell in row]
-                if any(cell for cell in row_data):  # Only add non-empty rows
-                    text += " | ".join(row_data) + "\n"
+            text = scanner.text() if summarize else "".join(lines)
+            sheets.append(SheetSegment(sheet_name=sheet_name, text=text, analytics=scanner.analysis()))
 
         workbook.close()
-        return text
+        return sheets
     except Exception as e:
         raise Exception(f"Failed to extract XLSX text: {str(e)}")
+
+
+def join_xlsx_sheets(sheets: List[SheetSegment]) -> str:
+    """Join sheet texts the way extract_text_from_xlsx returns them"""
+    return "".join(f"\n\n=== Sheet: {sheet.sheet_name} ===\n{sheet.text}" for sheet in sheets)
+
+
+def extract_text_from_xlsx(file_path: str) -> str:
+    """
+    Extract text from an XLSX file.
+
+    Args:
+        file_path: Path to the XLSX file
+
+    Returns:
+        str: Extracted text from all sheets in the XLSX file
+    """
+    return join_xlsx_sheets(extract_xlsx_sheets(file_path))
@@ -0,0 +1,192 @@
+"""
+Synthetic Shipment Documents
+Generates Bill of Lading PDFs (with a text layer, or scanned-style: the
+page rasterized and embedded as an image) and commercial invoice
+workbooks of a chosen size, together with the field values an
+extraction of them should return.
+"""
+import io
+import random
+import string
+from dataclasses import dataclass
+from datetime import date, timedelta
+from pathlib import Path
+from typing import Any, Dict, List
+
+import openpyxl
+import pypdfium2 as pdfium
+from reportlab.lib.pagesizes import A4
+from reportlab.lib.utils import ImageReader
+from reportlab.pdfgen import canvas
+
+from app.services.validators import ShipmentValidator
+
+# Line items of the invoice and extra BOL pages (terms, cargo manifest) per size
+SIZES = {
+    "small": {"line_items": 5, "extra_pages": 0},
+    "medium": {"line_items": 60, "extra_pages": 2},
+    "large": {"line_items": 600, "extra_pages": 8}
+}
+
+CONSIGNEES = [
+    ("KABOFER TRADING INC", ["3838 CAMINO DEL RIO NORTH, STE 235", "SAN DIEGO, CA 92108, USA"]),
+    ("HARBOR LINE IMPORTS LLC", ["1200 PORT AVENUE", "LONG BEACH, CA 90802, USA"]),
+    ("NORTHWIND SUPPLY CO", ["55 INDUSTRIAL PARKWAY, UNIT 4", "NEWARK, NJ 07114, USA"])
+]
+PRODUCTS = ["ABRASIVE DISC", "GRINDING WHEEL", "CUTTING BLADE", "SANDING BELT", "POLISHING PAD", "WIRE BRUSH"]
+TERMS_LINE = "The carrier shall not be liable for loss or damage arising from causes beyond its control."
+SCANNED_SCALE = 1.5  # Rasterization scale of scanned-style pages (~108 dpi)
+
+
+@dataclass
+class Shipment:
+    """Generated files of one shipment and the values expected from them"""
+    name: str
+    files: List[Path]
+    expected: Dict[str, Any]
+    size: str
+    scanned: bool
+
+
+def _container_number(rng: random.Random) -> str:
+    owner = "".join(rng.choice(string.ascii_uppercase) for _ in range(3)) + "U"
+    serial = f"{rng.randrange(10 ** 6):06d}"
+    return f"{owner}{serial}{ShipmentValidator.container_check_digit(owner + serial)}"
+
+
+def _bol_lines(expected: Dict[str, Any], consignee_address: List[str], total_weight: float, export: date) -> List[str]:
+    return [
+        "BILL OF LADING",
+        f"B/L No: {expected['billOfLadingNumber']}",
+        "SHIPPER",
+        "CHINA ABRASIVES EXPORT CORPORATION",
+        "CONSIGNEE:",
+        expected["consigneeName"],
+        *consignee_address,
+        "NOTIFY PARTY",
+        "SAME AS CONSIGNEE",
+        "VESSEL: COSCO BELGIUM   VOYAGE: 095E",
+        "PORT OF LOADING: SHANGHAI, CHINA",
+        "PORT OF DISCHARGE: LONG BEACH, CA",
+        f"CONTAINER NO: {expected['containerNumber']}",
+        f"SHIPPED ON BOARD DATE: {export.strftime('%d-%b-%Y')}",
+        f"TOTAL GROSS WEIGHT: {total_weight:,.2f} KGS"
+    ]
+
+
+def _draw_pages(pdf: canvas.Canvas, pages: List[List[str]]) -> None:
+    for lines in pages:
+        text = pdf.beginText(40, A4[1] - 50)
+        text.setFont("Helvetica", 10)
+        for line in lines:
+            text.textLine(line)
+        pdf.drawText(text)
+        pdf.showPage()
+
+
+def write_bol_pdf(path: Path, pages: List[List[str]], scanned: bool = False) -> None:
+    """Write the BOL pages; scanned-style pages carry an image and no text layer"""
+    buffer = io.BytesIO()
+    pdf = canvas.Canvas(buffer if scanned else str(path), pagesize=A4)
+    _draw_pages(pdf, pages)
+    pdf.save()
+    if not scanned:
+        return
+
+    source = pdfium.PdfDocument(buffer.getvalue())
+    output = canvas.Canvas(str(path), pagesize=A4)
+    try:
+        for page in source:
+            image = page.render(scale=SCANNED_SCALE, grayscale=True).to_pil()
+            output.drawImage(ImageReader(image), 0, 0, width=A4[0], height=A4[1])
+            output.showPage()
+    finally:
+        source.close()
+    output.save()
+
+
+def write_invoice_xlsx(path: Path, consignee: str, items: List[Dict[str, Any]]) -> None:
+    """Write an invoice sheet (header block, line items, TOTAL row) and a packing list"""
+    workbook = openpyxl.Workbook()
+    invoice = workbook.active
+    invoice.title = "Invoice"
+    invoice.append(["COMMERCIAL INVOICE"])
+    invoice.append(["SHIP TO:", consignee])
+    invoice.append([])
+    invoice.append(["S.No.", "Description", "Quantity", "Unit Price (USD)", "Total Value (USD)", "Gross Weight (KG)"])
+    for number, item in enumerate(items, start=1):
+        invoice.append([number, item["product"], item["quantity"], item["unit_price"], item["total"], item["weight"]])
+    invoice.append(["", "TOTAL", sum(i["quantity"] for i in items), "", round(sum(i["total"] for i in items), 2), ""])
+
+    packing = workbook.create_sheet("Packing List")
+    packing.append(["S.No.", "Description", "Cartons", "Net Weight (KG)", "Gross Weight (KG)"])
+    for number, item in enumerate(items, start=1):
+        packing.append([number, item["product"], item["quantity"] // 10 + 1, item["weight"] * 0.9, item["weight"]])
+    workbook.save(path)
+
+
+def make_line_items(rng: random.Random, count: int) -> List[Dict[str, Any]]:
+    """Random invoice line items (product, quantity, prices, gross weight)"""
+    items = []
+    for _ in range(count):
+        quantity = rng.randrange(10, 500)
+        unit_price = round(rng.uniform(0.5, 40), 2)
+        items.append({
+            "product": rng.choice(PRODUCTS),
+            "quantity": quantity,
+            "unit_price": unit_price,
+            "total": round(quantity * unit_price, 2),
+            "weight": round(rng.uniform(50, 1500), 2)
+        })
+    return items
+
+
+def filler_pages(rng: random.Random, count: int) -> List[List[str]]:
+    """Extra BOL pages: cargo manifests alternating with terms and conditions"""
+    pages = []
+    for page in range(count):
+        if page % 2:
+            pages.append(["TERMS AND CONDITIONS"] + [f"{n}. {TERMS_LINE}" for n in range(1, 60)])
+        else:
+            pages.append(["CARGO MANIFEST"] + [
+                f"{n:>4}  {rng.choice(PRODUCTS):<16} {rng.randrange(1, 90):>3} CTNS" for n in range(1, 60)
+            ])
+    return pages
+
+
+def make_shipment(directory: Path, index: int, size: str = "small", scanned: bool = False, seed: int = 0) -> Shipment:
+    """
+    Generate the BOL PDF and invoice XLSX of one shipment.
+
+    File names are unique per index so concurrent uploads do not collide;
+    the values differ per index so no cache can answer a later request.
+    """
+    rng = random.Random(f"{seed}-{index}")
+    line_items = SIZES[size]["line_items"]
+    consignee, address = CONSIGNEES[index % len(CONSIGNEES)]
+    export = date(2024, 1, 1) + timedelta(days=rng.randrange(365))
+
+    items = make_line_items(rng, line_items)
+    total_weight = round(sum(item["weight"] for item in items), 2)
+    total_value = sum(item["total"] for item in items)
+
+    expected = {
+        "billOfLadingNumber": f"BNCH{seed % 100:02d}{index:06d}",
+        "containerNumber": _container_number(rng),
+        "consigneeName": consignee,
+        "consigneeAddress": ", ".join(address),
+        "dateOfExport": export.strftime("%m/%d/%Y"),
+        "lineItemsCount": line_items,
+        "averageGrossWeight": f"{total_weight / line_items:.2f} KG",
+        "averagePrice": f"${round(total_value / line_items, 2):.2f}"
+    }
+
+    pages = [_bol_lines(expected, address, total_weight, export)] + filler_pages(rng, SIZES[size]["extra_pages"])
+
+    kind = "scan" if scanned else "text"
+    name = f"bench_{seed}_{index}_{size}_{kind}"
+    bol_path = directory / f"{name}_bol.pdf"
+    invoice_path = directory / f"{name}_invoice.xlsx"
+    write_bol_pdf(bol_path, pages, scanned)
+    write_invoice_xlsx(invoice_path, consignee, items)
+    return Shipment(name, [bol_path, invoice_path], expected, size, scanned)
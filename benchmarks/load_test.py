@@ -0,0 +1,332 @@
+"""
+Extraction Load Test
+Drives POST /api/extract in real mode (use_mock=false, use_cache=false)
+with synthetic shipments at a fixed concurrency, and reports throughput,
+latency percentiles (overall, per stage, per document kind), peak RSS
+and CPU per stage as JSON, so runs can be compared with each other.
+
+In-process (default): the FastAPI app is called through httpx's ASGI
+transport, and the LLM is the fake server from tools/fake_llm_server.py
+(also in-process, no rate limits). Stage wall times come from wrapping
+the route's upload, parse and LLM steps. CPU per stage and document
+kind comes from a serial profiling pass first, where CPU deltas belong
+to one stage (the llm stage includes the in-process fake server's CPU).
+
+Over localhost (--url): requests go to a running server (start it with
+LLM_BASE_URL pointing at a fake LLM server); only client-side figures
+are reported.
+
+Usage:
+    python -m benchmarks.load_test --requests 200 --concurrency 16 \\
+        --sizes small,medium,large --scanned-share 0.25 --output bench_results.json
+"""
+import argparse
+import asyncio
+import json
+import platform
+import random
+import shutil
+import tempfile
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional
+
+import httpx
+
+from app.api import routes
+from app.core.config import settings
+from app.services import llm_service
+from app.services.circuit_breaker import CircuitBreaker
+from app.services.llm_client import LLMClient
+from app.services.parse_pool import parse_pool
+from app.utils.document_cache import document_cache
+from benchmarks.documents import SIZES, Shipment, make_shipment
+from benchmarks.measure import cpu_delta, cpu_seconds, peak_rss_mb, percentiles
+from tools.fake_llm_server import FakeLLMConfig, create_app
+
+STAGES = ("upload", "parse", "llm")
+
+
+class StageRecorder:
+    """Wall time of each pipeline stage call, plus CPU while profiling (one request at a time)"""
+
+    def __init__(self):
+        self.wall: Dict[str, List[float]] = {stage: [] for stage in STAGES}
+        self.cpu: Dict[str, List[Dict[str, float]]] = {stage: [] for stage in STAGES}
+        self.profiling = False
+
+    def reset(self) -> None:
+        self.__init__()
+
+    @contextmanager
+    def measure(self, stage: str) -> Iterator[None]:
+        started = time.perf_counter()
+        cpu_before = cpu_seconds() if self.profiling else None
+        try:
+            yield
+        finally:
+            self.wall[stage].append(time.perf_counter() - started)
+            if cpu_before is not None:
+                self.cpu[stage].append(cpu_delta(cpu_before, cpu_seconds()))
+
+    @contextmanager
+    def installed(self) -> Iterator[None]:
+        """Wrap the route's stage functions for the duration of the run"""
+        save_uploads = routes._save_uploads
+        process_documents = routes.process_documents
+        extract = routes.extract_field_from_document
+
+        async def timed_save_uploads(*args, **kwargs):
+            with self.measure("upload"):
+                return await save_uploads(*args, **kwargs)
+
+        def timed_process_documents(*args, **kwargs):
+            with self.measure("parse"):
+                return process_documents(*args, **kwargs)
+
+        async def timed_extract(*args, **kwargs):
+            with self.measure("llm"):
+                return await extract(*args, **kwargs)
+
+        routes._save_uploads = timed_save_uploads
+        routes.process_documents = timed_process_documents
+        routes.extract_field_from_document = timed_extract
+        try:
+            yield
+        finally:
+            routes._save_uploads = save_uploads
+            routes.process_documents = process_documents
+            routes.extract_field_from_document = extract
+
+
+def _kind(shipment: Shipment) -> str:
+    return f"{shipment.size}_{'scanned' if shipment.scanned else 'text'}"
+
+
+async def _send(client: httpx.AsyncClient, shipment: Shipment) -> Dict[str, Any]:
+    """Upload one shipment and check the result against the expected values"""
+    files = []
+    for path in shipment.files:
+        content_type = "application/pdf" if path.suffix == ".pdf" else \
+            "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+        files.append(("files", (path.name, path.read_bytes(), content_type)))
+
+    started = time.perf_counter()
+    try:
+        response = await client.post("/api/extract", params={"use_mock": "false", "use_cache": "false"}, files=files)
+        status = response.status_code
+        body = response.json() if status == 200 else {}
+    except httpx.HTTPError as e:
+        status, body = None, {"error": str(e)}
+    elapsed = time.perf_counter() - started
+
+    data = body.get("data") or {}
+    correct = sum(1 for name, value in shipment.expected.items() if data.get(name) == value)
+    return {
+        "kind": _kind(shipment),
+        "status": status,
+        "seconds": elapsed,
+        "partial": bool(body.get("partial")),
+        "correct_fields": correct,
+        "fields": len(shipment.expected)
+    }
+
+
+async def _run_load(client: httpx.AsyncClient, shipments: List[Shipment], concurrency: int) -> List[Dict[str, Any]]:
+    """Send every shipment with at most `concurrency` requests in flight"""
+    queue: asyncio.Queue = asyncio.Queue()
+    for shipment in shipments:
+        queue.put_nowait(shipment)
+    results: List[Dict[str, Any]] = []
+
+    async def worker() -> None:
+        while not queue.empty():
+            results.append(await _send(client, queue.get_nowait()))
+
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return results
+
+
+def _summarize(results: List[Dict[str, Any]], seconds: float) -> Dict[str, Any]:
+    ok = [r for r in results if r["status"] == 200]
+    fields = sum(r["fields"] for r in ok)
+    return {
+        "requests": len(results),
+        "succeeded": len(ok),
+        "failed": len(results) - len(ok),
+        "partial": sum(1 for r in ok if r["partial"]),
+        "throughput_rps": round(len(ok) / seconds, 3) if seconds else 0.0,
+        "latency": percentiles([r["seconds"] for r in ok]),
+        "field_accuracy": round(sum(r["correct_fields"] for r in ok) / fields, 4) if fields else None
+    }
+
+
+def _cpu_per_stage(recorder: StageRecorder) -> Dict[str, Any]:
+    """CPU seconds of each stage during a profiled request"""
+    summary = {}
+    for stage, samples in recorder.cpu.items():
+        if samples:
+            summary[stage] = {key: round(sum(s[key] for s in samples) / len(samples), 4) for key in samples[0]}
+    return summary
+
+
+async def run(args: argparse.Namespace) -> Dict[str, Any]:
+    sizes = [size.strip() for size in args.sizes.split(",")]
+    rng = random.Random(args.seed)
+    workdir = Path(tempfile.mkdtemp(prefix="extract_bench_"))
+    recorder = StageRecorder()
+
+    print(f"Generating {args.requests} shipments ({', '.join(sizes)}, {args.scanned_share:.0%} scanned)...")
+    shipments = [
+        make_shipment(workdir, index, rng.choice(sizes), rng.random() < args.scanned_share, args.seed)
+        for index in range(args.requests)
+    ]
+    kinds = sorted({(s.size, s.scanned) for s in shipments})
+    profile_shipments = [
+        make_shipment(workdir, args.requests + offset, size, scanned, args.seed)
+        for offset, (size, scanned) in enumerate(kinds)
+    ]
+
+    fake_app = None
+    originals = (llm_service.llm_client, llm_service.llm_breaker, document_cache.enabled, settings.RULE_EXTRACTION_ENABLED)
+    if not args.url:
+        settings.RULE_EXTRACTION_ENABLED = not args.no_rules
+        document_cache.enabled = args.document_cache
+        llm_service.llm_breaker = CircuitBreaker()
+        if not args.real_llm:
+            fake_app = create_app(FakeLLMConfig(
+                latency_ms=args.llm_latency_ms,
+                output_tokens_per_second=args.llm_output_tps,
+                error_rate=args.llm_error_rate,
+                seed=args.seed
+            ))
+            llm_service.llm_client = LLMClient(
+                requests_per_minute=0,
+                tokens_per_minute=0,
+                transport=httpx.ASGITransport(app=fake_app)
+            )
+        parse_pool.warm_up()
+
+    transport = None if args.url else httpx.ASGITransport(app=_app())
+    base_url = args.url or "http://bench"
+    timeout = httpx.Timeout(args.timeout)
+    report: Dict[str, Any] = {}
+
+    try:
+        async with httpx.AsyncClient(transport=transport, base_url=base_url, timeout=timeout) as client:
+            if args.url:
+                load_results, seconds = await _timed_load(client, shipments, args.concurrency)
+            else:
+                with recorder.installed():
+                    # Serial pass: one request per document kind, CPU attributed per stage
+                    cpu_stages = {}
+                    for shipment in profile_shipments:
+                        recorder.reset()
+                        recorder.profiling = True
+                        await _send(client, shipment)
+                        cpu_stages[_kind(shipment)] = _cpu_per_stage(recorder)
+                    recorder.reset()
+
+                    cpu_before = cpu_seconds()
+                    load_results, seconds = await _timed_load(client, shipments, args.concurrency)
+                    cpu_load = cpu_delta(cpu_before, cpu_seconds())
+
+                report["stages"] = {stage: percentiles(times) for stage, times in recorder.wall.items()}
+                report["cpu_per_stage_seconds"] = cpu_stages
+                report["cpu_seconds"] = {
+                    **cpu_load,
+                    "per_request": round(sum(cpu_load.values()) / max(len(load_results), 1), 4)
+                }
+                report["peak_rss_mb"] = peak_rss_mb()
+                if fake_app is not None:
+                    report["fake_llm"] = {key: value for key, value in fake_app.state.fake.stats.items() if key != "in_flight"}
+    finally:
+        if not args.url:
+            llm_service.llm_client, llm_service.llm_breaker, document_cache.enabled, settings.RULE_EXTRACTION_ENABLED = originals
+            parse_pool.shutdown()
+        for shipment in shipments + profile_shipments:
+            for path in shipment.files:
+                (routes.UPLOAD_DIR / path.name).unlink(missing_ok=True)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    by_kind = {}
+    for kind in sorted({r["kind"] for r in load_results}):
+        results = [r for r in load_results if r["kind"] == kind]
+        by_kind[kind] = _summarize(results, seconds)
+        del by_kind[kind]["throughput_rps"]
+
+    return {
+        "benchmark": "extract_load",
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "environment": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "parse_workers": settings.PARSE_WORKERS,
+            "llm_max_in_flight": settings.LLM_MAX_IN_FLIGHT
+        },
+        "config": {
+            "mode": "http" if args.url else "in_process",
+            "llm": "external" if args.url else ("real" if args.real_llm else "fake"),
+            "requests": args.requests,
+            "concurrency": args.concurrency,
+            "sizes": {size: SIZES[size] for size in sizes},
+            "scanned_share": args.scanned_share,
+            "rules": not args.no_rules,
+            "document_cache": args.document_cache,
+            "llm_latency_ms": args.llm_latency_ms,
+            "llm_output_tps": args.llm_output_tps,
+            "llm_error_rate": args.llm_error_rate,
+            "seed": args.seed
+        },
+        "wall_seconds": round(seconds, 3),
+        **_summarize(load_results, seconds),
+        "by_kind": by_kind,
+        **report
+    }
+
+
+async def _timed_load(client: httpx.AsyncClient, shipments: List[Shipment], concurrency: int):
+    started = time.perf_counter()
+    results = await _run_load(client, shipments, concurrency)
+    return results, time.perf_counter() - started
+
+
+def _app():
+    from main import app
+    return app
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Load test POST /api/extract with synthetic shipments")
+    parser.add_argument("--requests", type=int, default=50)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--sizes", default="small,medium", help=f"Comma-separated, from: {', '.join(SIZES)}")
+    parser.add_argument("--scanned-share", type=float, default=0.2, help="Share of shipments with a scanned-style BOL")
+    parser.add_argument("--url", help="Base URL of a running server (default: call the app in-process)")
+    parser.add_argument("--real-llm", action="store_true", help="In-process: call the configured LLM instead of the fake")
+    parser.add_argument("--llm-latency-ms", type=float, default=800.0, help="Fake LLM median time to first token")
+    parser.add_argument("--llm-output-tps", type=float, default=80.0, help="Fake LLM output tokens per second")
+    parser.add_argument("--llm-error-rate", type=float, default=0.0, help="Fake LLM injected error share")
+    parser.add_argument("--no-rules", action="store_true", help="Disable rule extraction so every field goes to the LLM")
+    parser.add_argument("--document-cache", action="store_true", help="Keep the parsed document cache enabled")
+    parser.add_argument("--timeout", type=float, default=300.0, help="Per-request client timeout (seconds)")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help="Write the JSON results here (default: stdout)")
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    args = parse_args(argv)
+    results = asyncio.run(run(args))
+    text = json.dumps(results, indent=2)
+    if args.output:
+        Path(args.output).write_text(text + "\n")
+        print(f"Results written to {args.output}")
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+"""
+Benchmark Measurements
+Latency percentiles, CPU time and peak RSS of this process and of the
+parse pool workers (read from /proc on Linux; worker figures are left
+out elsewhere).
+"""
+import math
+import os
+import resource
+import sys
+from typing import Dict, List, Optional
+
+from app.services.parse_pool import parse_pool
+
+CLOCK_TICKS = os.sysconf("SC_CLK_TCK") if hasattr(os, "sysconf") else 100
+
+
+def percentiles(values: List[float]) -> Optional[Dict[str, float]]:
+    """Nearest-rank p50/p90/p95/p99 plus mean and max, in milliseconds (None if empty)"""
+    if not values:
+        return None
+    ordered = sorted(values)
+
+    def rank(fraction: float) -> float:
+        return ordered[max(0, math.ceil(fraction * len(ordered)) - 1)]
+
+    return {
+        "p50_ms": round(rank(0.50) * 1000, 2),
+        "p90_ms": round(rank(0.90) * 1000, 2),
+        "p95_ms": round(rank(0.95) * 1000, 2),
+        "p99_ms": round(rank(0.99) * 1000, 2),
+        "mean_ms": round(sum(ordered) / len(ordered) * 1000, 2),
+        "max_ms": round(ordered[-1] * 1000, 2)
+    }
+
+
+def _worker_pids() -> List[int]:
+    executor = getattr(parse_pool, "_executor", None)
+    processes = getattr(executor, "_processes", None) or {}
+    return list(processes)
+
+
+def _proc_cpu_seconds(pid: int) -> float:
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            fields = f.read().rsplit(")", 1)[1].split()
+        # utime and stime are fields 14 and 15 of the stat line (12 and 13 after the name)
+        return (int(fields[11]) + int(fields[12])) / CLOCK_TICKS
+    except (OSError, IndexError, ValueError):
+        return 0.0
+
+
+def _proc_peak_rss_mb(pid: int) -> float:
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except (OSError, ValueError):
+        pass
+    return 0.0
+
+
+def cpu_seconds() -> Dict[str, float]:
+    """CPU time used so far by this process and by the live parse pool workers"""
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return {
+        "server": usage.ru_utime + usage.ru_stime,
+        "parse_workers": sum(_proc_cpu_seconds(pid) for pid in _worker_pids())
+    }
+
+
+def cpu_delta(before: Dict[str, float], after: Dict[str, float]) -> Dict[str, float]:
+    return {key: round(after[key] - before[key], 4) for key in before}
+
+
+def peak_rss_mb() -> Dict[str, float]:
+    """Peak resident set size of this process and of each live parse worker (summed)"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in KB on Linux and bytes on macOS
+    server = peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+    return {
+        "server": round(server, 1),
+        "parse_workers": round(sum(_proc_peak_rss_mb(pid) for pid in _worker_pids()), 1)
+    }
@@ -0,0 +1,284 @@
+"""
+Parser Micro-Benchmarks
+Times the document parsers and validators over a grid of input sizes:
+
+    extract_text_from_pdf     PDF pages with a text layer
+    extract_pdf_as_image      scanned-style PDF pages (rendering)
+    extract_text_from_xlsx    invoice line item rows
+    process_documents         BOL pages + invoice rows (250 per page), cache off
+    validate_shipment_data    snapshots per batch
+
+Each case records wall time over several runs, and in one extra run
+under tracemalloc the allocated blocks and peak traced memory. Parsing
+runs inline (no parse pool), so the figures are the parsers' own.
+
+Results can be saved as a baseline and later runs compared against it;
+the run fails (exit code 1) when a case's median time or peak memory
+regresses beyond the threshold.
+
+Usage:
+    python -m benchmarks.micro --save-baseline
+    python -m benchmarks.micro --compare --threshold 0.25
+    python -m benchmarks.micro --quick --only extract_text_from_xlsx --output micro.json
+"""
+import argparse
+import json
+import platform
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+
+from app.services import document_processor
+from app.services.parse_pool import ParsePool
+from app.services.validators import ValidationError, validate_shipment_data
+from app.utils.document_cache import document_cache
+from app.utils.pdf_utils import extract_pdf_as_image, extract_text_from_pdf
+from app.utils.xlsx_utils import extract_text_from_xlsx
+from benchmarks.documents import CONSIGNEES, filler_pages, make_line_items, write_bol_pdf, write_invoice_xlsx
+
+DEFAULT_BASELINE = Path(__file__).parent / "baselines" / "micro.json"
+
+GRID = {
+    "extract_text_from_pdf": [1, 10, 50, 200],
+    "extract_pdf_as_image": [1, 10, 50, 200],
+    "extract_text_from_xlsx": [10, 1000, 10000, 50000],
+    "process_documents": [1, 10, 50, 200],
+    "validate_shipment_data": [1, 100, 1000, 10000]
+}
+# Smallest two sizes of each case, for CI and quick checks
+QUICK_GRID = {name: sizes[:2] for name, sizes in GRID.items()}
+ROWS_PER_PAGE = 250  # Invoice rows generated per BOL page for process_documents
+
+# Differences below this are timer noise, never a regression
+MIN_REGRESSION_SECONDS = 0.002
+MIN_REGRESSION_KB = 64
+
+
+@dataclass
+class Case:
+    """One benchmarked function; setup builds its input for a size"""
+    name: str
+    unit: str
+    setup: Callable[[Path, int], Any]
+    run: Callable[[Any], Any]
+
+
+def _pdf(workdir: Path, pages: int, scanned: bool = False) -> str:
+    path = workdir / f"{'scan' if scanned else 'text'}_{pages}.pdf"
+    if not path.exists():
+        write_bol_pdf(path, filler_pages(random.Random(pages), pages), scanned)
+    return str(path)
+
+
+def _xlsx(workdir: Path, rows: int) -> str:
+    path = workdir / f"invoice_{rows}.xlsx"
+    if not path.exists():
+        write_invoice_xlsx(path, CONSIGNEES[0][0], make_line_items(random.Random(rows), rows))
+    return str(path)
+
+
+def _snapshots(workdir: Path, count: int) -> List[Dict[str, Any]]:
+    return [{
+        "id": f"shipment-{n}",
+        "title": f"Shipment {n}",
+        "status": "in_progress",
+        "transportMode": "ocean",
+        "container_number": "CSQU3054383",
+        "house_bol_number": f"ZMLU{n:08d}",
+        "master_bol_number": "COSU534343282",
+        "port_of_loading": "Shanghai, China",
+        "port_of_discharge": "Long Beach, CA",
+        "gross_weight_kgs": "16250 KGS",
+        "vessel_name": "COSCO BELGIUM",
+        "voyage_number": "095E",
+        "consignee_name": "KABOFER TRADING INC",
+        "shipper_name": "CHINA ABRASIVES EXPORT CORPORATION"
+    } for n in range(count)]
+
+
+def _process(paths: List[str]):
+    return document_processor.process_documents(paths)
+
+
+def _validate_batch(snapshots: List[Dict[str, Any]]) -> int:
+    invalid = 0
+    for snapshot in snapshots:
+        try:
+            validate_shipment_data(snapshot)
+        except ValidationError:
+            invalid += 1
+    return invalid
+
+
+CASES = {
+    "extract_text_from_pdf": Case("extract_text_from_pdf", "pages", _pdf, extract_text_from_pdf),
+    "extract_pdf_as_image": Case(
+        "extract_pdf_as_image", "pages", lambda workdir, pages: _pdf(workdir, pages, scanned=True), extract_pdf_as_image
+    ),
+    "extract_text_from_xlsx": Case("extract_text_from_xlsx", "rows", _xlsx, extract_text_from_xlsx),
+    "process_documents": Case(
+        "process_documents", "pages",
+        lambda workdir, pages: [_pdf(workdir, pages), _xlsx(workdir, min(pages * ROWS_PER_PAGE, 50000))],
+        _process
+    ),
+    "validate_shipment_data": Case("validate_shipment_data", "snapshots", _snapshots, _validate_batch)
+}
+
+
+def measure(case: Case, size: int, workdir: Path, repeat: int) -> Dict[str, Any]:
+    """Wall times over `repeat` runs, then allocations and peak memory in one traced run"""
+    data = case.setup(workdir, size)
+    case.run(data)  # Warm-up: imports, file system cache
+
+    times = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        case.run(data)
+        times.append(time.perf_counter() - started)
+
+    tracemalloc.start()
+    try:
+        before = tracemalloc.take_snapshot()
+        tracemalloc.reset_peak()
+        case.run(data)
+        _, peak = tracemalloc.get_traced_memory()
+        after = tracemalloc.take_snapshot()
+    finally:
+        tracemalloc.stop()
+    allocated = [stat for stat in after.compare_to(before, "filename") if stat.count_diff > 0]
+
+    median = statistics.median(times)
+    return {
+        "case": case.name,
+        "size": size,
+        "unit": case.unit,
+        "runs": repeat,
+        "median_seconds": round(median, 6),
+        "min_seconds": round(min(times), 6),
+        "max_seconds": round(max(times), 6),
+        "per_unit_us": round(median / size * 1e6, 3),
+        "peak_memory_kb": round(peak / 1024, 1),
+        "retained_blocks": sum(stat.count_diff for stat in allocated),
+        "retained_kb": round(sum(stat.size_diff for stat in allocated) / 1024, 1)
+    }
+
+
+def run(grid: Dict[str, List[int]], repeat: int = 5) -> Dict[str, Any]:
+    """Run every case of the grid; results are keyed "case[size]" """
+    workdir = Path(tempfile.mkdtemp(prefix="micro_bench_"))
+    pool = document_processor.parse_pool
+    cache_enabled = document_cache.enabled
+    document_processor.parse_pool = ParsePool(max_workers=0)
+    document_cache.enabled = False
+
+    results = {}
+    try:
+        for name, sizes in grid.items():
+            for size in sizes:
+                result = measure(CASES[name], size, workdir, repeat)
+                results[f"{name}[{size}]"] = result
+                print(f"{name:<24} {size:>6} {result['unit']:<9} median {result['median_seconds'] * 1000:9.2f} ms  "
+                      f"peak {result['peak_memory_kb']:9.1f} KB", file=sys.stderr)
+    finally:
+        document_processor.parse_pool = pool
+        document_cache.enabled = cache_enabled
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    return {
+        "benchmark": "micro",
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "environment": {"python": platform.python_version(), "platform": platform.platform()},
+        "config": {"repeat": repeat, "grid": grid},
+        "results": results
+    }
+
+
+def compare(current: Dict[str, Any], baseline: Dict[str, Any], threshold: float) -> List[Dict[str, Any]]:
+    """
+    Cases whose median time or peak memory grew by more than `threshold`
+    (a fraction, 0.25 = 25%) over the baseline. Cases missing from either
+    side are skipped.
+    """
+    regressions = []
+    for key, result in current["results"].items():
+        base = baseline["results"].get(key)
+        if not base:
+            continue
+        checks = (
+            ("median_seconds", MIN_REGRESSION_SECONDS),
+            ("peak_memory_kb", MIN_REGRESSION_KB)
+        )
+        for metric, noise in checks:
+            old, new = base[metric], result[metric]
+            if new - old > noise and new > old * (1 + threshold):
+                regressions.append({
+                    "case": key,
+                    "metric": metric,
+                    "baseline": old,
+                    "current": new,
+                    "change": round(new / old - 1, 4) if old else None
+                })
+    return regressions
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Micro-benchmarks for the document parsers and validators")
+    parser.add_argument("--quick", action="store_true", help="Only the two smallest sizes of each case")
+    parser.add_argument("--only", help=f"Comma-separated cases, from: {', '.join(GRID)}")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--output", help="Write the JSON results here (default: stdout)")
+    parser.add_argument("--save-baseline", nargs="?", const=str(DEFAULT_BASELINE), help="Store the results as the baseline")
+    parser.add_argument("--compare", nargs="?", const=str(DEFAULT_BASELINE), help="Fail on regressions against a baseline")
+    parser.add_argument("--threshold", type=float, default=0.25, help="Allowed slowdown / memory growth (0.25 = 25%%)")
+    args = parser.parse_args(argv)
+    only = [name.strip() for name in args.only.split(",") if name.strip()] if args.only else []
+    unknown = [name for name in only if name not in GRID]
+    if unknown:
+        parser.error(f"unknown case(s) {', '.join(unknown)}; choose from: {', '.join(GRID)}")
+
+    # Check the baseline before spending minutes on the run
+    baseline = None
+    if args.compare:
+        baseline_path = Path(args.compare)
+        if not baseline_path.is_file():
+            print(f"No baseline at {baseline_path}; record one first with --save-baseline", file=sys.stderr)
+            return 2
+        baseline = json.loads(baseline_path.read_text())
+
+    grid = QUICK_GRID if args.quick else GRID
+    if only:
+        grid = {name: grid[name] for name in only}
+    results = run(grid, max(args.repeat, 1))
+
+    exit_code = 0
+    if baseline is not None:
+        regressions = compare(results, baseline, args.threshold)
+        results["comparison"] = {"baseline": args.compare, "threshold": args.threshold, "regressions": regressions}
+        for regression in regressions:
+            print(f"REGRESSION {regression['case']} {regression['metric']}: "
+                  f"{regression['baseline']} -> {regression['current']} ({regression['change']:+.0%})", file=sys.stderr)
+        exit_code = 1 if regressions else 0
+
+    text = json.dumps(results, indent=2)
+    if args.output:
+        Path(args.output).write_text(text + "\n")
+    else:
+        print(text)
+    if args.save_baseline:
+        path = Path(args.save_baseline)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(text + "\n")
+        print(f"Baseline saved to {path}", file=sys.stderr)
+    return exit_code
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,174 @@
+"""
+PDF Text Backend Comparison
+Times every PDF text backend on a corpus and checks that their output
+agrees. The corpus is synthetic text PDFs of 1-200 pages, the sample
+PDFs under storage/ and any directories passed with --corpus.
+
+For each file and backend it reports the median extraction time, the
+speedup over PyPDF2, and how closely the text matches PyPDF2's (per-page
+word sequence similarity). On a synthetic shipment of each size it also
+checks that the rule extractor still reads every expected field.
+
+Usage:
+    python -m benchmarks.pdf_backends
+    python -m benchmarks.pdf_backends --corpus /data/bols --repeat 3 --output backends.json
+"""
+import argparse
+import difflib
+import json
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from app.core.config import settings
+from app.services import document_processor
+from app.services.parse_pool import ParsePool
+from app.services.rule_extractor import extract_with_rules
+from app.utils.document_cache import document_cache
+from app.utils.pdf_utils import PDF_TEXT_BACKENDS, extract_pdf_page_range
+from benchmarks.documents import SIZES, filler_pages, make_shipment, write_bol_pdf
+
+REFERENCE_BACKEND = "pypdf2"
+PAGE_COUNTS = [1, 10, 50, 200]
+SAMPLE_DIR = Path(__file__).resolve().parent.parent / "storage"
+
+
+def similarity(pages: List[str], reference: List[str]) -> float:
+    """Mean word sequence similarity of the pages of two extractions (1.0 when both are empty)"""
+    if len(pages) != len(reference):
+        return 0.0
+    ratios = []
+    for text, reference_text in zip(pages, reference):
+        words, reference_words = text.split(), reference_text.split()
+        if words or reference_words:
+            ratios.append(difflib.SequenceMatcher(None, words, reference_words, autojunk=False).ratio())
+    return round(statistics.mean(ratios), 4) if ratios else 1.0
+
+
+def time_backend(path: Path, backend: str, repeat: int) -> Dict[str, Any]:
+    """Median wall time of extracting every page of a PDF with one backend"""
+    pages = extract_pdf_page_range(str(path), backend=backend)  # Warm-up
+    times = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        extract_pdf_page_range(str(path), backend=backend)
+        times.append(time.perf_counter() - started)
+    return {"median_seconds": round(statistics.median(times), 6), "pages": pages}
+
+
+def compare_file(path: Path, repeat: int) -> Dict[str, Any]:
+    runs = {name: time_backend(path, name, repeat) for name in PDF_TEXT_BACKENDS}
+    reference = runs[REFERENCE_BACKEND]
+    result = {"file": path.name, "pages": len(reference["pages"]), "backends": {}}
+    for name, run in runs.items():
+        result["backends"][name] = {
+            "median_seconds": run["median_seconds"],
+            "per_page_ms": round(run["median_seconds"] / max(len(run["pages"]), 1) * 1000, 3),
+            "speedup": round(reference["median_seconds"] / run["median_seconds"], 2) if run["median_seconds"] else None,
+            "chars": sum(len(page) for page in run["pages"]),
+            "similarity": similarity(run["pages"], reference["pages"])
+        }
+    return result
+
+
+def field_accuracy(directory: Path) -> Dict[str, Any]:
+    """Share of expected fields the rule extractor reads per backend, on one shipment of each size"""
+    shipments = [make_shipment(directory, index, size) for index, size in enumerate(SIZES)]
+    backend = settings.PDF_TEXT_BACKEND
+    accuracy = {}
+    try:
+        for name in PDF_TEXT_BACKENDS:
+            settings.PDF_TEXT_BACKEND = name
+            correct = total = 0
+            for shipment in shipments:
+                matches = extract_with_rules(document_processor.process_documents([str(p) for p in shipment.files])).matches
+                for field, value in shipment.expected.items():
+                    total += 1
+                    correct += field in matches and matches[field].value == value
+            accuracy[name] = round(correct / total, 4)
+    finally:
+        settings.PDF_TEXT_BACKEND = backend
+    return accuracy
+
+
+def run(page_counts: List[int], corpus: List[Path], repeat: int = 5) -> Dict[str, Any]:
+    workdir = Path(tempfile.mkdtemp(prefix="pdf_backends_"))
+    pool = document_processor.parse_pool
+    cache_enabled = document_cache.enabled
+    document_processor.parse_pool = ParsePool(max_workers=0)
+    document_cache.enabled = False
+
+    files = []
+    try:
+        for pages in page_counts:
+            path = workdir / f"text_{pages}.pdf"
+            write_bol_pdf(path, filler_pages(random.Random(pages), pages))
+            files.append(path)
+        for directory in corpus:
+            files.extend(sorted(directory.rglob("*.pdf")))
+
+        results = []
+        for path in files:
+            result = compare_file(path, repeat)
+            results.append(result)
+            timings = "  ".join(
+                f"{name} {figures['per_page_ms']:8.3f} ms/page (x{figures['speedup']}, sim {figures['similarity']})"
+                for name, figures in result["backends"].items()
+            )
+            print(f"{result['file']:<32} {result['pages']:>4}p  {timings}", file=sys.stderr)
+
+        accuracy = field_accuracy(workdir)
+    finally:
+        document_processor.parse_pool = pool
+        document_cache.enabled = cache_enabled
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    text_files = [result for result in results if result["backends"][REFERENCE_BACKEND]["chars"]]
+    summary = {}
+    for name in PDF_TEXT_BACKENDS:
+        speedups = [result["backends"][name]["speedup"] for result in text_files if result["backends"][name]["speedup"]]
+        summary[name] = {
+            "median_speedup": round(statistics.median(speedups), 2) if speedups else None,
+            "min_similarity": min((result["backends"][name]["similarity"] for result in results), default=None),
+            "field_accuracy": accuracy[name]
+        }
+
+    return {
+        "benchmark": "pdf_backends",
+        "reference": REFERENCE_BACKEND,
+        "config": {"repeat": repeat, "page_counts": page_counts, "corpus": [str(d) for d in corpus]},
+        "summary": summary,
+        "files": results
+    }
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Compare the PDF text backends on a corpus")
+    parser.add_argument("--pages", default=",".join(str(n) for n in PAGE_COUNTS), help="Synthetic text PDF page counts")
+    parser.add_argument("--corpus", action="append", default=[], help="Directory of PDFs to include (repeatable)")
+    parser.add_argument("--no-samples", action="store_true", help=f"Leave out the PDFs under {SAMPLE_DIR}")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--output", help="Write the JSON results here (default: stdout)")
+    args = parser.parse_args(argv)
+
+    corpus = [Path(directory) for directory in args.corpus]
+    if not args.no_samples and SAMPLE_DIR.is_dir():
+        corpus.append(SAMPLE_DIR)
+    page_counts = [int(n) for n in args.pages.split(",") if n]
+    results = run(page_counts, corpus, max(args.repeat, 1))
+
+    text = json.dumps(results, indent=2)
+    if args.output:
+        Path(args.output).write_text(text + "\n")
+    else:
+        print(text)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -3,6 +3,8 @@ from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
 from app.api.routes import router
 from app.api.auth import router as auth_router
+from app.services.llm_client import llm_client
+from app.services.parse_pool import parse_pool
 import uvicorn
 from pathlib import Path
 from dotenv import load_dotenv
@@ -30,6 +32,22 @@ app.mount("/uploads", StaticFiles(directory="uploads"), name="uploads")
 app.include_router(router, prefix="/api")
 app.include_router(auth_router, prefix="/api/auth", tags=["Authentication"])
 
+@app.on_event("startup")
+async def start_parse_pool():
+    # Start the parse workers now so the first upload does not pay for it
+    parse_pool.warm_up()
+
+
+@app.on_event("shutdown")
+async def stop_parse_pool():
+    parse_pool.shutdown()
+
+
+@app.on_event("shutdown")
+async def close_llm_client():
+    await llm_client.aclose()
+
+
 @app.get("/")
 async def root():
     return {
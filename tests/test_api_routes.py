@@ -223,3 +223,199 @@ class TestExcelPreviewEndpoint:
             test_file.unlink()
         except ImportError:
             pytest.skip("openpyxl not installed")
+
+
+class TestExtractUploads:
+    """Tests for streamed upload handling on /api/extract"""
+
+    def test_upload_is_published_once_and_private_copy_removed(self):
+        """Test the upload lands in uploads/ and the private copy is cleaned up"""
+        from app.api.routes import INCOMING_DIR
+
+        content = b"%PDF-1.4 streamed upload test"
+        response = client.post(
+            "/api/extract",
+            files=[("files", ("stream_test.pdf", content, "application/pdf"))]
+        )
+        assert response.status_code == 200
+        assert response.json()["files"][0]["size"] == len(content)
+
+        saved = UPLOAD_DIR / "stream_test.pdf"
+        assert saved.read_bytes() == content
+        assert list(INCOMING_DIR.iterdir()) == []
+
+        saved.unlink()
+
+    def test_rejects_content_not_matching_extension(self):
+        """Test the magic-byte check rejects a non-PDF named .pdf"""
+        response = client.post(
+            "/api/extract",
+            files=[("files", ("fake.pdf", b"not really a pdf", "application/pdf"))]
+        )
+        assert response.status_code == 400
+        assert "Invalid file content" in response.json()["detail"]
+        assert not (UPLOAD_DIR / "fake.pdf").exists()
+
+    def test_rejects_oversized_upload(self, monkeypatch):
+        """Test uploads over MAX_UPLOAD_BYTES are rejected with 413"""
+        from app.api import routes
+
+        monkeypatch.setattr(routes.settings, "MAX_UPLOAD_BYTES", 1024)
+        monkeypatch.setattr(routes.settings, "UPLOAD_CHUNK_SIZE", 256)
+
+        response = client.post(
+            "/api/extract",
+            files=[("files", ("big.pdf", b"%PDF-" + b"0" * 4096, "application/pdf"))]
+        )
+        assert response.status_code == 413
+        assert not (UPLOAD_DIR / "big.pdf").exists()
+
+
+class TestReextractFieldsEndpoint:
+    """Tests for POST /api/extract/fields"""
+
+    def test_fields_are_merged_into_data(self, monkeypatch):
+        """Test that the endpoint parses the uploaded files by hash and returns the merged result"""
+        import hashlib
+        from app.api import routes
+        from app.utils.document_segments import DocumentBundle, ParsedDocument, TextSegment
+
+        content = b"%PDF-1.4 reextract test"
+        file_hash = hashlib.sha256(content).hexdigest()
+        upload = UPLOAD_DIR / "reextract_test.pdf"
+        upload.write_bytes(content)
+        seen = {}
+
+        def fake_process_documents(paths, file_hashes=None, verify_hashes=False):
+            seen.update(paths=paths, hashes=file_hashes, verify=verify_hashes)
+            return DocumentBundle([ParsedDocument("reextract_test.pdf", "PDF", [TextSegment(text="CONSIGNEE:", page=0)])])
+
+        async def fake_reextract(documents, fields, current, report=None):
+            report["fields"] = fields
+            return {**current, "consigneeAddress": "NEW ADDRESS"}
+
+        monkeypatch.setattr(routes, "process_documents", fake_process_documents)
+        monkeypatch.setattr(routes, "reextract_fields", fake_reextract)
+
+        response = client.post("/api/extract/fields", json={
+            "files": [{"originalName": "reextract_test.pdf", "hash": file_hash}],
+            "fields": ["consigneeAddress"],
+            "data": {"billOfLadingNumber": "ZMLU34110002", "consigneeAddress": "OLD"}
+        })
+        upload.unlink()
+
+        assert response.status_code == 200
+        assert response.json()["data"] == {"billOfLadingNumber": "ZMLU34110002", "consigneeAddress": "NEW ADDRESS"}
+        assert seen == {"paths": [str(UPLOAD_DIR / "reextract_test.pdf")], "hashes": [file_hash], "verify": True}
+
+    def test_replaced_upload_is_a_conflict(self, monkeypatch):
+        """Test that a later upload with the same name is not re-extracted in place of the original"""
+        import hashlib
+        from app.services import document_processor
+
+        monkeypatch.setattr(document_processor.document_cache, "enabled", False)
+        upload = UPLOAD_DIR / "reextract_replaced.pdf"
+        upload.write_bytes(b"%PDF-1.4 a different shipment")
+
+        response = client.post("/api/extract/fields", json={
+            "files": [{"originalName": "reextract_replaced.pdf", "hash": hashlib.sha256(b"%PDF-1.4 original").hexdigest()}],
+            "fields": ["consigneeAddress"]
+        })
+        upload.unlink()
+
+        assert response.status_code == 409
+        assert "has changed" in response.json()["detail"]
+
+    def test_upper_case_extension_is_parsed(self, monkeypatch):
+        """Test that an upload named BOL.PDF is parsed for re-extraction"""
+        import hashlib
+        from reportlab.pdfgen import canvas
+        from app.api import routes
+        from app.services import document_processor
+
+        monkeypatch.setattr(document_processor.document_cache, "enabled", False)
+        upload = UPLOAD_DIR / "REEXTRACT_UPPER.PDF"
+        c = canvas.Canvas(str(upload))
+        c.drawString(100, 750, "CONSIGNEE: ACME TRADING")
+        c.save()
+        seen = {}
+
+        async def fake_reextract(documents, fields, current, report=None):
+            seen["filenames"] = [document.filename for document in documents.documents]
+            return current
+
+        monkeypatch.setattr(routes, "reextract_fields", fake_reextract)
+
+        response = client.post("/api/extract/fields", json={
+            "files": [{"originalName": upload.name, "hash": hashlib.sha256(upload.read_bytes()).hexdigest()}],
+            "fields": ["consigneeAddress"]
+        })
+        upload.unlink()
+
+        assert response.status_code == 200
+        assert seen["filenames"] == ["REEXTRACT_UPPER.PDF"]
+
+    def test_no_parsable_file_is_a_bad_request(self, monkeypatch):
+        """Test that the LLM is not called when none of the files is a document"""
+        import hashlib
+        from app.api import routes
+
+        async def fake_reextract(documents, fields, current, report=None):
+            raise AssertionError("re-extraction must not run without documents")
+
+        monkeypatch.setattr(routes, "reextract_fields", fake_reextract)
+        upload = UPLOAD_DIR / "reextract_notes.txt"
+        upload.write_bytes(b"just some notes")
+
+        response = client.post("/api/extract/fields", json={
+            "files": [{"originalName": upload.name, "hash": hashlib.sha256(b"just some notes").hexdigest()}],
+            "fields": ["consigneeAddress"]
+        })
+        upload.unlink()
+
+        assert response.status_code == 400
+
+    def test_hash_is_required(self):
+        """Test that files must be identified by the hash from the earlier response"""
+        response = client.post("/api/extract/fields", json={
+            "files": [{"originalName": "any.pdf"}],
+            "fields": ["consigneeAddress"]
+        })
+        assert response.status_code == 400
+
+    def test_open_circuit_is_service_unavailable(self, monkeypatch):
+        """Test that re-extraction while the LLM circuit is open is a 503, not a 500"""
+        from app.api import routes
+        from app.services import llm_service
+        from app.services.circuit_breaker import CircuitBreaker
+        from app.utils.document_segments import DocumentBundle, ParsedDocument, TextSegment
+
+        breaker = CircuitBreaker(window=10, min_calls=1, failure_rate=0.5, slow_call_seconds=60, open_seconds=300)
+        breaker.record_failure()
+        monkeypatch.setattr(llm_service, "llm_breaker", breaker)
+        documents = DocumentBundle([ParsedDocument("bol.pdf", "PDF", [TextSegment(text="CONSIGNEE:\nACME", page=0)])])
+        monkeypatch.setattr(routes, "process_documents", lambda *args, **kwargs: documents)
+
+        response = client.post("/api/extract/fields", json={
+            "files": [{"originalName": "bol.pdf", "hash": "a" * 64}],
+            "fields": ["consigneeAddress"]
+        })
+
+        assert response.status_code == 503
+        assert "circuit is open" in response.json()["detail"]
+
+    def test_rejects_unknown_field(self):
+        """Test that unknown field names are a 400"""
+        response = client.post("/api/extract/fields", json={
+            "files": [{"originalName": "any.pdf"}],
+            "fields": ["vesselName"]
+        })
+        assert response.status_code == 400
+
+    def test_missing_upload_is_not_found(self):
+        """Test that files must have been uploaded before"""
+        response = client.post("/api/extract/fields", json={
+            "files": [{"originalName": "never_uploaded.pdf", "hash": "0" * 64}],
+            "fields": ["consigneeAddress"]
+        })
+        assert response.status_code == 404
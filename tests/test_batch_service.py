@@ -0,0 +1,249 @@
+"""
+Unit tests for batch extraction (POST /api/extract/batch)
+"""
+import io
+import json
+import os
+import zipfile
+import pytest
+from fastapi.testclient import TestClient
+
+from main import app
+from app.api import routes
+from app.services.batch_service import BatchManager, BatchNotFoundError
+
+
+def read_ndjson(response):
+    """Parse an NDJSON response body into a list of objects"""
+    return [json.loads(line) for line in response.text.splitlines() if line.strip()]
+
+
+def make_archive(files):
+    """Build a zip archive from {member path: bytes}"""
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w") as archive:
+        for name, content in files.items():
+            archive.writestr(name, content)
+    return buffer.getvalue()
+
+
+@pytest.fixture
+def manager(tmp_path, monkeypatch):
+    """Batch manager writing to a temp dir, with parsing and the LLM faked"""
+    manager = BatchManager(directory=str(tmp_path), concurrency=4)
+    monkeypatch.setattr(routes, "batch_manager", manager)
+    # "Documents" are just the staged file paths
+    monkeypatch.setattr(routes, "process_documents", lambda paths, file_hashes=None: paths)
+
+    async def fake_extract(documents, report=None):
+        shipment = os.path.basename(os.path.dirname(documents[0]))
+        return {"billOfLadingNumber": shipment, "files": len(documents)}
+
+    monkeypatch.setattr(routes, "extract_field_from_document", fake_extract)
+    return manager
+
+
+class TestBatchEndpoint:
+    """Tests for submitting and streaming batches"""
+
+    def test_multipart_batch_streams_one_result_per_shipment(self, manager):
+        """Test that field names group files into shipments and each result is streamed"""
+        with TestClient(app) as client:
+            response = client.post("/api/extract/batch?use_cache=false", files=[
+                ("SHP1", ("bol.pdf", b"%PDF-1.4 one", "application/pdf")),
+                ("SHP1", ("invoice.xlsx", b"PK\x03\x04 one", "application/octet-stream")),
+                ("SHP2", ("bol.pdf", b"%PDF-1.4 two", "application/pdf"))
+            ])
+
+        assert response.status_code == 200
+        lines = read_ndjson(response)
+        assert lines[0]["type"] == "batch"
+        assert lines[0]["shipments"] == 2
+        assert response.headers["X-Batch-Id"] == lines[0]["batch_id"]
+
+        results = {line["shipment_id"]: line for line in lines if line["type"] == "result"}
+        assert results["SHP1"]["data"] == {"billOfLadingNumber": "SHP1", "files": 2}
+        assert results["SHP2"]["data"] == {"billOfLadingNumber": "SHP2", "files": 1}
+        assert lines[-1] == {
+            "type": "summary",
+            "batch_id": lines[0]["batch_id"],
+            "status": "completed",
+            "shipments": 2,
+            "succeeded": 2,
+            "partial": 0,
+            "failed": 0
+        }
+        # Files of finished shipments are removed
+        assert not any((manager.directory / lines[0]["batch_id"] / "files").iterdir())
+
+    def test_zip_archive_folders_are_shipments(self, manager):
+        """Test that each top-level folder of an archive becomes a shipment"""
+        archive = make_archive({
+            "A100/bol.pdf": b"%PDF-1.4 a",
+            "A100/invoice.xlsx": b"PK\x03\x04 a",
+            "B200/bol.pdf": b"%PDF-1.4 b",
+            "__MACOSX/A100/._bol.pdf": b"junk",
+            "B200/.DS_Store": b"junk"
+        })
+        with TestClient(app) as client:
+            response = client.post("/api/extract/batch?use_cache=false", files=[
+                ("archive", ("shipments.zip", archive, "application/zip"))
+            ])
+
+        assert response.status_code == 200
+        results = {line["shipment_id"]: line for line in read_ndjson(response) if line["type"] == "result"}
+        assert results["A100"]["data"]["files"] == 2
+        assert results["B200"]["data"]["files"] == 1
+
+    def test_upper_case_extensions_are_parsed(self, manager, monkeypatch, tmp_path):
+        """Test that BOL.PDF and INVOICE.XLSX are parsed rather than silently skipped"""
+        from openpyxl import Workbook
+        from reportlab.pdfgen import canvas
+        from app.services import document_processor
+
+        monkeypatch.setattr(document_processor.document_cache, "enabled", False)
+        monkeypatch.setattr(routes, "process_documents", document_processor.process_documents)
+
+        async def fake_extract(documents, report=None):
+            return {"files": [(document.filename, document.doc_type) for document in documents.documents]}
+
+        monkeypatch.setattr(routes, "extract_field_from_document", fake_extract)
+
+        pdf_path = tmp_path / "bol.pdf"
+        c = canvas.Canvas(str(pdf_path))
+        c.drawString(100, 750, "BILL OF LADING - B/L No: UPPER123")
+        c.save()
+        workbook = Workbook()
+        workbook.active.append(["INVOICE", "UPPER123"])
+        xlsx_path = tmp_path / "invoice.xlsx"
+        workbook.save(xlsx_path)
+
+        with TestClient(app) as client:
+            response = client.post("/api/extract/batch?use_cache=false", files=[
+                ("SHP1", ("BOL.PDF", pdf_path.read_bytes(), "application/pdf")),
+                ("SHP1", ("INVOICE.XLSX", xlsx_path.read_bytes(), "application/octet-stream"))
+            ])
+
+        assert response.status_code == 200
+        results = [line for line in read_ndjson(response) if line["type"] == "result"]
+        assert results[0]["data"]["files"] == [["BOL.PDF", "PDF"], ["INVOICE.XLSX", "XLSX"]]
+
+    def test_invalid_archive_member_is_rejected(self, manager):
+        """Test that archive members are validated like uploads and nothing is left behind"""
+        archive = make_archive({"A100/bol.pdf": b"not a pdf"})
+        with TestClient(app) as client:
+            response = client.post("/api/extract/batch", files=[
+                ("archive", ("shipments.zip", archive, "application/zip"))
+            ])
+
+        assert response.status_code == 400
+        assert list(manager.directory.iterdir()) == []
+
+    def test_invalid_shipment_id_is_rejected(self, manager):
+        """Test that shipment ids must be safe directory names"""
+        with TestClient(app) as client:
+            response = client.post("/api/extract/batch", files=[
+                ("../etc", ("bol.pdf", b"%PDF-1.4 x", "application/pdf"))
+            ])
+        assert response.status_code == 400
+
+    def test_empty_batch_is_rejected(self, manager):
+        """Test that a batch needs at least one file"""
+        with TestClient(app) as client:
+            response = client.post("/api/extract/batch", data={"note": "no files"})
+        assert response.status_code == 400
+
+    def test_failed_shipment_can_be_resumed(self, manager, monkeypatch):
+        """Test that a failure is reported and resume only re-runs unfinished shipments"""
+        calls = []
+
+        async def flaky_extract(documents, report=None):
+            shipment = os.path.basename(os.path.dirname(documents[0]))
+            calls.append(shipment)
+            if shipment == "SHP2" and calls.count("SHP2") == 1:
+                raise Exception("LLM unavailable")
+            return {"billOfLadingNumber": shipment}
+
+        monkeypatch.setattr(routes, "extract_field_from_document", flaky_extract)
+
+        with TestClient(app) as client:
+            response = client.post("/api/extract/batch?use_cache=false", files=[
+                ("SHP1", ("bol.pdf", b"%PDF-1.4 one", "application/pdf")),
+                ("SHP2", ("bol.pdf", b"%PDF-1.4 two", "application/pdf"))
+            ])
+            lines = read_ndjson(response)
+            batch_id = lines[0]["batch_id"]
+            summary = lines[-1]
+            assert summary["status"] == "completed_with_errors"
+            assert summary["failed"] == 1
+            failed = [line for line in lines if line["type"] == "result" and not line["success"]]
+            assert "LLM unavailable" in failed[0]["error"]
+
+            resumed = read_ndjson(client.post(f"/api/extract/batch/{batch_id}/resume?after=2&use_cache=false"))
+            assert [line["shipment_id"] for line in resumed if line["type"] == "result"] == ["SHP2"]
+            assert resumed[-1]["status"] == "completed"
+            assert resumed[-1]["succeeded"] == 2
+            assert resumed[-1]["failed"] == 0
+
+            replay = read_ndjson(client.get(f"/api/extract/batch/{batch_id}?after=1"))
+            assert [line["index"] for line in replay if line["type"] == "result"] == [1, 2]
+
+        assert calls.count("SHP1") == 1
+
+    def test_partial_shipment_keeps_its_files_and_is_resumed(self, manager, monkeypatch):
+        """Test that a rule-only result (LLM circuit open) is not counted as done"""
+        calls = []
+
+        async def degraded_extract(documents, report=None):
+            calls.append(documents[0])
+            if len(calls) == 1:
+                report["degraded"] = {"reason": "llm_circuit_open", "missing_fields": ["containerNumber"]}
+            return {"billOfLadingNumber": "SHP1"}
+
+        monkeypatch.setattr(routes, "extract_field_from_document", degraded_extract)
+
+        with TestClient(app) as client:
+            lines = read_ndjson(client.post("/api/extract/batch?use_cache=false", files=[
+                ("SHP1", ("bol.pdf", b"%PDF-1.4 one", "application/pdf"))
+            ]))
+            batch_id = lines[0]["batch_id"]
+            assert lines[1]["success"] is True
+            assert lines[1]["partial"] is True
+            assert lines[-1]["status"] == "completed_with_errors"
+            assert lines[-1]["succeeded"] == 0
+            assert lines[-1]["partial"] == 1
+            assert (manager.directory / batch_id / "files" / "SHP1" / "bol.pdf").exists()
+
+            resumed = read_ndjson(client.post(f"/api/extract/batch/{batch_id}/resume?after=1&use_cache=false"))
+            assert [line["partial"] for line in resumed if line["type"] == "result"] == [False]
+            assert resumed[-1]["status"] == "completed"
+            assert resumed[-1]["succeeded"] == 1
+            assert resumed[-1]["partial"] == 0
+
+        assert len(calls) == 2
+
+    def test_unknown_batch_returns_404(self, manager):
+        """Test looking up a batch that does not exist"""
+        with TestClient(app) as client:
+            assert client.get(f"/api/extract/batch/{'0' * 32}").status_code == 404
+            assert client.get("/api/extract/batch/not-a-batch").status_code == 404
+
+
+class TestBatchManager:
+    """Tests for reloading batches from disk"""
+
+    def test_reloaded_batch_with_pending_shipments_is_interrupted(self, tmp_path):
+        """Test that a batch left unfinished by a restart can be found and resumed"""
+        manager = BatchManager(directory=str(tmp_path))
+        batch = manager.new_batch_dir()
+        batch.shipments = {"SHP1": [], "SHP2": []}
+        batch.write_manifest()
+        batch.record({"shipment_id": "SHP1", "success": True, "data": {}})
+
+        reloaded = BatchManager(directory=str(tmp_path)).get(batch.batch_id)
+        assert reloaded.status == "interrupted"
+        assert reloaded.pending() == ["SHP2"]
+        assert reloaded.summary()["succeeded"] == 1
+
+        with pytest.raises(BatchNotFoundError):
+            manager.get("f" * 32)
@@ -0,0 +1,144 @@
+"""
+Unit tests for the benchmark suite (synthetic documents, measurements, load test, micro-benchmarks,
+PDF backend comparison)
+"""
+import pytest
+
+from app.services.document_processor import process_documents
+from app.services.rule_extractor import extract_with_rules
+from app.utils.document_cache import document_cache
+from benchmarks import load_test, micro, pdf_backends
+from benchmarks.documents import make_shipment
+from benchmarks.measure import percentiles
+
+
+class TestSyntheticDocuments:
+    """Tests for the generated BOL PDFs and invoice workbooks"""
+
+    def test_text_shipment_matches_expected_values(self, tmp_path, monkeypatch):
+        """Test that the rule stage reads back every generated value"""
+        monkeypatch.setattr(document_cache, "enabled", False)
+        shipment = make_shipment(tmp_path, 1, "medium")
+
+        documents = process_documents([str(path) for path in shipment.files])
+        matches = extract_with_rules(documents).matches
+
+        assert {name: match.value for name, match in matches.items()} == shipment.expected
+
+    def test_scanned_shipment_has_no_text_layer(self, tmp_path, monkeypatch):
+        """Test that scanned-style BOLs go down the vision path"""
+        monkeypatch.setattr(document_cache, "enabled", False)
+        shipment = make_shipment(tmp_path, 2, "small", scanned=True)
+
+        documents = process_documents([str(path) for path in shipment.files])
+
+        assert documents.has_images
+
+
+class TestMeasurements:
+    """Tests for latency percentiles"""
+
+    def test_nearest_rank_percentiles(self):
+        """Test percentiles of 1..100 ms"""
+        result = percentiles([n / 1000 for n in range(1, 101)])
+        assert result["p50_ms"] == 50.0
+        assert result["p99_ms"] == 99.0
+        assert result["max_ms"] == 100.0
+        assert percentiles([]) is None
+
+
+class TestLoadTest:
+    """Tests for the in-process load test against the fake LLM"""
+
+    @pytest.mark.asyncio
+    async def test_small_run_reports_json_figures(self):
+        """Test a tiny run end to end"""
+        args = load_test.parse_args([
+            "--requests", "3", "--concurrency", "2", "--sizes", "small",
+            "--scanned-share", "0", "--llm-latency-ms", "0", "--llm-output-tps", "0", "--no-rules"
+        ])
+        results = await load_test.run(args)
+
+        assert results["succeeded"] == 3
+        assert results["field_accuracy"] == 1.0
+        assert results["latency"]["p50_ms"] > 0
+        assert set(results["stages"]) == {"upload", "parse", "llm"}
+        assert "small_text" in results["cpu_per_stage_seconds"]
+        assert results["fake_llm"]["requests"] >= 3
+        assert results["peak_rss_mb"]["server"] > 0
+
+
+class TestMicroBenchmarks:
+    """Tests for the parser micro-benchmarks and the baseline comparison"""
+
+    def test_tiny_grid_records_time_and_memory(self):
+        """Test that each case reports timings and traced memory per size"""
+        results = micro.run({"extract_text_from_xlsx": [10], "validate_shipment_data": [1, 10]}, repeat=1)
+
+        assert set(results["results"]) == {
+            "extract_text_from_xlsx[10]", "validate_shipment_data[1]", "validate_shipment_data[10]"
+        }
+        xlsx = results["results"]["extract_text_from_xlsx[10]"]
+        assert xlsx["median_seconds"] > 0
+        assert xlsx["peak_memory_kb"] > 0
+        assert xlsx["unit"] == "rows"
+
+    def test_compare_flags_only_significant_regressions(self):
+        """Test the threshold and the absolute noise floor"""
+        def results(**cases):
+            return {"results": {key: {"median_seconds": seconds, "peak_memory_kb": kb}
+                                for key, (seconds, kb) in cases.items()}}
+
+        baseline = results(slow=(0.100, 1000), noisy=(0.0001, 10), leaky=(0.100, 1000))
+        current = results(slow=(0.200, 1000), noisy=(0.0009, 40), leaky=(0.105, 2000), new=(1.0, 1))
+
+        regressions = micro.compare(current, baseline, threshold=0.25)
+
+        assert {(r["case"], r["metric"]) for r in regressions} == {
+            ("slow", "median_seconds"), ("leaky", "peak_memory_kb")
+        }
+
+    def test_compare_without_baseline_fails_before_running(self, tmp_path, monkeypatch, capsys):
+        """Test that a missing baseline is reported up front instead of after the whole run"""
+        def unexpected(*args, **kwargs):
+            raise AssertionError("benchmarks should not run without a baseline")
+
+        monkeypatch.setattr(micro, "run", unexpected)
+
+        assert micro.main(["--compare", str(tmp_path / "missing.json")]) == 2
+        assert "--save-baseline" in capsys.readouterr().err
+
+    def test_unknown_only_case_is_a_usage_error(self, monkeypatch, capsys):
+        """Test that --only with a misspelt case lists the valid names instead of raising KeyError"""
+        def unexpected(*args, **kwargs):
+            raise AssertionError("benchmarks should not run for an unknown case")
+
+        monkeypatch.setattr(micro, "run", unexpected)
+
+        with pytest.raises(SystemExit) as exit_info:
+            micro.main(["--only", "extract_text_from_xlsx,no_such_case"])
+
+        assert exit_info.value.code == 2
+        error = capsys.readouterr().err
+        assert "no_such_case" in error
+        assert "validate_shipment_data" in error
+
+
+class TestPDFBackendComparison:
+    """Tests for the PDF text backend comparison"""
+
+    def test_backends_agree_on_synthetic_pdfs(self):
+        """Test that every backend is timed and matches PyPDF2's text and fields"""
+        results = pdf_backends.run([2], [], repeat=1)
+
+        assert set(results["summary"]) == {"auto", "pdfium", "pypdf2"}
+        for name, summary in results["summary"].items():
+            assert summary["min_similarity"] > 0.95
+            assert summary["field_accuracy"] == 1.0
+        assert results["files"][0]["backends"]["pdfium"]["median_seconds"] > 0
+
+    def test_similarity_is_per_page(self):
+        """Test that whitespace differences do not count and page mismatches do"""
+        assert pdf_backends.similarity(["A  B\r\nC"], ["A B\nC"]) == 1.0
+        assert pdf_backends.similarity(["", ""], ["", ""]) == 1.0
+        assert pdf_backends.similarity(["A"], ["A", "B"]) == 0.0
@@ -0,0 +1,106 @@
+"""
+Unit tests for the LLM circuit breaker
+"""
+from app.services import circuit_breaker
+from app.services.circuit_breaker import CircuitBreaker
+
+
+class FakeClock:
+    """Controllable replacement for time.monotonic"""
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def make_breaker(monkeypatch, **kwargs):
+    """Build a breaker on a fake clock"""
+    clock = FakeClock()
+    monkeypatch.setattr(circuit_breaker.time, "monotonic", clock)
+    options = dict(window=10, min_calls=4, failure_rate=0.5, slow_call_seconds=5, open_seconds=30, enabled=True)
+    options.update(kwargs)
+    return CircuitBreaker(**options), clock
+
+
+class TestCircuitBreaker:
+    """Tests for CircuitBreaker"""
+
+    def test_stays_closed_below_min_calls(self, monkeypatch):
+        """Test that a few failures do not open the circuit"""
+        breaker, _ = make_breaker(monkeypatch)
+        for _ in range(3):
+            breaker.record_failure()
+        assert breaker.state == "closed"
+        assert breaker.allow()
+
+    def test_opens_on_failure_rate_and_fails_fast(self, monkeypatch):
+        """Test that the circuit opens once half of the recent calls failed"""
+        breaker, _ = make_breaker(monkeypatch)
+        breaker.record_success(1.0)
+        breaker.record_success(1.0)
+        breaker.record_failure()
+        breaker.record_failure()
+
+        assert breaker.state == "open"
+        assert not breaker.allow()
+        assert breaker.stats()["times_opened"] == 1
+
+    def test_slow_calls_count_as_unhealthy(self, monkeypatch):
+        """Test that calls slower than the threshold open the circuit too"""
+        breaker, _ = make_breaker(monkeypatch)
+        for _ in range(4):
+            breaker.record_success(10.0)
+        assert breaker.state == "open"
+
+    def test_probe_success_closes_circuit(self, monkeypatch):
+        """Test half-open after the cool-down, with a single probe allowed"""
+        breaker, clock = make_breaker(monkeypatch)
+        for _ in range(4):
+            breaker.record_failure()
+
+        clock.now += 31
+        assert breaker.state == "half_open"
+        assert breaker.allow()
+        assert not breaker.allow()  # Only one probe at a time
+
+        breaker.record_success(1.0)
+        assert breaker.state == "closed"
+        assert breaker.stats()["window_calls"] == 0
+
+    def test_probe_failure_reopens_circuit(self, monkeypatch):
+        """Test that a failed probe opens the circuit for another cool-down"""
+        breaker, clock = make_breaker(monkeypatch)
+        for _ in range(4):
+            breaker.record_failure()
+
+        clock.now += 31
+        assert breaker.allow()
+        breaker.record_failure()
+
+        assert breaker.state == "open"
+        assert not breaker.allow()
+        assert breaker.stats()["times_opened"] == 2
+
+    def test_released_probe_lets_the_next_call_probe(self, monkeypatch):
+        """Test that releasing an unfinished probe neither opens nor closes the circuit"""
+        breaker, clock = make_breaker(monkeypatch)
+        for _ in range(4):
+            breaker.record_failure()
+
+        clock.now += 31
+        assert breaker.allow()
+        breaker.release()
+
+        assert breaker.state == "half_open"
+        assert breaker.allow()
+        assert not breaker.allow()
+
+    def test_disabled_breaker_allows_everything(self, monkeypatch):
+        """Test that a disabled breaker never opens"""
+        breaker, _ = make_breaker(monkeypatch, enabled=False)
+        for _ in range(10):
+            breaker.record_failure()
+        assert breaker.allow()
+        assert breaker.state == "closed"
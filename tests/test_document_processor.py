@@ -7,6 +7,7 @@ import tempfile
 import os
 
 from app.services.document_processor import process_documents
+from app.utils.document_segments import DocumentBundle, ImageSegment, SheetSegment, TextSegment
 
 
 class TestDocumentProcessor:
@@ -28,8 +29,11 @@ class TestDocumentProcessor:
             # Process
             result = process_documents([tmp_path])
 
-            assert isinstance(result, str)
-            assert len(result) > 0
+            assert isinstance(result, DocumentBundle)
+            assert len(result) == 1
+            assert "TEST123" in result.render_text()
+            assert isinstance(result.segments[0], TextSegment)
+            assert result.segments[0].source == os.path.basename(tmp_path)
 
             # Cleanup
             os.unlink(tmp_path)
@@ -54,9 +58,10 @@ class TestDocumentProcessor:
             # Process
             result = process_documents([tmp_path])
 
-            assert isinstance(result, str)
-            assert "Invoice No" in result
-            assert "INV123" in result
+            assert isinstance(result, DocumentBundle)
+            assert isinstance(result.segments[0], SheetSegment)
+            assert "Invoice No" in result.render_text()
+            assert "INV123" in result.render_text()
 
             # Cleanup
             os.unlink(tmp_path)
@@ -90,9 +95,10 @@ class TestDocumentProcessor:
             # Process both
             result = process_documents([pdf_path, xlsx_path])
 
-            assert isinstance(result, str)
-            # Should contain content from both files
-            assert len(result) > 0
+            # Should contain content from both files, in upload order
+            assert [d.doc_type for d in result.documents] == ["PDF", "XLSX"]
+            assert "PDF Content" in result.render_text()
+            assert "Excel Content" in result.render_text()
 
             # Cleanup
             os.unlink(pdf_path)
@@ -104,10 +110,282 @@ class TestDocumentProcessor:
     def test_process_empty_list(self):
         """Test processing empty file list"""
         result = process_documents([])
-        assert isinstance(result, str)
+        assert isinstance(result, DocumentBundle)
         assert len(result) == 0
+        assert result.render_text() == ""
 
     def test_process_nonexistent_file(self):
         """Test processing non-existent file raises error"""
         with pytest.raises(Exception):
             process_documents(["/nonexistent/file.pdf"])
+
+    def test_corrupt_pdf_is_marked_unreadable(self, monkeypatch, tmp_path):
+        """Test that a PDF neither parser can open fails on its own instead of failing the request"""
+        from reportlab.pdfgen import canvas
+        from app.services import document_processor
+
+        puts = []
+        monkeypatch.setattr(document_processor.document_cache, "get", lambda *args: None)
+        monkeypatch.setattr(document_processor.document_cache, "put", lambda *args: puts.append(args[0]))
+
+        corrupt_path = tmp_path / "corrupt.pdf"
+        corrupt_path.write_bytes(b"%PDF-1.4\ngarbage")
+        pdf_path = str(tmp_path / "bol.pdf")
+        c = canvas.Canvas(pdf_path)
+        c.drawString(100, 750, "BILL OF LADING - B/L No: GOOD123 - SHIPPER: CHINA ABRASIVES EXPORT CORP")
+        c.save()
+
+        events = []
+        result = process_documents(
+            [str(corrupt_path), pdf_path], on_stage=lambda stage, details: events.append((stage, details))
+        )
+
+        corrupt, good = result.documents
+        assert corrupt.parse_fallback == "unreadable"
+        assert "could not be opened" in corrupt.segments[0].text
+        assert not result.has_images
+        assert "GOOD123" in good.segments[0].text
+        assert ("parse_fallback", {"file": "corrupt.pdf", "reason": "error", "fallback": "unreadable"}) in events
+        assert len(puts) == 1  # Only the good file is cached
+
+
+class TestDocumentCache:
+    """Tests for the parsed document cache used by process_documents"""
+
+    def test_second_parse_is_served_from_cache(self, monkeypatch, tmp_path):
+        """Test that re-processing the same file skips the PDF parser"""
+        from reportlab.pdfgen import canvas
+        from app.services import document_processor
+        from app.utils.document_cache import DocumentCache
+
+        from app.services.parse_pool import ParsePool
+
+        cache = DocumentCache(cache_dir=str(tmp_path / "cache"), max_disk_bytes=10_000_000, enabled=True)
+        monkeypatch.setattr(document_processor, "document_cache", cache)
+        # Parse inline so the counting wrapper below is the one that runs
+        monkeypatch.setattr(document_processor, "parse_pool", ParsePool(max_workers=0))
+
+        pdf_path = str(tmp_path / "bol.pdf")
+        c = canvas.Canvas(pdf_path)
+        c.drawString(100, 750, "Bill of Lading CACHE123")
+        c.save()
+
+        calls = []
+        real_extract = document_processor.extract_pdf_page_range
+
+        def counting_extract(path, start=0, end=None, backend=None):
+            calls.append(path)
+            return real_extract(path, start, end, backend)
+
+        monkeypatch.setattr(document_processor, "extract_pdf_page_range", counting_extract)
+
+        first = process_documents([pdf_path])
+        second = process_documents([pdf_path])
+
+        assert first.render_text() == second.render_text()
+        assert "CACHE123" in second.render_text()
+        assert len(calls) == 1
+        assert cache.hits == 1
+
+    def test_changed_content_misses_cache(self, monkeypatch, tmp_path):
+        """Test that the cache is keyed by content, not file name"""
+        import openpyxl
+        from app.services import document_processor
+        from app.utils.document_cache import DocumentCache
+
+        cache = DocumentCache(cache_dir=str(tmp_path / "cache"), max_disk_bytes=10_000_000, enabled=True)
+        monkeypatch.setattr(document_processor, "document_cache", cache)
+
+        xlsx_path = str(tmp_path / "invoice.xlsx")
+        for value in ("INV001", "INV002"):
+            wb = openpyxl.Workbook()
+            wb.active['A1'] = value
+            wb.save(xlsx_path)
+            assert value in process_documents([xlsx_path]).render_text()
+
+        assert cache.hits == 0
+        assert cache.misses == 2
+
+
+class TestParallelParsing:
+    """Tests for parsing documents in the parse pool"""
+
+    def test_large_pdf_split_across_workers_keeps_page_order(self, monkeypatch, tmp_path):
+        """Test that page ranges parsed in parallel merge back in order"""
+        from reportlab.pdfgen import canvas
+        import openpyxl
+        from app.services import document_processor
+        from app.services.parse_pool import ParsePool
+        from app.utils.document_cache import DocumentCache
+
+        pool = ParsePool(max_workers=2, start_method="spawn")
+        monkeypatch.setattr(document_processor, "parse_pool", pool)
+        monkeypatch.setattr(
+            document_processor, "document_cache",
+            DocumentCache(cache_dir=str(tmp_path / "cache"), max_disk_bytes=10_000_000, enabled=False)
+        )
+        monkeypatch.setattr(document_processor.settings, "PARSE_PDF_PAGES_PER_TASK", 2)
+
+        pdf_path = str(tmp_path / "bol.pdf")
+        c = canvas.Canvas(pdf_path)
+        for page_no in range(1, 6):
+            c.drawString(100, 750, f"PAGE-{page_no}")
+            c.showPage()
+        c.save()
+
+        xlsx_path = str(tmp_path / "invoice.xlsx")
+        wb = openpyxl.Workbook()
+        wb.active['A1'] = "INVOICE-ROW"
+        wb.save(xlsx_path)
+
+        try:
+            result = process_documents([pdf_path, xlsx_path]).render_text()
+        finally:
+            pool.shutdown()
+
+        positions = [result.index(f"PAGE-{page_no}") for page_no in range(1, 6)]
+        assert positions == sorted(positions)
+        assert result.index("PAGE-5") < result.index("INVOICE-ROW")
+
+    def test_page_ranges(self):
+        """Test splitting page counts into ranges"""
+        from app.services.document_processor import _page_ranges
+
+        assert _page_ranges(3, 10) == [(0, None)]
+        assert _page_ranges(5, 2) == [(0, 2), (2, 4), (4, 5)]
+
+
+class TestScannedDocuments:
+    """Tests for scanned PDFs flowing through as image segments"""
+
+    def test_scanned_pdf_becomes_image_segments(self, monkeypatch, tmp_path):
+        """Test that scanned pages are kept as raw image bytes, not base64 text"""
+        from reportlab.pdfgen import canvas
+        from app.services import document_processor
+        from app.utils.document_cache import DocumentCache
+
+        cache = DocumentCache(cache_dir=str(tmp_path / "cache"), max_disk_bytes=10_000_000, enabled=True)
+        monkeypatch.setattr(document_processor, "document_cache", cache)
+
+        pdf_path = str(tmp_path / "scanned.pdf")
+        c = canvas.Canvas(pdf_path)
+        for _ in range(2):
+            c.rect(100, 400, 300, 200, fill=1)
+            c.showPage()
+        c.save()
+
+        for _ in range(2):  # Second pass is served from the document cache
+            result = process_documents([pdf_path])
+            assert result.has_images
+            assert len(result.images) == 2
+            assert all(isinstance(image, ImageSegment) for image in result.images)
+            assert result.images[0].data[:2] == b"\xff\xd8"  # JPEG bytes
+            assert "2 page image(s) attached" in result.render_text()
+
+        assert cache.hits == 1
+
+    @staticmethod
+    def write_mixed_pdf(pdf_path):
+        """A text page, two scanned pages (one with a stamped page number) and a blank page"""
+        from PIL import Image, ImageDraw
+        from reportlab.lib.utils import ImageReader
+        from reportlab.pdfgen import canvas
+
+        scan = Image.new("L", (400, 560), 255)
+        ImageDraw.Draw(scan).text((40, 40), "CONTAINER NO: CSQU3054383", fill=0)
+
+        c = canvas.Canvas(pdf_path)
+        c.drawString(100, 750, "BILL OF LADING - B/L No: MIXED123 - SHIPPER: CHINA ABRASIVES EXPORT CORP")
+        c.showPage()
+        c.drawImage(ImageReader(scan), 0, 0, width=595, height=842)
+        c.drawString(500, 20, "Page 2")  # Stamped page number on a scanned page
+        c.showPage()
+        c.drawImage(ImageReader(scan), 0, 0, width=595, height=842)
+        c.showPage()
+        c.showPage()  # Blank page
+        c.save()
+
+    def test_mixed_pdf_renders_only_image_pages(self, monkeypatch, tmp_path):
+        """Test that the text pages of a mixed PDF stay text and its scanned pages are rendered"""
+        from app.services import document_processor
+
+        monkeypatch.setattr(document_processor.document_cache, "enabled", False)
+
+        pdf_path = str(tmp_path / "mixed.pdf")
+        self.write_mixed_pdf(pdf_path)
+
+        stages = {}
+        result = process_documents([pdf_path], on_stage=lambda stage, details: stages.update({stage: details}))
+
+        segments = result.documents[0].segments
+        assert [(type(segment).__name__, segment.page) for segment in segments] == [
+            ("TextSegment", 0), ("TextSegment", 1), ("ImageSegment", 1), ("ImageSegment", 2)
+        ]
+        assert "MIXED123" in segments[0].text
+        assert stages["documents_parsed"]["scanned_pages"] == 2
+        assert stages["pages_rendered"] == {"pages": 2, "failed": 0, "skipped": 0}
+        assert "Scanned pages attached as images: 2, 3" in result.render_text()
+
+    def test_mixed_pdf_page_notes_reach_the_compacted_prompt(self, monkeypatch, tmp_path):
+        """Test that the compacted prompt still says which pages of a mixed PDF are images"""
+        from app.services import document_processor, llm_service
+
+        monkeypatch.setattr(document_processor.document_cache, "enabled", False)
+        monkeypatch.setattr(llm_service.settings, "PROMPT_COMPACTION_ENABLED", True)
+
+        pdf_path = str(tmp_path / "mixed.pdf")
+        self.write_mixed_pdf(pdf_path)
+
+        text = llm_service.prepare_document_text(process_documents([pdf_path]))
+
+        assert "MIXED123" in text
+        assert "[Scanned pages attached as images: 2, 3]" in text
+
+    def test_render_limit_reports_the_pages_left_out(self, monkeypatch, tmp_path):
+        """Test that every scanned page is rendered by default, and pages cut by a limit are reported"""
+        from reportlab.pdfgen import canvas
+        from app.services import document_processor
+
+        monkeypatch.setattr(document_processor.document_cache, "enabled", False)
+
+        pdf_path = str(tmp_path / "scanned.pdf")
+        c = canvas.Canvas(pdf_path)
+        for _ in range(7):
+            c.rect(100, 400, 300, 200, fill=1)
+            c.showPage()
+        c.save()
+
+        assert document_processor.settings.PDF_RENDER_MAX_PAGES == 0
+        assert len(process_documents([pdf_path]).images) == 7
+
+        monkeypatch.setattr(document_processor.settings, "PDF_RENDER_MAX_PAGES", 5)
+        stages = {}
+        result = process_documents([pdf_path], on_stage=lambda stage, details: stages.update({stage: details}))
+
+        assert len(result.images) == 5
+        assert result.documents[0].unrendered_pages == [5, 6]
+        assert result.parse_report()[0]["unrendered_pages"] == [6, 7]
+        assert stages["pages_rendered"] == {"pages": 5, "failed": 0, "skipped": 2}
+        assert "Scanned pages not attached (render limit): 6, 7" in result.render_text()
+
+    def test_text_pdf_layout_is_not_inspected(self, monkeypatch, tmp_path):
+        """Test that PDFs whose pages all carry enough text skip classification"""
+        from reportlab.pdfgen import canvas
+        from app.services import document_processor
+
+        monkeypatch.setattr(document_processor.document_cache, "enabled", False)
+
+        def unexpected(*args):
+            raise AssertionError("text PDF pages should not be classified")
+
+        monkeypatch.setattr(document_processor, "classify_pdf_pages", unexpected)
+
+        pdf_path = str(tmp_path / "text.pdf")
+        c = canvas.Canvas(pdf_path)
+        c.drawString(100, 750, "BILL OF LADING - B/L No: TEXT123 - SHIPPER: CHINA ABRASIVES EXPORT CORP")
+        c.save()
+
+        result = process_documents([pdf_path])
+
+        assert not result.has_images
+        assert "TEXT123" in result.render_text()
@@ -0,0 +1,127 @@
+"""
+Unit tests for the extraction result cache
+"""
+import os
+import time
+import pytest
+from fastapi.testclient import TestClient
+
+from main import app
+from app.api import routes
+from app.services.extraction_cache import ExtractionCache
+from app.utils.disk_cache import DiskCache
+
+client = TestClient(app)
+
+
+class TestDiskCache:
+    """Tests for the size-bounded disk store"""
+
+    def test_put_and_get(self, tmp_path):
+        """Test round-tripping bytes"""
+        cache = DiskCache(str(tmp_path), max_bytes=1024)
+        cache.put("abc123", b"hello")
+        assert cache.get("abc123") == b"hello"
+        assert cache.get("missing") is None
+
+    def test_evicts_least_recently_used(self, tmp_path):
+        """Test that old entries are evicted once over the size limit"""
+        cache = DiskCache(str(tmp_path), max_bytes=250)
+        cache.put("first", b"a" * 100)
+        cache.put("second", b"b" * 100)
+
+        # Make "first" older, then touch it so "second" becomes the LRU entry
+        past = time.time() - 100
+        os.utime(tmp_path / "first.bin", (past, past))
+        os.utime(tmp_path / "second.bin", (past - 10, past - 10))
+        cache.get("first")
+
+        cache.put("third", b"c" * 100)
+
+        assert cache.get("second") is None
+        assert cache.get("first") is not None
+        assert cache.get("third") is not None
+        assert cache.stats()["evictions"] == 1
+
+    def test_rejects_path_traversal_keys(self, tmp_path):
+        """Test that keys cannot escape the cache directory"""
+        cache = DiskCache(str(tmp_path), max_bytes=1024)
+        with pytest.raises(ValueError):
+            cache.get("../etc/passwd")
+
+
+class TestExtractionCache:
+    """Tests for the two-tier extraction cache"""
+
+    def test_key_ignores_file_order(self):
+        """Test that the key depends on the set of files, not their order"""
+        key1 = ExtractionCache.make_key(["aaa", "bbb"])
+        key2 = ExtractionCache.make_key(["bbb", "aaa"])
+        assert key1 == key2
+        assert key1 != ExtractionCache.make_key(["aaa"])
+
+    def test_key_changes_with_model(self):
+        """Test that a different model produces a different key"""
+        assert ExtractionCache.make_key(["aaa"], model="m1") != ExtractionCache.make_key(["aaa"], model="m2")
+
+    def test_memory_then_disk_tiers(self, tmp_path):
+        """Test hits from memory, and from disk after memory is lost"""
+        cache = ExtractionCache(max_memory_entries=10, cache_dir=str(tmp_path), max_disk_bytes=10_000)
+        cache.put("key1", {"billOfLadingNumber": "TEST123"})
+
+        data, tier = cache.get("key1")
+        assert data == {"billOfLadingNumber": "TEST123"}
+        assert tier == "memory"
+
+        # A new instance (e.g. after restart) only has the disk tier
+        fresh = ExtractionCache(max_memory_entries=10, cache_dir=str(tmp_path), max_disk_bytes=10_000)
+        data, tier = fresh.get("key1")
+        assert data == {"billOfLadingNumber": "TEST123"}
+        assert tier == "disk"
+
+    def test_invalidate_and_stats(self, tmp_path):
+        """Test invalidation removes both tiers and stats count lookups"""
+        cache = ExtractionCache(max_memory_entries=10, cache_dir=str(tmp_path), max_disk_bytes=10_000)
+        cache.put("key1", {"a": 1})
+        assert cache.invalidate("key1") is True
+        assert cache.get("key1") == (None, None)
+        assert cache.invalidate("key1") is False
+
+        stats = cache.stats()
+        assert stats["misses"] == 1
+        assert stats["disk"]["entries"] == 0
+
+
+class TestExtractEndpointCache:
+    """Tests for cache hits on /api/extract and the admin endpoints"""
+
+    def test_second_upload_is_served_from_cache(self, monkeypatch, tmp_path):
+        """Test that re-uploading the same file skips the LLM"""
+        cache = ExtractionCache(max_memory_entries=10, cache_dir=str(tmp_path), max_disk_bytes=10_000)
+        monkeypatch.setattr(routes, "extraction_cache", cache)
+        monkeypatch.setattr(routes, "process_documents", lambda paths, file_hashes=None: "BOL TEXT")
+        calls = []
+
+        async def fake_extract(documents, report=None):
+            calls.append(documents)
+            return {"billOfLadingNumber": "CACHE123"}
+
+        monkeypatch.setattr(routes, "extract_field_from_document", fake_extract)
+
+        upload = [("files", ("cache_test.pdf", b"%PDF-1.4 cache test", "application/pdf"))]
+        first = client.post("/api/extract?use_mock=false", files=upload)
+        second = client.post("/api/extract?use_mock=false", files=upload)
+
+        assert first.json()["cache"]["hit"] is False
+        assert second.json()["cache"]["hit"] is True
+        assert second.json()["data"] == {"billOfLadingNumber": "CACHE123"}
+        assert len(calls) == 1
+
+        stats = client.get("/api/admin/cache/stats").json()["stats"]
+        assert stats["writes"] == 1
+
+        key = second.json()["cache"]["key"]
+        assert client.delete(f"/api/admin/cache/{key}").status_code == 200
+        assert client.delete(f"/api/admin/cache/{key}").status_code == 404
+
+        (routes.UPLOAD_DIR / "cache_test.pdf").unlink(missing_ok=True)
@@ -0,0 +1,98 @@
+"""
+Unit tests for the fake LLM server used for offline load testing
+"""
+import httpx
+import pytest
+from fastapi.testclient import TestClient
+
+from app.services import llm_service
+from app.services.circuit_breaker import CircuitBreaker
+from app.services.llm_client import LLMClient
+from app.utils.document_segments import DocumentBundle, ParsedDocument, SheetSegment, TextSegment
+from tests.test_rule_extractor import BOL_TEXT
+from tools.fake_llm_server import FakeLLMConfig, create_app
+
+INSTANT = dict(latency="fixed", latency_ms=0, output_tokens_per_second=0)
+
+INVOICE_TEXT = """SHIP TO: | KABOFER TRADING INC
+COMPUTED INVOICE FIGURES (exact, calculated from every line item row):
+- lineItemsCount: 18
+- averagePrice: $1234.50
+"""
+
+
+def tool_request(prompt, stream=False):
+    """Messages API body shaped like an extraction call"""
+    return {
+        "model": "claude-test",
+        "max_tokens": 100,
+        "stream": stream,
+        "system": [{"type": "text", "text": "Extract the fields.", "cache_control": {"type": "ephemeral"}}],
+        "tools": [llm_service.EXTRACTION_TOOL],
+        "tool_choice": {"type": "tool", "name": llm_service.EXTRACTION_TOOL_NAME},
+        "messages": [{"role": "user", "content": prompt}]
+    }
+
+
+class TestFakeLLMServer:
+    """Tests for the fake messages API"""
+
+    def test_answers_requested_fields_from_the_prompt(self):
+        """Test a tool call answer read from the documents in the prompt"""
+        client = TestClient(create_app(FakeLLMConfig(**INSTANT)))
+        prompt = f"Only extract these fields: containerNumber, dateOfExport\n\nHere are the documents:\n{BOL_TEXT}"
+
+        message = client.post("/v1/messages", json=tool_request(prompt)).json()
+
+        assert message["stop_reason"] == "tool_use"
+        assert message["content"][0]["input"] == {"containerNumber": "CSQU3054383", "dateOfExport": "03/15/2024"}
+
+    def test_system_prompt_is_cached_after_first_call(self):
+        """Test the simulated prompt cache usage fields"""
+        client = TestClient(create_app(FakeLLMConfig(**INSTANT)))
+
+        first = client.post("/v1/messages", json=tool_request(BOL_TEXT)).json()["usage"]
+        second = client.post("/v1/messages", json=tool_request(BOL_TEXT)).json()["usage"]
+
+        assert first["cache_creation_input_tokens"] > 0
+        assert second["cache_read_input_tokens"] == first["cache_creation_input_tokens"]
+
+    def test_canned_response_and_error_injection(self, tmp_path):
+        """Test the canned answer file and injected error statuses"""
+        answer = tmp_path / "answer.json"
+        answer.write_text('{"billOfLadingNumber": "CANNED1"}')
+
+        client = TestClient(create_app(FakeLLMConfig(response_file=str(answer), **INSTANT)))
+        message = client.post("/v1/messages", json=tool_request("Only extract these fields: billOfLadingNumber\n")).json()
+        assert message["content"][0]["input"] == {"billOfLadingNumber": "CANNED1"}
+
+        failing = TestClient(create_app(FakeLLMConfig(error_rate=1.0, error_statuses=[529], **INSTANT)))
+        response = failing.post("/v1/messages", json=tool_request(BOL_TEXT))
+        assert response.status_code == 529
+        assert failing.get("/stats").json()["errors"] == 1
+
+    @pytest.mark.asyncio
+    async def test_real_extraction_runs_against_fake_server(self, monkeypatch):
+        """Test the extraction pipeline end to end (streamed tool call) through the Anthropic client"""
+        app = create_app(FakeLLMConfig(**INSTANT))
+        client = LLMClient(requests_per_minute=0, tokens_per_minute=0, transport=httpx.ASGITransport(app=app))
+        monkeypatch.setattr(llm_service, "llm_client", client)
+        monkeypatch.setattr(llm_service, "llm_breaker", CircuitBreaker(enabled=False))
+        monkeypatch.setattr(llm_service.settings, "RULE_EXTRACTION_ENABLED", False)
+        monkeypatch.setattr(llm_service.settings, "LLM_TIERING_ENABLED", False)
+
+        events = []
+        result = await llm_service.extract_field_from_document(
+            DocumentBundle([
+                ParsedDocument("bol.pdf", "PDF", [TextSegment(text=BOL_TEXT, page=0)]),
+                ParsedDocument("invoice.xlsx", "XLSX", [SheetSegment(sheet_name="Invoice", text=INVOICE_TEXT)])
+            ]),
+            on_event=lambda event, data: events.append((event, data))
+        )
+
+        assert result["billOfLadingNumber"] == "ZMLU34110002"
+        assert result["containerNumber"] == "CSQU3054383"
+        assert result["averageGrossWeight"] == "902.78 KG"
+        assert result["averagePrice"] == "$1234.50"
+        assert ("field", {"name": "containerNumber", "value": "CSQU3054383", "source": "llm"}) in events
+        assert app.state.fake.stats["streamed"] == 1
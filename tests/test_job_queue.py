@@ -0,0 +1,146 @@
+"""
+Unit tests for the background extraction job queue
+"""
+import asyncio
+import time
+import pytest
+from fastapi.testclient import TestClient
+
+from main import app
+from app.api import routes
+from app.services.job_queue import ExtractionJobQueue, QueueFullError
+
+
+class TestExtractionJobQueue:
+    """Tests for the job queue itself"""
+
+    @pytest.mark.asyncio
+    async def test_job_completes_with_result(self):
+        """Test a submitted job runs and stores its result"""
+        queue = ExtractionJobQueue(max_workers=2, max_queued=2)
+
+        async def runner():
+            return {"billOfLadingNumber": "TEST123"}
+
+        job = queue.submit(runner)
+        assert job.status == "queued"
+
+        job = await queue.wait(job.job_id, timeout=5)
+        assert job.status == "completed"
+        assert job.result == {"billOfLadingNumber": "TEST123"}
+
+    @pytest.mark.asyncio
+    async def test_failed_job_records_error_and_runs_cleanup(self):
+        """Test that failures are captured and cleanup always runs"""
+        queue = ExtractionJobQueue(max_workers=1, max_queued=1)
+        cleaned = []
+
+        async def runner():
+            raise Exception("LLM unavailable")
+
+        job = queue.submit(runner, cleanup=lambda: cleaned.append(True))
+        job = await queue.wait(job.job_id, timeout=5)
+
+        assert job.status == "failed"
+        assert "LLM unavailable" in job.error
+        assert cleaned == [True]
+
+    @pytest.mark.asyncio
+    async def test_cancelled_jobs_are_marked_failed(self):
+        """Test that cancelling the running and queued tasks finishes their jobs and runs cleanup"""
+        queue = ExtractionJobQueue(max_workers=1, max_queued=1)
+        started = asyncio.Event()
+        cleaned = []
+
+        async def runner():
+            started.set()
+            await asyncio.Event().wait()
+
+        jobs = [queue.submit(runner, cleanup=lambda: cleaned.append(True)) for _ in range(2)]
+        await started.wait()
+        tasks = list(queue._tasks)
+        for task in tasks:
+            task.cancel()
+        results = await asyncio.gather(*tasks, return_exceptions=True)
+
+        assert all(isinstance(result, asyncio.CancelledError) for result in results)
+        assert [job.status for job in jobs] == ["failed", "failed"]
+        assert all(job.error == "Job was cancelled" for job in jobs)
+        assert cleaned == [True, True]
+
+    @pytest.mark.asyncio
+    async def test_concurrency_is_bounded(self):
+        """Test that no more than max_workers jobs run at once"""
+        queue = ExtractionJobQueue(max_workers=2, max_queued=10)
+        running = 0
+        peak = 0
+
+        async def runner():
+            nonlocal running, peak
+            running += 1
+            peak = max(peak, running)
+            await asyncio.sleep(0.05)
+            running -= 1
+            return {}
+
+        jobs = [queue.submit(runner) for _ in range(6)]
+        for job in jobs:
+            await queue.wait(job.job_id, timeout=5)
+
+        assert peak == 2
+
+    @pytest.mark.asyncio
+    async def test_queue_full_rejects_jobs(self):
+        """Test that submit fails once workers and queue are saturated"""
+        queue = ExtractionJobQueue(max_workers=1, max_queued=1)
+        release = asyncio.Event()
+
+        async def runner():
+            await release.wait()
+            return {}
+
+        queue.submit(runner)
+        queue.submit(runner)
+        with pytest.raises(QueueFullError):
+            queue.submit(runner)
+
+        release.set()
+
+
+class TestJobEndpoints:
+    """Tests for async_mode on /api/extract and GET /api/jobs/{id}"""
+
+    def test_async_extract_returns_job_id_and_result(self, monkeypatch):
+        """Test that job mode returns 202 and the job eventually completes"""
+        monkeypatch.setattr(routes, "process_documents", lambda paths, file_hashes=None: "BOL TEXT")
+
+        async def fake_extract(documents, report=None):
+            return {"billOfLadingNumber": "JOB123"}
+
+        monkeypatch.setattr(routes, "extract_field_from_document", fake_extract)
+
+        with TestClient(app) as client:
+            response = client.post(
+                "/api/extract?use_mock=false&async_mode=true&use_cache=false",
+                files=[("files", ("job_test.pdf", b"%PDF-1.4 test", "application/pdf"))]
+            )
+            assert response.status_code == 202
+            job_id = response.json()["job_id"]
+
+            deadline = time.time() + 5
+            while time.time() < deadline:
+                job = client.get(f"/api/jobs/{job_id}").json()["job"]
+                if job["status"] in ("completed", "failed"):
+                    break
+                time.sleep(0.02)
+
+            assert job["status"] == "completed"
+            assert job["result"]["data"] == {"billOfLadingNumber": "JOB123"}
+
+        (routes.UPLOAD_DIR / "job_test.pdf").unlink(missing_ok=True)
+
+    def test_unknown_job_returns_404(self):
+        """Test polling an unknown job id"""
+        with TestClient(app) as client:
+            response = client.get("/api/jobs/does-not-exist")
+        assert response.status_code == 404
@@ -0,0 +1,511 @@
+"""
+Unit tests for the pooled LLM client and rate limiter
+"""
+import asyncio
+import json
+import time
+import pytest
+import httpx
+import anthropic
+
+from app.services import llm_client as llm_client_module
+from app.services.llm_client import LLMClient, batch_lane, estimate_tokens, usage_summary
+from app.services.llm_metrics import LLMMetrics
+from app.services.rate_limiter import TokenBucket
+
+
+def make_message_response(text="{}", input_tokens=10, output_tokens=5, cache_read=None, cache_write=None):
+    """Build an Anthropic messages API response body"""
+    usage = {"input_tokens": input_tokens, "output_tokens": output_tokens}
+    if cache_read is not None:
+        usage.update(cache_read_input_tokens=cache_read, cache_creation_input_tokens=cache_write or 0)
+    return {
+        "id": "msg_test",
+        "type": "message",
+        "role": "assistant",
+        "model": "claude-test",
+        "content": [{"type": "text", "text": text}],
+        "stop_reason": "end_turn",
+        "stop_sequence": None,
+        "usage": usage
+    }
+
+
+def make_stream_response(chunks, input_tokens=10, output_tokens=5, tool_name=None):
+    """Build a streamed (SSE) messages API response body (text, or a tool call's input JSON)"""
+    message = make_message_response(input_tokens=input_tokens, output_tokens=0)
+    message["content"] = []
+    if tool_name:
+        block = {"type": "tool_use", "id": "toolu_test", "name": tool_name, "input": {}}
+    else:
+        block = {"type": "text", "text": ""}
+    events = [
+        ("message_start", {"type": "message_start", "message": message}),
+        ("content_block_start", {"type": "content_block_start", "index": 0, "content_block": block})
+    ]
+    for chunk in chunks:
+        delta = {"type": "input_json_delta", "partial_json": chunk} if tool_name else {"type": "text_delta", "text": chunk}
+        events.append(("content_block_delta", {"type": "content_block_delta", "index": 0, "delta": delta}))
+    events += [
+        ("content_block_stop", {"type": "content_block_stop", "index": 0}),
+        ("message_delta", {"type": "message_delta", "delta": {"stop_reason": "end_turn", "stop_sequence": None},
+                           "usage": {"output_tokens": output_tokens}}),
+        ("message_stop", {"type": "message_stop"})
+    ]
+    return "".join(f"event: {name}\ndata: {json.dumps(data)}\n\n" for name, data in events)
+
+
+class TestTokenBucket:
+    """Tests for the token bucket limiter"""
+
+    @pytest.mark.asyncio
+    async def test_acquire_within_capacity_does_not_wait(self):
+        """Test that tokens within capacity are granted immediately"""
+        bucket = TokenBucket(rate_per_minute=600)
+        waited = await bucket.acquire(10)
+        assert waited == 0.0
+
+    @pytest.mark.asyncio
+    async def test_acquire_waits_for_refill(self):
+        """Test that an empty bucket waits for refill"""
+        # 6000/min = 100 tokens per second
+        bucket = TokenBucket(rate_per_minute=6000, capacity=10)
+        await bucket.acquire(10)
+
+        start = time.monotonic()
+        await bucket.acquire(5)
+        assert time.monotonic() - start >= 0.04
+
+    @pytest.mark.asyncio
+    async def test_zero_rate_disables_limit(self):
+        """Test that rate 0 means unlimited"""
+        bucket = TokenBucket(rate_per_minute=0)
+        assert not bucket.enabled
+        assert await bucket.acquire(1_000_000) == 0.0
+
+    def test_debit_can_return_tokens(self):
+        """Test reconciling estimated vs actual usage"""
+        bucket = TokenBucket(rate_per_minute=60, capacity=100)
+        bucket.debit(50)
+        assert bucket.available() < 51
+        bucket.debit(-50)
+        assert bucket.available() >= 99
+
+
+class TestLLMClient:
+    """Tests for LLMClient against a local stand-in transport"""
+
+    def test_estimate_tokens(self):
+        """Test token estimation for strings and content blocks"""
+        assert estimate_tokens("a" * 400) == 101
+        blocks = [
+            {"type": "image", "source": {}},
+            {"type": "text", "text": "a" * 40}
+        ]
+        assert estimate_tokens(blocks) > 1600
+
+    @pytest.mark.asyncio
+    async def test_create_message_returns_parsed_message(self):
+        """Test a call through the pooled client"""
+        def handler(request):
+            body = json.loads(request.content)
+            assert body["model"] == "claude-test"
+            return httpx.Response(200, json=make_message_response('{"a": 1}'))
+
+        client = LLMClient(transport=httpx.MockTransport(handler))
+        message = await client.create_message(
+            model="claude-test",
+            max_tokens=100,
+            messages=[{"role": "user", "content": "hello"}]
+        )
+        assert message.content[0].text == '{"a": 1}'
+
+    @pytest.mark.asyncio
+    async def test_in_flight_calls_are_limited(self):
+        """Test the in-flight semaphore caps concurrent calls"""
+        in_flight = 0
+        peak = 0
+
+        async def handler(request):
+            nonlocal in_flight, peak
+            in_flight += 1
+            peak = max(peak, in_flight)
+            await asyncio.sleep(0.05)
+            in_flight -= 1
+            return httpx.Response(200, json=make_message_response())
+
+        client = LLMClient(
+            max_in_flight=2,
+            requests_per_minute=0,
+            tokens_per_minute=0,
+            transport=httpx.MockTransport(handler)
+        )
+        await asyncio.gather(*[
+            client.create_message(
+                model="claude-test",
+                max_tokens=10,
+                messages=[{"role": "user", "content": "hi"}]
+            )
+            for _ in range(5)
+        ])
+        assert peak == 2
+
+    @pytest.mark.asyncio
+    async def test_batch_lane_has_its_own_in_flight_limit(self):
+        """Test that batch calls do not take slots from interactive calls"""
+        release = asyncio.Event()
+        in_flight = 0
+        peak = 0
+
+        async def handler(request):
+            nonlocal in_flight, peak
+            in_flight += 1
+            peak = max(peak, in_flight)
+            await release.wait()
+            in_flight -= 1
+            return httpx.Response(200, json=make_message_response())
+
+        client = LLMClient(
+            max_in_flight=1,
+            batch_max_in_flight=3,
+            requests_per_minute=0,
+            tokens_per_minute=0,
+            transport=httpx.MockTransport(handler)
+        )
+
+        async def call(batch: bool):
+            kwargs = dict(model="claude-test", max_tokens=10, messages=[{"role": "user", "content": "hi"}])
+            if batch:
+                with batch_lane():
+                    return await client.create_message(**kwargs)
+            return await client.create_message(**kwargs)
+
+        tasks = [asyncio.ensure_future(call(batch=True)) for _ in range(5)]
+        tasks.append(asyncio.ensure_future(call(batch=False)))
+        await asyncio.sleep(0.1)
+        # 3 batch slots plus the interactive slot, which the batch calls cannot take
+        assert peak == 4
+        release.set()
+        await asyncio.gather(*tasks)
+
+    @pytest.mark.asyncio
+    async def test_cache_control_uses_prompt_caching_api(self):
+        """Test that cacheable system blocks go to the prompt caching beta and usage is recorded"""
+        seen = {}
+
+        def handler(request):
+            body = json.loads(request.content)
+            seen["beta"] = request.headers.get("anthropic-beta")
+            seen["system"] = body["system"]
+            # Echo usage: first call writes the cache, later calls read it
+            first = not seen.get("calls")
+            seen["calls"] = seen.get("calls", 0) + 1
+            return httpx.Response(200, json=make_message_response(
+                input_tokens=50, cache_read=0 if first else 1200, cache_write=1200 if first else 0
+            ))
+
+        client = LLMClient(requests_per_minute=0, tokens_per_minute=0, transport=httpx.MockTransport(handler))
+        kwargs = dict(
+            model="claude-test",
+            max_tokens=10,
+            system=[{"type": "text", "text": "instructions", "cache_control": {"type": "ephemeral"}}],
+            messages=[{"role": "user", "content": "documents"}]
+        )
+        first = await client.create_message(**kwargs)
+        second = await client.create_message(**kwargs)
+
+        assert "prompt-caching" in seen["beta"]
+        assert seen["system"][0]["cache_control"] == {"type": "ephemeral"}
+        assert usage_summary(first)["cache_creation_input_tokens"] == 1200
+        assert usage_summary(second)["cache_read_input_tokens"] == 1200
+        assert client.usage_totals["cache_read_input_tokens"] == 1200
+        assert client.usage_totals["calls"] == 2
+
+    @pytest.mark.asyncio
+    async def test_cache_control_is_dropped_when_caching_is_off(self):
+        """Test that the regular messages API gets plain system blocks"""
+        seen = {}
+
+        def handler(request):
+            seen["beta"] = request.headers.get("anthropic-beta")
+            seen["system"] = json.loads(request.content)["system"]
+            return httpx.Response(200, json=make_message_response())
+
+        client = LLMClient(requests_per_minute=0, tokens_per_minute=0, transport=httpx.MockTransport(handler))
+        client.prompt_caching = False
+        await client.create_message(
+            model="claude-test",
+            max_tokens=10,
+            system=[{"type": "text", "text": "instructions", "cache_control": {"type": "ephemeral"}}],
+            messages=[{"role": "user", "content": "documents"}]
+        )
+
+        assert seen["beta"] is None
+        assert seen["system"] == [{"type": "text", "text": "instructions"}]
+
+    @pytest.mark.asyncio
+    async def test_on_text_streams_the_response(self):
+        """Test that text deltas reach the callback and the full message is returned"""
+        seen = {}
+
+        def handler(request):
+            seen["stream"] = json.loads(request.content).get("stream")
+            return httpx.Response(
+                200,
+                headers={"content-type": "text/event-stream"},
+                content=make_stream_response(['{"billOf', 'LadingNumber": ', '"ZMLU34110002"}'], output_tokens=7)
+            )
+
+        client = LLMClient(requests_per_minute=0, tokens_per_minute=0, transport=httpx.MockTransport(handler))
+        chunks = []
+        message = await client.create_message(
+            on_text=chunks.append,
+            model="claude-test",
+            max_tokens=10,
+            messages=[{"role": "user", "content": "documents"}]
+        )
+
+        assert seen["stream"] is True
+        assert chunks == ['{"billOf', 'LadingNumber": ', '"ZMLU34110002"}']
+        assert message.content[0].text == '{"billOfLadingNumber": "ZMLU34110002"}'
+        assert usage_summary(message)["output_tokens"] == 7
+        assert client.usage_totals["calls"] == 1
+
+    @pytest.mark.asyncio
+    async def test_on_text_receives_tool_input_json(self):
+        """Test that a streamed tool call's input JSON reaches the callback"""
+        def handler(request):
+            return httpx.Response(
+                200,
+                headers={"content-type": "text/event-stream"},
+                content=make_stream_response(['{"containerNumber"', ': "CSQU3054383"}'], tool_name="record")
+            )
+
+        client = LLMClient(requests_per_minute=0, tokens_per_minute=0, transport=httpx.MockTransport(handler))
+        chunks = []
+        message = await client.create_message(
+            on_text=chunks.append,
+            model="claude-test",
+            max_tokens=10,
+            tools=[{"name": "record", "input_schema": {"type": "object", "properties": {}}}],
+            tool_choice={"type": "tool", "name": "record"},
+            messages=[{"role": "user", "content": "documents"}]
+        )
+
+        assert "".join(chunks) == '{"containerNumber": "CSQU3054383"}'
+        assert message.content[0].type == "tool_use"
+        assert message.content[0].input == {"containerNumber": "CSQU3054383"}
+
+
+class FakeLLMServer:
+    """
+    Local stand-in for the messages API with scripted latency and errors.
+
+    Each request takes the next step of the script (the last step repeats):
+    {"delay": seconds, "status": HTTP status, "headers": {...}, "chunks": [...]}.
+    """
+
+    def __init__(self, *script):
+        self.script = list(script) or [{}]
+        self.requests = 0
+        self.cancelled = 0
+
+    async def handler(self, request):
+        step = self.script[min(self.requests, len(self.script) - 1)]
+        self.requests += 1
+        try:
+            await asyncio.sleep(step.get("delay", 0))
+        except asyncio.CancelledError:
+            self.cancelled += 1
+            raise
+
+        status = step.get("status", 200)
+        if status != 200:
+            return httpx.Response(status, headers=step.get("headers", {}), json={
+                "type": "error", "error": {"type": "api_error", "message": f"injected {status}"}
+            })
+        if json.loads(request.content).get("stream"):
+            return httpx.Response(
+                200,
+                headers={"content-type": "text/event-stream"},
+                content=make_stream_response(step.get("chunks", ["{}"]))
+            )
+        return httpx.Response(200, json=make_message_response(step.get("text", "{}")))
+
+    def client(self, **attributes):
+        client = LLMClient(
+            requests_per_minute=0,
+            tokens_per_minute=0,
+            transport=httpx.MockTransport(self.handler)
+        )
+        client.retry_base_delay = 0.01
+        client.retry_max_delay = 0.05
+        for name, value in attributes.items():
+            setattr(client, name, value)
+        return client
+
+
+async def send(client, **kwargs):
+    """Make a small call through the client"""
+    return await client.create_message(
+        model="claude-test",
+        max_tokens=10,
+        messages=[{"role": "user", "content": "hi"}],
+        **kwargs
+    )
+
+
+class TestClientLifecycle:
+    """Tests for closing the client bound to an earlier event loop"""
+
+    def test_client_of_a_running_loop_is_closed_on_that_loop(self):
+        """Test that rebinding to a new loop closes the old client on its own, still running loop"""
+        import threading
+
+        client = LLMClient(transport=httpx.MockTransport(lambda request: httpx.Response(200)))
+        other_loop = asyncio.new_event_loop()
+        thread = threading.Thread(target=other_loop.run_forever, daemon=True)
+        thread.start()
+        try:
+            async def bind():
+                return client.client
+
+            old = asyncio.run_coroutine_threadsafe(bind(), other_loop).result(timeout=5)
+            new = asyncio.run(bind())
+
+            assert new is not old
+            deadline = time.monotonic() + 5
+            while not old._client.is_closed and time.monotonic() < deadline:
+                time.sleep(0.01)
+            assert old._client.is_closed
+            assert not new._client.is_closed
+        finally:
+            other_loop.call_soon_threadsafe(other_loop.stop)
+            thread.join(timeout=5)
+            other_loop.close()
+
+    @pytest.mark.asyncio
+    async def test_aclose_closes_the_client(self):
+        """Test that aclose closes the current client and the next call creates a new one"""
+        client = LLMClient(transport=httpx.MockTransport(lambda request: httpx.Response(200)))
+        old = client.client
+
+        await client.aclose()
+
+        assert old._client.is_closed
+        assert client.client is not old
+
+
+class TestResilience:
+    """Tests for deadlines, retries and hedging against the fake server"""
+
+    @pytest.fixture(autouse=True)
+    def metrics(self, monkeypatch):
+        """Fresh counters for each test"""
+        metrics = LLMMetrics()
+        monkeypatch.setattr(llm_client_module, "llm_metrics", metrics)
+        return metrics
+
+    @pytest.mark.asyncio
+    async def test_slow_attempt_times_out_and_is_retried(self, metrics):
+        """Test that a hung attempt is cut off at the timeout and retried"""
+        server = FakeLLMServer({"delay": 5}, {})
+        client = server.client(timeout=0.1)
+
+        start = time.monotonic()
+        await send(client)
+
+        assert time.monotonic() - start < 1
+        assert server.requests == 2
+        assert metrics.get("llm_timeouts") == 1
+        assert metrics.get("llm_retries") == 1
+
+    @pytest.mark.asyncio
+    async def test_retryable_errors_are_retried(self, metrics):
+        """Test that 529/500 responses are retried until one succeeds"""
+        server = FakeLLMServer({"status": 529}, {"status": 500}, {"text": '{"ok": true}'})
+        message = await send(server.client())
+
+        assert message.content[0].text == '{"ok": true}'
+        assert server.requests == 3
+        assert metrics.get("llm_retries") == 2
+
+    @pytest.mark.asyncio
+    async def test_client_errors_are_not_retried(self):
+        """Test that a 400 fails immediately"""
+        server = FakeLLMServer({"status": 400})
+        with pytest.raises(anthropic.BadRequestError):
+            await send(server.client())
+        assert server.requests == 1
+
+    @pytest.mark.asyncio
+    async def test_retry_after_is_respected(self):
+        """Test that the backoff waits at least the server's Retry-After"""
+        server = FakeLLMServer({"status": 429, "headers": {"retry-after": "0.2"}}, {})
+        start = time.monotonic()
+        await send(server.client(retry_max_delay=1.0))
+        assert time.monotonic() - start >= 0.2
+        assert server.requests == 2
+
+    @pytest.mark.asyncio
+    async def test_retries_stop_at_max_retries_and_deadline(self):
+        """Test that retries are bounded by count and by the overall deadline"""
+        server = FakeLLMServer({"status": 503})
+        with pytest.raises(anthropic.InternalServerError):
+            await send(server.client(max_retries=2))
+        assert server.requests == 3
+
+        server = FakeLLMServer({"delay": 5})
+        start = time.monotonic()
+        with pytest.raises(Exception, match="timed out"):
+            await send(server.client(timeout=0.1, deadline=0.35, max_retries=10))
+        assert time.monotonic() - start < 1
+        assert server.requests <= 4
+
+    @pytest.mark.asyncio
+    async def test_slow_first_token_is_hedged(self, monkeypatch, metrics):
+        """Test that a late request is hedged, the hedge wins and the loser is cancelled"""
+        monkeypatch.setattr(llm_client_module.settings, "LLM_HEDGE_INITIAL_DELAY_SECONDS", 0.05)
+        server = FakeLLMServer({"delay": 2, "text": '"slow"'}, {"text": '"fast"'})
+        client = server.client(hedging=True)
+
+        start = time.monotonic()
+        message = await send(client)
+        await asyncio.sleep(0.01)
+
+        assert message.content[0].text == '"fast"'
+        assert time.monotonic() - start < 1
+        assert server.requests == 2
+        assert server.cancelled == 1
+        assert metrics.get("llm_hedges") == 1
+        assert metrics.get("llm_hedge_wins") == 1
+
+    @pytest.mark.asyncio
+    async def test_hedged_stream_forwards_only_the_winner(self, monkeypatch):
+        """Test that the callback never mixes deltas from two responses"""
+        monkeypatch.setattr(llm_client_module.settings, "LLM_HEDGE_INITIAL_DELAY_SECONDS", 0.05)
+        server = FakeLLMServer({"delay": 2, "chunks": ["slow"]}, {"chunks": ["fa", "st"]})
+        chunks = []
+        await send(server.client(hedging=True), on_text=chunks.append)
+        assert chunks == ["fa", "st"]
+
+    @pytest.mark.asyncio
+    async def test_fast_response_is_not_hedged(self, monkeypatch, metrics):
+        """Test that no hedge is sent when the first token is on time"""
+        monkeypatch.setattr(llm_client_module.settings, "LLM_HEDGE_INITIAL_DELAY_SECONDS", 0.5)
+        server = FakeLLMServer({})
+        await send(server.client(hedging=True))
+        assert server.requests == 1
+        assert metrics.get("llm_hedges") == 0
+
+    def test_hedge_delay_uses_observed_percentile(self, monkeypatch):
+        """Test the hedge delay switches from the initial value to the p95"""
+        monkeypatch.setattr(llm_client_module.settings, "LLM_HEDGE_MIN_SAMPLES", 20)
+        client = LLMClient()
+        assert client.hedge_delay(streamed=False) == llm_client_module.settings.LLM_HEDGE_INITIAL_DELAY_SECONDS
+
+        for latency in range(1, 101):
+            client.latencies[False].record(latency / 100)
+        assert client.hedge_delay(streamed=False) == 0.96
+        # Streamed calls keep their own samples
+        assert client.hedge_delay(streamed=True) == llm_client_module.settings.LLM_HEDGE_INITIAL_DELAY_SECONDS
@@ -0,0 +1,563 @@
+"""
+Unit tests for the LLM extraction service
+"""
+import json
+import pytest
+
+from app.services import llm_service
+from app.services.circuit_breaker import CircuitBreaker
+from app.services.llm_metrics import LLMMetrics
+from tests.test_rule_extractor import BOL_TEXT, make_documents
+from app.utils.document_segments import (
+    DocumentBundle,
+    ImageSegment,
+    ParsedDocument,
+    SheetSegment,
+    TextSegment
+)
+
+
+@pytest.fixture(autouse=True)
+def single_model(monkeypatch):
+    """Send every call to LLM_MODEL unless a test turns model tiering on"""
+    monkeypatch.setattr(llm_service.settings, "LLM_TIERING_ENABLED", False)
+
+
+@pytest.fixture(autouse=True)
+def breaker(monkeypatch):
+    """Give every test its own circuit breaker so failures do not leak between tests"""
+    breaker = CircuitBreaker(window=10, min_calls=2, failure_rate=0.5, slow_call_seconds=60, open_seconds=30)
+    monkeypatch.setattr(llm_service, "llm_breaker", breaker)
+    return breaker
+
+
+class FakeMessage:
+    """Minimal stand-in for an Anthropic Message"""
+
+    class _Block:
+        def __init__(self, text):
+            self.type = "text"
+            self.text = text
+
+    def __init__(self, text):
+        self.content = [self._Block(text)]
+        self.usage = None
+
+
+def make_bundle(with_image=False):
+    """Build a small BOL + invoice bundle"""
+    if with_image:
+        pdf_segments = [ImageSegment(data=b"\xff\xd8fake-jpeg", media_type="image/jpeg", page=0, source="bol.pdf")]
+    else:
+        pdf_segments = [TextSegment(text="B/L No: TEST123", page=0, source="bol.pdf")]
+
+    return DocumentBundle([
+        ParsedDocument("bol.pdf", "PDF", pdf_segments),
+        ParsedDocument("invoice.xlsx", "XLSX", [
+            SheetSegment(sheet_name="Invoice", text="S.No. | Item\n1 | Widget\n", source="invoice.xlsx")
+        ])
+    ])
+
+
+class TestExtractFieldFromDocument:
+    """Tests for building requests from typed segments"""
+
+    @pytest.mark.asyncio
+    async def test_text_documents_are_rendered_into_prompt(self, monkeypatch):
+        """Test that text-only bundles send a single text prompt"""
+        sent = {}
+
+        async def fake_create_message(**kwargs):
+            sent.update(kwargs)
+            return FakeMessage(json.dumps({"billOfLadingNumber": "TEST123"}))
+
+        monkeypatch.setattr(llm_service.llm_client, "create_message", fake_create_message)
+
+        result = await llm_service.extract_field_from_document(make_bundle())
+
+        prompt = sent["messages"][0]["content"]
+        assert "=== Document: bol.pdf (PDF) ===" in prompt
+        assert "=== Sheet: Invoice ===" in prompt
+        assert result["billOfLadingNumber"] == "TEST123"
+        assert result["containerNumber"] is None
+
+    @pytest.mark.asyncio
+    async def test_image_documents_send_image_blocks(self, monkeypatch):
+        """Test that page images become image blocks, encoded once"""
+        sent = {}
+
+        async def fake_create_message(**kwargs):
+            sent.update(kwargs)
+            return FakeMessage("```json\n{\"containerNumber\": \"MSCU1234567\"}\n```")
+
+        monkeypatch.setattr(llm_service.llm_client, "create_message", fake_create_message)
+
+        bundle = make_bundle(with_image=True)
+        result = await llm_service.extract_field_from_document(bundle)
+
+        content = sent["messages"][0]["content"]
+        assert content[0]["type"] == "image"
+        assert content[0]["source"]["media_type"] == "image/jpeg"
+        assert content[0]["source"]["data"] == bundle.images[0].base64()
+        assert "S.No. | Item" in content[-1]["text"]
+        assert "IMAGE_PDF" not in content[-1]["text"]
+        assert result["containerNumber"] == "MSCU1234567"
+
+    @pytest.mark.asyncio
+    async def test_computed_invoice_figures_override_llm(self, monkeypatch):
+        """Test that count and average price come from the XLSX analytics"""
+        async def fake_create_message(**kwargs):
+            return FakeMessage(json.dumps({"lineItemsCount": 17, "averagePrice": "$99.00"}))
+
+        monkeypatch.setattr(llm_service.llm_client, "create_message", fake_create_message)
+
+        bundle = make_bundle()
+        bundle.documents[1].segments.insert(0, SheetSegment(
+            sheet_name="Packing List", text="", analytics={"line_items_count": 3, "average_price": 1.0}
+        ))
+        bundle.documents[1].segments[1].analytics = {"line_items_count": 18, "average_price": 1234.5}
+
+        result = await llm_service.extract_field_from_document(bundle)
+
+        assert result["lineItemsCount"] == 18
+        assert result["averagePrice"] == "$1234.50"
+
+
+class TestPromptCaching:
+    """Tests for the cacheable instruction prefix"""
+
+    @pytest.mark.asyncio
+    async def test_instructions_are_a_cacheable_system_prefix(self, monkeypatch):
+        """Test that the static instructions are identical across shipments"""
+        systems = []
+
+        async def fake_create_message(**kwargs):
+            systems.append(kwargs["system"])
+            return FakeMessage("{}")
+
+        monkeypatch.setattr(llm_service.llm_client, "create_message", fake_create_message)
+
+        await llm_service.extract_field_from_document(make_bundle())
+        await llm_service.extract_field_from_document(make_documents(BOL_TEXT.replace("CSQU3054383", "")))
+
+        assert systems[0] == systems[1]
+        assert systems[0][0]["cache_control"] == {"type": "ephemeral"}
+        assert "8. averagePrice" in systems[0][0]["text"]
+
+
+class TestRuleBasedShortcut:
+    """Tests for skipping or narrowing the LLM call"""
+
+    @pytest.mark.asyncio
+    async def test_complete_rule_extraction_skips_llm(self, monkeypatch):
+        """Test that Claude is not called when every field is found locally"""
+        async def fail_create_message(**kwargs):
+            raise AssertionError("LLM should not be called")
+
+        monkeypatch.setattr(llm_service.llm_client, "create_message", fail_create_message)
+
+        report = {}
+        result = await llm_service.extract_field_from_document(make_documents(), report=report)
+
+        assert result["containerNumber"] == "CSQU3054383"
+        assert result["averageGrossWeight"] == "902.78 KG"
+        assert report["llm_fields"] == []
+
+    @pytest.mark.asyncio
+    async def test_only_missing_fields_are_requested(self, monkeypatch):
+        """Test that the prompt only asks for fields the rules did not find"""
+        sent = {}
+
+        async def fake_create_message(**kwargs):
+            sent.update(kwargs)
+            return FakeMessage(json.dumps({"containerNumber": "CSQU3054383", "billOfLadingNumber": "IGNORED"}))
+
+        monkeypatch.setattr(llm_service.llm_client, "create_message", fake_create_message)
+
+        documents = make_documents(BOL_TEXT.replace("CONTAINER NO: CSQU3054383\n", ""))
+        report = {}
+        result = await llm_service.extract_field_from_document(documents, report=report)
+
+        prompt = sent["messages"][0]["content"]
+        assert "Only extract these fields: containerNumber\n" in prompt
+        assert report["prompt"]["tokens_after"] <= report["prompt"]["tokens_before"]
+        assert "- billOfLadingNumber: ZMLU34110002" in prompt
+        assert result["containerNumber"] == "CSQU3054383"
+        assert result["billOfLadingNumber"] == "ZMLU34110002"
+
+
+class TestStreamedFields:
+    """Tests for progress events during extraction"""
+
+    @pytest.mark.asyncio
+    async def test_rule_and_llm_fields_are_emitted(self, monkeypatch):
+        """Test that rule fields come first, then LLM fields as the response streams"""
+        events = []
+
+        async def fake_create_message(on_text=None, **kwargs):
+            response = json.dumps({"containerNumber": "CSQU3054383", "billOfLadingNumber": "IGNORED"})
+            for start in range(0, len(response), 7):
+                on_text(response[start:start + 7])
+            return FakeMessage(response)
+
+        monkeypatch.setattr(llm_service.llm_client, "create_message", fake_create_message)
+
+        documents = make_documents(BOL_TEXT.replace("CONTAINER NO: CSQU3054383\n", ""))
+        await llm_service.extract_field_from_document(
+            documents, on_event=lambda event, data: events.append((event, data))
+        )
+
+        started = events.index(next(e for e in events if e[0] == "llm_started"))
+        rule_fields = [data["name"] for event, data in events[:started] if event == "field"]
+        llm_fields = [data for event, data in events[started + 1:] if event == "field"]
+
+        assert "billOfLadingNumber" in rule_fields
+        assert events[started][1]["fields"] == ["containerNumber"]
+        # Fields the LLM was not asked for are not reported
+        assert llm_fields == [{"name": "containerNumber", "value": "CSQU3054383", "source": "llm"}]
+
+
+class FakeToolMessage:
+    """Stand-in for a response that calls the extraction tool"""
+
+    class _ToolUse:
+        def __init__(self, data, block_id):
+            self.type = "tool_use"
+            self.id = block_id
+            self.name = llm_service.EXTRACTION_TOOL_NAME
+            self.input = data
+
+    def __init__(self, data, block_id="toolu_1"):
+        self.content = [self._ToolUse(data, block_id)]
+        self.usage = None
+
+
+class TestStructuredOutput:
+    """Tests for tool-call output, the repair path and parse metrics"""
+
+    @pytest.fixture(autouse=True)
+    def metrics(self, monkeypatch):
+        """Fresh counters for each test"""
+        metrics = LLMMetrics()
+        monkeypatch.setattr(llm_service, "llm_metrics", metrics)
+        return metrics
+
+    @pytest.mark.asyncio
+    async def test_fields_come_from_the_tool_call(self, monkeypatch, metrics):
+        """Test that the tool is forced and its input is used as the result"""
+        sent = {}
+
+        async def fake_create_message(**kwargs):
+            sent.update(kwargs)
+            return FakeToolMessage({"billOfLadingNumber": "TEST123", "lineItemsCount": "1"})
+
+        monkeypatch.setattr(llm_service.llm_client, "create_message", fake_create_message)
+
+        result = await llm_service.extract_field_from_document(make_bundle())
+
+        assert sent["tools"] == [llm_service.EXTRACTION_TOOL]
+        assert sent["tool_choice"] == {"type": "tool", "name": "record_shipment_data"}
+        assert result["billOfLadingNumber"] == "TEST123"
+        assert metrics.stats()["responses"] == 1
+        assert metrics.stats()["parse_failure_rate"] == 0.0
+
+    @pytest.mark.asyncio
+    async def test_only_malformed_fields_are_re_asked(self, monkeypatch, metrics):
+        """Test that a malformed field gets one follow-up call for just that field"""
+        calls = []
+
+        async def fake_create_message(**kwargs):
+            calls.append(kwargs)
+            if len(calls) == 1:
+                return FakeToolMessage({"billOfLadingNumber": "TEST123", "dateOfExport": "2019-08-22"})
+            return FakeToolMessage({"dateOfExport": "08/22/2019"}, block_id="toolu_2")
+
+        monkeypatch.setattr(llm_service.llm_client, "create_message", fake_create_message)
+
+        report = {}
+        result = await llm_service.extract_field_from_document(make_bundle(), report=report)
+
+        assert len(calls) == 2
+        repair_turn = calls[1]["messages"][-1]["content"][0]
+        assert repair_turn["type"] == "tool_result"
+        assert repair_turn["tool_use_id"] == "toolu_1"
+        assert "- dateOfExport: expected MM/DD/YYYY (got \"2019-08-22\")" in repair_turn["content"]
+        assert "billOfLadingNumber" not in repair_turn["content"]
+        assert result["dateOfExport"] == "08/22/2019"
+        assert result["billOfLadingNumber"] == "TEST123"
+        assert report["structured_output"] == {
+            "malformed_fields": ["dateOfExport"],
+            "repair_calls": 1,
+            "unrepaired_fields": []
+        }
+        assert metrics.stats()["malformed_response_rate"] == 1.0
+
+    @pytest.mark.asyncio
+    async def test_repairs_are_bounded(self, monkeypatch, metrics):
+        """Test that a field that stays malformed does not cause endless calls"""
+        calls = []
+
+        async def fake_create_message(**kwargs):
+            calls.append(kwargs)
+            return FakeToolMessage({"averagePrice": "about 12 dollars"})
+
+        monkeypatch.setattr(llm_service.llm_client, "create_message", fake_create_message)
+        monkeypatch.setattr(llm_service.settings, "LLM_REPAIR_ATTEMPTS", 2)
+
+        result = await llm_service.extract_field_from_document(make_bundle())
+
+        assert len(calls) == 3
+        assert result["averagePrice"] == "about 12 dollars"
+        assert metrics.get("unrepaired_fields") == 1
+
+    @pytest.mark.asyncio
+    async def test_prose_response_counts_as_parse_failure(self, monkeypatch, metrics):
+        """Test that a response without structured output is recorded and repaired"""
+        calls = []
+
+        async def fake_create_message(**kwargs):
+            calls.append(kwargs)
+            if len(calls) == 1:
+                return FakeMessage("Sorry, I could not find the fields.")
+            return FakeToolMessage({"billOfLadingNumber": "TEST123"})
+
+        monkeypatch.setattr(llm_service.llm_client, "create_message", fake_create_message)
+
+        result = await llm_service.extract_field_from_document(make_bundle())
+
+        assert result["billOfLadingNumber"] == "TEST123"
+        assert metrics.stats()["parse_failure_rate"] == 1.0
+        assert calls[1]["messages"][-1]["content"][0]["type"] == "text"
+
+
+class TestCircuitBreakerFallback:
+    """Tests for the degraded local-only path while the LLM circuit is open"""
+
+    @pytest.mark.asyncio
+    async def test_failures_open_the_circuit_and_skip_the_llm(self, monkeypatch, breaker):
+        """Test that after repeated failures the rule result is returned without calling Claude"""
+        calls = []
+
+        async def failing_create_message(**kwargs):
+            calls.append(kwargs)
+            raise Exception("LLM API call failed: overloaded")
+
+        monkeypatch.setattr(llm_service.llm_client, "create_message", failing_create_message)
+        metrics = LLMMetrics()
+        monkeypatch.setattr(llm_service, "llm_metrics", metrics)
+
+        documents = make_documents(BOL_TEXT.replace("CONTAINER NO: CSQU3054383\n", ""))
+        for _ in range(2):
+            with pytest.raises(Exception):
+                await llm_service.extract_field_from_document(documents)
+        assert breaker.state == "open"
+
+        events = []
+        report = {}
+        result = await llm_service.extract_field_from_document(
+            documents, report=report, on_event=lambda event, data: events.append((event, data))
+        )
+
+        assert len(calls) == 2
+        assert result["billOfLadingNumber"] == "ZMLU34110002"
+        assert result["containerNumber"] is None
+        assert report["degraded"]["reason"] == "llm_circuit_open"
+        assert "containerNumber" in report["degraded"]["missing_fields"]
+        assert events[-1] == ("degraded", report["degraded"])
+        assert metrics.get("degraded_responses") == 1
+
+    @pytest.mark.asyncio
+    async def test_successful_calls_are_recorded(self, monkeypatch, breaker):
+        """Test that a normal LLM call is counted as healthy"""
+        async def fake_create_message(**kwargs):
+            return FakeMessage(json.dumps({"billOfLadingNumber": "TEST123"}))
+
+        monkeypatch.setattr(llm_service.llm_client, "create_message", fake_create_message)
+
+        report = {}
+        await llm_service.extract_field_from_document(make_bundle(), report=report)
+
+        assert breaker.stats()["window_calls"] == 1
+        assert breaker.stats()["window_unhealthy"] == 0
+        assert "degraded" not in report
+
+    @pytest.mark.asyncio
+    async def test_cancelled_probe_frees_the_probe_slot(self, monkeypatch):
+        """Test that a half-open probe cancelled mid-call (client gone) lets the next call probe"""
+        import asyncio
+
+        breaker = CircuitBreaker(window=10, min_calls=2, failure_rate=0.5, slow_call_seconds=60, open_seconds=0)
+        monkeypatch.setattr(llm_service, "llm_breaker", breaker)
+        breaker.record_failure()
+        breaker.record_failure()
+        assert breaker.state == "half_open"
+
+        started = asyncio.Event()
+
+        async def hanging_create_message(**kwargs):
+            started.set()
+            await asyncio.Event().wait()
+
+        monkeypatch.setattr(llm_service.llm_client, "create_message", hanging_create_message)
+
+        probe = asyncio.ensure_future(llm_service.extract_field_from_document(make_bundle()))
+        await started.wait()
+        probe.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await probe
+
+        assert breaker.state == "half_open"
+        assert breaker.stats()["times_opened"] == 1
+        assert breaker.allow()
+
+
+class TestModelTiering:
+    """Tests for fast model first, large model for failed fields"""
+
+    @pytest.fixture(autouse=True)
+    def tiers(self, monkeypatch):
+        """Enable tiering with distinct test models and fresh metrics"""
+        monkeypatch.setattr(llm_service.settings, "LLM_TIERING_ENABLED", True)
+        monkeypatch.setattr(llm_service.settings, "LLM_FAST_MODEL", "fast-model")
+        monkeypatch.setattr(llm_service.settings, "LLM_MODEL", "large-model")
+        metrics = LLMMetrics()
+        monkeypatch.setattr(llm_service, "llm_metrics", metrics)
+        return metrics
+
+    @staticmethod
+    def fake_models(monkeypatch, answers):
+        """Answer each model with its own tool call data; returns the calls made"""
+        calls = []
+
+        async def fake_create_message(**kwargs):
+            calls.append(kwargs)
+            return FakeToolMessage(answers[kwargs["model"]])
+
+        monkeypatch.setattr(llm_service.llm_client, "create_message", fake_create_message)
+        return calls
+
+    @pytest.mark.asyncio
+    async def test_valid_fast_answer_is_not_escalated(self, monkeypatch, tiers):
+        """Test that a clean fast model answer needs a single call"""
+        calls = self.fake_models(monkeypatch, {"fast-model": {"containerNumber": "CSQU3054383"}})
+
+        report = {}
+        documents = make_documents(BOL_TEXT.replace("CONTAINER NO: CSQU3054383\n", ""))
+        result = await llm_service.extract_field_from_document(documents, report=report)
+
+        assert [call["model"] for call in calls] == ["fast-model"]
+        assert result["containerNumber"] == "CSQU3054383"
+        assert report["tiers"]["escalated_fields"] == {}
+        assert tiers.stats()["escalation_rate"] == 0.0
+
+    @pytest.mark.asyncio
+    async def test_invalid_field_is_escalated_alone(self, monkeypatch, tiers):
+        """Test that only the field failing ShipmentValidator goes to the large model"""
+        calls = self.fake_models(monkeypatch, {
+            "fast-model": {"containerNumber": "CSQU3054384", "dateOfExport": "03/15/2024"},
+            "large-model": {"containerNumber": "CSQU3054383"}
+        })
+
+        events = []
+        report = {}
+        documents = make_documents(
+            BOL_TEXT.replace("CONTAINER NO: CSQU3054383\n", "").replace("SHIPPED ON BOARD DATE: 15-Mar-2024\n", "")
+        )
+        result = await llm_service.extract_field_from_document(
+            documents, report=report, on_event=lambda event, data: events.append((event, data))
+        )
+
+        assert [call["model"] for call in calls] == ["fast-model", "large-model"]
+        assert "Only extract these fields: containerNumber\n" in calls[1]["messages"][0]["content"]
+        assert "- dateOfExport: 03/15/2024" in calls[1]["messages"][0]["content"]
+        assert result["containerNumber"] == "CSQU3054383"
+        assert result["dateOfExport"] == "03/15/2024"
+        assert "check digit" in report["tiers"]["escalated_fields"]["containerNumber"]
+        assert ("llm_escalated", {
+            "fields": ["containerNumber"],
+            "model": "large-model",
+            "reasons": report["tiers"]["escalated_fields"]
+        }) in events
+        assert tiers.stats()["escalation_rate"] == 1.0
+
+    @pytest.mark.asyncio
+    async def test_scanned_documents_go_to_large_model(self, monkeypatch, tiers):
+        """Test that vision inputs skip the fast model"""
+        calls = self.fake_models(monkeypatch, {"large-model": {"billOfLadingNumber": "TEST123"}})
+
+        await llm_service.extract_field_from_document(make_bundle(with_image=True))
+
+        assert [call["model"] for call in calls] == ["large-model"]
+
+    def test_average_weight_must_match_document_total(self):
+        """Test the cross-field check of average weight x line items against the BOL total"""
+        documents = make_documents()
+        consistent = {"lineItemsCount": 18, "averageGrossWeight": "902.78 KG"}
+        inconsistent = {"lineItemsCount": 18, "averageGrossWeight": "500.00 KG"}
+
+        assert llm_service.find_inconsistent_fields(consistent, ["averageGrossWeight"], documents) == {}
+        problems = llm_service.find_inconsistent_fields(inconsistent, ["averageGrossWeight"], documents)
+        assert "16250.00 KG" in problems["averageGrossWeight"]
+
+
+class TestReextractFields:
+    """Tests for re-extracting a subset of fields"""
+
+    @staticmethod
+    def make_shipment():
+        """Two-page BOL plus invoice and packing list sheets"""
+        return DocumentBundle([
+            ParsedDocument("bol.pdf", "PDF", [
+                TextSegment(text=BOL_TEXT, page=0),
+                TextSegment(text="TERMS AND CONDITIONS OF CARRIAGE\n" * 50, page=1)
+            ]),
+            ParsedDocument("invoice.xlsx", "XLSX", [
+                SheetSegment(sheet_name="Invoice", text="COMPUTED INVOICE FIGURES (exact):\n- lineItemsCount: 18\n",
+                             analytics={"line_items_count": 18, "average_price": 1234.5}),
+                SheetSegment(sheet_name="Packing List", text="1 | Widget | 10 CTNS\n" * 50)
+            ])
+        ])
+
+    @pytest.mark.asyncio
+    async def test_only_relevant_pages_are_sent(self, monkeypatch):
+        """Test the minimal prompt and the merge into the current result"""
+        sent = []
+
+        async def fake_create_message(**kwargs):
+            sent.append(kwargs)
+            return FakeToolMessage({"consigneeAddress": "3838 CAMINO DEL RIO NORTH, SAN DIEGO, CA 92108"})
+
+        monkeypatch.setattr(llm_service.llm_client, "create_message", fake_create_message)
+
+        current = {name: None for name in llm_service.EXPECTED_FIELDS}
+        current.update({"billOfLadingNumber": "ZMLU34110002", "consigneeAddress": "KABOFER"})
+        report = {}
+        result = await llm_service.reextract_fields(self.make_shipment(), ["consigneeAddress"], current, report=report)
+
+        prompt = sent[0]["messages"][0]["content"]
+        assert len(sent) == 1
+        assert "Only extract these fields: consigneeAddress\n" in prompt
+        assert "- billOfLadingNumber: ZMLU34110002" in prompt
+        assert "TERMS AND CONDITIONS" not in prompt
+        assert "Widget" not in prompt
+        assert report["sections"] == {"selected": 1, "total": 4}
+        assert result["consigneeAddress"] == "3838 CAMINO DEL RIO NORTH, SAN DIEGO, CA 92108"
+        assert result["billOfLadingNumber"] == "ZMLU34110002"
+
+    @pytest.mark.asyncio
+    async def test_computed_fields_skip_the_llm(self, monkeypatch):
+        """Test that invoice figures are recomputed without a call"""
+        async def fail_create_message(**kwargs):
+            raise AssertionError("LLM should not be called")
+
+        monkeypatch.setattr(llm_service.llm_client, "create_message", fail_create_message)
+
+        result = await llm_service.reextract_fields(self.make_shipment(), ["averagePrice"], {"averagePrice": "$1.00"})
+
+        assert result == {"averagePrice": "$1234.50"}
+
+    @pytest.mark.asyncio
+    async def test_unknown_field_is_rejected(self):
+        """Test that only extractable fields can be requested"""
+        with pytest.raises(ValueError):
+            await llm_service.reextract_fields(self.make_shipment(), ["vesselName"], {})
@@ -0,0 +1,228 @@
+"""
+Unit tests for the parse pool watchdog (deadlines, memory cap, crashes, fallbacks)
+"""
+import os
+import time
+
+import pytest
+
+from app.services import document_processor
+from app.services.document_processor import process_documents
+from app.services.parse_pool import ParsePool
+from app.utils.document_segments import SheetSegment
+
+
+# Parse calls run in spawned workers, so they have to be importable module functions
+
+def _sleep(seconds):
+    time.sleep(seconds)
+    return seconds
+
+
+def _allocate(megabytes):
+    return len(bytearray(megabytes * 1024 * 1024))
+
+
+def _crash():
+    os._exit(1)
+
+
+def _fail():
+    raise ValueError("broken file")
+
+
+def _hanging_pdf_text(path, start=0, end=None, backend=None):
+    time.sleep(30)
+
+
+def _hanging_xlsx(path):
+    time.sleep(30)
+
+
+def _hanging_page_count(path):
+    time.sleep(30)
+
+
+@pytest.fixture
+def make_pool():
+    pools = []
+
+    def make(**options):
+        pool = ParsePool(**{"max_workers": 2, "start_method": "spawn", "isolate": True,
+                            "timeout": 30.0, "memory_limit_mb": 0, **options})
+        pools.append(pool)
+        return pool
+
+    yield make
+    for pool in pools:
+        pool.shutdown()
+
+
+class TestParseWatchdog:
+    """Tests for guarded parse calls"""
+
+    def test_call_over_deadline_is_killed_and_others_finish(self, make_pool):
+        """Test that a hanging call times out without failing the calls beside it"""
+        pool = make_pool(timeout=0.5)
+
+        started = time.monotonic()
+        results = pool.map_guarded([(_sleep, (30,)), (_sleep, (0.01,)), (_sleep, (0.02,))])
+
+        assert time.monotonic() - started < 15
+        assert results[0].failure == "timeout"
+        assert [result.value for result in results[1:]] == [0.01, 0.02]
+        assert pool.stats()["timeouts"] == 1
+        assert pool.stats()["kills"] == 1
+        # The pool restarts for the next request
+        assert pool.map_guarded([(_sleep, (0.01,))])[0].value == 0.01
+
+    def test_call_queued_behind_a_hang_is_not_blamed(self, make_pool):
+        """Test that the deadline counts from when a call starts, not when it was queued"""
+        pool = make_pool(max_workers=1, timeout=0.5)
+
+        results = pool.map_guarded([(_sleep, (30,)), (_sleep, (0.01,))])
+
+        assert results[0].failure == "timeout"
+        assert results[1].ok
+        assert results[1].seconds < 0.5
+
+    def test_memory_cap_fails_only_the_greedy_call(self, make_pool):
+        """Test that allocating past RLIMIT_AS fails the call, not the pool"""
+        pool = make_pool(max_workers=1, memory_limit_mb=1024)
+
+        results = pool.map_guarded([(_allocate, (4096,)), (_allocate, (16,))])
+
+        assert results[0].failure == "memory"
+        assert results[1].value == 16 * 1024 * 1024
+        assert pool.stats()["memory_errors"] == 1
+
+    def test_crashing_call_is_singled_out(self, make_pool):
+        """Test that only the call that kills its worker is reported as crashed"""
+        pool = make_pool()
+
+        results = pool.map_guarded([(_crash, ()), (_sleep, (0.01,))])
+
+        assert results[0].failure == "crashed"
+        assert results[1].value == 0.01
+        assert pool.stats()["crashes"] == 1
+
+    def test_pool_shut_down_by_another_request_is_replaced(self, make_pool):
+        """Test that calls submitted to a pool another thread just discarded are run in a new one"""
+        pool = make_pool()
+        get_executor = pool._get_executor
+        discarded = []
+
+        def stale_executor():
+            executor, generation = get_executor()
+            if not discarded:
+                # Another request's watchdog drops the pool between lookup and submit
+                pool._discard(executor)
+                discarded.append(executor)
+            return executor, generation
+
+        pool._get_executor = stale_executor
+
+        results = pool.map_guarded([(_sleep, (0.01,)), (_sleep, (0.02,))])
+
+        assert [result.value for result in results] == [0.01, 0.02]
+        assert pool.stats()["crashes"] == 0
+
+    def test_exceptions_are_returned_not_raised(self, make_pool):
+        """Test failures of the parser itself, isolated and inline"""
+        for pool in (make_pool(), ParsePool(max_workers=0)):
+            result = pool.map_guarded([(_fail, ())])[0]
+            assert result.failure == "error"
+            assert "broken file" in result.detail
+
+
+class TestParseFallbacks:
+    """Tests for process_documents when a parser blows its budget"""
+
+    @pytest.fixture
+    def pool(self, make_pool, monkeypatch):
+        pool = make_pool(max_workers=1, timeout=0.5)
+        monkeypatch.setattr(document_processor, "parse_pool", pool)
+        return pool
+
+    def test_pdf_falls_back_to_rendering(self, pool, monkeypatch, tmp_path):
+        """Test that a PDF whose text parser hangs is rendered instead, and not cached"""
+        from reportlab.pdfgen import canvas
+
+        monkeypatch.setattr(document_processor, "extract_pdf_page_range", _hanging_pdf_text)
+        puts = []
+        monkeypatch.setattr(document_processor.document_cache, "get", lambda *args: None)
+        monkeypatch.setattr(document_processor.document_cache, "put", lambda *args: puts.append(args))
+
+        pdf_path = str(tmp_path / "bol.pdf")
+        c = canvas.Canvas(pdf_path)
+        c.drawString(100, 750, "BILL OF LADING - B/L No: SLOW123 - SHIPPER: CHINA ABRASIVES EXPORT CORP")
+        c.save()
+
+        events = []
+        result = process_documents([pdf_path], on_stage=lambda stage, details: events.append((stage, details)))
+
+        assert result.has_images
+        assert result.documents[0].parse_fallback == "render_only"
+        assert ("parse_fallback", {"file": "bol.pdf", "reason": "timeout", "fallback": "render_only"}) in events
+        assert result.parse_report()[0]["seconds"] >= 0.5
+        assert puts == []
+
+    def test_pdf_that_hangs_on_open_is_unreadable(self, pool, monkeypatch, tmp_path):
+        """Test that the page count runs under the deadline and fails only its own file"""
+        import openpyxl
+
+        monkeypatch.setattr(document_processor, "count_pdf_pages", _hanging_page_count)
+        monkeypatch.setattr(document_processor.document_cache, "enabled", False)
+
+        pdf_path = tmp_path / "hostile.pdf"
+        pdf_path.write_bytes(b"%PDF-1.4\n")
+        xlsx_path = str(tmp_path / "invoice.xlsx")
+        openpyxl.Workbook().save(xlsx_path)
+
+        events = []
+        result = process_documents([str(pdf_path), xlsx_path], on_stage=lambda stage, details: events.append((stage, details)))
+
+        pdf, xlsx = result.documents
+        assert pdf.parse_fallback == "unreadable"
+        assert xlsx.parse_fallback is None
+        assert ("parse_fallback", {"file": "hostile.pdf", "reason": "timeout", "fallback": "unreadable"}) in events
+
+    def test_spreadsheet_is_skipped(self, pool, monkeypatch, tmp_path):
+        """Test that a hanging spreadsheet is left out while the other files parse"""
+        import openpyxl
+        from reportlab.pdfgen import canvas
+
+        monkeypatch.setattr(document_processor, "extract_xlsx_sheets", _hanging_xlsx)
+        monkeypatch.setattr(document_processor.document_cache, "enabled", False)
+
+        xlsx_path = str(tmp_path / "invoice.xlsx")
+        openpyxl.Workbook().save(xlsx_path)
+        pdf_path = str(tmp_path / "bol.pdf")
+        c = canvas.Canvas(pdf_path)
+        c.drawString(100, 750, "BILL OF LADING - B/L No: FAST123 - SHIPPER: CHINA ABRASIVES EXPORT CORP")
+        c.save()
+
+        result = process_documents([pdf_path, xlsx_path])
+
+        pdf, xlsx = result.documents
+        assert "FAST123" in pdf.segments[0].text
+        assert pdf.parse_fallback is None
+        assert xlsx.parse_fallback == "skipped"
+        assert isinstance(xlsx.segments[0], SheetSegment)
+        assert "could not be parsed: timeout" in result.render_text()
+
+    def test_stats_endpoint_reports_budgets_and_kills(self, pool, monkeypatch):
+        """Test the admin view of the parse pool"""
+        from fastapi.testclient import TestClient
+        from app.api import routes
+        from main import app
+
+        monkeypatch.setattr(routes, "parse_pool", pool)
+        pool.map_guarded([(_sleep, (30,))])
+
+        stats = TestClient(app).get("/api/admin/parse/stats").json()["stats"]
+
+        assert stats["isolated"] is True
+        assert stats["timeout_seconds"] == 0.5
+        assert stats["timeouts"] == 1
+        assert stats["kills"] == 1
@@ -0,0 +1,98 @@
+"""
+Unit tests for prompt compaction
+"""
+from app.services.prompt_compactor import compact_documents, compact_text, select_sections
+from app.utils.document_segments import DocumentBundle, ImageSegment, ParsedDocument, SheetSegment, TextSegment
+
+
+def make_workbook(rows=2000):
+    """Invoice workbook with a large detail sheet, a duplicate and a terms sheet"""
+    detail = "".join(f"{i} |  |  | Widget {i} |  | 10 | 1.50 |  | \n" for i in range(1, rows + 1))
+    return DocumentBundle([
+        ParsedDocument("bol.pdf", "PDF", [
+            TextSegment(text="CONSIGNEE:\nKABOFER TRADING INC\n\nTOTAL GROSS WEIGHT:   16250 KGS", page=0)
+        ]),
+        ParsedDocument("invoice.xlsx", "XLSX", [
+            SheetSegment(sheet_name="Invoice", text="SHIP TO: | KABOFER\nCOMPUTED INVOICE FIGURES (exact):\n- lineItemsCount: 18\n"),
+            SheetSegment(sheet_name="Invoice (copy)", text="SHIP TO: | KABOFER\nCOMPUTED INVOICE FIGURES (exact):\n- lineItemsCount: 18\n"),
+            SheetSegment(sheet_name="Terms", text="Payment within 30 days\n"),
+            SheetSegment(sheet_name="Details", text=detail)
+        ])
+    ])
+
+
+class TestCompactText:
+    """Tests for whitespace and empty cell collapsing"""
+
+    def test_collapses_empty_cells_and_whitespace(self):
+        """Test that runs of empty cells and spaces become single separators"""
+        assert compact_text("A  |  |  | B |   \n\n  C\t\tD | | ") == "A | B\nC D"
+
+
+class TestCompactDocuments:
+    """Tests for budgeted document text"""
+
+    def test_drops_duplicate_and_irrelevant_sheets(self):
+        """Test that duplicate and terms sheets are not sent"""
+        result = compact_documents(make_workbook(rows=5), budget=0)
+
+        assert "=== Sheet: Invoice ===" in result.text
+        assert "Invoice (copy)" not in result.text
+        assert "Payment within 30 days" not in result.text
+        assert set(result.dropped) == {"invoice.xlsx:Invoice (copy)", "invoice.xlsx:Terms"}
+        assert "=== Document: bol.pdf (PDF) ===" in result.text
+
+    def test_keeps_key_sections_under_budget(self):
+        """Test that the consignee block and figures survive while bulk rows are trimmed"""
+        result = compact_documents(make_workbook(rows=2000), budget=1500)
+
+        assert result.tokens_before > 10000
+        assert result.tokens_after <= 1500 + 100  # document headers are not budgeted
+        assert "KABOFER TRADING INC" in result.text
+        assert "16250 KGS" in result.text
+        assert "- lineItemsCount: 18" in result.text
+        assert "lines omitted]" in result.text
+        assert result.trimmed == ["=== Sheet: Details ==="]
+
+    def test_page_notes_survive_compaction(self, monkeypatch):
+        """Test that the render limit note reaches the compacted prompt without using the budget"""
+        from app.services import llm_service
+
+        document = ParsedDocument("scanned.pdf", "PDF", [
+            TextSegment(text="BILL OF LADING\n" + "cargo line\n" * 400, page=0),
+            ImageSegment(data=b"\xff\xd8", media_type="image/jpeg", page=1)
+        ], unrendered_pages=[5, 6])
+        monkeypatch.setattr(llm_service.settings, "PROMPT_COMPACTION_ENABLED", True)
+        monkeypatch.setattr(llm_service.settings, "PROMPT_TOKEN_BUDGET", 100)
+
+        text = llm_service.prepare_document_text(DocumentBundle([document]))
+
+        assert "lines omitted]" in text
+        assert "[Scanned pages not attached (render limit): 6, 7]" in text
+
+
+class TestSelectSections:
+    """Tests for picking the pages/sheets relevant to some fields"""
+
+    def test_keeps_only_matching_sections(self):
+        """Test that a consignee re-extraction leaves out the invoice detail sheets"""
+        selected = select_sections(make_workbook(rows=5), ["consigneeAddress"])
+
+        names = [getattr(segment, "sheet_name", "page") for segment in selected.segments]
+        assert names == ["page", "Invoice", "Invoice (copy)"]
+
+    def test_images_are_always_kept(self):
+        """Test that page images survive selection"""
+        documents = DocumentBundle([
+            ParsedDocument("scan.pdf", "PDF", [ImageSegment(data=b"jpeg", media_type="image/jpeg", page=0)]),
+            ParsedDocument("invoice.xlsx", "XLSX", [SheetSegment(sheet_name="Invoice", text="SHIP TO: | KABOFER\n")])
+        ])
+        selected = select_sections(documents, ["consigneeName"])
+
+        assert len(selected.images) == 1
+        assert len(selected.segments) == 2
+
+    def test_no_match_returns_everything(self):
+        """Test the fallback when no section mentions the fields"""
+        documents = DocumentBundle([ParsedDocument("notes.pdf", "PDF", [TextSegment(text="Hello", page=0)])])
+        assert select_sections(documents, ["containerNumber"]) is documents
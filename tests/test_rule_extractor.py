@@ -0,0 +1,117 @@
+"""
+Unit tests for the rule-based pre-extraction stage
+"""
+from app.services.rule_extractor import extract_with_rules, normalize_date
+from app.services.validators import ShipmentValidator
+from app.utils.document_segments import DocumentBundle, ParsedDocument, SheetSegment, TextSegment
+
+BOL_TEXT = """BILL OF LADING
+B/L No: ZMLU34110002
+SHIPPER
+ACME EXPORTS LTD
+CONSIGNEE:
+KABOFER TRADING INC
+3838 CAMINO DEL RIO NORTH, STE 235
+SAN DIEGO, CA 92108, USA
+NOTIFY PARTY
+SAME AS CONSIGNEE
+CONTAINER NO: CSQU3054383
+SHIPPED ON BOARD DATE: 15-Mar-2024
+TOTAL GROSS WEIGHT: 16,250.00 KGS
+"""
+
+
+def make_documents(pdf_text=BOL_TEXT, analytics=None):
+    """BOL text plus an invoice sheet with computed figures"""
+    analytics = analytics or {"line_items_count": 18, "average_price": 1234.5}
+    return DocumentBundle([
+        ParsedDocument("bol.pdf", "PDF", [TextSegment(text=pdf_text, page=0)]),
+        ParsedDocument("invoice.xlsx", "XLSX", [
+            SheetSegment(sheet_name="Invoice", text="SHIP TO: | KABOFER TRADING INC\n", analytics=analytics)
+        ])
+    ])
+
+
+class TestContainerCheckDigit:
+    """Tests for ISO 6346 check digit validation"""
+
+    def test_valid_check_digit(self):
+        """Test that a correct check digit passes"""
+        assert ShipmentValidator.container_check_digit("CSQU305438") == 3
+        assert ShipmentValidator.validate_container_check_digit("CSQU3054383") is None
+
+    def test_invalid_check_digit(self):
+        """Test that a wrong check digit is reported"""
+        error = ShipmentValidator.validate_container_check_digit("CSQU3054384")
+        assert "check digit" in error
+
+
+class TestRuleExtraction:
+    """Tests for locally extracted fields and confidence"""
+
+    def test_well_formed_bol_is_complete(self):
+        """Test that all eight fields are found in a clean text layer"""
+        result = extract_with_rules(make_documents())
+
+        assert result.complete
+        assert result.accepted == {
+            "billOfLadingNumber": "ZMLU34110002",
+            "containerNumber": "CSQU3054383",
+            "consigneeName": "KABOFER TRADING INC",
+            "consigneeAddress": "3838 CAMINO DEL RIO NORTH, STE 235, SAN DIEGO, CA 92108, USA",
+            "dateOfExport": "03/15/2024",
+            "lineItemsCount": 18,
+            "averageGrossWeight": "902.78 KG",
+            "averagePrice": "$1234.50"
+        }
+
+    def test_bad_check_digit_is_left_to_llm(self):
+        """Test that a container number with a wrong check digit is not accepted"""
+        result = extract_with_rules(make_documents(BOL_TEXT.replace("CSQU3054383", "CSQU3054384")))
+
+        assert result.matches["containerNumber"].confidence < result.min_confidence
+        assert result.missing == ["containerNumber"]
+
+    def test_missing_invoice_figures(self):
+        """Test that count-based fields are missing without invoice analytics"""
+        documents = DocumentBundle([ParsedDocument("bol.pdf", "PDF", [TextSegment(text=BOL_TEXT, page=0)])])
+
+        result = extract_with_rules(documents)
+
+        assert result.missing == ["lineItemsCount", "averageGrossWeight", "averagePrice"]
+
+    def test_consignee_name_on_the_label_line_is_not_trusted(self):
+        """Test that "CONSIGNEE <name>" without a colon keeps the name but leaves it to the LLM"""
+        text = BOL_TEXT.replace("CONSIGNEE:\nKABOFER TRADING INC", "CONSIGNEE KABOFER TRADING INC")
+
+        result = extract_with_rules(make_documents(text))
+
+        assert result.matches["consigneeName"].value == "KABOFER TRADING INC"
+        assert result.matches["consigneeName"].confidence < result.min_confidence
+        assert result.matches["consigneeAddress"].confidence < result.min_confidence
+        assert "consigneeName" in result.missing
+
+    def test_consignee_heading_above_the_value(self):
+        """Test a bare CONSIGNEE heading (with a qualifier) whose value is on the next lines"""
+        text = BOL_TEXT.replace("CONSIGNEE:", "CONSIGNEE (NAME AND ADDRESS)")
+
+        result = extract_with_rules(make_documents(text))
+
+        assert result.accepted["consigneeName"] == "KABOFER TRADING INC"
+        assert result.accepted["consigneeAddress"].startswith("3838 CAMINO DEL RIO NORTH")
+
+    def test_year_after_bol_label_is_not_a_bol_number(self):
+        """Test that short or all-digit values such as "BOL NUMBER 2019" are left to the LLM"""
+        text = BOL_TEXT.replace("B/L No: ZMLU34110002", "BOL NUMBER 2019")
+
+        result = extract_with_rules(make_documents(text))
+
+        assert result.matches["billOfLadingNumber"].confidence < result.min_confidence
+        assert "billOfLadingNumber" in result.missing
+
+    def test_normalize_date(self):
+        """Test date normalization and ambiguity scoring"""
+        assert normalize_date("2024-03-15") == ("03/15/2024", 0.95)
+        assert normalize_date("15/03/2024")[0] == "03/15/2024"
+        value, confidence = normalize_date("03/04/2024")
+        assert value == "03/04/2024" and confidence < 0.8
@@ -0,0 +1,88 @@
+"""
+Unit tests for the Server-Sent Events extraction endpoint
+"""
+import json
+from fastapi.testclient import TestClient
+
+from main import app
+from app.api import routes
+
+
+def read_events(response):
+    """Parse an SSE response body into (event, data) pairs"""
+    events = []
+    for block in response.text.strip().split("\n\n"):
+        lines = dict(line.split(": ", 1) for line in block.splitlines())
+        events.append((lines["event"], json.loads(lines["data"])))
+    return events
+
+
+def fake_process_documents(paths, file_hashes=None, on_stage=None):
+    """Stand-in parser that reports its stages"""
+    if on_stage:
+        on_stage("documents_parsed", {"parsed": len(paths), "scanned_pdfs": 0})
+    return paths
+
+
+class TestExtractStream:
+    """Tests for POST /api/extract/stream"""
+
+    def test_events_are_streamed_in_order(self, monkeypatch):
+        """Test stage events, field events and the final result"""
+        monkeypatch.setattr(routes, "process_documents", fake_process_documents)
+
+        async def fake_extract(documents, report=None, on_event=None):
+            on_event("field", {"name": "billOfLadingNumber", "value": "SSE123", "source": "rules"})
+            on_event("llm_started", {"fields": ["containerNumber"], "model": "claude-test", "vision": False})
+            on_event("field", {"name": "containerNumber", "value": "CSQU3054383", "source": "llm"})
+            return {"billOfLadingNumber": "SSE123", "containerNumber": "CSQU3054383"}
+
+        monkeypatch.setattr(routes, "extract_field_from_document", fake_extract)
+
+        with TestClient(app) as client:
+            response = client.post(
+                "/api/extract/stream?use_cache=false",
+                files=[("files", ("sse_test.pdf", b"%PDF-1.4 test", "application/pdf"))]
+            )
+
+        assert response.status_code == 200
+        assert response.headers["content-type"].startswith("text/event-stream")
+        events = read_events(response)
+        assert [event for event, _ in events] == [
+            "upload_saved", "documents_parsed", "field", "llm_started", "field", "result"
+        ]
+        assert events[0][1]["originalName"] == "sse_test.pdf"
+        assert events[4][1] == {"name": "containerNumber", "value": "CSQU3054383", "source": "llm"}
+        assert events[-1][1]["data"] == {"billOfLadingNumber": "SSE123", "containerNumber": "CSQU3054383"}
+
+        (routes.UPLOAD_DIR / "sse_test.pdf").unlink(missing_ok=True)
+
+    def test_failure_is_reported_as_error_event(self, monkeypatch):
+        """Test that an extraction error ends the stream with an error event"""
+        monkeypatch.setattr(routes, "process_documents", fake_process_documents)
+
+        async def failing_extract(documents, report=None, on_event=None):
+            raise Exception("LLM unavailable")
+
+        monkeypatch.setattr(routes, "extract_field_from_document", failing_extract)
+
+        with TestClient(app) as client:
+            response = client.post(
+                "/api/extract/stream?use_cache=false",
+                files=[("files", ("sse_fail.pdf", b"%PDF-1.4 test", "application/pdf"))]
+            )
+
+        event, data = read_events(response)[-1]
+        assert event == "error"
+        assert "LLM unavailable" in data["detail"]
+
+        (routes.UPLOAD_DIR / "sse_fail.pdf").unlink(missing_ok=True)
+
+    def test_invalid_file_is_rejected_before_streaming(self):
+        """Test that upload validation still returns a plain 400"""
+        with TestClient(app) as client:
+            response = client.post(
+                "/api/extract/stream",
+                files=[("files", ("notes.txt", b"hello", "text/plain"))]
+            )
+        assert response.status_code == 400
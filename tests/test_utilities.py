@@ -7,7 +7,9 @@ import tempfile
 import os
 
 from app.utils.pdf_utils import extract_text_from_pdf, extract_pdf_as_image
-from app.utils.xlsx_utils import extract_text_from_xlsx
+from app.utils.xlsx_utils import extract_text_from_xlsx, extract_xlsx_sheets
+from app.utils.xlsx_analysis import InvoiceTableScanner, analyze_rows, find_table_header
+from app.utils.json_stream import IncrementalJSONParser
 
 
 class TestPDFUtils:
@@ -46,11 +48,12 @@ class TestPDFUtils:
         with pytest.raises(FileNotFoundError):
             extract_text_from_pdf("/nonexistent/path/file.pdf")
 
-    def test_extract_pdf_as_image_returns_base64(self):
-        """Test that image extraction returns base64 encoded data"""
+    def test_extract_pdf_as_image_returns_image_segments(self):
+        """Test that image extraction returns typed image segments"""
         # Create a minimal PDF
         try:
             from reportlab.pdfgen import canvas
+            from app.utils.document_segments import ImageSegment
 
             with tempfile.NamedTemporaryFile(suffix='.pdf', delete=False) as tmp:
                 tmp_path = tmp.name
@@ -62,16 +65,18 @@ class TestPDFUtils:
             result = extract_pdf_as_image(tmp_path)
 
             # Check format
-            assert isinstance(result, str)
-            assert result.startswith("IMAGE_PDF:")
-
-            # Extract base64 part
-            base64_data = result.split("IMAGE_PDF:")[1]
-            assert len(base64_data) > 100  # Should be substantial
-            # Base64 should only contain valid characters
+            assert len(result) == 1
+            image = result[0]
+            assert isinstance(image, ImageSegment)
+            assert image.page == 0
+            assert len(image.data) > 100  # Should be substantial
+
+            # Base64 is only produced when building the API payload
+            block = image.to_content_block()
+            assert block["source"]["media_type"] == image.media_type
             import string
             valid_chars = set(string.ascii_letters + string.digits + '+/=')
-            assert all(c in valid_chars for c in base64_data[:100])
+            assert all(c in valid_chars for c in block["source"]["data"][:100])
 
             # Cleanup
             os.unlink(tmp_path)
@@ -80,6 +85,200 @@ class TestPDFUtils:
             pytest.skip("reportlab or pypdfium2 not installed")
 
 
+class TestPDFRendering:
+    """Tests for scanned PDF page rendering"""
+
+    def _make_scanned_pdf(self, path, pages):
+        """Create a PDF with graphics but no text layer"""
+        from reportlab.pdfgen import canvas
+
+        c = canvas.Canvas(path)
+        for page_no in range(pages):
+            c.rect(50 + page_no * 10, 500, 300, 200, fill=1)
+            c.showPage()
+        c.save()
+
+    def test_select_render_pages(self):
+        """Test page selection by max pages and by explicit range"""
+        from app.utils.pdf_utils import select_render_pages
+
+        assert select_render_pages(10, {"max_pages": 3, "page_range": ""}) == [0, 1, 2]
+        assert select_render_pages(2, {"max_pages": 0, "page_range": ""}) == [0, 1]
+        assert select_render_pages(10, {"max_pages": 3, "page_range": "2-4, 9, 20"}) == [1, 2, 3, 8]
+
+    def test_select_render_pages_among_candidates(self):
+        """Test that the limits apply to the image-only pages of a mixed PDF"""
+        from app.utils.pdf_utils import select_render_pages
+
+        assert select_render_pages(10, {"max_pages": 2, "page_range": ""}, [3, 6, 9]) == [3, 6]
+        assert select_render_pages(10, {"max_pages": 0, "page_range": "1-7"}, [3, 6, 9]) == [3, 6]
+
+    def test_renders_every_page_as_jpeg(self, tmp_path):
+        """Test that all pages of a scanned PDF are rendered, not just the first"""
+        from app.utils.pdf_utils import extract_pdf_as_image
+
+        pdf_path = str(tmp_path / "scanned.pdf")
+        self._make_scanned_pdf(pdf_path, pages=3)
+
+        result = extract_pdf_as_image(pdf_path)
+        assert [image.page for image in result] == [0, 1, 2]
+        for image in result:
+            assert image.media_type == "image/jpeg"
+            assert image.data[:2] == b"\xff\xd8"
+
+    def test_page_images_fit_byte_budget(self, tmp_path):
+        """Test that rendering lowers quality/size to fit the budget"""
+        from app.utils.pdf_utils import render_pdf_page, render_options
+
+        pdf_path = str(tmp_path / "scanned.pdf")
+        self._make_scanned_pdf(pdf_path, pages=1)
+
+        options = dict(render_options(), format="JPEG", quality=95, grayscale=False)
+        large = render_pdf_page(pdf_path, 0, options, max_bytes=10_000_000)
+        small = render_pdf_page(pdf_path, 0, options, max_bytes=len(large.data) // 2)
+
+        assert large.media_type == "image/jpeg"
+        assert len(small.data) <= len(large.data) // 2
+
+    def test_adaptive_scale_targets_long_edge(self, tmp_path):
+        """Test the render scale is derived from the page size"""
+        import io
+        from PIL import Image
+        from app.utils.pdf_utils import render_pdf_page, render_options
+
+        pdf_path = str(tmp_path / "scanned.pdf")
+        self._make_scanned_pdf(pdf_path, pages=1)
+
+        options = dict(render_options(), format="PNG", target_long_edge=800)
+        image = Image.open(io.BytesIO(render_pdf_page(pdf_path, 0, options, max_bytes=10_000_000).data))
+        assert abs(max(image.size) - 800) <= 2
+
+
+class TestPDFTextBackends:
+    """Tests for the pluggable PDF text backends"""
+
+    @pytest.fixture
+    def text_pdf(self, tmp_path):
+        from reportlab.pdfgen import canvas
+
+        path = tmp_path / "bol.pdf"
+        c = canvas.Canvas(str(path))
+        for page in range(3):
+            c.drawString(100, 750, f"Page {page + 1} of the Bill of Lading")
+            c.drawString(100, 730, "B/L No: TEST123")
+            c.showPage()
+        c.save()
+        return str(path)
+
+    @pytest.mark.parametrize("backend", ["auto", "pdfium", "pypdf2"])
+    def test_backends_read_the_same_lines(self, text_pdf, backend):
+        """Test that every backend returns LF-separated page text"""
+        from app.utils.pdf_utils import extract_pdf_page_range
+
+        pages = extract_pdf_page_range(text_pdf, backend=backend)
+
+        assert len(pages) == 3
+        assert "\r" not in "".join(pages)
+        assert [page.split("\n")[0].strip() for page in pages] == [
+            f"Page {n} of the Bill of Lading" for n in (1, 2, 3)
+        ]
+        assert "B/L No: TEST123" in pages[2]
+
+    def test_page_iteration_is_lazy_and_ranged(self, text_pdf):
+        """Test that pages are produced one at a time within [start, end)"""
+        from app.utils.pdf_utils import iter_pdf_pages
+
+        pages = iter_pdf_pages(text_pdf, 1, 3, backend="pdfium")
+
+        assert "Page 2" in next(pages)
+        assert "Page 3" in next(pages)
+        assert next(pages, None) is None
+
+    def test_auto_backend_replaces_badly_decoded_pages(self, text_pdf, monkeypatch):
+        """Test the PyPDF2 fallback for pages PDFium decodes as garbage"""
+        from app.utils import pdf_utils
+
+        def garbled(self, file_path, start=0, end=None):
+            yield "\ufffd\ue000\ue001\ue002 TEST"
+            yield "Page 2 of the Bill of Lading"
+
+        monkeypatch.setattr(pdf_utils.PdfiumBackend, "iter_pages", garbled)
+
+        pages = pdf_utils.extract_pdf_page_range(text_pdf, 0, 2, backend="auto")
+
+        assert "Page 1 of the Bill of Lading" in pages[0]
+        assert pages[1] == "Page 2 of the Bill of Lading"
+
+    def test_auto_backend_falls_back_when_pdfium_cannot_open(self, text_pdf, monkeypatch):
+        """Test that PyPDF2 reads files PDFium rejects"""
+        from app.utils import pdf_utils
+
+        def unreadable(self, file_path, start=0, end=None):
+            raise pdf_utils.pdfium.PdfiumError("Failed to load document")
+            yield
+
+        monkeypatch.setattr(pdf_utils.PdfiumBackend, "iter_pages", unreadable)
+
+        assert len(pdf_utils.extract_pdf_page_range(text_pdf, backend="auto")) == 3
+
+    def test_page_count_falls_back_when_pdfium_cannot_open(self, text_pdf, monkeypatch):
+        """Test that pages of files PDFium rejects are counted with PyPDF2"""
+        from app.utils import pdf_utils
+
+        def unreadable(*args, **kwargs):
+            raise pdf_utils.pdfium.PdfiumError("Failed to load document")
+
+        monkeypatch.setattr(pdf_utils.pdfium, "PdfDocument", unreadable)
+
+        assert pdf_utils.count_pdf_pages(text_pdf) == 3
+
+    def test_unknown_backend_is_rejected(self, text_pdf):
+        """Test that a misconfigured backend name fails loudly"""
+        from app.utils.pdf_utils import extract_pdf_page_range
+
+        with pytest.raises(ValueError):
+            extract_pdf_page_range(text_pdf, backend="poppler")
+
+
+class TestPageClassification:
+    """Tests for classifying PDF pages as text, image-only or blank"""
+
+    OPTIONS = {"min_text_chars": 50, "min_image_coverage": 0.5}
+
+    def test_classify_page(self):
+        """Test the text density and image coverage rules"""
+        from app.utils.pdf_utils import classify_page
+
+        dense = "B/L No: TEST123 " * 10
+        assert classify_page(dense, None, self.OPTIONS) == "text"
+        assert classify_page(dense, {"image_coverage": 1.0, "objects": 1}, self.OPTIONS) == "text"
+        assert classify_page("Page 2 of 4", {"image_coverage": 0.95, "objects": 2}, self.OPTIONS) == "image"
+        assert classify_page("Signed: J. Doe", {"image_coverage": 0.05, "objects": 3}, self.OPTIONS) == "text"
+        assert classify_page("", {"image_coverage": 0.0, "objects": 4}, self.OPTIONS) == "image"
+        assert classify_page("", {"image_coverage": 0.0, "objects": 0}, self.OPTIONS) == "blank"
+
+    def test_page_layout_measures_image_coverage(self, tmp_path):
+        """Test image coverage and object counts read from the PDF"""
+        from PIL import Image
+        from reportlab.lib.utils import ImageReader
+        from reportlab.pdfgen import canvas
+        from app.utils.pdf_utils import pdf_page_layout
+
+        path = str(tmp_path / "layout.pdf")
+        c = canvas.Canvas(path, pagesize=(600, 800))
+        c.drawImage(ImageReader(Image.new("L", (60, 80), 255)), 0, 0, width=600, height=800)
+        c.showPage()
+        c.drawImage(ImageReader(Image.new("L", (60, 80), 255)), 0, 0, width=300, height=400)
+        c.showPage()
+        c.showPage()
+        c.save()
+
+        layouts = pdf_page_layout(path, [0, 1, 2])
+
+        assert [layout["image_coverage"] for layout in layouts] == [1.0, 0.25, 0.0]
+        assert layouts[2]["objects"] == 0
+
+
 class TestExcelUtils:
     """Tests for Excel utility functions"""
 
@@ -190,3 +389,166 @@ class TestExcelUtils:
         with pytest.raises(Exception) as exc_info:
             extract_text_from_xlsx("/nonexistent/path/file.xlsx")
         assert "Failed to extract XLSX text" in str(exc_info.value)
+
+
+def write_invoice_xlsx(path, rows=20):
+    """Synthetic commercial invoice: header block, line item table, TOTAL row"""
+    import openpyxl
+
+    wb = openpyxl.Workbook()
+    ws = wb.active
+    ws.title = "Invoice"
+    ws.append(["COMMERCIAL INVOICE"])
+    ws.append(["Invoice No:", "INV-2024-001"])
+    ws.append(["SHIP TO:", "Acme Imports LLC"])
+    ws.append([])
+    ws.append(["S.No.", "Description", "Qty", "Unit Price (USD)", "Total Value (USD)", "Gross Weight (KG)"])
+    for i in range(1, rows + 1):
+        ws.append([i, f"Widget model {i}", 10, 1.1 * i, 11.0 * i, 2.5])
+    ws.append([None, "TOTAL", 10 * rows, None, sum(11.0 * i for i in range(1, rows + 1)), 2.5 * rows])
+    ws.append(["Signed by: J. Smith"])
+    wb.save(path)
+
+
+class TestInvoiceAnalysis:
+    """Tests for computing invoice figures locally"""
+
+    def test_find_table_header(self):
+        """Test that the header row maps column roles and skips unit prices"""
+        columns = find_table_header(["S.No.", "Description", "Qty", "Unit Price (USD)", "Total Value (USD)"])
+        assert columns == {"serial": 0, "quantity": 2, "total_value": 4}
+        assert find_table_header(["Invoice No:", "INV-1"]) is None
+
+    def test_analyze_rows_counts_and_sums(self):
+        """Test counts, exact sums and the average over line item rows"""
+        rows = [
+            ("S.No.", "Item", "Total Value (USD)"),
+            (1, "A", 0.1),
+            (2, "B", "$0.20"),
+            (4, "C", 0.3),  # Gaps in numbering still count
+            (None, "continued description", None),
+            (None, "TOTAL", 0.6)
+        ]
+        analysis = analyze_rows(rows)
+        assert analysis["line_items_count"] == 3
+        assert analysis["total_value_sum"] == 0.6
+        assert analysis["stated_total_value"] == 0.6
+        assert analysis["average_price"] == 0.2
+
+    def test_unlabelled_footer_is_the_stated_total(self):
+        """Test that a footer row with only numbers counts as the stated total, and a mismatch is flagged"""
+        rows = [
+            ("S.No.", "Item", "Qty", "Total Value (USD)"),
+            (1, "A", 5, 100),
+            (None, None, 5, 100),  # Subtotal: more line items follow
+            (2, "B", 5, 200),
+            (None, None, 10, 290),
+            (None, "Signed by: J. Smith", None, None)
+        ]
+        scanner = InvoiceTableScanner()
+        for row in rows:
+            scanner.feed(row)
+        analysis = scanner.analysis()
+
+        assert analysis["line_items_count"] == 2
+        assert analysis["total_value_sum"] == 300
+        assert analysis["stated_total_value"] == 290
+        assert analysis["total_mismatch"] is True
+        assert analysis["average_price"] == 150
+        assert analysis["stated_average_price"] == 145
+        assert "WARNING" in scanner.text()
+        assert "Signed by: J. Smith" in scanner.text()
+
+    def test_rows_after_a_table_without_footer_are_kept(self):
+        """Test that trailing text is kept when the table has no TOTAL row and no numeric footer"""
+        rows = [
+            ("S.No.", "Item", "Qty", "Total Value (USD)"),
+            (1, "A", 5, 100),
+            (2, "B", 5, 200),
+            (None, "Country of origin: China", None, None),
+            (None, "Signed by: J. Smith", None, None)
+        ]
+        scanner = InvoiceTableScanner()
+        for row in rows:
+            scanner.feed(row)
+
+        assert scanner.analysis()["stated_total_value"] is None
+        assert "Country of origin: China" in scanner.text()
+        assert "Signed by: J. Smith" in scanner.text()
+
+    def test_sample_invoice_mismatch_does_not_override_average_price(self):
+        """Test the repo sample, whose line items add up to more than its unlabelled footer total"""
+        from app.services.llm_service import apply_computed_figures
+        from app.services.rule_extractor import extract_with_rules
+        from app.utils.document_segments import DocumentBundle, ParsedDocument
+
+        path = Path(__file__).resolve().parent.parent / "storage" / "ZMLU34110002" / "Demo-Invoice-PackingList_1.xlsx"
+        sheets = extract_xlsx_sheets(str(path), summarize=True)
+        documents = DocumentBundle([ParsedDocument("invoice.xlsx", "XLSX", sheets)])
+        analytics = documents.invoice_analytics()
+
+        assert analytics["stated_total_value"] == pytest.approx(23211.24)
+        assert analytics["total_mismatch"] is True
+        assert apply_computed_figures({"averagePrice": "$1289.51"}, documents)["averagePrice"] == "$1289.51"
+        rules = extract_with_rules(documents)
+        assert rules.matches["averagePrice"].value == "$1289.51"
+        assert "averagePrice" in rules.missing
+
+    def test_xlsx_table_is_summarized(self, tmp_path):
+        """Test that line item rows are replaced by computed figures"""
+        path = tmp_path / "invoice.xlsx"
+        write_invoice_xlsx(path, rows=20)
+
+        [sheet] = extract_xlsx_sheets(str(path), summarize=True)
+
+        assert sheet.analytics["line_items_count"] == 20
+        assert sheet.analytics["total_value_sum"] == 2310.0
+        assert sheet.analytics["average_price"] == 115.5
+        assert sheet.analytics["gross_weight_sum"] == 50.0
+        # Header block and footer are kept, individual rows are not
+        assert "INV-2024-001" in sheet.text
+        assert "Acme Imports LLC" in sheet.text
+        assert "Signed by: J. Smith" in sheet.text
+        assert "COMPUTED INVOICE FIGURES" in sheet.text
+        assert "averagePrice: $115.50" in sheet.text
+        assert "Widget model 7" not in sheet.text
+
+    def test_xlsx_full_dump_when_disabled(self, tmp_path):
+        """Test that every row is kept when summarizing is off"""
+        path = tmp_path / "invoice.xlsx"
+        write_invoice_xlsx(path, rows=5)
+
+        [sheet] = extract_xlsx_sheets(str(path), summarize=False)
+
+        assert "Widget model 5" in sheet.text
+        assert "COMPUTED INVOICE FIGURES" not in sheet.text
+        assert sheet.analytics["line_items_count"] == 5
+
+
+class TestIncrementalJSONParser:
+    """Tests for emitting JSON fields while a response streams in"""
+
+    def test_fields_are_emitted_as_soon_as_complete(self):
+        """Test feeding a fenced response one character at a time"""
+        response = '```json\n{"billOfLadingNumber": "ZMLU34110002", "lineItemsCount": 18, ' \
+                   '"consigneeAddress": null, "note": "a \\"quoted\\" }", "items": [1, {"b": "]"}]}\n```'
+        parser = IncrementalJSONParser()
+        emitted = []
+        for index, char in enumerate(response):
+            for name, value in parser.feed(char):
+                emitted.append((name, value, index))
+
+        names = [name for name, _, _ in emitted]
+        assert names == ["billOfLadingNumber", "lineItemsCount", "consigneeAddress", "note", "items"]
+        assert parser.fields["note"] == 'a "quoted" }'
+        assert parser.fields["items"] == [1, {"b": "]"}]
+        # The B/L number is reported right after its closing quote
+        assert emitted[0][2] == response.index('"ZMLU34110002"') + len('"ZMLU34110002"') - 1
+        assert parser.done
+
+    def test_partial_value_is_not_emitted(self):
+        """Test that a value is held back until it is terminated"""
+        parser = IncrementalJSONParser()
+        assert parser.feed('{"lineItemsCount": 1') == []
+        assert parser.feed('8, "averagePrice": "$12') == [("lineItemsCount", 18)]
+        assert parser.feed('.50"}') == [("averagePrice", "$12.50")]
@@ -0,0 +1,360 @@
+"""
+Fake LLM Server
+Local stand-in for the Anthropic messages API, for load and latency
+testing real-mode extraction offline. Point the backend at it with
+LLM_BASE_URL=http://127.0.0.1:8089 and call /api/extract?use_mock=false.
+
+Answers come from (first match wins):
+- a canned response file (--response answer.json), or
+- fixture files (--fixtures dir/*.json), picked when the fixture's
+  billOfLadingNumber appears in the prompt, or
+- the documents in the prompt, read with the rule-based extractor.
+
+Time to first token, prefill and output token rates, injected errors
+(429/500/529) and hung requests are configurable.
+
+Usage:
+    python -m tools.fake_llm_server --port 8089 --latency-ms 800 --output-tps 80 --error-rate 0.02
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import random
+import re
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+from app.services.llm_client import estimate_tokens
+from app.services.rule_extractor import EXPECTED_FIELDS, extract_with_rules
+from app.utils.document_segments import DocumentBundle, ParsedDocument, SheetSegment, TextSegment
+
+FIELDS_REQUEST_PATTERN = re.compile(r"Only extract these fields: ([^\n]+)")
+REPAIR_FIELD_PATTERN = re.compile(r"^- (\w+): ", re.MULTILINE)
+LINE_ITEMS_PATTERN = re.compile(r"^- lineItemsCount: (\d+)", re.MULTILINE)
+AVERAGE_PRICE_PATTERN = re.compile(r"^- averagePrice: \$([\d,]+\.\d+)", re.MULTILINE)
+
+ERROR_TYPES = {
+    429: "rate_limit_error",
+    500: "api_error",
+    529: "overloaded_error"
+}
+
+
+@dataclass
+class FakeLLMConfig:
+    """Latency, throughput and failure behaviour of the fake server"""
+    latency: str = "lognormal"  # Time to first token: fixed, uniform or lognormal
+    latency_ms: float = 800.0  # Median time to first token
+    latency_spread: float = 0.5  # Lognormal sigma, or +/- fraction for uniform
+    input_tokens_per_second: float = 0.0  # Prefill rate added to the first token time (0 = free)
+    output_tokens_per_second: float = 80.0  # Output pacing (0 = instant)
+    error_rate: float = 0.0  # Share of requests answered with an error status
+    error_statuses: List[int] = field(default_factory=lambda: [429, 500, 529])
+    hang_rate: float = 0.0  # Share of requests that never answer
+    hang_seconds: float = 600.0
+    response_file: Optional[str] = None  # Canned answer (JSON object of fields)
+    fixtures_dir: Optional[str] = None  # Expected results, matched by billOfLadingNumber
+    seed: Optional[int] = None
+
+
+class FakeLLM:
+    """Request handling and counters of one fake server"""
+
+    def __init__(self, config: FakeLLMConfig):
+        self.config = config
+        self.random = random.Random(config.seed)
+        self.canned = json.loads(Path(config.response_file).read_text()) if config.response_file else None
+        self.fixtures = []
+        if config.fixtures_dir:
+            for path in sorted(Path(config.fixtures_dir).glob("*.json")):
+                self.fixtures.append(json.loads(path.read_text()))
+        self.cached_prefixes = set()
+        self.stats = self._empty_stats()
+
+    @staticmethod
+    def _empty_stats() -> Dict[str, Any]:
+        return {
+            "requests": 0,
+            "in_flight": 0,
+            "peak_in_flight": 0,
+            "errors": 0,
+            "hangs": 0,
+            "streamed": 0,
+            "input_tokens": 0,
+            "output_tokens": 0,
+            "models": {}
+        }
+
+    def reset(self) -> None:
+        self.stats = self._empty_stats()
+        self.cached_prefixes.clear()
+
+    def first_token_delay(self, input_tokens: int) -> float:
+        """Seconds before the first output token (sampled latency + prefill)"""
+        config = self.config
+        median = config.latency_ms / 1000
+        if config.latency == "fixed":
+            delay = median
+        elif config.latency == "uniform":
+            delay = self.random.uniform(median * (1 - config.latency_spread), median * (1 + config.latency_spread))
+        else:
+            delay = self.random.lognormvariate(0, config.latency_spread) * median
+        if config.input_tokens_per_second:
+            delay += input_tokens / config.input_tokens_per_second
+        return max(delay, 0.0)
+
+    def answer(self, body: Dict[str, Any]) -> Dict[str, Any]:
+        """Field values for a request: canned, from a fixture, or read from the prompt"""
+        text = _request_text(body)
+        fields = _requested_fields(body)
+        if self.canned is not None:
+            data = self.canned
+        else:
+            data = next(
+                (fixture for fixture in self.fixtures if fixture.get("billOfLadingNumber") and fixture["billOfLadingNumber"] in text),
+                None
+            ) or _fields_from_text(text)
+        return {name: data.get(name) for name in fields}
+
+    def usage(self, body: Dict[str, Any], output_tokens: int) -> Dict[str, int]:
+        """Token usage, with the system prompt written to / read from a simulated prompt cache"""
+        system = body.get("system") or ""
+        if isinstance(system, list):
+            cacheable = "".join(block.get("text", "") for block in system if block.get("cache_control"))
+            system = "".join(block.get("text", "") for block in system)
+        else:
+            cacheable = ""
+        total = estimate_tokens(system) + sum(estimate_tokens(message["content"]) for message in body.get("messages", []))
+        total += sum(estimate_tokens(json.dumps(tool)) for tool in body.get("tools", []))
+
+        usage = {"input_tokens": total, "output_tokens": output_tokens}
+        if cacheable:
+            prefix = estimate_tokens(cacheable)
+            digest = hashlib.sha256(f"{body.get('model')}:{cacheable}".encode("utf-8")).hexdigest()
+            key = "cache_read_input_tokens" if digest in self.cached_prefixes else "cache_creation_input_tokens"
+            self.cached_prefixes.add(digest)
+            usage[key] = prefix
+            usage["input_tokens"] = max(total - prefix, 1)
+        return usage
+
+
+def _request_text(body: Dict[str, Any]) -> str:
+    """All text of the request's user messages"""
+    parts = []
+    for message in body.get("messages", []):
+        if message.get("role") != "user":
+            continue
+        content = message["content"]
+        if isinstance(content, str):
+            parts.append(content)
+            continue
+        for block in content:
+            if block.get("type") == "text":
+                parts.append(block["text"])
+            elif block.get("type") == "tool_result" and isinstance(block.get("content"), str):
+                parts.append(block["content"])
+    return "\n".join(parts)
+
+
+def _requested_fields(body: Dict[str, Any]) -> List[str]:
+    """Fields the last user turn asks for (a repair request, a subset, or all of them)"""
+    messages = [message for message in body.get("messages", []) if message.get("role") == "user"]
+    last = _request_text({"messages": messages[-1:]})
+    if "missing or malformed" in last:
+        return [name for name in REPAIR_FIELD_PATTERN.findall(last) if name in EXPECTED_FIELDS]
+    match = FIELDS_REQUEST_PATTERN.search(last)
+    if match:
+        return [name.strip() for name in match.group(1).split(",") if name.strip() in EXPECTED_FIELDS]
+    return list(EXPECTED_FIELDS)
+
+
+def _fields_from_text(text: str) -> Dict[str, Any]:
+    """Read the fields from prompt text the way the rule stage reads documents"""
+    analytics = None
+    count = LINE_ITEMS_PATTERN.search(text)
+    if count:
+        price = AVERAGE_PRICE_PATTERN.search(text)
+        analytics = {
+            "line_items_count": int(count.group(1)),
+            "average_price": float(price.group(1).replace(",", "")) if price else None
+        }
+    documents = DocumentBundle([
+        ParsedDocument("prompt", "PDF", [TextSegment(text=text)]),
+        ParsedDocument("prompt", "XLSX", [SheetSegment(sheet_name="Invoice", text="", analytics=analytics)])
+    ])
+    return {name: match.value for name, match in extract_with_rules(documents).matches.items()}
+
+
+def _output_blocks(body: Dict[str, Any], data: Dict[str, Any], request_id: int) -> Tuple[Dict[str, Any], str]:
+    """(content block, its streamed text) - a tool call if the request has tools, else JSON text"""
+    tools = body.get("tools") or []
+    if tools:
+        choice = body.get("tool_choice") or {}
+        name = choice.get("name") or tools[0]["name"]
+        return {"type": "tool_use", "id": f"toolu_fake_{request_id}", "name": name, "input": data}, json.dumps(data)
+    return {"type": "text", "text": json.dumps(data)}, json.dumps(data)
+
+
+def _message(body: Dict[str, Any], request_id: int, content: List[Dict[str, Any]], usage: Dict[str, int]) -> Dict[str, Any]:
+    return {
+        "id": f"msg_fake_{request_id}",
+        "type": "message",
+        "role": "assistant",
+        "model": body.get("model", "fake"),
+        "content": content,
+        "stop_reason": "tool_use" if content and content[0]["type"] == "tool_use" else "end_turn",
+        "stop_sequence": None,
+        "usage": usage
+    }
+
+
+def _sse(event: str, data: Dict[str, Any]) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+def create_app(config: Optional[FakeLLMConfig] = None) -> FastAPI:
+    """Build the fake messages API app"""
+    fake = FakeLLM(config or FakeLLMConfig())
+    app = FastAPI(title="Fake LLM Server")
+    app.state.fake = fake
+
+    @app.post("/v1/messages")
+    async def create_message(request: Request):
+        body = await request.json()
+        stats = fake.stats
+        stats["requests"] += 1
+        request_id = stats["requests"]
+        model = body.get("model", "fake")
+        stats["models"][model] = stats["models"].get(model, 0) + 1
+        stats["in_flight"] += 1
+        stats["peak_in_flight"] = max(stats["peak_in_flight"], stats["in_flight"])
+        streamed = False
+
+        try:
+            roll = fake.random.random()
+            if roll < fake.config.hang_rate:
+                stats["hangs"] += 1
+                await asyncio.sleep(fake.config.hang_seconds)
+            elif roll < fake.config.hang_rate + fake.config.error_rate:
+                stats["errors"] += 1
+                status = fake.random.choice(fake.config.error_statuses)
+                headers = {"retry-after": "1"} if status == 429 else {}
+                return JSONResponse(status_code=status, headers=headers, content={
+                    "type": "error",
+                    "error": {"type": ERROR_TYPES.get(status, "api_error"), "message": f"Injected {status} from fake LLM server"}
+                })
+
+            block, text = _output_blocks(body, fake.answer(body), request_id)
+            output_tokens = estimate_tokens(text)
+            usage = fake.usage(body, output_tokens)
+            stats["input_tokens"] += usage["input_tokens"]
+            stats["output_tokens"] += output_tokens
+            await asyncio.sleep(fake.first_token_delay(usage["input_tokens"]))
+
+            if not body.get("stream"):
+                rate = fake.config.output_tokens_per_second
+                if rate:
+                    await asyncio.sleep(output_tokens / rate)
+                return _message(body, request_id, [block], usage)
+
+            stats["streamed"] += 1
+            streamed = True
+            return StreamingResponse(
+                _stream(fake, body, request_id, block, text, usage),
+                media_type="text/event-stream"
+            )
+        finally:
+            if not streamed:
+                stats["in_flight"] -= 1
+
+    @app.get("/stats")
+    async def get_stats():
+        return fake.stats
+
+    @app.delete("/stats")
+    async def reset_stats():
+        fake.reset()
+        return {"success": True}
+
+    return app
+
+
+async def _stream(
+    fake: FakeLLM,
+    body: Dict[str, Any],
+    request_id: int,
+    block: Dict[str, Any],
+    text: str,
+    usage: Dict[str, int]
+) -> AsyncIterator[str]:
+    """SSE events of a streamed response, paced at the output token rate"""
+    try:
+        start = dict(block, input={}) if block["type"] == "tool_use" else dict(block, text="")
+        yield _sse("message_start", {"type": "message_start", "message": _message(body, request_id, [], dict(usage, output_tokens=1))})
+        yield _sse("content_block_start", {"type": "content_block_start", "index": 0, "content_block": start})
+
+        chunk_chars = 40  # ~10 tokens per delta
+        rate = fake.config.output_tokens_per_second
+        for offset in range(0, len(text), chunk_chars):
+            chunk = text[offset:offset + chunk_chars]
+            if block["type"] == "tool_use":
+                delta = {"type": "input_json_delta", "partial_json": chunk}
+            else:
+                delta = {"type": "text_delta", "text": chunk}
+            yield _sse("content_block_delta", {"type": "content_block_delta", "index": 0, "delta": delta})
+            if rate:
+                await asyncio.sleep(estimate_tokens(chunk) / rate)
+
+        yield _sse("content_block_stop", {"type": "content_block_stop", "index": 0})
+        yield _sse("message_delta", {
+            "type": "message_delta",
+            "delta": {"stop_reason": "tool_use" if block["type"] == "tool_use" else "end_turn", "stop_sequence": None},
+            "usage": {"output_tokens": usage["output_tokens"]}
+        })
+        yield _sse("message_stop", {"type": "message_stop"})
+    finally:
+        fake.stats["in_flight"] -= 1
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Fake Anthropic messages API for offline load testing")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8089)
+    parser.add_argument("--latency", choices=["fixed", "uniform", "lognormal"], default="lognormal")
+    parser.add_argument("--latency-ms", type=float, default=800.0, help="Median time to first token")
+    parser.add_argument("--latency-spread", type=float, default=0.5)
+    parser.add_argument("--input-tps", type=float, default=0.0, help="Prefill tokens per second (0 = free)")
+    parser.add_argument("--output-tps", type=float, default=80.0, help="Output tokens per second (0 = instant)")
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--error-statuses", default="429,500,529")
+    parser.add_argument("--hang-rate", type=float, default=0.0)
+    parser.add_argument("--response", help="Canned answer: JSON file of field values")
+    parser.add_argument("--fixtures", help="Directory of expected results (*.json), matched by B/L number")
+    parser.add_argument("--seed", type=int)
+    args = parser.parse_args()
+
+    config = FakeLLMConfig(
+        latency=args.latency,
+        latency_ms=args.latency_ms,
+        latency_spread=args.latency_spread,
+        input_tokens_per_second=args.input_tps,
+        output_tokens_per_second=args.output_tps,
+        error_rate=args.error_rate,
+        error_statuses=[int(status) for status in args.error_statuses.split(",")],
+        hang_rate=args.hang_rate,
+        response_file=args.response,
+        fixtures_dir=args.fixtures,
+        seed=args.seed
+    )
+
+    import uvicorn
+    uvicorn.run(create_app(config), host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()